@@ -8,7 +8,12 @@ from .models import (
     JournalComptable, 
     EcritureComptable, LigneEcriture, 
     Tiers,
-    TauxDeTaxe
+    TauxDeTaxe,
+    SoldeComptePeriode,
+    SequencePiece,
+    ImportEcritures,
+    ClotureComptable,
+    SoldeCloture
 )
 
 @admin.register(CompteComptableDefaut)
@@ -130,7 +135,7 @@ class EcritureComptableAdmin(admin.ModelAdmin):
     list_display = (
         'date_ecriture', 'journal', 'numero_piece', 'libelle_piece', 
         'numero_facture_liee', 'get_tiers_en_tete_nom', 'get_dossier_pme_nom', 
-        'total_debit_lignes', 'total_credit_lignes', 'est_equilibree'
+        'total_debit', 'total_credit', 'nombre_lignes', 'get_est_equilibree'
     )
     list_filter = (('dossier_pme', admin.RelatedOnlyFieldListFilter), ('journal', admin.RelatedOnlyFieldListFilter), 'date_ecriture', ('tiers_en_tete', admin.RelatedOnlyFieldListFilter))
     search_fields = (
@@ -150,12 +155,15 @@ class EcritureComptableAdmin(admin.ModelAdmin):
             'fields': ('numero_facture_liee', 'reference_piece', 'tiers_en_tete', 'date_echeance_piece', 'montant_total_controle'),
             'classes': ('collapse',), 
         }),
+        (_('Totaux des lignes'), {'fields': ('total_debit', 'total_credit', 'nombre_lignes')}),
     )
-    def get_queryset(self, request):
-        return super().get_queryset(request).prefetch_related(
-            'lignes_ecriture__compte_general', 'lignes_ecriture__tiers_ligne',   
-            'journal', 'tiers_en_tete', 'dossier_pme'
-        )
+    readonly_fields = ('total_debit', 'total_credit', 'nombre_lignes')
+    # Les totaux sont stockés sur la pièce : la liste n'a plus besoin de charger les lignes
+    list_select_related = ('journal__dossier_pme', 'tiers_en_tete', 'dossier_pme')
+
+    @admin.display(description=_('Équilibrée ?'), boolean=True)
+    def get_est_equilibree(self, obj):
+        return obj.est_equilibree
 
     @admin.display(description=_('Dossier PME'), ordering='dossier_pme__nom_dossier')
     def get_dossier_pme_nom(self, obj):
@@ -163,4 +171,66 @@ class EcritureComptableAdmin(admin.ModelAdmin):
     
     @admin.display(description=_('Tiers en-tête'), ordering='tiers_en_tete__nom_ou_raison_sociale')
     def get_tiers_en_tete_nom(self, obj):
-        return obj.tiers_en_tete.nom_ou_raison_sociale if obj.tiers_en_tete else '-'
\ No newline at end of file
+        return obj.tiers_en_tete.nom_ou_raison_sociale if obj.tiers_en_tete else '-'
+
+@admin.register(SoldeComptePeriode)
+class SoldeComptePeriodeAdmin(admin.ModelAdmin):
+    list_display = ('dossier_pme', 'compte_general', 'annee', 'mois', 'total_debit', 'total_credit', 'solde')
+    list_filter = (('dossier_pme', admin.RelatedOnlyFieldListFilter), 'annee', 'mois')
+    search_fields = ('compte_general__numero_compte', 'compte_general__intitule_compte')
+    list_select_related = ('dossier_pme', 'compte_general')
+    ordering = ('dossier_pme', 'annee', 'mois', 'compte_general__numero_compte')
+    # Table maintenue automatiquement : lecture seule (voir la commande reconstruire_soldes)
+    readonly_fields = ('dossier_pme', 'compte_general', 'annee', 'mois', 'total_debit', 'total_credit')
+
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(SequencePiece)
+class SequencePieceAdmin(admin.ModelAdmin):
+    list_display = ('journal', 'exercice', 'prefixe', 'largeur', 'dernier_numero', 'date_mise_a_jour')
+    list_filter = (('journal__dossier_pme', admin.RelatedOnlyFieldListFilter), 'exercice')
+    search_fields = ('journal__code_journal', 'prefixe')
+    list_select_related = ('journal',)
+    # Le compteur n'avance que sous verrou (utils/sequences_pieces.py) : pas de modification manuelle
+    readonly_fields = ('dernier_numero',)
+
+@admin.register(ImportEcritures)
+class ImportEcrituresAdmin(admin.ModelAdmin):
+    list_display = ('nom_fichier', 'dossier_pme', 'format_fichier', 'statut', 'pieces_importees', 'lignes_importees', 'pieces_rejetees', 'date_debut')
+    list_filter = (('dossier_pme', admin.RelatedOnlyFieldListFilter), 'statut', 'format_fichier')
+    search_fields = ('nom_fichier', 'empreinte')
+    list_select_related = ('dossier_pme',)
+    # Suivi écrit par le pipeline d'import (utils/import_ecritures.py) : lecture seule
+    readonly_fields = [f.name for f in ImportEcritures._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+class SoldeClotureInline(admin.TabularInline):
+    model = SoldeCloture
+    fields = ('compte_general', 'solde_debit', 'solde_credit')
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('compte_general')
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+@admin.register(ClotureComptable)
+class ClotureComptableAdmin(admin.ModelAdmin):
+    list_display = ('dossier_pme', 'type_cloture', 'date_fin', 'ecriture_a_nouveau', 'date_cloture', 'cloture_par')
+    list_filter = (('dossier_pme', admin.RelatedOnlyFieldListFilter), 'type_cloture')
+    list_select_related = ('dossier_pme', 'ecriture_a_nouveau', 'cloture_par')
+    inlines = [SoldeClotureInline]
+    # Clôtures passées par utils/cloture_comptable.py, immuables : lecture seule
+    readonly_fields = [f.name for f in ClotureComptable._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -8,8 +8,20 @@ from decimal import Decimal
 from .models import (
     CompteComptablePME, CompteComptableDefaut, 
     JournalComptable, Tiers, TauxDeTaxe, 
-    EcritureComptable, LigneEcriture 
+    EcritureComptable, LigneEcriture, ImportEcritures, ClotureComptable
 )
+from .utils.plan_reference import get_plan_reference
+
+class PlanReferenceChoiceIterator(forms.models.ModelChoiceIterator):
+    """Choix servis par le plan SYSCOHADA en mémoire : aucune requête au rendu du formulaire."""
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for compte in get_plan_reference().comptes:
+            yield (compte.pk, str(compte))
+
+    def __len__(self):
+        return len(get_plan_reference()) + (self.field.empty_label is not None)
 
 # --- Formulaire pour CompteComptablePME ---
 class CompteComptablePMEForm(forms.ModelForm):
@@ -63,6 +75,8 @@ class CompteComptablePMEForm(forms.ModelForm):
             self.fields['compte_parent'].empty_label = _("--- Aucun (Compte Racine/Classe) ---")
         else:
             self.fields['compte_parent'].queryset = CompteComptablePME.objects.none()
+        # L'itérateur doit être posé avant le queryset, dont l'affectation reconstruit les choix du widget
+        self.fields['compte_syscohada_ref'].iterator = PlanReferenceChoiceIterator
         self.fields['compte_syscohada_ref'].queryset = CompteComptableDefaut.objects.all().order_by('numero_compte')
         self.fields['compte_syscohada_ref'].required = False
         self.fields['compte_syscohada_ref'].empty_label = _("--- Aucune référence SYSCOHADA ---")
@@ -311,6 +325,58 @@ class SaisieJournalSelectionForm(forms.Form):
                 raise forms.ValidationError(_("Mois doit être un nombre entier."))
         return None # Ou lever une erreur si le mois est obligatoire et non fourni
 
+class ImportEcrituresForm(forms.Form):
+    fichier = forms.FileField(label=_("Fichier d'écritures"))
+    format_fichier = forms.ChoiceField(
+        label=_("Format"),
+        choices=ImportEcritures.FORMAT_CHOICES,
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    journal = forms.ModelChoiceField(
+        queryset=JournalComptable.objects.none(),
+        label=_("Journal par défaut"),
+        required=False,
+        help_text=_("Utilisé pour les lignes sans code journal."),
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    encodage = forms.ChoiceField(
+        label=_("Encodage"),
+        choices=[('utf-8-sig', 'UTF-8'), ('cp1252', 'Windows (ANSI)')],
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    ignorer_erreurs = forms.BooleanField(
+        label=_("Rejeter les pièces invalides et continuer"),
+        required=False
+    )
+
+    def __init__(self, *args, **kwargs):
+        dossier_pme = kwargs.pop('dossier_pme', None)
+        super().__init__(*args, **kwargs)
+        if dossier_pme:
+            self.fields['journal'].queryset = JournalComptable.objects.filter(
+                dossier_pme=dossier_pme, est_actif=True
+            ).order_by('code_journal')
+
+
+class ClotureForm(forms.Form):
+    type_cloture = forms.ChoiceField(
+        label=_("Clôturer"),
+        choices=ClotureComptable.TYPE_CLOTURE_CHOICES,
+        widget=forms.Select(attrs={'class': 'form-select'})
+    )
+    annee = forms.IntegerField(
+        label=_("Année"), min_value=1900, max_value=2100,
+        help_text=_("Année du mois, ou année de début de l'exercice.")
+    )
+    mois = forms.IntegerField(label=_("Mois"), min_value=1, max_value=12, required=False)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if cleaned_data.get('type_cloture') == ClotureComptable.MOIS and not cleaned_data.get('mois'):
+            self.add_error('mois', _("Indiquez le mois à clôturer."))
+        return cleaned_data
+
+
 class PieceComptableEnTeteForm(forms.ModelForm):
     jour = forms.IntegerField(
         label=_("Jour"), 
@@ -0,0 +1,124 @@
+# comptabilite/management/commands/benchmark_balance_generale.py
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from statistics import median
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils.dateparse import parse_date
+
+from dossiers_pme.models import DossierPME
+from comptabilite.models import CompteComptablePME, EcritureComptable, JournalComptable, LigneEcriture
+from comptabilite.utils import balance_generale, texte
+
+PIECES_PAR_LOT = 10000
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure le calcul de la balance générale (requête groupée + cumul de la hiérarchie). "
+        "--generer N crée d'abord un dossier de test de N lignes réparties sur trois exercices."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dossier', type=int, help="PK du dossier à mesurer.")
+        parser.add_argument('--generer', type=int, help="Crée un dossier de test avec ce nombre de lignes (ex: 2000000).")
+        parser.add_argument('--date-debut', help="Début de période (AAAA-MM-JJ, 1er janvier de l'an dernier par défaut).")
+        parser.add_argument('--date-fin', help="Fin de période (AAAA-MM-JJ, 31 décembre de l'an dernier par défaut).")
+        parser.add_argument('--repetitions', type=int, default=5)
+
+    def handle(self, *args, **options):
+        if options['generer']:
+            dossier = self._generer(options['generer'])
+        elif options['dossier']:
+            dossier = DossierPME.objects.filter(pk=options['dossier']).first()
+            if dossier is None:
+                raise CommandError(f"Dossier PME {options['dossier']} introuvable.")
+        else:
+            raise CommandError("Indiquez --dossier ou --generer.")
+
+        annee = date.today().year - 1
+        date_debut = parse_date(options['date_debut'] or '') or date(annee, 1, 1)
+        date_fin = parse_date(options['date_fin'] or '') or date(annee, 12, 31)
+        nombre_lignes = LigneEcriture.objects.filter(ecriture__dossier_pme=dossier).count()
+
+        reset_queries()  # journal des requêtes plein après la génération (DEBUG) : le décompte serait faussé
+        durees_requete, durees_total = [], []
+        for __ in range(max(options['repetitions'], 1)):
+            debut = time.perf_counter()
+            balance_generale.mouvements_par_compte(dossier, date_debut, date_fin)
+            durees_requete.append(time.perf_counter() - debut)
+            with CaptureQueriesContext(connection) as requetes:
+                debut = time.perf_counter()
+                balance = balance_generale.calculer_balance(dossier, date_debut, date_fin)
+                durees_total.append(time.perf_counter() - debut)
+
+        self.stdout.write(
+            f"Dossier {dossier.pk} : {nombre_lignes} lignes, balance du {date_debut:%d/%m/%Y} au {date_fin:%d/%m/%Y}, "
+            f"{len(balance.comptes)} comptes, {len(balance.classes)} classes, {len(requetes)} requêtes."
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Requête groupée : médiane {median(durees_requete) * 1000:.0f} ms ; "
+            f"balance complète : médiane {median(durees_total) * 1000:.0f} ms, max {max(durees_total) * 1000:.0f} ms "
+            f"(cumul hiérarchique {max(median(durees_total) - median(durees_requete), 0) * 1000:.0f} ms)."
+        ))
+        if not balance.est_equilibree:
+            self.stdout.write(self.style.WARNING("Balance déséquilibrée sur la période."))
+
+    def _generer(self, nombre_lignes):
+        """Dossier de test : plan à trois niveaux par classe, pièces de deux lignes sur trois exercices."""
+        rng = random.Random(42)
+        dossier = DossierPME.objects.create(nom_dossier=f"Benchmark balance {time.strftime('%Y%m%d-%H%M%S')}")
+        comptes = self._plan(dossier)
+        journal = JournalComptable.objects.create(dossier_pme=dossier, code_journal='BEN', libelle='Benchmark', type_journal='OD')
+        premier_jour = date(date.today().year - 2, 1, 1)
+        nombre_pieces = max(nombre_lignes // 2, 1)
+        debut = time.perf_counter()
+        for lot in range(0, nombre_pieces, PIECES_PAR_LOT):
+            with transaction.atomic():
+                ecritures = []
+                montants = []
+                for n in range(lot, min(lot + PIECES_PAR_LOT, nombre_pieces)):
+                    numero = f"BEN{n:08d}"
+                    montant = Decimal(rng.randint(100, 10_000_000)) / 100
+                    montants.append(montant)
+                    ecritures.append(EcritureComptable(
+                        dossier_pme=dossier, journal=journal, numero_piece=numero, cle_sequence=texte.cle_sequence(numero),
+                        date_ecriture=premier_jour + timedelta(days=n * 1095 // nombre_pieces),
+                        libelle_piece=numero, total_debit=montant, total_credit=montant, nombre_lignes=2,
+                    ))
+                ecritures = EcritureComptable.objects.bulk_create(ecritures)
+                LigneEcriture.objects.bulk_create([
+                    LigneEcriture(ecriture=ecriture, compte_general_id=compte_pk, libelle_ligne=ecriture.libelle_piece,
+                                  debit=montant if ordre == 0 else 0, credit=montant if ordre == 1 else 0, ordre=ordre)
+                    for ecriture, montant in zip(ecritures, montants)
+                    for ordre, compte_pk in enumerate(rng.sample(comptes, 2))
+                ], batch_size=5000, maj_totaux_pieces=False)
+            self.stdout.write(f"  {min(lot + PIECES_PAR_LOT, nombre_pieces) * 2} lignes générées ({time.perf_counter() - debut:.0f} s)")
+        return dossier
+
+    def _plan(self, dossier):
+        """PK des comptes de détail du dossier (plan de test créé si le plan cloné est trop petit)."""
+        details = list(CompteComptablePME.objects.filter(dossier_pme=dossier, nature_compte='DETAIL').values_list('pk', flat=True))
+        if len(details) >= 50:
+            return details
+        for classe in '1234567':
+            racine = CompteComptablePME.objects.create(
+                dossier_pme=dossier, numero_compte=classe, intitule_compte=f"Classe {classe}", nature_compte='CENTRALISATEUR',
+            )
+            for sous in range(1, 6):
+                parent = CompteComptablePME.objects.create(
+                    dossier_pme=dossier, numero_compte=f"{classe}{sous}", intitule_compte=f"Compte {classe}{sous}",
+                    nature_compte='COLLECTIF', compte_parent=racine,
+                )
+                details.extend(
+                    CompteComptablePME.objects.create(
+                        dossier_pme=dossier, numero_compte=f"{classe}{sous}{n:04d}", intitule_compte=f"Compte {classe}{sous}{n:04d}",
+                        compte_parent=parent,
+                    ).pk
+                    for n in range(1, 6)
+                )
+        return details
@@ -0,0 +1,115 @@
+# comptabilite/management/commands/benchmark_lettrage.py
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from dossiers_pme.models import DossierPME
+from comptabilite.models import CompteComptablePME, EcritureComptable, JournalComptable, LigneEcriture, Tiers
+from comptabilite.utils import lettrage, texte
+
+LIGNES_PAR_LOT = 10000
+
+
+class Command(BaseCommand):
+    help = (
+        "Mesure le lettrage automatique d'un compte en simulation (chargement des lignes ouvertes et "
+        "rapprochement). --generer N crée d'abord un dossier de test de N lignes ouvertes sur un compte "
+        "client : factures réglées à l'identique, par plusieurs règlements, ou restées sans contrepartie."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dossier', type=int, help="PK du dossier à mesurer.")
+        parser.add_argument('--compte', help="Numéro du compte lettrable à mesurer (avec --dossier).")
+        parser.add_argument('--generer', type=int, help="Crée un dossier de test avec ce nombre de lignes ouvertes (ex: 100000).")
+        parser.add_argument('--tiers', type=int, default=1,
+                            help="Nombre de tiers du dossier généré (1 : toutes les lignes rapprochées ensemble, le pire cas).")
+        parser.add_argument('--sans-contrepartie', type=float, default=0.5,
+                            help="Part des lignes générées sans contrepartie (examinées par toutes les passes).")
+        parser.add_argument('--repetitions', type=int, default=3)
+
+    def handle(self, *args, **options):
+        if options['generer']:
+            compte = self._generer(options['generer'], max(options['tiers'], 1), options['sans_contrepartie'])
+        elif options['dossier'] and options['compte']:
+            compte = CompteComptablePME.objects.filter(
+                dossier_pme_id=options['dossier'], numero_compte=options['compte'], est_lettrable=True,
+            ).first()
+            if compte is None:
+                raise CommandError(f"Compte lettrable {options['compte']} introuvable dans le dossier {options['dossier']}.")
+        else:
+            raise CommandError("Indiquez --dossier et --compte, ou --generer.")
+
+        durees = []
+        for __ in range(max(options['repetitions'], 1)):
+            debut = time.perf_counter()
+            resultat = lettrage.lettrer_compte(compte, simulation=True)
+            durees.append(time.perf_counter() - debut)
+
+        methodes = ', '.join(f"{methode} {nombre}" for methode, nombre in sorted(resultat.par_methode().items())) or '-'
+        self.stdout.write(
+            f"Compte {compte.numero_compte} du dossier {compte.dossier_pme_id} : {resultat.lignes_ouvertes} lignes ouvertes, "
+            f"{resultat.lignes_lettrees} lignes lettrables en {len(resultat.groupes)} groupes ({methodes})."
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Lettrage en simulation (chargement et rapprochement, rien n'est écrit) : "
+            f"min {min(durees):.2f} s, max {max(durees):.2f} s."
+        ))
+
+    def _generer(self, nombre_lignes, nombre_tiers, sans_contrepartie):
+        """Compte client lettrable : lignes sur deux ans, une pièce par ligne, montants aléatoires."""
+        rng = random.Random(42)
+        dossier = DossierPME.objects.create(nom_dossier=f"Benchmark lettrage {time.strftime('%Y%m%d-%H%M%S')}")
+        compte = CompteComptablePME.objects.filter(dossier_pme=dossier, numero_compte='411100').first()
+        if compte is None:
+            compte = CompteComptablePME.objects.create(
+                dossier_pme=dossier, numero_compte='411100', intitule_compte="Clients", type_compte='TIERS_CLIENT',
+            )
+        compte.est_lettrable = True
+        compte.save(update_fields=['est_lettrable'])
+        journal = JournalComptable.objects.create(dossier_pme=dossier, code_journal='BEN', libelle='Benchmark', type_journal='OD')
+        tiers = [tiers.pk for tiers in Tiers.objects.bulk_create([
+            Tiers(dossier_pme=dossier, code_tiers=f"BEN{n:05d}", nom_ou_raison_sociale=f"Client {n}", type_tiers='CL')
+            for n in range(nombre_tiers)
+        ])]
+
+        # (jour, tiers, montant en centimes, débit > 0) : factures et leurs règlements dans les 90 jours
+        premier_jour = date(date.today().year - 2, 1, 1)
+        mouvements = []
+        while len(mouvements) < nombre_lignes:
+            jour = premier_jour + timedelta(days=rng.randint(0, 729))
+            tiers_pk = rng.choice(tiers)
+            montant = rng.randint(1000, 5_000_000)
+            tirage = rng.random()
+            if tirage < sans_contrepartie:
+                mouvements.append((jour, tiers_pk, montant * rng.choice((1, -1))))
+            elif tirage < sans_contrepartie + (1 - sans_contrepartie) / 2:
+                mouvements += [(jour, tiers_pk, montant), (jour + timedelta(days=rng.randint(0, 90)), tiers_pk, -montant)]
+            else:
+                acompte = rng.randint(1, montant - 1)
+                mouvements += [(jour, tiers_pk, montant), (jour + timedelta(days=rng.randint(0, 45)), tiers_pk, -acompte),
+                               (jour + timedelta(days=rng.randint(0, 90)), tiers_pk, acompte - montant)]
+        mouvements = mouvements[:nombre_lignes]
+
+        debut = time.perf_counter()
+        for lot in range(0, len(mouvements), LIGNES_PAR_LOT):
+            with transaction.atomic():
+                ecritures = []
+                for n, (jour, __, montant) in enumerate(mouvements[lot:lot + LIGNES_PAR_LOT], start=lot):
+                    numero = f"BEN{n:08d}"
+                    ecritures.append(EcritureComptable(
+                        dossier_pme=dossier, journal=journal, numero_piece=numero, cle_sequence=texte.cle_sequence(numero),
+                        date_ecriture=jour, libelle_piece=numero,
+                        total_debit=Decimal(abs(montant)) / 100, total_credit=Decimal(abs(montant)) / 100, nombre_lignes=1,
+                    ))
+                ecritures = EcritureComptable.objects.bulk_create(ecritures)
+                LigneEcriture.objects.bulk_create([
+                    LigneEcriture(ecriture=ecriture, compte_general=compte, tiers_ligne_id=tiers_pk, libelle_ligne=ecriture.libelle_piece,
+                                  debit=Decimal(max(montant, 0)) / 100, credit=Decimal(max(-montant, 0)) / 100)
+                    for ecriture, (__, tiers_pk, montant) in zip(ecritures, mouvements[lot:lot + LIGNES_PAR_LOT])
+                ], batch_size=5000, maj_totaux_pieces=False)
+            self.stdout.write(f"  {min(lot + LIGNES_PAR_LOT, len(mouvements))} lignes générées ({time.perf_counter() - debut:.0f} s)")
+        return compte
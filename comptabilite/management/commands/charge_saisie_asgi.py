@@ -0,0 +1,167 @@
+# comptabilite/management/commands/charge_saisie_asgi.py
+import asyncio
+import json
+import time
+from itertools import cycle
+from statistics import median
+
+from asgiref.sync import ThreadSensitiveContext
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, override_settings
+from django.urls import reverse
+
+from dossiers_pme.models import DossierPME
+from comptabilite.models import CompteComptablePME, EcritureComptable, JournalComptable, Tiers
+
+
+def _percentile(valeurs, p):
+    valeurs = sorted(valeurs)
+    return valeurs[min(len(valeurs) - 1, int(round(p / 100 * (len(valeurs) - 1))))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Test de charge des API de saisie servies en ASGI : mesure la latence des recherches "
+        "(comptes, tiers, navigation, pièces) seules, puis pendant des enregistrements de pièces volumineuses. "
+        "Les pièces créées sont supprimées à la fin. À lancer sur un dossier de test."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dossier', type=int, required=True, help="PK du dossier PME de test.")
+        parser.add_argument('--journal', type=int, help="PK du journal (premier journal du dossier par défaut).")
+        parser.add_argument('--utilisateur', help="Nom de l'utilisateur authentifié (premier superutilisateur par défaut).")
+        parser.add_argument('--recherches', type=int, default=200, help="Nombre de recherches par phase.")
+        parser.add_argument('--concurrence', type=int, default=20, help="Recherches simultanées.")
+        parser.add_argument('--enregistrements', type=int, default=4, help="Pièces enregistrées pendant la seconde phase.")
+        parser.add_argument('--lignes', type=int, default=300, help="Lignes par pièce enregistrée.")
+
+    def handle(self, *args, **options):
+        try:
+            dossier = DossierPME.objects.get(pk=options['dossier'])
+        except DossierPME.DoesNotExist:
+            raise CommandError(f"Dossier PME {options['dossier']} introuvable.")
+        journaux = JournalComptable.objects.filter(dossier_pme=dossier).order_by('pk')
+        journal = journaux.filter(pk=options['journal']).first() if options['journal'] else journaux.first()
+        if journal is None:
+            raise CommandError("Aucun journal à utiliser pour ce dossier.")
+        utilisateurs = get_user_model().objects.filter(is_active=True)
+        utilisateur = (utilisateurs.filter(username=options['utilisateur']) if options['utilisateur']
+                       else utilisateurs.filter(is_superuser=True)).first()
+        if utilisateur is None:
+            raise CommandError("Aucun utilisateur actif trouvé pour s'authentifier.")
+        comptes = list(CompteComptablePME.objects.filter(
+            dossier_pme=dossier, est_actif=True, nature_compte='DETAIL'
+        ).order_by('numero_compte').values_list('numero_compte', flat=True)[:50])
+        if len(comptes) < 2:
+            raise CommandError("Le dossier doit avoir au moins deux comptes de détail actifs.")
+        tiers = list(Tiers.objects.filter(dossier_pme=dossier, est_actif=True).values_list('nom_ou_raison_sociale', flat=True)[:50])
+        piece = EcritureComptable.objects.filter(journal=journal).order_by('cle_sequence').values_list('numero_piece', flat=True).first()
+
+        urls = self._urls_recherche(dossier, journal, comptes, tiers, piece)
+        url_enregistrement = reverse('comptabilite:api_save_piece')
+        corps = json.dumps({
+            'journal_id': journal.pk,
+            'date': time.strftime('%Y-%m-%d'),
+            'libelle': 'Test de charge',
+            'lignes': [
+                {'compte': comptes[i % 2], 'libelle': 'Test de charge',
+                 'debit': '1.00' if i % 2 == 0 else '0', 'credit': '0' if i % 2 == 0 else '1.00'}
+                for i in range(options['lignes'] - options['lignes'] % 2 or 2)
+            ],
+        })
+
+        # Requêtes émises en interne vers le gestionnaire ASGI, comme le client de test de Django
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            seule, (pendant, durees_enregistrement, creees) = asyncio.run(self._campagne(
+                utilisateur, urls, url_enregistrement, corps, options
+            ))
+
+        self._rapport("Recherches seules", seule)
+        self._rapport("Recherches pendant les enregistrements", pendant)
+        if durees_enregistrement:
+            self.stdout.write(
+                f"Enregistrements : {len(durees_enregistrement)} pièce(s) de {options['lignes']} lignes, "
+                f"médiane {median(durees_enregistrement) * 1000:.0f} ms, max {max(durees_enregistrement) * 1000:.0f} ms"
+            )
+            p95_seule, p95_pendant = _percentile(seule, 95), _percentile(pendant, 95)
+            self.stdout.write(
+                f"p95 des recherches pendant / sans enregistrements : x{p95_pendant / p95_seule:.2f} "
+                f"(p95 pendant = {p95_pendant / max(durees_enregistrement) * 100:.0f} % de l'enregistrement le plus long)"
+            )
+        self._nettoyer(creees)
+
+    def _urls_recherche(self, dossier, journal, comptes, tiers, piece):
+        urls = [reverse('comptabilite:search_accounts', kwargs={'dossier_pk': dossier.pk}) + f'?q={numero[:3]}'
+                for numero in comptes]
+        urls += [reverse('comptabilite:api_tiers_lookup', kwargs={'dossier_pk': dossier.pk}) + f'?q={nom[:4]}'
+                 for nom in tiers if nom[:4].strip()]
+        urls.append(reverse('comptabilite:api_journal_info', kwargs={'journal_pk': journal.pk}))
+        urls.append(reverse('comptabilite:search_pieces', kwargs={'dossier_pk': dossier.pk, 'journal_pk': journal.pk}) + '?limit=20')
+        if piece:
+            urls.append(reverse('comptabilite:get_adjacent_piece', kwargs={
+                'dossier_pk': dossier.pk, 'journal_pk': journal.pk, 'piece_number': piece, 'direction': 'next',
+            }))
+        return urls
+
+    async def _campagne(self, utilisateur, urls, url_enregistrement, corps, options):
+        client = AsyncClient()
+        await client.aforce_login(utilisateur)
+        # Préchauffage : index de comptes et de tiers construits avant la mesure
+        for url in urls:
+            await client.get(url)
+        seule = await self._recherches(client, urls, options)
+        return seule, await self._recherches_pendant_enregistrements(client, urls, url_enregistrement, corps, options)
+
+    # Chaque requête dans son propre ThreadSensitiveContext, comme le fait ASGIHandler en déploiement :
+    # le code synchrone d'une requête (vue d'enregistrement) ne bloque pas celui des autres.
+    async def _recherches(self, client, urls, options):
+        latences = []
+        file_urls = cycle(urls)
+        semaphore = asyncio.Semaphore(options['concurrence'])
+
+        async def recherche(url):
+            async with semaphore:
+                debut = time.perf_counter()
+                async with ThreadSensitiveContext():
+                    reponse = await client.get(url)
+                latences.append(time.perf_counter() - debut)
+                if reponse.status_code != 200:
+                    raise CommandError(f"{url} : HTTP {reponse.status_code}")
+
+        await asyncio.gather(*(recherche(next(file_urls)) for __ in range(options['recherches'])))
+        return latences
+
+    async def _recherches_pendant_enregistrements(self, client, urls, url_enregistrement, corps, options):
+        durees, creees = [], []
+
+        async def enregistrement():
+            debut = time.perf_counter()
+            async with ThreadSensitiveContext():
+                reponse = await client.post(url_enregistrement, corps, content_type='application/json')
+            durees.append(time.perf_counter() - debut)
+            donnees = reponse.json()
+            if donnees.get('success'):
+                creees.append(donnees['id'])
+            else:
+                self.stderr.write(f"Enregistrement refusé : {donnees.get('message')}")
+
+        taches = [asyncio.create_task(enregistrement()) for __ in range(options['enregistrements'])]
+        await asyncio.sleep(0)  # les enregistrements démarrent avant les recherches
+        latences = await self._recherches(client, urls, options)
+        await asyncio.gather(*taches)
+        return latences, durees, creees
+
+    def _rapport(self, titre, latences):
+        self.stdout.write(
+            f"{titre} : {len(latences)} requêtes, p50 {_percentile(latences, 50) * 1000:.1f} ms, "
+            f"p95 {_percentile(latences, 95) * 1000:.1f} ms, max {max(latences) * 1000:.1f} ms"
+        )
+
+    def _nettoyer(self, creees):
+        # Du dernier numéro au premier : chaque suppression fait reculer le compteur (voir signals.py)
+        for ecriture in EcritureComptable.objects.filter(pk__in=creees).order_by('-cle_sequence'):
+            ecriture.delete()
+        if creees:
+            self.stdout.write(self.style.SUCCESS(f"{len(creees)} pièce(s) de test supprimée(s)."))
@@ -0,0 +1,43 @@
+# comptabilite/management/commands/cloturer_periode.py
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dossiers_pme.models import DossierPME
+from comptabilite.utils import cloture_comptable, clotures
+
+
+class Command(BaseCommand):
+    help = (
+        "Clôture un mois (--mois AAAA-MM) ou un exercice (--exercice AAAA) d'un dossier : verrouille les écritures "
+        "de la période, fige les soldes des comptes et, pour un exercice, passe l'écriture d'à-nouveaux."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dossier', type=int, required=True, help="PK du dossier PME.")
+        periode = parser.add_mutually_exclusive_group(required=True)
+        periode.add_argument('--mois', help="Mois à clôturer, AAAA-MM (mois antérieurs compris).")
+        periode.add_argument('--exercice', type=int, help="Année de début de l'exercice à clôturer.")
+
+    def handle(self, *args, **options):
+        dossier = DossierPME.objects.filter(pk=options['dossier']).first()
+        if dossier is None:
+            raise CommandError(f"Dossier PME {options['dossier']} introuvable.")
+        try:
+            if options['exercice']:
+                cloture = cloture_comptable.cloturer_exercice(dossier, options['exercice'])
+            else:
+                correspondance = re.fullmatch(r'(\d{4})-(\d{1,2})', options['mois'])
+                if not correspondance or not 1 <= int(correspondance.group(2)) <= 12:
+                    raise CommandError(f"Mois invalide : {options['mois']} (attendu AAAA-MM).")
+                cloture = cloture_comptable.cloturer_mois(dossier, int(correspondance.group(1)), int(correspondance.group(2)))
+        except clotures.ClotureImpossible as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f"{cloture.soldes.count()} soldes de comptes figés.")
+        if cloture.ecriture_a_nouveau:
+            self.stdout.write(
+                f"Écriture d'à-nouveaux {cloture.ecriture_a_nouveau.numero_piece} du "
+                f"{cloture.ecriture_a_nouveau.date_ecriture:%d/%m/%Y} ({cloture.ecriture_a_nouveau.nombre_lignes} lignes)."
+            )
+        self.stdout.write(self.style.SUCCESS(f"Dossier {dossier.nom_dossier} clôturé au {cloture.date_fin:%d/%m/%Y}."))
@@ -0,0 +1,58 @@
+# comptabilite/management/commands/exporter_fec.py
+import bz2
+import gzip
+import lzma
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dossiers_pme.models import DossierPME
+from comptabilite.utils import export_fec
+
+COMPRESSIONS = {'gzip': (gzip.open, '.gz'), 'bz2': (bz2.open, '.bz2'), 'xz': (lzma.open, '.xz'), 'aucune': (open, '')}
+
+
+class Command(BaseCommand):
+    help = (
+        "Écrit le Fichier des Écritures Comptables (FEC) d'un exercice, compressé par défaut. "
+        "Les lignes sont lues en flux : la mémoire utilisée ne dépend pas de la taille du dossier."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dossier', type=int, required=True, help="PK du dossier PME.")
+        parser.add_argument('--exercice', type=int, help="Année de début de l'exercice (exercice en cours par défaut).")
+        parser.add_argument('--date-debut', help="Début de période (AAAA-MM-JJ), avec --date-fin.")
+        parser.add_argument('--date-fin', help="Fin de période (AAAA-MM-JJ), avec --date-debut.")
+        parser.add_argument('--sortie', default='.', help="Fichier ou répertoire de destination (nom réglementaire dans un répertoire).")
+        parser.add_argument('--compression', choices=list(COMPRESSIONS), default='gzip', help="Compression du fichier (gzip par défaut).")
+        parser.add_argument('--strict', action='store_true', help="18 colonnes réglementaires uniquement (sans DateEcheance).")
+        parser.add_argument('--taille-lot', type=int, default=export_fec.TAILLE_LOT, help="Lignes lues par aller-retour du curseur.")
+
+    def handle(self, *args, **options):
+        try:
+            dossier = DossierPME.objects.get(pk=options['dossier'])
+        except DossierPME.DoesNotExist:
+            raise CommandError(f"Dossier PME {options['dossier']} introuvable.")
+        try:
+            date_debut, date_fin = export_fec.periode_fec(dossier, options['exercice'], options['date_debut'], options['date_fin'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        ouvrir, extension = COMPRESSIONS[options['compression']]
+        chemin = options['sortie']
+        if os.path.isdir(chemin):
+            chemin = os.path.join(chemin, export_fec.nom_fichier(dossier, date_fin) + extension)
+
+        debut = time.perf_counter()
+        nombre_lignes = -1  # en-tête
+        with ouvrir(chemin, 'wt', encoding='utf-8', newline='') as fichier:
+            for bloc in export_fec.iterer_fec(dossier, date_debut, date_fin, echeances=not options['strict'],
+                                              taille_lot=options['taille_lot']):
+                fichier.write(bloc)
+                nombre_lignes += bloc.count(export_fec.FIN_DE_LIGNE)
+        duree = time.perf_counter() - debut
+        self.stdout.write(self.style.SUCCESS(
+            f"FEC du {date_debut:%d/%m/%Y} au {date_fin:%d/%m/%Y} : {nombre_lignes} lignes écrites dans {chemin} "
+            f"en {duree:.1f} s ({os.path.getsize(chemin) / 1e6:.1f} Mo)."
+        ))
@@ -0,0 +1,70 @@
+# comptabilite/management/commands/import_ecritures.py
+import io
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dossiers_pme.models import DossierPME
+from comptabilite.models import JournalComptable
+from comptabilite.utils import import_ecritures
+
+
+class Command(BaseCommand):
+    help = (
+        "Importe un fichier d'écritures (CSV ou export Sage 100 tabulé) dans un dossier, par lots transactionnels. "
+        "Un import interrompu du même fichier reprend automatiquement après la dernière ligne comptabilisée."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('fichier', help="Chemin du fichier à importer.")
+        parser.add_argument('--dossier', type=int, required=True, help="PK du dossier PME.")
+        parser.add_argument('--journal', help="Code du journal des lignes sans colonne journal.")
+        parser.add_argument('--format', choices=['csv', 'sage'], help="Format du fichier (déduit de l'extension par défaut : .txt = sage).")
+        parser.add_argument('--encodage', default='utf-8-sig', help="Encodage du fichier (utf-8-sig par défaut, cp1252 pour les exports Sage).")
+        parser.add_argument('--taille-lot', type=int, default=import_ecritures.TAILLE_LOT, help="Lignes d'écriture par transaction.")
+        parser.add_argument('--ignorer-erreurs', action='store_true', help="Rejeter les pièces invalides au lieu d'arrêter l'import.")
+        parser.add_argument('--reprendre', type=int, help="PK d'un import inachevé à reprendre (fichier corrigé).")
+        parser.add_argument('--recommencer', action='store_true', help="Importer à nouveau un fichier déjà importé.")
+
+    def handle(self, *args, **options):
+        try:
+            dossier = DossierPME.objects.get(pk=options['dossier'])
+        except DossierPME.DoesNotExist:
+            raise CommandError(f"Dossier PME {options['dossier']} introuvable.")
+        journal = None
+        if options['journal']:
+            journal = JournalComptable.objects.filter(dossier_pme=dossier, code_journal__iexact=options['journal']).first()
+            if journal is None:
+                raise CommandError(f"Journal '{options['journal']}' introuvable dans ce dossier.")
+        chemin = options['fichier']
+        format_fichier = (options['format'] or ('sage' if chemin.lower().endswith('.txt') else 'csv')).upper()
+
+        try:
+            with open(chemin, 'rb') as fichier:
+                job = import_ecritures.preparer_job(
+                    dossier, fichier, os.path.basename(chemin), format_fichier, journal,
+                    reprendre=options['reprendre'], recommencer=options['recommencer'],
+                )
+                if job.lignes_traitees:
+                    self.stdout.write(f"Reprise de l'import n°{job.pk} après la ligne {job.lignes_traitees}.")
+                flux = io.TextIOWrapper(fichier, encoding=options['encodage'], newline='')
+                job = import_ecritures.importer(
+                    flux, job, taille_lot=options['taille_lot'], ignorer_erreurs=options['ignorer_erreurs'],
+                    progression=self._progression,
+                )
+        except OSError as e:
+            raise CommandError(f"Lecture impossible : {e}")
+        except import_ecritures.ErreurImport as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Import n°{job.pk} terminé : {job.pieces_importees} pièces, {job.lignes_importees} lignes "
+            f"en {job.duree_secondes:.1f} s ({job.lignes_par_seconde:.0f} lignes/s)."
+        ))
+        if job.pieces_rejetees:
+            self.stdout.write(self.style.WARNING(f"{job.pieces_rejetees} pièces rejetées :"))
+            for rejet in job.rejets[:20]:
+                self.stdout.write(f"  lignes {rejet['lignes'][0]}-{rejet['lignes'][1]} : {'; '.join(rejet['erreurs'])}")
+
+    def _progression(self, job):
+        self.stdout.write(f"  {job.lignes_importees} lignes importées ({job.lignes_par_seconde:.0f} lignes/s)")
@@ -0,0 +1,33 @@
+# comptabilite/management/commands/initialiser_plan_comptable.py
+from django.core.management.base import BaseCommand, CommandError
+
+from dossiers_pme.models import DossierPME
+from comptabilite.utils.plan_comptable import cloner_plan_syscohada
+from comptabilite.utils.plan_reference import get_plan_reference
+
+
+class Command(BaseCommand):
+    help = "Initialise le plan comptable PME d'un ou plusieurs dossiers à partir du plan SYSCOHADA par défaut."
+
+    def add_arguments(self, parser):
+        cible = parser.add_mutually_exclusive_group(required=True)
+        cible.add_argument('--dossier', type=int, help="PK du dossier PME à initialiser.")
+        cible.add_argument('--tous', action='store_true', help="Initialiser tous les dossiers sans plan comptable.")
+
+    def handle(self, *args, **options):
+        if not get_plan_reference():
+            raise CommandError("Aucun compte SYSCOHADA par défaut trouvé. Chargez d'abord la fixture syscohada_plan.json.")
+
+        if options['dossier']:
+            dossiers = DossierPME.objects.filter(pk=options['dossier'])
+            if not dossiers.exists():
+                raise CommandError(f"Dossier PME {options['dossier']} introuvable.")
+        else:
+            dossiers = DossierPME.objects.filter(plan_comptable_personnalise__isnull=True).distinct()
+
+        for dossier in dossiers:
+            rapport = cloner_plan_syscohada(dossier)
+            if rapport:
+                self.stdout.write(self.style.SUCCESS(f"{dossier.nom_dossier} : {rapport}"))
+            else:
+                self.stdout.write(f"{dossier.nom_dossier} : plan comptable déjà existant, ignoré.")
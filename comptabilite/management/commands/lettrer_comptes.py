@@ -0,0 +1,68 @@
+# comptabilite/management/commands/lettrer_comptes.py
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from dossiers_pme.models import DossierPME
+from comptabilite.models import CompteComptablePME, Tiers
+from comptabilite.utils import lettrage
+
+
+class Command(BaseCommand):
+    help = (
+        "Lettrage automatique des comptes lettrables d'un dossier : références (n° de facture, référence), "
+        "puis montants identiques, puis combinaisons de lignes dans une fenêtre de dates."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dossier', type=int, required=True, help="PK du dossier PME.")
+        parser.add_argument('--compte', help="Numéro du compte à lettrer (tous les comptes lettrables par défaut).")
+        parser.add_argument('--tiers', help="Code du tiers à lettrer (avec --compte).")
+        parser.add_argument('--fenetre', type=int, default=lettrage.FENETRE_JOURS_DEFAUT,
+                            help="Écart maximal en jours entre les lignes rapprochées par montant ou combinaison.")
+        parser.add_argument('--taille-max', type=int, default=lettrage.TAILLE_MAX_DEFAUT,
+                            help="Nombre maximal de lignes opposées à une ligne dans une combinaison (1 : désactivé).")
+        parser.add_argument('--simulation', action='store_true', help="Affiche les lettrages proposés sans les écrire.")
+        parser.add_argument('--detail', action='store_true', help="Liste chaque groupe de lignes lettré.")
+
+    def handle(self, *args, **options):
+        dossier = DossierPME.objects.filter(pk=options['dossier']).first()
+        if dossier is None:
+            raise CommandError(f"Dossier PME {options['dossier']} introuvable.")
+        parametres = {'fenetre_jours': options['fenetre'], 'taille_max': options['taille_max'], 'simulation': options['simulation']}
+
+        compte = tiers = None
+        if options['compte']:
+            compte = CompteComptablePME.objects.filter(dossier_pme=dossier, numero_compte=options['compte']).first()
+            if compte is None:
+                raise CommandError(f"Compte {options['compte']} introuvable dans le dossier.")
+        if options['tiers']:
+            if compte is None:
+                raise CommandError("--tiers s'utilise avec --compte.")
+            tiers = Tiers.objects.filter(dossier_pme=dossier, code_tiers=options['tiers']).first()
+            if tiers is None:
+                raise CommandError(f"Tiers {options['tiers']} introuvable dans le dossier.")
+
+        debut = time.perf_counter()
+        try:
+            if compte is not None:
+                resultats = [lettrage.lettrer_compte(compte, tiers, **parametres)]
+            else:
+                resultats = lettrage.lettrer_dossier(dossier, **parametres)
+        except lettrage.ConflitLettrage as e:
+            raise CommandError(str(e))
+
+        for resultat in resultats:
+            methodes = ', '.join(f"{methode} {nombre}" for methode, nombre in sorted(resultat.par_methode().items())) or '-'
+            self.stdout.write(
+                f"{resultat.numero_compte} : {resultat.lignes_lettrees}/{resultat.lignes_ouvertes} lignes lettrées, "
+                f"{len(resultat.groupes)} groupes ({methodes})"
+            )
+            if options['detail']:
+                for groupe in resultat.groupes:
+                    self.stdout.write(f"  {groupe.code} [{groupe.methode}] {groupe.montant} : lignes {groupe.ligne_pks}")
+        bilan = f"{sum(r.lignes_lettrees for r in resultats)} lignes en {time.perf_counter() - debut:.1f} s"
+        if options['simulation']:
+            self.stdout.write(self.style.WARNING(f"Simulation : rien n'a été écrit ({bilan})."))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"Lettrage terminé ({bilan})."))
@@ -0,0 +1,37 @@
+# comptabilite/management/commands/reconcilier_totaux_pieces.py
+from django.core.management.base import BaseCommand, CommandError
+
+from dossiers_pme.models import DossierPME
+from comptabilite.utils.totaux_pieces import reconstruire_totaux, verifier_totaux
+
+
+class Command(BaseCommand):
+    help = "Rapproche (ou vérifie) les totaux stockés des pièces comptables avec leurs lignes d'écriture."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dossier', type=int, help="PK du dossier PME à traiter (tous les dossiers par défaut).")
+        parser.add_argument('--verifier', action='store_true', help="Vérifier seulement, sans rien modifier.")
+
+    def handle(self, *args, **options):
+        dossier = None
+        if options['dossier']:
+            try:
+                dossier = DossierPME.objects.get(pk=options['dossier'])
+            except DossierPME.DoesNotExist:
+                raise CommandError(f"Dossier PME {options['dossier']} introuvable.")
+
+        if options['verifier']:
+            ecarts = verifier_totaux(dossier)
+            for ecart in ecarts[:50]:
+                self.stdout.write(
+                    f"Pièce {ecart['ecriture_id']} ({ecart['numero_piece'] or 'N/A'}) : "
+                    f"attendu D {ecart['debit_attendu']} C {ecart['credit_attendu']} ({ecart['lignes_attendues']} lignes), "
+                    f"stocké D {ecart['debit_stocke']} C {ecart['credit_stocke']} ({ecart['lignes_stockees']} lignes)"
+                )
+            if ecarts:
+                raise CommandError(f"{len(ecarts)} pièce(s) incohérente(s). Relancez sans --verifier pour corriger.")
+            self.stdout.write(self.style.SUCCESS("Totaux des pièces cohérents avec les lignes d'écriture."))
+            return
+
+        nombre = reconstruire_totaux(dossier)
+        self.stdout.write(self.style.SUCCESS(f"{nombre} pièce(s) corrigée(s)."))
@@ -0,0 +1,37 @@
+# comptabilite/management/commands/reconstruire_soldes.py
+from django.core.management.base import BaseCommand, CommandError
+
+from dossiers_pme.models import DossierPME
+from comptabilite.utils.soldes_periodes import reconstruire_soldes, verifier_soldes
+
+
+class Command(BaseCommand):
+    help = "Reconstruit (ou vérifie) la table des soldes par période à partir des lignes d'écriture."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dossier', type=int, help="PK du dossier PME à traiter (tous les dossiers par défaut).")
+        parser.add_argument('--verifier', action='store_true', help="Vérifier seulement, sans rien modifier.")
+
+    def handle(self, *args, **options):
+        dossier = None
+        if options['dossier']:
+            try:
+                dossier = DossierPME.objects.get(pk=options['dossier'])
+            except DossierPME.DoesNotExist:
+                raise CommandError(f"Dossier PME {options['dossier']} introuvable.")
+
+        if options['verifier']:
+            ecarts = verifier_soldes(dossier)
+            for ecart in ecarts[:50]:
+                self.stdout.write(
+                    f"Dossier {ecart['dossier_pme_id']} compte {ecart['compte_general_id']} "
+                    f"{ecart['mois']:02d}/{ecart['annee']} : attendu D {ecart['debit_attendu']} C {ecart['credit_attendu']}, "
+                    f"stocké D {ecart['debit_stocke']} C {ecart['credit_stocke']}"
+                )
+            if ecarts:
+                raise CommandError(f"{len(ecarts)} solde(s) incohérent(s). Relancez sans --verifier pour reconstruire.")
+            self.stdout.write(self.style.SUCCESS("Soldes par période cohérents avec les lignes d'écriture."))
+            return
+
+        nombre = reconstruire_soldes(dossier)
+        self.stdout.write(self.style.SUCCESS(f"{nombre} solde(s) par période reconstruit(s)."))
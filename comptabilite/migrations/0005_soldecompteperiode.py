@@ -0,0 +1,34 @@
+# Generated by Django 5.2.1 on 2026-10-18 02:56
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comptabilite', '0004_remove_ligneecriture_reference_ligne'),
+        ('dossiers_pme', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SoldeComptePeriode',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('annee', models.PositiveSmallIntegerField(verbose_name='Année')),
+                ('mois', models.PositiveSmallIntegerField(verbose_name='Mois')),
+                ('total_debit', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=17, verbose_name='Total Débit')),
+                ('total_credit', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=17, verbose_name='Total Crédit')),
+                ('compte_general', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='soldes_periodes', to='comptabilite.comptecomptablepme', verbose_name='Compte Général')),
+                ('dossier_pme', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='soldes_periodes', to='dossiers_pme.dossierpme', verbose_name='Dossier PME')),
+            ],
+            options={
+                'verbose_name': 'Solde de Compte par Période',
+                'verbose_name_plural': 'Soldes de Comptes par Période',
+                'ordering': ['dossier_pme', 'annee', 'mois', 'compte_general'],
+                'unique_together': {('dossier_pme', 'compte_general', 'annee', 'mois')},
+            },
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.1 on 2026-10-18 03:04
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+INDEX_TRIGRAMMES = 'comptabilite_tiers_cle_recherche_trgm'
+
+# Copie figée de comptabilite.utils.texte.cle_recherche à la date de la migration :
+# une évolution ultérieure de l'utilitaire ne doit pas changer ce que calcule la migration.
+_SEPARATEURS = re.compile(r'[^0-9a-z]+')
+
+
+def _normaliser(texte):
+    decompose = unicodedata.normalize('NFKD', texte or '')
+    return ''.join(c for c in decompose if not unicodedata.combining(c)).lower()
+
+
+def cle_recherche(*textes):
+    return ' '.join(mot for texte in textes for mot in _SEPARATEURS.split(_normaliser(texte)) if mot)
+
+
+def remplir_cles_recherche(apps, schema_editor):
+    Tiers = apps.get_model('comptabilite', 'Tiers')
+    a_mettre_a_jour = []
+    for tiers in Tiers.objects.only('pk', 'code_tiers', 'nom_ou_raison_sociale', 'prenom').iterator(chunk_size=2000):
+        tiers.cle_recherche = cle_recherche(tiers.code_tiers, tiers.nom_ou_raison_sociale, tiers.prenom)[:400]
+        a_mettre_a_jour.append(tiers)
+    Tiers.objects.bulk_update(a_mettre_a_jour, ['cle_recherche'], batch_size=1000)
+
+
+def creer_index_trigrammes(apps, schema_editor):
+    # PostgreSQL uniquement : index GIN pg_trgm pour les recherches LIKE '%...%'.
+    # Les autres bases utilisent l'index n-grammes en mémoire (utils/recherche_tiers.py).
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    schema_editor.execute(
+        f"CREATE INDEX IF NOT EXISTS {INDEX_TRIGRAMMES} "
+        "ON comptabilite_tiers USING gin (cle_recherche gin_trgm_ops)"
+    )
+
+
+def supprimer_index_trigrammes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f"DROP INDEX IF EXISTS {INDEX_TRIGRAMMES}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comptabilite', '0005_soldecompteperiode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tiers',
+            name='cle_recherche',
+            field=models.CharField(blank=True, default='', editable=False, help_text='Code, nom et prénom sans accents ni casse (recherche de tiers).', max_length=400, verbose_name='Clé de recherche'),
+        ),
+        migrations.RunPython(remplir_cles_recherche, migrations.RunPython.noop),
+        migrations.RunPython(creer_index_trigrammes, supprimer_index_trigrammes),
+    ]
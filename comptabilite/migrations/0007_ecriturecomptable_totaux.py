@@ -0,0 +1,46 @@
+# Generated by Django 5.2.1 on 2026-10-18 03:06
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def calculer_totaux_pieces(apps, schema_editor):
+    EcritureComptable = apps.get_model('comptabilite', 'EcritureComptable')
+    LigneEcriture = apps.get_model('comptabilite', 'LigneEcriture')
+    agregats = LigneEcriture.objects.values('ecriture_id').annotate(
+        debit=Coalesce(Sum('debit'), Value(Decimal(0)), output_field=DecimalField()),
+        credit=Coalesce(Sum('credit'), Value(Decimal(0)), output_field=DecimalField()),
+        lignes=Count('pk'),
+    ).order_by()
+    EcritureComptable.objects.bulk_update([
+        EcritureComptable(pk=agg['ecriture_id'], total_debit=agg['debit'], total_credit=agg['credit'], nombre_lignes=agg['lignes'])
+        for agg in agregats
+    ], ['total_debit', 'total_credit', 'nombre_lignes'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comptabilite', '0006_tiers_cle_recherche'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ecriturecomptable',
+            name='nombre_lignes',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Nombre de lignes'),
+        ),
+        migrations.AddField(
+            model_name='ecriturecomptable',
+            name='total_credit',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0'), editable=False, max_digits=17, verbose_name='Total Crédit'),
+        ),
+        migrations.AddField(
+            model_name='ecriturecomptable',
+            name='total_debit',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0'), editable=False, max_digits=17, verbose_name='Total Débit'),
+        ),
+        migrations.RunPython(calculer_totaux_pieces, migrations.RunPython.noop),
+    ]
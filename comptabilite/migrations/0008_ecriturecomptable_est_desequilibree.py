@@ -0,0 +1,31 @@
+# Generated by Django 5.2.1 on 2026-10-18 03:08
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def signaler_pieces_desequilibrees(apps, schema_editor):
+    EcritureComptable = apps.get_model('comptabilite', 'EcritureComptable')
+    # Totaux à deux décimales : toute différence est un déséquilibre
+    EcritureComptable.objects.exclude(total_debit=F('total_credit')).update(est_desequilibree=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comptabilite', '0007_ecriturecomptable_totaux'),
+        ('dossiers_pme', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ecriturecomptable',
+            name='est_desequilibree',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Déséquilibrée ?'),
+        ),
+        migrations.AddIndex(
+            model_name='ecriturecomptable',
+            index=models.Index(condition=models.Q(('est_desequilibree', True)), fields=['dossier_pme', '-date_ecriture', '-id'], name='ecriture_desequilibree_idx'),
+        ),
+        migrations.RunPython(signaler_pieces_desequilibrees, migrations.RunPython.noop),
+    ]
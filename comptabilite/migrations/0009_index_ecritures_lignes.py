@@ -0,0 +1,55 @@
+# Generated by Django 5.2.1 on 2026-10-18 03:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comptabilite', '0008_ecriturecomptable_est_desequilibree'),
+        ('dossiers_pme', '0001_initial'),
+    ]
+
+    operations = [
+        # Index composites créés avant la suppression des index simples des clés étrangères qu'ils couvrent
+        migrations.AddIndex(
+            model_name='ecriturecomptable',
+            index=models.Index(fields=['dossier_pme', 'date_ecriture', 'id'], name='ecriture_dossier_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ecriturecomptable',
+            index=models.Index(fields=['journal', 'numero_piece'], name='ecriture_journal_numero_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ecriturecomptable',
+            index=models.Index(fields=['journal', 'date_ecriture', 'numero_piece'], name='ecriture_journal_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ligneecriture',
+            index=models.Index(fields=['compte_general', 'ecriture'], include=('debit', 'credit'), name='ligne_compte_ecriture_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ligneecriture',
+            index=models.Index(condition=models.Q(('lettrage_code__isnull', False)), fields=['lettrage_code'], name='ligne_lettrage_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ligneecriture',
+            index=models.Index(condition=models.Q(('lettrage_code__isnull', True)), fields=['compte_general', 'tiers_ligne'], name='ligne_non_lettree_idx'),
+        ),
+        migrations.AlterField(
+            model_name='ecriturecomptable',
+            name='dossier_pme',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='ecritures', to='dossiers_pme.dossierpme'),
+        ),
+        migrations.AlterField(
+            model_name='ecriturecomptable',
+            name='journal',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='ecritures', to='comptabilite.journalcomptable'),
+        ),
+        migrations.AlterField(
+            model_name='ligneecriture',
+            name='compte_general',
+            field=models.ForeignKey(db_index=False, limit_choices_to={'est_actif': True, 'nature_compte': 'DETAIL'}, on_delete=django.db.models.deletion.PROTECT, to='comptabilite.comptecomptablepme', verbose_name='N° Compte Général'),
+        ),
+    ]
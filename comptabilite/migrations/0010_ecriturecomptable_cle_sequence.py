@@ -0,0 +1,56 @@
+# Generated by Django 5.2.1 on 2026-10-18 03:13
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+# Copie figée de comptabilite.utils.texte.cle_sequence à la date de la migration :
+# une évolution ultérieure de l'utilitaire ne doit pas changer ce que calcule la migration.
+_SEGMENTS_NUMERIQUES = re.compile(r'(\d+)')
+
+
+def _normaliser(texte):
+    decompose = unicodedata.normalize('NFKD', texte or '')
+    return ''.join(c for c in decompose if not unicodedata.combining(c)).lower()
+
+
+def cle_sequence(numero):
+    segments = []
+    for i, segment in enumerate(_SEGMENTS_NUMERIQUES.split((numero or '').strip())):
+        if i % 2:
+            chiffres = segment.lstrip('0') or '0'
+            segments.append(f"{len(chiffres):02d}{chiffres}")
+        else:
+            segments.append(_normaliser(segment))
+    return ''.join(segments)
+
+
+def remplir_cles_sequence(apps, schema_editor):
+    EcritureComptable = apps.get_model('comptabilite', 'EcritureComptable')
+    a_mettre_a_jour = []
+    for ecriture in EcritureComptable.objects.only('pk', 'numero_piece').iterator(chunk_size=2000):
+        ecriture.cle_sequence = cle_sequence(ecriture.numero_piece)[:120]
+        a_mettre_a_jour.append(ecriture)
+    EcritureComptable.objects.bulk_update(a_mettre_a_jour, ['cle_sequence'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comptabilite', '0009_index_ecritures_lignes'),
+        ('dossiers_pme', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ecriturecomptable',
+            name='cle_sequence',
+            field=models.CharField(blank=True, default='', editable=False, help_text='Numéro de pièce normalisé pour le tri naturel (navigation dans le journal).', max_length=120, verbose_name='Clé de séquence'),
+        ),
+        migrations.RunPython(remplir_cles_sequence, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='ecriturecomptable',
+            index=models.Index(fields=['journal', 'cle_sequence', 'id'], name='ecriture_journal_sequence_idx'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.1 on 2026-10-18 03:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comptabilite', '0010_ecriturecomptable_cle_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SequencePiece',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('exercice', models.PositiveSmallIntegerField(help_text="Année de début de l'exercice comptable.", verbose_name='Exercice')),
+                ('prefixe', models.CharField(max_length=30, verbose_name='Préfixe')),
+                ('largeur', models.PositiveSmallIntegerField(default=4, verbose_name='Largeur du numéro')),
+                ('dernier_numero', models.PositiveIntegerField(default=0, verbose_name='Dernier numéro attribué')),
+                ('date_mise_a_jour', models.DateTimeField(auto_now=True)),
+                ('journal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sequences_pieces', to='comptabilite.journalcomptable', verbose_name='Journal')),
+            ],
+            options={
+                'verbose_name': 'Séquence de Pièces',
+                'verbose_name_plural': 'Séquences de Pièces',
+                'ordering': ['journal', '-exercice'],
+                'unique_together': {('journal', 'exercice')},
+            },
+        ),
+        migrations.CreateModel(
+            name='NumeroPieceLibere',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('numero', models.PositiveIntegerField(verbose_name='Numéro')),
+                ('date_liberation', models.DateTimeField(auto_now_add=True)),
+                ('sequence', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='numeros_liberes', to='comptabilite.sequencepiece')),
+            ],
+            options={
+                'verbose_name': 'Numéro de Pièce Libéré',
+                'verbose_name_plural': 'Numéros de Pièces Libérés',
+                'ordering': ['sequence', 'numero'],
+                'unique_together': {('sequence', 'numero')},
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.1 on 2026-10-18 03:29
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comptabilite', '0011_sequences_pieces'),
+        ('dossiers_pme', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportEcritures',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nom_fichier', models.CharField(max_length=255, verbose_name='Fichier')),
+                ('empreinte', models.CharField(max_length=64, verbose_name='Empreinte SHA-256')),
+                ('format_fichier', models.CharField(choices=[('CSV', 'CSV'), ('SAGE', 'Export Sage 100 (texte tabulé)')], default='CSV', max_length=4, verbose_name='Format')),
+                ('statut', models.CharField(choices=[('EN_COURS', 'En cours'), ('TERMINE', 'Terminé'), ('ECHEC', 'Échec')], default='EN_COURS', max_length=10, verbose_name='Statut')),
+                ('lignes_traitees', models.PositiveIntegerField(default=0, help_text='Point de reprise : lignes du fichier déjà comptabilisées ou rejetées.', verbose_name='Lignes source traitées')),
+                ('lignes_importees', models.PositiveIntegerField(default=0, verbose_name='Lignes importées')),
+                ('pieces_importees', models.PositiveIntegerField(default=0, verbose_name='Pièces importées')),
+                ('pieces_rejetees', models.PositiveIntegerField(default=0, verbose_name='Pièces rejetées')),
+                ('rejets', models.JSONField(blank=True, default=list, verbose_name='Rejets')),
+                ('message_erreur', models.TextField(blank=True, verbose_name='Erreur')),
+                ('duree_secondes', models.FloatField(default=0, verbose_name='Durée (s)')),
+                ('date_debut', models.DateTimeField(auto_now_add=True)),
+                ('date_mise_a_jour', models.DateTimeField(auto_now=True)),
+                ('dossier_pme', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='imports_ecritures', to='dossiers_pme.dossierpme', verbose_name='Dossier PME')),
+                ('journal_defaut', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='comptabilite.journalcomptable', verbose_name='Journal par défaut')),
+                ('utilisateur', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': "Import d'Écritures",
+                'verbose_name_plural': "Imports d'Écritures",
+                'ordering': ['-date_debut'],
+                'indexes': [models.Index(fields=['dossier_pme', 'empreinte'], name='import_dossier_empreinte_idx')],
+            },
+        ),
+    ]
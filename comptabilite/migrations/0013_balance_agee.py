@@ -0,0 +1,23 @@
+# Generated by Django 5.2.1 on 2026-10-18 04:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comptabilite', '0012_import_ecritures'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ligneecriture',
+            name='tiers_ligne',
+            field=models.ForeignKey(blank=True, db_index=False, help_text='Si compte général collectif.', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='lignes_ecriture_detail', to='comptabilite.tiers', verbose_name='N° Compte Tiers (ligne)'),
+        ),
+        migrations.AddIndex(
+            model_name='ligneecriture',
+            index=models.Index(fields=['tiers_ligne', 'lettrage_code', 'date_echeance_ligne'], include=('debit', 'credit'), name='ligne_tiers_echeance_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.1 on 2026-10-18 05:29
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comptabilite', '0013_balance_agee'),
+        ('dossiers_pme', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClotureComptable',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type_cloture', models.CharField(choices=[('MOIS', 'Mois'), ('EXERCICE', 'Exercice')], max_length=8, verbose_name='Type de clôture')),
+                ('date_fin', models.DateField(verbose_name="Clôturé jusqu'au")),
+                ('date_cloture', models.DateTimeField(auto_now_add=True)),
+                ('cloture_par', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('dossier_pme', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='clotures', to='dossiers_pme.dossierpme', verbose_name='Dossier PME')),
+                ('ecriture_a_nouveau', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='+', to='comptabilite.ecriturecomptable', verbose_name="Écriture d'à-nouveaux")),
+            ],
+            options={
+                'verbose_name': 'Clôture Comptable',
+                'verbose_name_plural': 'Clôtures Comptables',
+                'ordering': ['dossier_pme', '-date_fin', 'type_cloture'],
+                'unique_together': {('dossier_pme', 'date_fin', 'type_cloture')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SoldeCloture',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('solde_debit', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=17, verbose_name='Solde Débiteur')),
+                ('solde_credit', models.DecimalField(decimal_places=2, default=Decimal('0'), max_digits=17, verbose_name='Solde Créditeur')),
+                ('cloture', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='soldes', to='comptabilite.cloturecomptable', verbose_name='Clôture')),
+                ('compte_general', models.ForeignKey(on_delete=django.db.models.deletion.RESTRICT, related_name='+', to='comptabilite.comptecomptablepme', verbose_name='Compte Général')),
+            ],
+            options={
+                'verbose_name': 'Solde de Clôture',
+                'verbose_name_plural': 'Soldes de Clôture',
+                'ordering': ['cloture', 'compte_general'],
+                'unique_together': {('cloture', 'compte_general')},
+            },
+        ),
+    ]
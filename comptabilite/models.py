@@ -1,12 +1,15 @@
 # comptabilite/models.py
+from django.conf import settings
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 from django.db.models import Sum, Q, Value, F, Max, DecimalField # Ajout de DecimalField, Max
 from django.db.models.functions import Coalesce
+from django.dispatch import Signal
 from dossiers_pme.models import DossierPME # Assurez-vous que l'import est correct
 from decimal import Decimal # Pour les valeurs Decimal par défaut
+from .utils import texte
 
 class CompteComptableDefaut(models.Model):
     TYPE_COMPTE_CHOICES = [
@@ -130,6 +133,8 @@ class Tiers(models.Model):
     est_actif = models.BooleanField(_("Tiers Actif ?"), default=True)
     date_creation = models.DateTimeField(_("Date de création"), default=timezone.now, editable=False)
     date_mise_a_jour = models.DateTimeField(_("Date de mise à jour"), auto_now=True)
+    cle_recherche = models.CharField(_("Clé de recherche"), max_length=400, blank=True, default="", editable=False,
+                                     help_text=_("Code, nom et prénom sans accents ni casse (recherche de tiers)."))
     
     class Meta: 
         verbose_name = _("Tiers")
@@ -140,6 +145,16 @@ class Tiers(models.Model):
     def __str__(self): 
         return f"{self.code_tiers} - {self.nom_ou_raison_sociale} ({self.dossier_pme.nom_dossier})"
 
+    def calculer_cle_recherche(self):
+        return texte.cle_recherche(self.code_tiers, self.nom_ou_raison_sociale, self.prenom)[:400]
+
+    def save(self, *args, **kwargs):
+        self.cle_recherche = self.calculer_cle_recherche()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'cle_recherche' not in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'cle_recherche']
+        super().save(*args, **kwargs)
+
 class TauxDeTaxe(models.Model):
     dossier_pme = models.ForeignKey(DossierPME, on_delete=models.CASCADE, related_name='taux_de_taxes', verbose_name=_("Dossier PME"))
     code_taxe = models.CharField(_("Code Taxe"), max_length=20, help_text=_("Code unique pour cette taxe (ex: TVA18COL)."))
@@ -163,36 +178,88 @@ class TauxDeTaxe(models.Model):
     def get_taux_decimal(self): return self.taux / Decimal(100) if self.taux is not None else Decimal(0)
 
 class EcritureComptable(models.Model):
-    dossier_pme = models.ForeignKey(DossierPME, on_delete=models.CASCADE, related_name='ecritures')
-    journal = models.ForeignKey(JournalComptable, on_delete=models.PROTECT, related_name='ecritures')
+    # Index des clés étrangères couverts par les index composites de Meta.indexes
+    dossier_pme = models.ForeignKey(DossierPME, on_delete=models.CASCADE, related_name='ecritures', db_index=False)
+    journal = models.ForeignKey(JournalComptable, on_delete=models.PROTECT, related_name='ecritures', db_index=False)
     date_ecriture = models.DateField(_("Date de la Pièce")) 
     numero_piece = models.CharField(_("N° Pièce"), max_length=50, blank=True, help_text=_("Numéro séquentiel ou manuel."))
+    cle_sequence = models.CharField(_("Clé de séquence"), max_length=120, blank=True, default="", editable=False,
+                                    help_text=_("Numéro de pièce normalisé pour le tri naturel (navigation dans le journal)."))
     libelle_piece = models.CharField(_("Libellé Pièce"), max_length=255, help_text=_("Libellé général de la pièce."))
     numero_facture_liee = models.CharField(_("N° Facture"), max_length=50, blank=True, null=True)
     reference_piece = models.CharField(_("Référence"), max_length=100, blank=True, null=True)
     tiers_en_tete = models.ForeignKey(Tiers, on_delete=models.SET_NULL, null=True, blank=True, related_name='ecritures_en_tete', verbose_name=_("N° Compte Tiers (en-tête)"))
     date_echeance_piece = models.DateField(_("Date Échéance (en-tête)"), null=True, blank=True)
     montant_total_controle = models.DecimalField(_("Montant Total Contrôle"), max_digits=15, decimal_places=2, null=True, blank=True)
+    # Totaux des lignes, tenus à jour par les signaux des lignes (voir comptabilite/signals.py)
+    total_debit = models.DecimalField(_("Total Débit"), max_digits=17, decimal_places=2, default=Decimal(0), editable=False)
+    total_credit = models.DecimalField(_("Total Crédit"), max_digits=17, decimal_places=2, default=Decimal(0), editable=False)
+    nombre_lignes = models.PositiveIntegerField(_("Nombre de lignes"), default=0, editable=False)
+    est_desequilibree = models.BooleanField(_("Déséquilibrée ?"), default=False, editable=False)
     date_creation = models.DateTimeField(auto_now_add=True)
     date_mise_a_jour = models.DateTimeField(auto_now=True)
 
+    CHAMPS_TOTAUX = ('total_debit', 'total_credit', 'nombre_lignes', 'est_desequilibree')
+
     class Meta:
         verbose_name = _("Pièce Comptable"); verbose_name_plural = _("Pièces Comptables")
         ordering = ['dossier_pme', '-date_ecriture', 'journal', '-id']
+        indexes = [
+            # Tableaux de bord et rapports : pièces d'un dossier sur une plage de dates
+            models.Index(fields=['dossier_pme', 'date_ecriture', 'id'], name='ecriture_dossier_date_idx'),
+            # Recherche d'une pièce par numéro dans un journal (search_pieces, get_adjacent_piece)
+            models.Index(fields=['journal', 'numero_piece'], name='ecriture_journal_numero_idx'),
+            # Parcours chronologique d'un journal (pièce précédente/suivante, dernier numéro de l'année)
+            models.Index(fields=['journal', 'date_ecriture', 'numero_piece'], name='ecriture_journal_date_idx'),
+            # Navigation pièce précédente/suivante/n-ième dans l'ordre naturel des numéros
+            models.Index(fields=['journal', 'cle_sequence', 'id'], name='ecriture_journal_sequence_idx'),
+            # Registre des pièces déséquilibrées : index partiel, ne contient que les pièces signalées
+            models.Index(fields=['dossier_pme', '-date_ecriture', '-id'], condition=Q(est_desequilibree=True),
+                         name='ecriture_desequilibree_idx'),
+        ]
     def __str__(self): return f"Pièce {self.numero_piece or 'N/A'} du {self.date_ecriture.strftime('%d/%m/%Y')}"
+    def save(self, *args, **kwargs):
+        self.cle_sequence = texte.cle_sequence(self.numero_piece)[:120]
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'numero_piece' in update_fields and 'cle_sequence' not in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'cle_sequence']
+        # Les totaux sont incrémentés en base par les lignes : une instance chargée avant
+        # l'ajout de lignes ne doit pas les écraser avec des valeurs périmées.
+        if not self._state.adding and update_fields is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.CHAMPS_TOTAUX
+            ]
+        super().save(*args, **kwargs)
+    def delete(self, *args, **kwargs):
+        # Avant la collecte des objets liés : la pièce d'à-nouveaux d'une clôture (RESTRICT) est
+        # refusée comme une pièce de période clôturée (PeriodeCloturee) plutôt que par RestrictedError
+        from .utils import clotures
+        clotures.verifier_periode_ouverte(self.dossier_pme_id, [self.date_ecriture], ecriture_pk=self.pk)
+        return super().delete(*args, **kwargs)
     @property
-    def total_debit_lignes(self): return self.lignes_ecriture.aggregate(total=Coalesce(Sum('debit'), Value(Decimal(0)), output_field=DecimalField()))['total']
+    def total_debit_lignes(self): return self.total_debit
     @property
-    def total_credit_lignes(self): return self.lignes_ecriture.aggregate(total=Coalesce(Sum('credit'), Value(Decimal(0)), output_field=DecimalField()))['total']
+    def total_credit_lignes(self): return self.total_credit
     @property
-    def solde_piece(self): return self.total_debit_lignes - self.total_credit_lignes
+    def solde_piece(self): return self.total_debit - self.total_credit
     @property
     def est_equilibree(self): return abs(self.solde_piece) < Decimal('0.001')
 
+# bulk_create ne déclenche pas post_save : ce signal permet aux soldes dérivés de suivre les insertions en masse.
+lignes_ecriture_creees_en_masse = Signal()
+
+class LigneEcritureQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, maj_totaux_pieces=True, **kwargs):
+        # maj_totaux_pieces=False : pièces créées avec leurs totaux déjà calculés (import en masse)
+        lignes = super().bulk_create(objs, *args, **kwargs)
+        lignes_ecriture_creees_en_masse.send(sender=self.model, lignes=lignes, maj_totaux_pieces=maj_totaux_pieces)
+        return lignes
+
 class LigneEcriture(models.Model):
     ecriture = models.ForeignKey(EcritureComptable, on_delete=models.CASCADE, related_name='lignes_ecriture')
-    compte_general = models.ForeignKey(CompteComptablePME, on_delete=models.PROTECT, limit_choices_to={'nature_compte': 'DETAIL', 'est_actif': True}, verbose_name=_("N° Compte Général"))
-    tiers_ligne = models.ForeignKey(Tiers, on_delete=models.SET_NULL, null=True, blank=True, related_name='lignes_ecriture_detail', verbose_name=_("N° Compte Tiers (ligne)"), help_text=_("Si compte général collectif."))
+    compte_general = models.ForeignKey(CompteComptablePME, on_delete=models.PROTECT, limit_choices_to={'nature_compte': 'DETAIL', 'est_actif': True}, verbose_name=_("N° Compte Général"), db_index=False)
+    tiers_ligne = models.ForeignKey(Tiers, on_delete=models.SET_NULL, null=True, blank=True, related_name='lignes_ecriture_detail', verbose_name=_("N° Compte Tiers (ligne)"), help_text=_("Si compte général collectif."), db_index=False)
     libelle_ligne = models.CharField(_("Libellé Écriture (ligne)"), max_length=255, help_text=_("Libellé spécifique à cette ligne."))
     date_echeance_ligne = models.DateField(_("Date Échéance (ligne)"), null=True, blank=True)
     lettrage_code = models.CharField(_("Lettrage"), max_length=10, blank=True, null=True )
@@ -204,9 +271,23 @@ class LigneEcriture(models.Model):
     credit = models.DecimalField(_("Crédit"), max_digits=15, decimal_places=2, default=Decimal(0))
     ordre = models.PositiveIntegerField(_("Ordre"), default=0, editable=False)
 
+    objects = LigneEcritureQuerySet.as_manager()
+
     class Meta:
         verbose_name = _("Ligne de Pièce Comptable"); verbose_name_plural = _("Lignes de Pièces Comptables")
         ordering = ['ecriture', 'ordre', 'id']
+        indexes = [
+            # Mouvements d'un compte (grand livre, balances) ; remplace l'index simple de la clé étrangère.
+            # Sur PostgreSQL, debit/credit sont inclus pour les agrégats en parcours d'index seul.
+            models.Index(fields=['compte_general', 'ecriture'], include=['debit', 'credit'], name='ligne_compte_ecriture_idx'),
+            # Lignes d'un même code de lettrage
+            models.Index(fields=['lettrage_code'], condition=Q(lettrage_code__isnull=False), name='ligne_lettrage_idx'),
+            # Lignes restant à lettrer par compte et tiers
+            models.Index(fields=['compte_general', 'tiers_ligne'], condition=Q(lettrage_code__isnull=True), name='ligne_non_lettree_idx'),
+            # Encours d'un tiers par échéance (balance âgée) ; remplace l'index simple de la clé étrangère tiers_ligne.
+            models.Index(fields=['tiers_ligne', 'lettrage_code', 'date_echeance_ligne'], include=['debit', 'credit'],
+                         name='ligne_tiers_echeance_idx'),
+        ]
     def __str__(self): return f"Ligne pour {self.ecriture.numero_piece or 'N/A'}: Cpte {self.compte_general.numero_compte}"
     def clean(self):
         if (self.debit or Decimal(0)) > Decimal(0) and (self.credit or Decimal(0)) > Decimal(0):
@@ -216,4 +297,143 @@ class LigneEcriture(models.Model):
             max_ordre_dict = LigneEcriture.objects.filter(ecriture=self.ecriture).aggregate(max_o=Max('ordre'))
             max_ordre = max_ordre_dict['max_o']
             self.ordre = (max_ordre if max_ordre is not None else -1) + 1
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+
+class SoldeComptePeriode(models.Model):
+    """
+    Cumul des mouvements d'un compte pour un mois donné, tenu à jour à chaque écriture
+    (voir comptabilite/signals.py). Les tableaux de bord lisent ces cumuls au lieu de
+    ré-agréger toutes les lignes d'écriture du dossier.
+    """
+    dossier_pme = models.ForeignKey(DossierPME, on_delete=models.CASCADE, related_name='soldes_periodes', verbose_name=_("Dossier PME"))
+    compte_general = models.ForeignKey(CompteComptablePME, on_delete=models.CASCADE, related_name='soldes_periodes', verbose_name=_("Compte Général"))
+    annee = models.PositiveSmallIntegerField(_("Année"))
+    mois = models.PositiveSmallIntegerField(_("Mois"))
+    total_debit = models.DecimalField(_("Total Débit"), max_digits=17, decimal_places=2, default=Decimal(0))
+    total_credit = models.DecimalField(_("Total Crédit"), max_digits=17, decimal_places=2, default=Decimal(0))
+
+    class Meta:
+        verbose_name = _("Solde de Compte par Période"); verbose_name_plural = _("Soldes de Comptes par Période")
+        unique_together = ('dossier_pme', 'compte_general', 'annee', 'mois')
+        ordering = ['dossier_pme', 'annee', 'mois', 'compte_general']
+    def __str__(self): return f"{self.compte_general_id} {self.mois:02d}/{self.annee}: D {self.total_debit} / C {self.total_credit}"
+    @property
+    def solde(self): return self.total_debit - self.total_credit
+
+class SequencePiece(models.Model):
+    """
+    Compteur de numérotation des pièces d'un journal pour un exercice (voir utils/sequences_pieces.py).
+    Les numéros sont attribués sous verrou de ligne : deux saisies concurrentes n'obtiennent jamais le même numéro.
+    """
+    journal = models.ForeignKey(JournalComptable, on_delete=models.CASCADE, related_name='sequences_pieces', verbose_name=_("Journal"))
+    exercice = models.PositiveSmallIntegerField(_("Exercice"), help_text=_("Année de début de l'exercice comptable."))
+    prefixe = models.CharField(_("Préfixe"), max_length=30)
+    largeur = models.PositiveSmallIntegerField(_("Largeur du numéro"), default=4)
+    dernier_numero = models.PositiveIntegerField(_("Dernier numéro attribué"), default=0)
+    date_mise_a_jour = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _("Séquence de Pièces"); verbose_name_plural = _("Séquences de Pièces")
+        unique_together = ('journal', 'exercice')
+        ordering = ['journal', '-exercice']
+    def __str__(self): return f"{self.prefixe} : {self.dernier_numero}"
+    def formater(self, numero: int) -> str: return f"{self.prefixe}{numero:0{self.largeur}d}"
+
+class NumeroPieceLibere(models.Model):
+    """Numéro réservé puis abandonné, réattribué en priorité pour garder la séquence sans trou."""
+    sequence = models.ForeignKey(SequencePiece, on_delete=models.CASCADE, related_name='numeros_liberes')
+    numero = models.PositiveIntegerField(_("Numéro"))
+    date_liberation = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("Numéro de Pièce Libéré"); verbose_name_plural = _("Numéros de Pièces Libérés")
+        unique_together = ('sequence', 'numero')
+        ordering = ['sequence', 'numero']
+    def __str__(self): return self.sequence.formater(self.numero)
+
+class ImportEcritures(models.Model):
+    """
+    Suivi d'un import de fichier d'écritures (voir utils/import_ecritures.py). Les lots validés sont
+    comptabilisés au fil de l'eau : après un échec, l'import reprend après la dernière ligne source validée.
+    """
+    FORMAT_CHOICES = [('CSV', _('CSV')), ('SAGE', _('Export Sage 100 (texte tabulé)'))]
+    STATUT_CHOICES = [('EN_COURS', _('En cours')), ('TERMINE', _('Terminé')), ('ECHEC', _('Échec'))]
+
+    dossier_pme = models.ForeignKey(DossierPME, on_delete=models.CASCADE, related_name='imports_ecritures', verbose_name=_("Dossier PME"))
+    journal_defaut = models.ForeignKey(JournalComptable, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name=_("Journal par défaut"))
+    nom_fichier = models.CharField(_("Fichier"), max_length=255)
+    empreinte = models.CharField(_("Empreinte SHA-256"), max_length=64)
+    format_fichier = models.CharField(_("Format"), max_length=4, choices=FORMAT_CHOICES, default='CSV')
+    statut = models.CharField(_("Statut"), max_length=10, choices=STATUT_CHOICES, default='EN_COURS')
+    lignes_traitees = models.PositiveIntegerField(_("Lignes source traitées"), default=0, help_text=_("Point de reprise : lignes du fichier déjà comptabilisées ou rejetées."))
+    lignes_importees = models.PositiveIntegerField(_("Lignes importées"), default=0)
+    pieces_importees = models.PositiveIntegerField(_("Pièces importées"), default=0)
+    pieces_rejetees = models.PositiveIntegerField(_("Pièces rejetées"), default=0)
+    rejets = models.JSONField(_("Rejets"), default=list, blank=True)
+    message_erreur = models.TextField(_("Erreur"), blank=True)
+    duree_secondes = models.FloatField(_("Durée (s)"), default=0)
+    utilisateur = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    date_debut = models.DateTimeField(auto_now_add=True)
+    date_mise_a_jour = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = _("Import d'Écritures"); verbose_name_plural = _("Imports d'Écritures")
+        ordering = ['-date_debut']
+        indexes = [models.Index(fields=['dossier_pme', 'empreinte'], name='import_dossier_empreinte_idx')]
+    def __str__(self): return f"{self.nom_fichier} ({self.get_statut_display()})"
+    @property
+    def lignes_par_seconde(self): return self.lignes_importees / self.duree_secondes if self.duree_secondes else 0
+
+class ClotureComptable(models.Model):
+    """
+    Clôture d'un mois ou d'un exercice (voir utils/cloture_comptable.py) : les écritures datées
+    jusqu'à date_fin ne peuvent plus être modifiées, et les rapports repartent des soldes figés
+    (SoldeCloture) ou, après une clôture d'exercice, de l'écriture d'à-nouveaux. Une clôture
+    n'est ni modifiable ni supprimable (sauf avec son dossier).
+    """
+    MOIS = 'MOIS'
+    EXERCICE = 'EXERCICE'
+    TYPE_CLOTURE_CHOICES = [(MOIS, _('Mois')), (EXERCICE, _('Exercice'))]
+
+    dossier_pme = models.ForeignKey(DossierPME, on_delete=models.CASCADE, related_name='clotures', verbose_name=_("Dossier PME"))
+    type_cloture = models.CharField(_("Type de clôture"), max_length=8, choices=TYPE_CLOTURE_CHOICES)
+    date_fin = models.DateField(_("Clôturé jusqu'au"))
+    # RESTRICT : la pièce d'à-nouveaux ne disparaît qu'avec le dossier
+    ecriture_a_nouveau = models.ForeignKey(EcritureComptable, on_delete=models.RESTRICT, null=True, blank=True, related_name='+', verbose_name=_("Écriture d'à-nouveaux"))
+    date_cloture = models.DateTimeField(auto_now_add=True)
+    cloture_par = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    class Meta:
+        verbose_name = _("Clôture Comptable"); verbose_name_plural = _("Clôtures Comptables")
+        # Un mois et l'exercice qui se terminent le même jour peuvent être clôturés l'un après l'autre
+        unique_together = ('dossier_pme', 'date_fin', 'type_cloture')
+        ordering = ['dossier_pme', '-date_fin', 'type_cloture']
+    def __str__(self): return f"{self.get_type_cloture_display()} clôturé au {self.date_fin.strftime('%d/%m/%Y')}"
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValidationError(_("Une clôture comptable ne peut pas être modifiée."))
+        super().save(*args, **kwargs)
+    def delete(self, *args, **kwargs):
+        raise ValidationError(_("Une clôture comptable ne peut pas être supprimée."))
+
+class SoldeCloture(models.Model):
+    """Solde d'un compte à la date de fin d'une clôture, figé au moment de la clôture."""
+    cloture = models.ForeignKey(ClotureComptable, on_delete=models.CASCADE, related_name='soldes', verbose_name=_("Clôture"))
+    compte_general = models.ForeignKey(CompteComptablePME, on_delete=models.RESTRICT, related_name='+', verbose_name=_("Compte Général"))
+    solde_debit = models.DecimalField(_("Solde Débiteur"), max_digits=17, decimal_places=2, default=Decimal(0))
+    solde_credit = models.DecimalField(_("Solde Créditeur"), max_digits=17, decimal_places=2, default=Decimal(0))
+
+    class Meta:
+        verbose_name = _("Solde de Clôture"); verbose_name_plural = _("Soldes de Clôture")
+        unique_together = ('cloture', 'compte_general')
+        ordering = ['cloture', 'compte_general']
+    def __str__(self): return f"{self.compte_general_id} au {self.cloture.date_fin:%d/%m/%Y}: D {self.solde_debit} / C {self.solde_credit}"
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValidationError(_("Un solde de clôture ne peut pas être modifié."))
+        super().save(*args, **kwargs)
+    def delete(self, *args, **kwargs):
+        raise ValidationError(_("Un solde de clôture ne peut pas être supprimé."))
+    @property
+    def solde(self): return self.solde_debit - self.solde_credit
@@ -1,52 +1,226 @@
 # comptabilite/signals.py
-from django.db.models.signals import post_save
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, pre_save, post_delete, pre_delete
 from django.dispatch import receiver
 from dossiers_pme.models import DossierPME
-from .models import CompteComptableDefaut, CompteComptablePME
+from .models import (
+    CompteComptableDefaut, CompteComptablePME, EcritureComptable, JournalComptable, LigneEcriture, Tiers,
+    lignes_ecriture_creees_en_masse,
+)
+from .utils import (
+    clotures, index_comptes, indicateurs_dossier, plan_comptable, plan_reference, recherche_tiers, sequences_pieces,
+    soldes_periodes, totaux_pieces,
+)
 
 @receiver(post_save, sender=DossierPME)
-def creer_plan_comptable_pour_nouveau_dossier(sender, instance, created, **kwargs):
-    if created:
-        if not CompteComptablePME.objects.filter(dossier_pme=instance).exists():
-            comptes_defaut_dict = {
-                cd.numero_compte: cd for cd in CompteComptableDefaut.objects.all()
-            }
-            
-            comptes_pme_a_creer = []
-            comptes_pme_crees_dict = {} # Pour retrouver les PKs des parents PME
-
-            # Première passe : créer les comptes sans les parents
-            for compte_defaut in CompteComptableDefaut.objects.order_by('numero_compte'): # Ordonner peut aider pour la hiérarchie
-                compte_pme = CompteComptablePME(
-                    dossier_pme=instance,
-                    compte_syscohada_ref=compte_defaut,
-                    numero_compte=compte_defaut.numero_compte,
-                    intitule_compte=compte_defaut.intitule_compte,
-                    type_compte=compte_defaut.type_compte,
-                    nature_compte=compte_defaut.nature_compte,
-                    sens_habituel=compte_defaut.sens_habituel,
-                    est_lettrable=compte_defaut.est_lettrable_par_defaut,
-                    est_actif=True
-                )
-                comptes_pme_a_creer.append(compte_pme)
-            
-            CompteComptablePME.objects.bulk_create(comptes_pme_a_creer)
-            
-            # Remplir le dictionnaire avec les comptes PME créés et leur PK
-            for compte_pme_cree in CompteComptablePME.objects.filter(dossier_pme=instance):
-                comptes_pme_crees_dict[compte_pme_cree.numero_compte] = compte_pme_cree
-
-            # Deuxième passe : assigner les parents
-            comptes_pme_a_updater = []
-            for compte_defaut in CompteComptableDefaut.objects.filter(compte_parent_syscohada__isnull=False):
-                compte_pme_enfant = comptes_pme_crees_dict.get(compte_defaut.numero_compte)
-                if compte_pme_enfant and compte_defaut.compte_parent_syscohada:
-                    compte_pme_parent = comptes_pme_crees_dict.get(compte_defaut.compte_parent_syscohada.numero_compte)
-                    if compte_pme_parent:
-                        compte_pme_enfant.compte_parent = compte_pme_parent
-                        comptes_pme_a_updater.append(compte_pme_enfant)
-            
-            if comptes_pme_a_updater:
-                CompteComptablePME.objects.bulk_update(comptes_pme_a_updater, ['compte_parent'])
-
-            print(f"Plan comptable par défaut initialisé pour le dossier {instance.nom_dossier}")
\ No newline at end of file
+def creer_plan_comptable_pour_nouveau_dossier(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        plan_comptable.cloner_plan_syscohada(instance)
+
+@receiver(post_save, sender=CompteComptableDefaut)
+@receiver(post_delete, sender=CompteComptableDefaut)
+def invalider_plan_reference(sender, **kwargs):
+    plan_reference.invalider_plan_reference()
+
+@receiver(post_save, sender=CompteComptablePME)
+@receiver(post_delete, sender=CompteComptablePME)
+def invalider_index_comptes(sender, instance, **kwargs):
+    # Après commit : un index reconstruit entre-temps lirait encore l'ancien plan
+    dossier_pk = instance.dossier_pme_id
+    transaction.on_commit(lambda: index_comptes.invalider_index_comptes(dossier_pk))
+
+@receiver(post_save, sender=Tiers)
+@receiver(post_delete, sender=Tiers)
+def invalider_index_tiers(sender, instance, **kwargs):
+    dossier_pk = instance.dossier_pme_id
+    transaction.on_commit(lambda: recherche_tiers.invalider_index_tiers(dossier_pk))
+
+@receiver(post_save, sender=CompteComptablePME)
+@receiver(post_delete, sender=CompteComptablePME)
+@receiver(post_save, sender=JournalComptable)
+@receiver(post_delete, sender=JournalComptable)
+@receiver(post_save, sender=Tiers)
+@receiver(post_delete, sender=Tiers)
+def invalider_indicateurs_referentiel(sender, instance, origin=None, **kwargs):
+    if _modele_origine(origin) is DossierPME:
+        return
+    indicateurs_dossier.invalider_referentiel(instance.dossier_pme_id)
+
+# --- Maintenance des soldes par période (SoldeComptePeriode) et des totaux des pièces ---
+
+def _modele_origine(origin):
+    """Modèle à l'origine d'une suppression (instance ou QuerySet), ou None."""
+    if origin is None:
+        return None
+    return origin.model if isinstance(origin, QuerySet) else type(origin)
+
+@receiver(pre_save, sender=LigneEcriture)
+def memoriser_ligne_avant_modification(sender, instance, raw=False, **kwargs):
+    instance._mouvement_precedent = None
+    if raw or instance._state.adding:
+        return
+    instance._mouvement_precedent = LigneEcriture.objects.filter(pk=instance.pk).values(
+        'ecriture_id', 'ecriture__dossier_pme_id', 'ecriture__date_ecriture', 'compte_general_id', 'debit', 'credit'
+    ).first()
+
+@receiver(post_save, sender=LigneEcriture)
+def maj_soldes_apres_enregistrement_ligne(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    mouvements = soldes_periodes.nouveaux_mouvements()
+    precedent = getattr(instance, '_mouvement_precedent', None)
+    if precedent:
+        soldes_periodes.ajouter_mouvement(
+            mouvements, precedent['ecriture__dossier_pme_id'], precedent['compte_general_id'],
+            precedent['ecriture__date_ecriture'], precedent['debit'], precedent['credit'], signe=-1
+        )
+    ecriture = instance.ecriture
+    soldes_periodes.ajouter_mouvement(
+        mouvements, ecriture.dossier_pme_id, instance.compte_general_id,
+        ecriture.date_ecriture, instance.debit, instance.credit
+    )
+    soldes_periodes.appliquer_mouvements(mouvements)
+
+    variations = totaux_pieces.nouvelles_variations()
+    if precedent:
+        totaux_pieces.ajouter_ligne(variations, precedent['ecriture_id'], precedent['debit'], precedent['credit'], signe=-1)
+    totaux_pieces.ajouter_ligne(variations, instance.ecriture_id, instance.debit, instance.credit)
+    totaux_pieces.appliquer_variations(variations, [ecriture])
+    indicateurs_dossier.invalider_periodes(
+        ecriture.dossier_pme_id, [ecriture.date_ecriture, precedent and precedent['ecriture__date_ecriture']]
+    )
+
+@receiver(lignes_ecriture_creees_en_masse, sender=LigneEcriture)
+def maj_soldes_apres_creation_en_masse(sender, lignes, maj_totaux_pieces=True, **kwargs):
+    # Lignes déjà insérées : l'exception annule la transaction de l'appelant (saisie, import, clôture)
+    pieces_par_dossier = defaultdict(dict)
+    for ligne in lignes:
+        pieces_par_dossier[ligne.ecriture.dossier_pme_id][ligne.ecriture_id] = ligne.ecriture.date_ecriture
+    for dossier_pk, pieces in pieces_par_dossier.items():
+        clotures.verifier_periode_ouverte(dossier_pk, pieces.values())
+    mouvements = soldes_periodes.nouveaux_mouvements()
+    variations = totaux_pieces.nouvelles_variations()
+    for ligne in lignes:
+        ecriture = ligne.ecriture
+        soldes_periodes.ajouter_mouvement(
+            mouvements, ecriture.dossier_pme_id, ligne.compte_general_id,
+            ecriture.date_ecriture, ligne.debit, ligne.credit
+        )
+        if maj_totaux_pieces:
+            totaux_pieces.ajouter_ligne(variations, ligne.ecriture_id, ligne.debit, ligne.credit)
+    soldes_periodes.appliquer_mouvements(mouvements)
+    if maj_totaux_pieces:
+        totaux_pieces.appliquer_variations(variations, [ligne.ecriture for ligne in lignes])
+    for dossier_pk, pieces in pieces_par_dossier.items():
+        indicateurs_dossier.invalider_periodes(dossier_pk, set(pieces.values()))
+
+@receiver(post_delete, sender=LigneEcriture)
+def maj_soldes_apres_suppression_ligne(sender, instance, origin=None, **kwargs):
+    # Suppression d'une pièce : déjà traitée globalement par retirer_soldes_piece_supprimee.
+    # Suppression d'un dossier : ses soldes disparaissent avec lui.
+    if _modele_origine(origin) in (EcritureComptable, DossierPME):
+        return
+    ecriture = instance.ecriture
+    mouvements = soldes_periodes.nouveaux_mouvements()
+    soldes_periodes.ajouter_mouvement(
+        mouvements, ecriture.dossier_pme_id, instance.compte_general_id,
+        ecriture.date_ecriture, instance.debit, instance.credit, signe=-1
+    )
+    soldes_periodes.appliquer_mouvements(mouvements)
+
+    variations = totaux_pieces.nouvelles_variations()
+    totaux_pieces.ajouter_ligne(variations, instance.ecriture_id, instance.debit, instance.credit, signe=-1)
+    totaux_pieces.appliquer_variations(variations, [ecriture])
+    indicateurs_dossier.invalider_periodes(ecriture.dossier_pme_id, [ecriture.date_ecriture])
+
+@receiver(pre_delete, sender=EcritureComptable)
+def retirer_soldes_piece_supprimee(sender, instance, origin=None, **kwargs):
+    if _modele_origine(origin) is DossierPME:
+        return
+    mouvements = soldes_periodes.mouvements_depuis_lignes(LigneEcriture.objects.filter(ecriture=instance))
+    for valeurs in mouvements.values():
+        valeurs[0], valeurs[1] = -valeurs[0], -valeurs[1]
+    soldes_periodes.appliquer_mouvements(mouvements)
+
+@receiver(pre_save, sender=EcritureComptable)
+def memoriser_date_piece_avant_modification(sender, instance, raw=False, **kwargs):
+    instance._date_precedente = None
+    if raw:
+        return
+    # Certaines vues passent la date sous forme de chaîne : la normaliser pour les signaux des lignes.
+    instance.date_ecriture = sender._meta.get_field('date_ecriture').to_python(instance.date_ecriture)
+    if instance._state.adding:
+        return
+    instance._date_precedente = EcritureComptable.objects.filter(pk=instance.pk).values_list('date_ecriture', flat=True).first()
+
+@receiver(post_save, sender=EcritureComptable)
+def invalider_indicateurs_piece(sender, instance, **kwargs):
+    indicateurs_dossier.invalider_periodes(
+        instance.dossier_pme_id, [instance.date_ecriture, getattr(instance, '_date_precedente', None)]
+    )
+
+@receiver(post_delete, sender=EcritureComptable)
+def invalider_indicateurs_piece_supprimee(sender, instance, origin=None, **kwargs):
+    if _modele_origine(origin) is DossierPME:
+        return
+    indicateurs_dossier.invalider_periodes(instance.dossier_pme_id, [instance.date_ecriture])
+
+@receiver(post_delete, sender=EcritureComptable)
+def liberer_numero_piece_supprimee(sender, instance, origin=None, **kwargs):
+    # Le numéro d'une pièce supprimée est réattribué : la séquence du journal reste sans trou
+    if _modele_origine(origin) in (DossierPME, JournalComptable) or not instance.numero_piece:
+        return
+    sequences_pieces.liberer(instance.journal_id, instance.numero_piece)
+
+@receiver(post_save, sender=EcritureComptable)
+def deplacer_soldes_si_changement_periode(sender, instance, raw=False, **kwargs):
+    date_precedente = getattr(instance, '_date_precedente', None)
+    if raw or date_precedente is None:
+        return
+    if (date_precedente.year, date_precedente.month) == (instance.date_ecriture.year, instance.date_ecriture.month):
+        return
+    mouvements_nouvelle_periode = soldes_periodes.mouvements_depuis_lignes(LigneEcriture.objects.filter(ecriture=instance))
+    mouvements = soldes_periodes.nouveaux_mouvements()
+    for (dossier_id, compte_id, __, __), (debit, credit) in mouvements_nouvelle_periode.items():
+        soldes_periodes.ajouter_mouvement(mouvements, dossier_id, compte_id, date_precedente, debit, credit, signe=-1)
+        soldes_periodes.ajouter_mouvement(mouvements, dossier_id, compte_id, instance.date_ecriture, debit, credit)
+    soldes_periodes.appliquer_mouvements(mouvements)
+
+# --- Verrou des périodes clôturées (utils/clotures.py) ---
+# Enregistrés après memoriser_* : la date ou le mouvement précédent sont déjà connus.
+
+@receiver(pre_save, sender=EcritureComptable)
+def verifier_periode_piece(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    clotures.verifier_periode_ouverte(
+        instance.dossier_pme_id, [instance.date_ecriture, instance._date_precedente],
+        ecriture_pk=None if instance._state.adding else instance.pk,
+    )
+
+@receiver(pre_delete, sender=EcritureComptable)
+def verifier_periode_piece_supprimee(sender, instance, origin=None, **kwargs):
+    if _modele_origine(origin) is DossierPME:
+        return
+    clotures.verifier_periode_ouverte(instance.dossier_pme_id, [instance.date_ecriture], ecriture_pk=instance.pk)
+
+@receiver(pre_save, sender=LigneEcriture)
+def verifier_periode_ligne(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    precedent = instance._mouvement_precedent
+    ecriture = instance.ecriture
+    clotures.verifier_periode_ouverte(
+        ecriture.dossier_pme_id, [ecriture.date_ecriture, precedent and precedent['ecriture__date_ecriture']],
+        ecriture_pk=ecriture.pk,
+    )
+
+@receiver(pre_delete, sender=LigneEcriture)
+def verifier_periode_ligne_supprimee(sender, instance, origin=None, **kwargs):
+    if _modele_origine(origin) in (EcritureComptable, DossierPME):
+        return
+    ecriture = instance.ecriture
+    clotures.verifier_periode_ouverte(ecriture.dossier_pme_id, [ecriture.date_ecriture], ecriture_pk=ecriture.pk)
@@ -1,3 +1,577 @@
-from django.test import TestCase
+from datetime import date, timedelta
+from decimal import Decimal
+import io
+import json
+import unittest
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Sum
+from django.test import RequestFactory, TestCase
+from django.urls import reverse
+
+from dossiers_pme.models import DossierPME
+from .models import (
+    ClotureComptable, CompteComptablePME, EcritureComptable, ImportEcritures, JournalComptable, LigneEcriture,
+    NumeroPieceLibere, SequencePiece, SoldeComptePeriode, Tiers,
+)
+from .utils import balance_generale, cloture_comptable, clotures, import_ecritures, lettrage, sequences_pieces, totaux_pieces
+from .utils.sage_grid_handler import SageGridHandler
+from .views_sage_grid import save_piece
+
+AUJOURD_HUI = date(2026, 1, 1)  # date passée aux clôtures : toutes les périodes de test sont terminées
+
+
+def creer_dossier(nom="Dossier test"):
+    """Dossier, plan réduit (numéro -> compte), journal de ventes VE et client CL001."""
+    dossier = DossierPME.objects.create(nom_dossier=nom)
+    comptes = {
+        numero: CompteComptablePME.objects.create(
+            dossier_pme=dossier, numero_compte=numero, intitule_compte=f"Compte {numero}", type_compte=type_compte,
+            est_lettrable=numero == '411100',
+        )
+        for numero, type_compte in [
+            ('121', None), ('1291', None), ('401100', 'TIERS_FOURNISSEUR'), ('411100', 'TIERS_CLIENT'),
+            ('521100', 'TRESORERIE_ACTIF'), ('601100', 'CHARGE'), ('701100', 'PRODUIT'),
+        ]
+    }
+    journal = JournalComptable.objects.create(dossier_pme=dossier, code_journal='VE', libelle='Ventes', type_journal='VE')
+    tiers = Tiers.objects.create(dossier_pme=dossier, code_tiers='CL001', nom_ou_raison_sociale='Client 1', type_tiers='CL')
+    return dossier, comptes, journal, tiers
+
+
+def creer_piece(journal, jour, lignes, numero_piece=''):
+    """Pièce du journal ; `lignes` : (compte, débit, crédit, autres champs de la ligne)."""
+    ecriture = EcritureComptable.objects.create(
+        dossier_pme=journal.dossier_pme, journal=journal, date_ecriture=jour, numero_piece=numero_piece, libelle_piece='Pièce',
+    )
+    for compte, debit, credit, champs in lignes:
+        LigneEcriture.objects.create(ecriture=ecriture, compte_general=compte, debit=Decimal(debit), credit=Decimal(credit),
+                                     libelle_ligne='Ligne', **champs)
+    return ecriture
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "Plans d'exécution vérifiés sur PostgreSQL uniquement.")
+class PlansIndexLedgerTests(TestCase):
+    """
+    Vérifie que les requêtes chaudes du grand livre sont servies par les index des migrations 0009 et 0013.
+
+    Les volumes de test sont faibles : les parcours séquentiels sont désactivés pour que le plan
+    retenu reflète les index utilisables, puis on vérifie le nom de l'index dans EXPLAIN.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.dossier = DossierPME.objects.create(nom_dossier="Dossier EXPLAIN")
+        cls.compte_client = CompteComptablePME.objects.create(
+            dossier_pme=cls.dossier, numero_compte='411900', intitule_compte='Clients test', type_compte='TIERS_CLIENT')
+        cls.compte_produit = CompteComptablePME.objects.create(
+            dossier_pme=cls.dossier, numero_compte='701900', intitule_compte='Ventes test', type_compte='PRODUIT')
+        cls.journal = JournalComptable.objects.create(
+            dossier_pme=cls.dossier, code_journal='VT', libelle='Ventes test', type_journal='VE')
+        cls.tiers = Tiers.objects.create(
+            dossier_pme=cls.dossier, code_tiers='CL900', nom_ou_raison_sociale='Client test', type_tiers='CL')
+
+        debut = date(2024, 1, 1)
+        ecritures = EcritureComptable.objects.bulk_create([
+            EcritureComptable(
+                dossier_pme=cls.dossier, journal=cls.journal, date_ecriture=debut + timedelta(days=i % 730),
+                numero_piece=f"VT{i:05d}", libelle_piece=f"Vente {i}",
+            )
+            for i in range(2000)
+        ])
+        lignes = []
+        for i, ecriture in enumerate(ecritures):
+            lettrage = f"L{i:04d}" if i % 10 else None
+            lignes.append(LigneEcriture(ecriture=ecriture, compte_general=cls.compte_client, libelle_ligne='Client',
+                                        tiers_ligne=cls.tiers if i % 4 == 0 else None,
+                                        date_echeance_ligne=ecriture.date_ecriture + timedelta(days=30),
+                                        debit=Decimal('100.00'), lettrage_code=lettrage, ordre=0))
+            lignes.append(LigneEcriture(ecriture=ecriture, compte_general=cls.compte_produit, libelle_ligne='Vente',
+                                        credit=Decimal('100.00'), ordre=1))
+        LigneEcriture.objects.bulk_create(lignes)
+        EcritureComptable.objects.filter(pk=ecritures[0].pk).update(est_desequilibree=True)
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE comptabilite_ecriturecomptable")
+            cursor.execute("ANALYZE comptabilite_ligneecriture")
+            cursor.execute("SET LOCAL enable_seqscan = off")
+
+    def assertUtiliseIndex(self, queryset, nom_index):
+        plan = queryset.explain()
+        self.assertIn(nom_index, plan, msg=f"Index {nom_index} absent du plan :\n{plan}")
+
+    def test_pieces_dossier_par_periode(self):
+        self.assertUtiliseIndex(
+            EcritureComptable.objects.filter(
+                dossier_pme=self.dossier, date_ecriture__range=(date(2024, 3, 1), date(2024, 3, 31))
+            ),
+            'ecriture_dossier_date_idx',
+        )
+
+    def test_dernieres_pieces_du_dossier(self):
+        self.assertUtiliseIndex(
+            EcritureComptable.objects.filter(dossier_pme=self.dossier).order_by('-date_ecriture', '-id')[:5],
+            'ecriture_dossier_date_idx',
+        )
+
+    def test_piece_par_numero_dans_le_journal(self):
+        self.assertUtiliseIndex(
+            EcritureComptable.objects.filter(journal=self.journal, numero_piece='VT01234'),
+            'ecriture_journal_numero_idx',
+        )
+
+    def test_piece_suivante_dans_le_journal(self):
+        self.assertUtiliseIndex(
+            EcritureComptable.objects.filter(
+                journal=self.journal, date_ecriture__gte=date(2024, 6, 1), numero_piece__gt='VT00100'
+            ).order_by('date_ecriture', 'numero_piece')[:1],
+            'ecriture_journal_date_idx',
+        )
+
+    def test_dernier_numero_de_l_annee(self):
+        self.assertUtiliseIndex(
+            EcritureComptable.objects.filter(journal=self.journal, date_ecriture__year=2025),
+            'ecriture_journal_date_idx',
+        )
+
+    def test_mouvements_d_un_compte_sur_une_periode(self):
+        self.assertUtiliseIndex(
+            LigneEcriture.objects.filter(
+                compte_general=self.compte_client,
+                ecriture__date_ecriture__range=(date(2024, 1, 1), date(2024, 12, 31)),
+            ).values('compte_general').annotate(total=Sum('debit')),
+            'ligne_compte_ecriture_idx',
+        )
+
+    def test_lignes_par_code_de_lettrage(self):
+        self.assertUtiliseIndex(LigneEcriture.objects.filter(lettrage_code='L0042'), 'ligne_lettrage_idx')
+
+    def test_lignes_non_lettrees_d_un_compte(self):
+        self.assertUtiliseIndex(
+            LigneEcriture.objects.filter(compte_general=self.compte_client, lettrage_code__isnull=True),
+            'ligne_non_lettree_idx',
+        )
+
+    def test_encours_non_lettre_d_un_tiers_par_echeance(self):
+        self.assertUtiliseIndex(
+            LigneEcriture.objects.filter(
+                tiers_ligne=self.tiers, lettrage_code__isnull=True, date_echeance_ligne__lte=date(2024, 6, 30),
+            ).values('tiers_ligne').annotate(total=Sum('debit')),
+            'ligne_tiers_echeance_idx',
+        )
+
+    def test_registre_des_pieces_desequilibrees(self):
+        self.assertUtiliseIndex(totaux_pieces.pieces_desequilibrees(self.dossier)[:3], 'ecriture_desequilibree_idx')
+
+
+class ClotureTests(TestCase):
+    """Clôtures de mois et d'exercice : soldes figés, écriture d'à-nouveaux et verrou des périodes clôturées."""
+
+    def setUp(self):
+        self.dossier, self.comptes, self.journal, self.tiers = creer_dossier()
+        c = self.comptes
+        facture = {'tiers_ligne': self.tiers, 'numero_facture': 'F1'}
+        self.piece_mars = creer_piece(self.journal, date(2024, 3, 10), [
+            (c['411100'], 1000, 0, dict(facture, date_echeance_ligne=date(2024, 12, 31))), (c['701100'], 0, 1000, {}),
+        ])
+        self.piece_avril = creer_piece(self.journal, date(2024, 4, 1), [
+            (c['521100'], 400, 0, {}), (c['411100'], 0, 400, facture),
+        ])
+        creer_piece(self.journal, date(2024, 5, 1), [(c['601100'], 300, 0, {}), (c['401100'], 0, 300, {})])
+        creer_piece(self.journal, date(2025, 1, 15), [(c['521100'], 50, 0, {}), (c['701100'], 0, 50, {})])
+
+    def balance(self, date_debut, date_fin):
+        return {
+            ligne.numero: (ligne.ouverture, ligne.debit, ligne.credit)
+            for ligne in balance_generale.calculer_balance(self.dossier, date_debut, date_fin).comptes
+        }
+
+    def test_cloture_de_mois_fige_les_soldes_et_le_report_en_repart(self):
+        avant = self.balance(date(2024, 4, 1), date(2024, 12, 31))
+        cloture = cloture_comptable.cloturer_mois(self.dossier, 2024, 3, aujourd_hui=AUJOURD_HUI)
+
+        self.assertEqual(clotures.soldes_figes(cloture), {
+            self.comptes['411100'].pk: Decimal('1000.00'), self.comptes['701100'].pk: Decimal('-1000.00'),
+        })
+        __, depart = balance_generale.report(self.dossier, date(2024, 4, 1))
+        self.assertEqual(depart, clotures.soldes_figes(cloture))
+        self.assertEqual(self.balance(date(2024, 4, 1), date(2024, 12, 31)), avant)
+        self.assertEqual(clotures.date_verrouillage(self.dossier), date(2024, 3, 31))
+
+    def test_clotures_successives_sans_retour_en_arriere(self):
+        cloture_comptable.cloturer_mois(self.dossier, 2024, 3, aujourd_hui=AUJOURD_HUI)
+        for annee, mois in [(2024, 2), (2024, 3)]:
+            with self.assertRaises(clotures.ClotureImpossible):
+                cloture_comptable.cloturer_mois(self.dossier, annee, mois, aujourd_hui=AUJOURD_HUI)
+        with self.assertRaises(clotures.ClotureImpossible):
+            cloture_comptable.cloturer_mois(self.dossier, 2026, 1, aujourd_hui=AUJOURD_HUI)
+
+    def test_cloture_d_exercice_puis_de_mois(self):
+        avant_2025 = self.balance(date(2025, 2, 1), date(2025, 12, 31))
+        cloture = cloture_comptable.cloturer_exercice(self.dossier, 2024, aujourd_hui=AUJOURD_HUI)
+
+        a_nouveaux = cloture.ecriture_a_nouveau
+        self.assertEqual(a_nouveaux.date_ecriture, date(2025, 1, 1))
+        self.assertEqual(a_nouveaux.journal.type_journal, 'AN')
+        self.assertFalse(a_nouveaux.est_desequilibree)
+        # Bilan repris, pièces ouvertes du compte lettrable une à une (échéance et facture conservées),
+        # résultat de l'exercice (1000 - 300) au report à nouveau
+        self.assertEqual(sorted(
+            (ligne.compte_general.numero_compte, ligne.debit, ligne.credit, ligne.numero_facture, ligne.date_echeance_ligne)
+            for ligne in a_nouveaux.lignes_ecriture.select_related('compte_general')
+        ), [
+            ('121', Decimal('0.00'), Decimal('700.00'), None, None),
+            ('401100', Decimal('0.00'), Decimal('300.00'), None, None),
+            ('411100', Decimal('0.00'), Decimal('400.00'), 'F1', date(2024, 4, 1)),
+            ('411100', Decimal('1000.00'), Decimal('0.00'), 'F1', date(2024, 12, 31)),
+            ('521100', Decimal('400.00'), Decimal('0.00'), None, None),
+        ])
+        apres_2025 = self.balance(date(2025, 2, 1), date(2025, 12, 31))
+        self.assertEqual(apres_2025.pop('121'), (Decimal('-700.00'), Decimal('0.00'), Decimal('0.00')))
+        self.assertEqual(apres_2025, avant_2025)
+
+        # Clôture de mois dans le nouvel exercice : les soldes repartent de l'à-nouveaux
+        avant_mars = self.balance(date(2025, 3, 1), date(2025, 12, 31))
+        cloture_comptable.cloturer_mois(self.dossier, 2025, 2, aujourd_hui=AUJOURD_HUI)
+        self.assertEqual(self.balance(date(2025, 3, 1), date(2025, 12, 31)), avant_mars)
+        with self.assertRaises(clotures.ClotureImpossible):
+            cloture_comptable.cloturer_mois(self.dossier, 2024, 6, aujourd_hui=AUJOURD_HUI)
+
+    def test_perte_reportee_au_1291(self):
+        dossier, comptes, journal, __ = creer_dossier("Dossier en perte")
+        creer_piece(journal, date(2024, 6, 1), [(comptes['601100'], 80, 0, {}), (comptes['521100'], 0, 80, {})])
+        cloture = cloture_comptable.cloturer_exercice(dossier, 2024, aujourd_hui=AUJOURD_HUI)
+        self.assertEqual(sorted(
+            (ligne.compte_general.numero_compte, ligne.debit, ligne.credit)
+            for ligne in cloture.ecriture_a_nouveau.lignes_ecriture.select_related('compte_general')
+        ), [('1291', Decimal('80.00'), Decimal('0.00')), ('521100', Decimal('0.00'), Decimal('80.00'))])
+
+    def test_saisies_refusees_en_periode_cloturee(self):
+        cloture_comptable.cloturer_mois(self.dossier, 2024, 3, aujourd_hui=AUJOURD_HUI)
+        utilisateur = User.objects.create_user('comptable', password='secret')
+        self.client.force_login(utilisateur)
+
+        reponse = self.client.post(reverse('comptabilite:api_save_piece'), json.dumps(
+            {'journal_id': self.journal.pk, 'date': '2024-03-05', 'lignes': []}), content_type='application/json')
+        self.assertEqual(reponse.status_code, 400)
+        self.assertIn('clôturée', reponse.json()['message'])
+
+        requete = RequestFactory().post('/', json.dumps({'journal_pk': self.journal.pk, 'date': '2024-03-05', 'lignes': []}),
+                                        content_type='application/json')
+        requete.user = utilisateur
+        reponse = save_piece(requete)
+        self.assertEqual(reponse.status_code, 400)
+        self.assertIn('clôturée', json.loads(reponse.content)['error'])
+
+        ok, erreurs = SageGridHandler(self.dossier, self.journal).save_grid_data({'date_ecriture': '2024-03-20'}, [
+            {'compte': '521100', 'libelle': 'Encaissement', 'debit': '5'},
+            {'compte': '701100', 'libelle': 'Encaissement', 'credit': '5'},
+        ])
+        self.assertFalse(ok)
+        self.assertIn('clôturée', erreurs[0])
+
+        ligne = self.piece_mars.lignes_ecriture.first()
+        ligne.libelle_ligne = 'Modifiée'
+        with self.assertRaises(clotures.PeriodeCloturee):
+            ligne.save()
+        with self.assertRaises(clotures.PeriodeCloturee):
+            self.piece_mars.delete()
+        self.piece_avril.date_ecriture = date(2024, 3, 15)  # déplacement dans la période clôturée
+        with self.assertRaises(clotures.PeriodeCloturee):
+            self.piece_avril.save()
+        self.assertEqual(EcritureComptable.objects.filter(dossier_pme=self.dossier, date_ecriture__lte=date(2024, 3, 31)).count(), 1)
+
+    def test_piece_a_nouveaux_verrouillee(self):
+        a_nouveaux = cloture_comptable.cloturer_exercice(self.dossier, 2024, aujourd_hui=AUJOURD_HUI).ecriture_a_nouveau
+        with self.assertRaises(clotures.PeriodeCloturee):
+            a_nouveaux.delete()
+        with self.assertRaises(clotures.PeriodeCloturee):
+            a_nouveaux.lignes_ecriture.first().save()
+        with self.assertRaises(clotures.PeriodeCloturee):
+            a_nouveaux.save()
+        self.assertTrue(ClotureComptable.objects.filter(ecriture_a_nouveau=a_nouveaux).exists())
+
+
+class NumerotationPiecesTests(TestCase):
+    """Séquences de pièces : réservation, consommation, libération à la suppression et suggestion prise entre-temps."""
+
+    JOUR = date(2024, 3, 15)
+
+    def setUp(self):
+        self.dossier, self.comptes, self.journal, self.tiers = creer_dossier()
+
+    def piece(self, numero_piece):
+        return creer_piece(self.journal, self.JOUR, [(self.comptes['521100'], 10, 0, {}), (self.comptes['701100'], 0, 10, {})],
+                           numero_piece=numero_piece)
+
+    def sequence(self):
+        return SequencePiece.objects.get(journal=self.journal, exercice=2024)
+
+    def liberes(self):
+        return list(NumeroPieceLibere.objects.filter(sequence__journal=self.journal).values_list('numero', flat=True))
+
+    def grille(self, **entete):
+        lignes = [{'compte': '521100', 'libelle': 'Vente', 'debit': '10'}, {'compte': '701100', 'libelle': 'Vente', 'credit': '10'}]
+        return SageGridHandler(self.dossier, self.journal, self.JOUR).save_grid_data(dict(entete, date_ecriture=self.JOUR), lignes)
+
+    def test_reservation_unitaire_et_en_lot(self):
+        self.assertEqual(sequences_pieces.prochain_numero(self.journal, self.JOUR), 'VE240001')
+        self.assertFalse(SequencePiece.objects.exists())  # la suggestion ne réserve rien
+        self.assertEqual(sequences_pieces.reserver(self.journal, self.JOUR), ['VE240001'])
+        self.assertEqual(sequences_pieces.reserver(self.journal, self.JOUR, 3), ['VE240002', 'VE240003', 'VE240004'])
+        self.assertEqual(sequences_pieces.reserver(self.journal, self.JOUR, 0), [])
+        self.assertEqual(sequences_pieces.reserver(self.journal, date(2025, 1, 2)), ['VE250001'])
+        self.assertEqual(self.sequence().dernier_numero, 4)
+
+    def test_amorcage_sur_un_journal_existant(self):
+        self.piece('VE240007')
+        self.assertEqual(sequences_pieces.reserver(self.journal, self.JOUR), ['VE240008'])
+
+    def test_consommation_d_un_numero_saisi(self):
+        sequences_pieces.reserver(self.journal, self.JOUR)
+        sequences_pieces.consommer(self.journal, self.JOUR, 'VE240004')
+        # Le compteur avance et les numéros sautés rejoignent la réserve, réattribués en priorité
+        self.assertEqual((self.sequence().dernier_numero, self.liberes()), (4, [2, 3]))
+        self.assertEqual(sequences_pieces.reserver(self.journal, self.JOUR, 3), ['VE240002', 'VE240003', 'VE240005'])
+        sequences_pieces.consommer(self.journal, self.JOUR, 'MANUEL-1')  # hors séquence : compteur inchangé
+        self.assertEqual(self.sequence().dernier_numero, 5)
+
+        self.piece('VE240004')
+        with self.assertRaisesMessage(sequences_pieces.NumeroPieceUtilise, "'VE240004' déjà utilisé dans le journal VE"):
+            sequences_pieces.consommer(self.journal, self.JOUR, 'VE240004')
+
+    def test_consommation_en_lot(self):
+        sequences_pieces.consommer(self.journal, self.JOUR, 'VE240003')
+        sequences_pieces.consommer_lot(self.journal, self.JOUR, ['VE240002', 'VE240006', 'IMP1'])
+        # Un seul verrou par lot : le trou 4-5 n'est pas comblé
+        self.assertEqual((self.sequence().dernier_numero, self.liberes()), (6, [1]))
+
+    def test_suppression_d_une_piece_libere_son_numero(self):
+        numeros = sequences_pieces.reserver(self.journal, self.JOUR, 3)
+        pieces = [self.piece(numero) for numero in numeros]
+        pieces[1].delete()
+        self.assertEqual((self.sequence().dernier_numero, self.liberes()), (3, [2]))
+        self.assertEqual(sequences_pieces.prochain_numero(self.journal, self.JOUR), 'VE240002')
+
+        # Le dernier numéro fait reculer le compteur en absorbant les numéros libérés qui le précèdent
+        pieces[2].delete()
+        self.assertEqual((self.sequence().dernier_numero, self.liberes()), (1, []))
+        self.assertEqual(sequences_pieces.reserver(self.journal, self.JOUR), ['VE240002'])
+
+        self.piece('MANUEL-1').delete()  # hors séquence : rien à libérer
+        self.assertFalse(sequences_pieces.liberer(self.journal, 'VE240001'))  # porté par une pièce
+        self.assertEqual(self.sequence().dernier_numero, 2)
+
+    def test_suggestion_prise_entre_temps(self):
+        suggestion = sequences_pieces.prochain_numero(self.journal, self.JOUR)
+        ok, premiere = self.grille(numero_piece=suggestion, numero_suggere=suggestion)
+        self.assertTrue(ok)
+        # Deuxième grille ouverte avec la même suggestion : elle reçoit le numéro suivant, pas un doublon
+        ok, seconde = self.grille(numero_piece=suggestion, numero_suggere=suggestion)
+        self.assertTrue(ok)
+        self.assertEqual((premiere.numero_piece, seconde.numero_piece), ('VE240001', 'VE240002'))
+
+        # Un numéro saisi à la main déjà porté par une pièce est refusé
+        ok, erreurs = self.grille(numero_piece='VE240001')
+        self.assertFalse(ok)
+        self.assertIn('déjà utilisé', erreurs[0])
+        self.assertEqual(EcritureComptable.objects.count(), 2)
+
+
+class LettrageTests(TestCase):
+    """Lettrage automatique : passes références / montants / combinaisons, simulation et relance."""
+
+    def setUp(self):
+        self.dossier, self.comptes, self.journal, self.tiers = creer_dossier()
+        self.client_compte = self.comptes['411100']
+        self.autre_tiers = Tiers.objects.create(dossier_pme=self.dossier, code_tiers='CL002', nom_ou_raison_sociale='Client 2',
+                                                type_tiers='CL')
+
+    def ligne(self, jour, montant, tiers=None, **champs):
+        """Ligne client (débit si `montant` > 0) et sa contrepartie en produit ; retourne le pk de la ligne client."""
+        montant = Decimal(montant)
+        ecriture = creer_piece(self.journal, jour, [
+            (self.client_compte, max(montant, 0), max(-montant, 0), dict(champs, tiers_ligne=tiers or self.tiers)),
+            (self.comptes['701100'], max(-montant, 0), max(montant, 0), {}),
+        ])
+        return ecriture.lignes_ecriture.get(compte_general=self.client_compte).pk
+
+    def codes(self):
+        return dict(LigneEcriture.objects.filter(compte_general=self.client_compte).values_list('pk', 'lettrage_code'))
+
+    def creer_scenario(self):
+        return {
+            'reference': [self.ligne(date(2025, 1, 1), 100, numero_facture='F-001'),
+                          self.ligne(date(2025, 1, 20), -100, reference='f001')],
+            'montant': [self.ligne(date(2025, 1, 5), 250), self.ligne(date(2025, 2, 5), -250)],
+            'combinaison': [self.ligne(date(2025, 1, 5), 300), self.ligne(date(2025, 1, 6), 200),
+                            self.ligne(date(2025, 2, 1), -500)],
+            'tiers_differents': [self.ligne(date(2025, 1, 5), 400, tiers=self.autre_tiers), self.ligne(date(2025, 1, 6), -400)],
+            'hors_fenetre': [self.ligne(date(2025, 1, 5), 70), self.ligne(date(2025, 9, 6), -70)],
+        }
+
+    def test_trois_passes(self):
+        lignes = self.creer_scenario()
+        resultat = lettrage.lettrer_compte(self.client_compte)
+        self.assertEqual(resultat.par_methode(), {'reference': 1, 'montant': 1, 'combinaison': 1})
+        self.assertEqual((resultat.lignes_ouvertes, resultat.lignes_lettrees), (11, 7))
+        codes = self.codes()
+        for methode, code in [('reference', 'AAA'), ('montant', 'AAB'), ('combinaison', 'AAC')]:
+            self.assertEqual({codes[pk] for pk in lignes[methode]}, {code}, methode)
+        for cas in ('tiers_differents', 'hors_fenetre'):
+            self.assertEqual({codes[pk] for pk in lignes[cas]}, {None}, cas)
+        self.assertEqual(next(g for g in resultat.groupes if g.code == 'AAC').montant, Decimal('500'))
+
+    def test_simulation_n_ecrit_rien(self):
+        self.creer_scenario()
+        resultat = lettrage.lettrer_compte(self.client_compte, simulation=True)
+        self.assertEqual([g.code for g in resultat.groupes], ['AAA', 'AAB', 'AAC'])
+        self.assertEqual(set(self.codes().values()), {None})
+
+        sortie = io.StringIO()
+        call_command('lettrer_comptes', dossier=self.dossier.pk, simulation=True, stdout=sortie)
+        self.assertIn('7/11 lignes lettrées', sortie.getvalue())
+        self.assertEqual(set(self.codes().values()), {None})
+
+    def test_relance_apres_nouvelles_lignes(self):
+        self.creer_scenario()
+        self.ligne(date(2024, 6, 1), 10, lettrage_code='ZZ')  # code manuel plus court : les codes repartent de AAA
+        self.ligne(date(2024, 6, 1), -10, lettrage_code='ZZ')
+        lettrage.lettrer_compte(self.client_compte)
+        self.assertEqual(lettrage.lettrer_compte(self.client_compte).groupes, [])  # rien de nouveau à lettrer
+
+        nouvelles = [self.ligne(date(2025, 3, 1), 5), self.ligne(date(2025, 3, 2), -5)]
+        resultat = lettrage.lettrer_compte(self.client_compte)
+        self.assertEqual([(g.methode, g.code) for g in resultat.groupes], [('montant', 'AAD')])
+        self.assertEqual({self.codes()[pk] for pk in nouvelles}, {'AAD'})
+
+    def test_lignes_deja_lettrees_non_ecrasees(self):
+        debit, credit = self.ligne(date(2025, 1, 5), 80), self.ligne(date(2025, 1, 6), -80)
+        LigneEcriture.objects.filter(pk=debit).update(lettrage_code='M1')  # lettrée à la main pendant le calcul
+        self.assertEqual(lettrage.ecrire_codes([(debit, 'AAA'), (credit, 'AAA')]), 1)
+        self.assertEqual(self.codes()[debit], 'M1')
+
+
+class ExportFecTests(TestCase):
+    """Paramètres de période de l'export FEC : refusés avec un message lisible plutôt que remplacés par l'exercice en cours."""
+
+    def setUp(self):
+        self.dossier, self.comptes, self.journal, self.tiers = creer_dossier()
+        creer_piece(self.journal, date(2024, 3, 15), [(self.comptes['521100'], 10, 0, {}), (self.comptes['701100'], 0, 10, {})],
+                    numero_piece='VE240001')
+        self.client.force_login(User.objects.create_user('comptable', password='motdepasse'))
+        self.url = reverse('comptabilite:export_fec', kwargs={'dossier_pk': self.dossier.pk})
+
+    def contenu(self, reponse):
+        return b''.join(reponse.streaming_content).decode('utf-8')
+
+    def test_periodes_valides(self):
+        reponse = self.client.get(self.url, {'exercice': '2024'})
+        self.assertEqual(reponse.status_code, 200)
+        self.assertIn('VE240001', self.contenu(reponse))
+        self.assertIn('FEC20241231.txt', reponse['Content-Disposition'])
+        reponse = self.client.get(self.url, {'date_debut': '2024-04-01', 'date_fin': '2024-06-30'})
+        self.assertEqual(reponse.status_code, 200)
+        self.assertNotIn('VE240001', self.contenu(reponse))
+
+    def test_parametres_invalides(self):
+        for parametres, message in [
+            ({'exercice': 'abc'}, "Exercice invalide : « abc »"),
+            ({'exercice': '0'}, "Exercice invalide"),
+            ({'date_debut': '2024-01-01'}, "à la fois la date de début et la date de fin"),
+            ({'date_fin': '2024-12-31'}, "à la fois la date de début et la date de fin"),
+            ({'date_debut': 'hier', 'date_fin': '2024-12-31'}, "Date invalide pour date_debut : « hier »"),
+            ({'date_debut': '2024-01-01', 'date_fin': '2024-02-30'}, "Date invalide pour date_fin"),
+            ({'date_debut': '2024-12-31', 'date_fin': '2024-01-01'}, "La date de début doit précéder la date de fin."),
+        ]:
+            reponse = self.client.get(self.url, parametres)
+            self.assertEqual(reponse.status_code, 400, parametres)
+            self.assertIn(message, reponse.content.decode('utf-8'), parametres)
+
+
+class ImportEcrituresTests(TestCase):
+    """Import en lots : reprise après échec, rejets, contrôle des numéros et soldes par période."""
+
+    ENTETE = "Journal;Date;N° pièce;Compte;Tiers;Libellé;Débit;Crédit\n"
+
+    def setUp(self):
+        self.dossier, self.comptes, self.journal, self.tiers = creer_dossier()
+
+    def fichier(self, pieces):
+        """CSV d'une pièce de vente (client / produit) par (numéro, montant, compte de produit)."""
+        lignes = [self.ENTETE]
+        for numero, montant, produit in pieces:
+            lignes.append(f"VE;15/03/2024;{numero};411100;CL001;Facture {numero};{montant};\n")
+            lignes.append(f"VE;15/03/2024;{numero};{produit};;Vente {numero};;{montant}\n")
+        return ''.join(lignes)
+
+    def importer(self, contenu, reprendre=None, **options):
+        job = import_ecritures.preparer_job(self.dossier, io.BytesIO(contenu.encode('utf-8')), 'ventes.csv', reprendre=reprendre)
+        return import_ecritures.importer(io.StringIO(contenu), job, **options)
+
+    def test_lots_numeros_et_soldes(self):
+        job = self.importer(self.fichier([('', '100,50', '701100'), ('IMP2', '1 000', '701100'), ('', '10', '701100')]),
+                            taille_lot=2)
+        self.assertEqual((job.statut, job.pieces_importees, job.lignes_importees, job.lignes_traitees), ('TERMINE', 3, 6, 7))
+        self.assertEqual(sorted(EcritureComptable.objects.values_list('numero_piece', flat=True)), ['IMP2', 'VE240001', 'VE240002'])
+        self.assertEqual(EcritureComptable.objects.get(numero_piece='IMP2').total_debit, Decimal('1000.00'))
+        self.assertEqual(totaux_pieces.verifier_totaux(self.dossier), [])
+        solde = SoldeComptePeriode.objects.get(compte_general=self.comptes['411100'], annee=2024, mois=3)
+        self.assertEqual(solde.total_debit, Decimal('1110.50'))
+
+    def test_reprise_apres_echec(self):
+        pieces = [(f'IMP{n}', '10', '701100') for n in range(1, 7)]
+        avec_erreur = list(pieces)
+        avec_erreur[3] = ('IMP4', '10', '999999')  # compte inconnu
+        with self.assertRaises(import_ecritures.ErreurImport):
+            self.importer(self.fichier(avec_erreur), taille_lot=4)
+        job = ImportEcritures.objects.get()
+        # Pièces valides qui précèdent la pièce invalide comptabilisées, reprise après leur dernière ligne
+        self.assertEqual((job.statut, job.pieces_importees, job.lignes_traitees), ('ECHEC', 3, 7))
+        self.assertIn('ligne 8', job.message_erreur)
+
+        job = self.importer(self.fichier(pieces), reprendre=job.pk, taille_lot=4)
+        self.assertEqual((job.statut, job.pieces_importees, job.lignes_importees), ('TERMINE', 6, 12))
+        self.assertEqual(EcritureComptable.objects.count(), 6)
+
+    def test_rejets_avec_ignorer_erreurs_sans_doublon_a_la_reprise(self):
+        contenu = self.fichier([('IMP1', '10', '701100'), ('IMP2', '10', '999999'), ('IMP3', '10', '701100'),
+                                ('IMP4', '10', '999999'), ('IMP5', '10', '701100')])
+        appels = []
+
+        def echec_au_deuxieme_lot(job):
+            appels.append(job.lignes_traitees)
+            if len(appels) == 2:
+                raise RuntimeError("coupure")
+
+        with self.assertRaises(import_ecritures.ErreurImport):
+            self.importer(contenu, taille_lot=4, ignorer_erreurs=True, progression=echec_au_deuxieme_lot)
+        job = ImportEcritures.objects.get()
+        self.assertEqual((job.statut, job.pieces_importees, job.pieces_rejetees), ('ECHEC', 2, 2))
+
+        job = self.importer(contenu, reprendre=job.pk, taille_lot=4, ignorer_erreurs=True)
+        self.assertEqual((job.statut, job.pieces_importees, job.pieces_rejetees), ('TERMINE', 3, 2))
+        self.assertEqual([rejet['lignes'] for rejet in job.rejets], [[4, 5], [8, 9]])
+        self.assertIn("Compte invalide '999999'", job.rejets[0]['erreurs'][0])
+
+    def test_numeros_deja_utilises_ou_en_double(self):
+        creer_piece(self.journal, date(2024, 3, 1), [(self.comptes['521100'], 5, 0, {}), (self.comptes['701100'], 0, 5, {})],
+                    numero_piece='IMP1')
+        job = self.importer(self.fichier([('IMP1', '10', '701100'), ('IMP2', '10', '701100'), ('IMP3', '10', '701100'),
+                                          ('IMP2', '20', '701100')]), ignorer_erreurs=True)
+        self.assertEqual((job.pieces_importees, job.pieces_rejetees), (2, 2))
+        erreurs = [rejet['erreurs'][0] for rejet in job.rejets]
+        self.assertIn("'IMP1' déjà utilisé dans le journal VE", erreurs[0])
+        self.assertIn("'IMP2' en double dans le fichier", erreurs[1])
+        self.assertEqual(EcritureComptable.objects.filter(numero_piece='IMP2').count(), 1)
+
+    def test_encodage_incorrect(self):
+        contenu = self.fichier([('IMP1', '10', '701100')]).replace('Facture', 'Règlement').encode('cp1252')
+        job = import_ecritures.preparer_job(self.dossier, io.BytesIO(contenu), 'ventes.csv')
+        with self.assertRaisesMessage(import_ecritures.ErreurImport, 'Windows (ANSI)'):
+            import_ecritures.importer(io.TextIOWrapper(io.BytesIO(contenu), encoding='utf-8', newline=''), job)
+        job.refresh_from_db()
+        self.assertEqual(job.statut, 'ECHEC')
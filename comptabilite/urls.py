@@ -7,6 +7,7 @@ app_name = 'comptabilite'
 urlpatterns = [
     # Tableau de bord comptable (tableau de bord principal de la compta pour un dossier)
     path('dossier/<int:dossier_pk>/', views.tableau_bord_compta_view, name='tableau_bord_compta'),
+    path('api/dossier/<int:dossier_pk>/pieces-desequilibrees/', views.pieces_desequilibrees_view, name='pieces_desequilibrees'),
 
     # ... (vos URLs existantes pour le plan_comptable, CRUDs ComptePME, Journal, chargement de plan etc.)
 
@@ -26,6 +27,18 @@ urlpatterns = [
          views.enregistrer_ligne_ajax_view,
          name='ajouter_ligne_ecriture_ajax'),
 
+    # Import de fichiers d'écritures (CSV, export Sage 100)
+    path('dossier/<int:dossier_pk>/import-ecritures/', views.import_ecritures_view, name='import_ecritures'),
+    # États : balance générale, grand livre, balance âgée, états financiers (HTML, ?format=csv|json|ndjson)
+    path('dossier/<int:dossier_pk>/balance-generale/', views.balance_generale_view, name='balance_generale'),
+    path('dossier/<int:dossier_pk>/grand-livre/', views.grand_livre_view, name='grand_livre'),
+    path('dossier/<int:dossier_pk>/balance-agee/', views.balance_agee_view, name='balance_agee'),
+    path('dossier/<int:dossier_pk>/etats-financiers/', views.etats_financiers_view, name='etats_financiers'),
+    # Clôture de mois ou d'exercice : verrou des écritures, soldes figés, à-nouveaux
+    path('dossier/<int:dossier_pk>/clotures/', views.clotures_view, name='clotures'),
+    # Export FEC (Fichier des Écritures Comptables), en flux
+    path('dossier/<int:dossier_pk>/export-fec/', views.export_fec_view, name='export_fec'),
+
     path('dossier/<int:dossier_pk>/plan-comptable/', views.plan_comptable_view, name='plan_comptable'),
 
     # Routes CRUD pour les journaux
@@ -48,6 +61,10 @@ urlpatterns = [
     path('api/dossier/<int:dossier_pk>/journal/<int:journal_pk>/<int:annee>/<int:mois>/save-entry/', 
          views_sage_grid.save_sage_grid_entry, 
          name='save_sage_grid_entry'),
+
+    path('api/dossier/<int:dossier_pk>/journal/<int:journal_pk>/<int:annee>/<int:mois>/validate-batch/',
+         views_sage_grid.validate_sage_grid_batch,
+         name='validate_sage_grid_batch'),
       # API endpoints pour la saisie Sage
     path('api/dossier/<int:dossier_pk>/search-accounts/', 
          views_sage_grid.search_accounts_view, 
@@ -60,6 +77,10 @@ urlpatterns = [
     path('api/dossier/<int:dossier_pk>/journal/<int:journal_pk>/search-pieces/',
          views_sage_grid.search_pieces,
          name='search_pieces'),
+
+    path('api/dossier/<int:dossier_pk>/journal/<int:journal_pk>/search-pieces/stream/',
+         views_sage_grid.stream_pieces,
+         name='stream_pieces'),
          
     path('api/dossier/<int:dossier_pk>/journal/<int:journal_pk>/suggest-piece-number/',
          views_sage_grid.suggest_piece_number,
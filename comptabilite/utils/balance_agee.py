@@ -0,0 +1,147 @@
+"""
+Balance âgée - Encours clients / fournisseurs par tiers, ventilés par ancienneté de l'échéance
+
+Seules les lignes non lettrées (lettrage_code nul) portées par un tiers sont retenues : une ligne
+lettrée est soldée par la pièce qui la lettre. Le retard d'une ligne est le nombre de jours entre
+son échéance (date d'écriture à défaut) et la date de référence ; les tranches sont des agrégats
+filtrés d'une seule requête groupée par tiers, servie par l'index ligne_tiers_echeance_idx
+(tiers_ligne, lettrage_code, date_echeance_ligne).
+
+Le lettrage n'est pas daté : une balance âgée à une date passée ignore les lignes lettrées
+depuis, elle reflète l'état du lettrage au moment du calcul.
+"""
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import List, Optional, Tuple
+
+from django.db.models import F, Q, Sum
+from django.db.models.functions import Coalesce
+
+from comptabilite.models import LigneEcriture
+from comptabilite.utils import clotures
+
+ZERO = Decimal('0.00')
+
+# (clé, libellé, retard minimal, retard maximal) en jours ; None = non borné
+TRANCHES = (
+    ('non_echu', "Non échu", None, -1),
+    ('retard_0_30', "0 à 30 jours", 0, 30),
+    ('retard_31_60', "31 à 60 jours", 31, 60),
+    ('retard_61_90', "61 à 90 jours", 61, 90),
+    ('retard_plus_90', "Plus de 90 jours", 91, None),
+)
+
+# nature -> (racine des comptes collectifs SYSCOHADA, signe de l'encours)
+NATURES = {
+    'clients': ('41', 1),        # créances : solde débiteur
+    'fournisseurs': ('40', -1),  # dettes : solde créditeur
+}
+
+
+@dataclass
+class LigneBalanceAgee:
+    tiers_pk: Optional[int]
+    code_tiers: str
+    nom: str
+    montants: List[Decimal] = field(default_factory=lambda: [ZERO] * len(TRANCHES))
+
+    @property
+    def total(self) -> Decimal:
+        return sum(self.montants, ZERO)
+
+    @property
+    def echu(self) -> Decimal:
+        return self.total - self.montants[0]
+
+    def tranches(self) -> List[Tuple[str, Decimal]]:
+        return [(cle, montant) for (cle, *__), montant in zip(TRANCHES, self.montants)]
+
+    def vers_dict(self) -> dict:
+        return {
+            'tiers': self.code_tiers, 'nom': self.nom, **dict(self.tranches()),
+            'echu': self.echu, 'total': self.total,
+        }
+
+
+@dataclass
+class BalanceAgee:
+    nature: str
+    date_reference: date
+    tiers: List[LigneBalanceAgee] = field(default_factory=list)
+    total: LigneBalanceAgee = field(default_factory=lambda: LigneBalanceAgee(None, '', "Total"))
+
+    def vers_dict(self) -> dict:
+        return {
+            'nature': self.nature, 'date_reference': self.date_reference.isoformat(),
+            'tranches': [{'cle': cle, 'libelle': libelle, 'retard_min': mini, 'retard_max': maxi}
+                         for cle, libelle, mini, maxi in TRANCHES],
+            'tiers': [ligne.vers_dict() for ligne in self.tiers],
+            'total': self.total.vers_dict(),
+        }
+
+
+def filtre_tranche(date_reference: date, retard_min: Optional[int], retard_max: Optional[int]) -> Q:
+    """Lignes dont le retard au `date_reference` est compris entre les bornes (incluses)."""
+    filtre = Q()
+    if retard_min is not None:
+        filtre &= Q(echeance__lte=date_reference - timedelta(days=retard_min))
+    if retard_max is not None:
+        filtre &= Q(echeance__gte=date_reference - timedelta(days=retard_max))
+    return filtre
+
+
+def lignes_ouvertes(dossier, nature: str, date_reference: date):
+    """
+    Lignes non lettrées des comptes de tiers de la nature, passées au plus tard à la date de référence.
+    Après une clôture d'exercice, les pièces ouvertes sont reprises une à une par les à-nouveaux :
+    les lignes antérieures sont ignorées.
+    """
+    racine, __ = NATURES[nature]
+    lignes = LigneEcriture.objects.filter(
+        ecriture__dossier_pme=dossier,
+        ecriture__date_ecriture__lte=date_reference,
+        compte_general__numero_compte__startswith=racine,
+        tiers_ligne__isnull=False,
+        lettrage_code__isnull=True,
+    )
+    origine = clotures.origine_report(dossier, date_reference)
+    if origine:
+        lignes = lignes.filter(ecriture__date_ecriture__gte=origine)
+    return lignes.alias(echeance=Coalesce('date_echeance_ligne', 'ecriture__date_ecriture'))
+
+
+def calculer_balance_agee(dossier, nature: str = 'clients', date_reference: Optional[date] = None) -> BalanceAgee:
+    """Encours par tiers et par tranche de retard (une requête groupée), tiers sans encours exclus."""
+    if nature not in NATURES:
+        raise ValueError(f"Nature de balance âgée inconnue : {nature}.")
+    date_reference = date_reference or date.today()
+    __, signe = NATURES[nature]
+    solde = (F('debit') - F('credit')) * signe
+    agregats = lignes_ouvertes(dossier, nature, date_reference).values(
+        'tiers_ligne_id', 'tiers_ligne__code_tiers', 'tiers_ligne__nom_ou_raison_sociale',
+    ).annotate(**{
+        cle: Sum(solde, filter=filtre_tranche(date_reference, mini, maxi)) for cle, __, mini, maxi in TRANCHES
+    }).order_by('tiers_ligne__code_tiers').values_list(
+        'tiers_ligne_id', 'tiers_ligne__code_tiers', 'tiers_ligne__nom_ou_raison_sociale', *(cle for cle, *__ in TRANCHES),
+    )
+
+    balance = BalanceAgee(nature, date_reference)
+    for pk, code, nom, *montants in agregats:
+        ligne = LigneBalanceAgee(pk, code, nom, [(montant or ZERO).quantize(ZERO) for montant in montants])
+        if not any(ligne.montants):
+            continue
+        balance.tiers.append(ligne)
+        balance.total.montants = [cumul + montant for cumul, montant in zip(balance.total.montants, ligne.montants)]
+    return balance
+
+
+COLONNES_CSV = ('Tiers', 'Nom', *(libelle for __, libelle, *__ in TRANCHES), 'Total échu', 'Total')
+
+
+def lignes_csv(balance: BalanceAgee):
+    yield COLONNES_CSV
+    for ligne in [*balance.tiers, balance.total]:
+        yield (ligne.code_tiers, ligne.nom, *(
+            f"{valeur:.2f}".replace('.', ',') for valeur in (*ligne.montants, ligne.echu, ligne.total)
+        ))
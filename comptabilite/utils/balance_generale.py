@@ -0,0 +1,251 @@
+"""
+Balance générale - Soldes d'ouverture, mouvements et soldes de clôture par compte sur une période
+
+Le calcul tient en une requête d'agrégation groupée par compte sur les lignes d'écriture (solde
+d'ouverture et mouvements par agrégats filtrés), quel que soit le nombre de lignes. Les totaux
+des comptes parents (compte_parent), des classes SYSCOHADA et le total général sont ensuite
+cumulés en mémoire sur des tableaux indexés par position de compte : une passe des feuilles
+vers les racines, en O(comptes).
+
+Les comptes de gestion (classes 6, 7 et 8) repartent de zéro à l'ouverture de chaque exercice :
+leur solde d'ouverture ne reprend que les lignes de l'exercice antérieures à la période.
+
+Le solde d'ouverture ne relit pas les lignes antérieures à la dernière clôture (utils/clotures.py) :
+après une clôture de mois, il part des soldes figés de la clôture ; après une clôture d'exercice,
+l'écriture d'à-nouveaux du lendemain reprend les soldes et les lignes antérieures sont ignorées.
+"""
+from dataclasses import dataclass, field
+from datetime import date
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from django.db.models import F, Q, Sum
+
+from comptabilite.models import ClotureComptable, CompteComptablePME, LigneEcriture
+from comptabilite.utils import clotures, export_fec, sequences_pieces
+
+ZERO = Decimal('0.00')
+CLASSES_GESTION = ('6', '7', '8')
+LIBELLES_CLASSES = {
+    '1': "Comptes de ressources durables",
+    '2': "Comptes d'actif immobilisé",
+    '3': "Comptes de stocks",
+    '4': "Comptes de tiers",
+    '5': "Comptes de trésorerie",
+    '6': "Comptes de charges des activités ordinaires",
+    '7': "Comptes de produits des activités ordinaires",
+    '8': "Comptes des autres charges et des autres produits",
+    '9': "Comptes des engagements hors bilan et de la comptabilité analytique",
+}
+PROFONDEUR_MAX = 20  # protection contre un cycle dans compte_parent
+
+
+@dataclass
+class LigneBalance:
+    numero: str
+    intitule: str
+    niveau: int = 0
+    ouverture: Decimal = ZERO  # solde signé : débiteur > 0, créditeur < 0
+    debit: Decimal = ZERO
+    credit: Decimal = ZERO
+    compte_pk: Optional[int] = None
+    est_detail: bool = True
+
+    @property
+    def cloture(self) -> Decimal:
+        return self.ouverture + self.debit - self.credit
+
+    @property
+    def ouverture_debit(self) -> Decimal:
+        return max(self.ouverture, ZERO)
+
+    @property
+    def ouverture_credit(self) -> Decimal:
+        return max(-self.ouverture, ZERO)
+
+    @property
+    def cloture_debit(self) -> Decimal:
+        return max(self.cloture, ZERO)
+
+    @property
+    def cloture_credit(self) -> Decimal:
+        return max(-self.cloture, ZERO)
+
+    @property
+    def est_vide(self) -> bool:
+        return not (self.ouverture or self.debit or self.credit)
+
+    def vers_dict(self) -> dict:
+        return {
+            'numero': self.numero, 'intitule': self.intitule, 'niveau': self.niveau, 'est_detail': self.est_detail,
+            'ouverture_debit': self.ouverture_debit, 'ouverture_credit': self.ouverture_credit,
+            'debit': self.debit, 'credit': self.credit,
+            'cloture_debit': self.cloture_debit, 'cloture_credit': self.cloture_credit,
+        }
+
+
+@dataclass
+class Balance:
+    date_debut: date
+    date_fin: date
+    comptes: List[LigneBalance] = field(default_factory=list)
+    classes: List[LigneBalance] = field(default_factory=list)
+    total: LigneBalance = field(default_factory=lambda: LigneBalance('', "Total général", est_detail=False))
+
+    @property
+    def est_equilibree(self) -> bool:
+        return self.total.debit == self.total.credit
+
+    def par_classe(self):
+        """(ligne de classe, comptes de la classe) dans l'ordre des numéros."""
+        comptes_par_classe: Dict[str, List[LigneBalance]] = {}
+        for ligne in self.comptes:
+            comptes_par_classe.setdefault(ligne.numero[:1], []).append(ligne)
+        return [(classe, comptes_par_classe.get(classe.numero, [])) for classe in self.classes]
+
+    def vers_dict(self) -> dict:
+        return {
+            'date_debut': self.date_debut.isoformat(), 'date_fin': self.date_fin.isoformat(),
+            'est_equilibree': self.est_equilibree,
+            'comptes': [ligne.vers_dict() for ligne in self.comptes],
+            'classes': [ligne.vers_dict() for ligne in self.classes],
+            'total': self.total.vers_dict(),
+        }
+
+
+def _debut_exercice(dossier, jour: date) -> date:
+    return export_fec.periode_exercice(dossier, sequences_pieces.exercice_de(dossier, jour))[0]
+
+
+def filtre_comptes_gestion(champ: str = 'compte_general__numero_compte') -> Q:
+    comptes_gestion = Q()
+    for classe in CLASSES_GESTION:
+        comptes_gestion |= Q(**{f'{champ}__startswith': classe})
+    return comptes_gestion
+
+
+def filtre_report(dossier, date_debut: date) -> Q:
+    """Lignes reportées dans le solde d'ouverture au `date_debut` : comptes de gestion limités à l'exercice."""
+    return Q(ecriture__date_ecriture__gte=_debut_exercice(dossier, date_debut)) | ~filtre_comptes_gestion()
+
+
+def report(dossier, date_debut: date, soldes_figes: bool = True) -> Tuple[Q, Dict[int, Decimal]]:
+    """
+    (filtre des lignes reportées, soldes de départ par compte) pour le solde d'ouverture au
+    `date_debut` : les lignes postérieures à la dernière clôture, ajoutées à ses soldes figés.
+    soldes_figes=False (lignes filtrées par journal ou tiers, que les soldes par compte ne
+    distinguent pas) : seules les clôtures d'exercice sont prises en compte.
+    """
+    filtre = filtre_report(dossier, date_debut)
+    cloture = clotures.derniere_cloture(dossier, date_debut, exercices_seulement=not soldes_figes)
+    if cloture is None:
+        return filtre, {}
+    filtre &= Q(ecriture__date_ecriture__gt=cloture.date_fin)
+    if cloture.type_cloture == ClotureComptable.EXERCICE:  # soldes repris par l'écriture d'à-nouveaux
+        return filtre, {}
+    depart = clotures.soldes_figes(cloture)
+    if _debut_exercice(dossier, date_debut) > cloture.date_fin:  # nouvel exercice : comptes de gestion remis à zéro
+        gestion = set(CompteComptablePME.objects.filter(
+            filtre_comptes_gestion('numero_compte'), pk__in=depart,
+        ).values_list('pk', flat=True))
+        depart = {pk: solde for pk, solde in depart.items() if pk not in gestion}
+    return filtre, depart
+
+
+def mouvements_par_compte(dossier, date_debut: date, date_fin: date) -> Dict[int, tuple]:
+    """compte_pk -> (solde d'ouverture, débit, crédit de la période) : une requête groupée."""
+    filtre, depart = report(dossier, date_debut)
+    avant = Q(ecriture__date_ecriture__lt=date_debut)
+    pendant = Q(ecriture__date_ecriture__gte=date_debut)
+    agregats = LigneEcriture.objects.filter(
+        filtre,
+        ecriture__dossier_pme=dossier,
+        ecriture__date_ecriture__lte=date_fin,
+    ).values('compte_general_id').annotate(
+        ouverture=Sum(F('debit') - F('credit'), filter=avant),
+        total_debit=Sum('debit', filter=pendant),
+        total_credit=Sum('credit', filter=pendant),
+    ).order_by().values_list('compte_general_id', 'ouverture', 'total_debit', 'total_credit')
+    mouvements = {pk: (ZERO, ZERO, ZERO) for pk in depart}
+    for pk, *valeurs in agregats:
+        mouvements[pk] = tuple((valeur or ZERO).quantize(ZERO) for valeur in valeurs)
+    for pk, solde in depart.items():
+        ouverture, debit, credit = mouvements[pk]
+        mouvements[pk] = (ouverture + solde, debit, credit)
+    return mouvements
+
+
+def calculer_balance(dossier, date_debut: date, date_fin: date, comptes_sans_mouvement: bool = False) -> Balance:
+    """Balance générale du dossier entre deux dates incluses, cumulée par compte parent et par classe."""
+    mouvements = mouvements_par_compte(dossier, date_debut, date_fin)
+    plan = list(CompteComptablePME.objects.filter(dossier_pme=dossier).order_by('numero_compte').values_list(
+        'pk', 'numero_compte', 'intitule_compte', 'compte_parent_id', 'nature_compte'
+    ))
+
+    # Tableaux parallèles indexés par position dans le plan
+    position = {pk: i for i, (pk, *__) in enumerate(plan)}
+    parent = [position.get(parent_pk, -1) for __, __, __, parent_pk, __ in plan]
+    ouverture = [ZERO] * len(plan)
+    debit = [ZERO] * len(plan)
+    credit = [ZERO] * len(plan)
+    for pk, (o, d, c) in mouvements.items():
+        i = position.get(pk)
+        if i is not None:
+            ouverture[i], debit[i], credit[i] = o, d, c
+
+    profondeur = [0] * len(plan)
+    for i in range(len(plan)):
+        p, n = parent[i], 0
+        while p >= 0 and n < PROFONDEUR_MAX:
+            p, n = parent[p], n + 1
+        if p >= 0:  # cycle : le compte est traité comme une racine
+            parent[i], n = -1, 0
+        profondeur[i] = n
+
+    # Cumul des feuilles vers les racines
+    for i in sorted(range(len(plan)), key=profondeur.__getitem__, reverse=True):
+        p = parent[i]
+        if p >= 0:
+            ouverture[p] += ouverture[i]
+            debit[p] += debit[i]
+            credit[p] += credit[i]
+
+    balance = Balance(date_debut, date_fin)
+    classes: Dict[str, LigneBalance] = {}
+    for i, (pk, numero, intitule, __, nature) in enumerate(plan):
+        ligne = LigneBalance(numero, intitule, profondeur[i], ouverture[i], debit[i], credit[i], pk, nature == 'DETAIL')
+        if parent[i] < 0:
+            classe = classes.setdefault(numero[:1], LigneBalance(
+                numero[:1], LIBELLES_CLASSES.get(numero[:1], f"Classe {numero[:1]}"), est_detail=False
+            ))
+            classe.ouverture += ligne.ouverture
+            classe.debit += ligne.debit
+            classe.credit += ligne.credit
+        if comptes_sans_mouvement or not ligne.est_vide:
+            balance.comptes.append(ligne)
+
+    balance.classes = [classes[cle] for cle in sorted(classes) if comptes_sans_mouvement or not classes[cle].est_vide]
+    for classe in balance.classes:
+        balance.total.ouverture += classe.ouverture
+        balance.total.debit += classe.debit
+        balance.total.credit += classe.credit
+    return balance
+
+
+COLONNES_CSV = (
+    'Compte', 'Intitulé', 'Ouverture débit', 'Ouverture crédit', 'Mouvements débit', 'Mouvements crédit',
+    'Solde débit', 'Solde crédit',
+)
+
+
+def lignes_csv(balance: Balance):
+    """Lignes du fichier CSV : comptes, puis totaux des classes et total général."""
+    yield COLONNES_CSV
+    for ligne in [*balance.comptes, *balance.classes, balance.total]:
+        numero = ligne.numero if ligne.compte_pk or not ligne.numero else f"Classe {ligne.numero}"
+        yield (numero, ligne.intitule, *(
+            f"{valeur:.2f}".replace('.', ',') for valeur in (
+                ligne.ouverture_debit, ligne.ouverture_credit, ligne.debit, ligne.credit,
+                ligne.cloture_debit, ligne.cloture_credit,
+            )
+        ))
@@ -0,0 +1,57 @@
+"""
+Jetons de version partagés via le cache Django
+
+Les index tenus en mémoire par chaque processus (plan de référence, recherche de comptes...)
+sont marqués du jeton courant de leur clé. Invalider une clé remplace son jeton : tous les
+processus qui partagent le backend de cache reconstruisent alors leur index au prochain accès.
+Un jeton évincé du cache est simplement remplacé, ce qui provoque aussi une reconstruction.
+"""
+import uuid
+
+from django.core.cache import cache
+
+PREFIXE = 'comptabilite:version'
+
+
+def _cle_cache(*cle) -> str:
+    return ':'.join([PREFIXE, *map(str, cle)])
+
+
+def version_courante(*cle) -> str:
+    """Jeton de version courant de la clé (créé au besoin)."""
+    cle_cache = _cle_cache(*cle)
+    version = cache.get(cle_cache)
+    if version is None:
+        cache.add(cle_cache, uuid.uuid4().hex, timeout=None)
+        version = cache.get(cle_cache)
+    return version
+
+
+async def aversion_courante(*cle) -> str:
+    """Variante asynchrone de version_courante (vues async)."""
+    cle_cache = _cle_cache(*cle)
+    version = await cache.aget(cle_cache)
+    if version is None:
+        await cache.aadd(cle_cache, uuid.uuid4().hex, timeout=None)
+        version = await cache.aget(cle_cache)
+    return version
+
+
+def invalider(*cle) -> None:
+    """Remplace le jeton de version de la clé, rendant obsolètes les index qui en dépendent."""
+    cache.set(_cle_cache(*cle), uuid.uuid4().hex, timeout=None)
+
+
+def versions_courantes(cles) -> dict:
+    """
+    Jetons de version de plusieurs clés (tuples) en un aller-retour au cache. Les jetons absents sont
+    créés en un seul set_many : écraser le jeton qu'un autre processus vient de créer ne coûte qu'une
+    reconstruction de plus, comme une éviction.
+    """
+    cles_cache = {cle: _cle_cache(*cle) for cle in cles}
+    versions = cache.get_many(list(cles_cache.values()))
+    manquants = {cle_cache: uuid.uuid4().hex for cle_cache in cles_cache.values() if cle_cache not in versions}
+    if manquants:
+        cache.set_many(manquants, timeout=None)
+        versions.update(manquants)
+    return {cle: versions[cle_cache] for cle, cle_cache in cles_cache.items()}
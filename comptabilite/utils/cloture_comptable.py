@@ -0,0 +1,182 @@
+"""
+Clôture comptable - Clôture d'un mois ou d'un exercice : soldes figés et écriture d'à-nouveaux
+
+Clôturer un mois ou un exercice :
+1. contrôle que la période est terminée, postérieure à la dernière clôture du dossier (les
+   clôtures se succèdent, sans réouverture) et sans pièce déséquilibrée ;
+2. fige le solde de chaque compte au dernier jour (SoldeCloture), calculé par la requête groupée
+   de la balance générale à partir de la clôture précédente ;
+3. pour un exercice, passe l'écriture d'à-nouveaux datée du lendemain dans le journal de type AN :
+   comptes de bilan (hors classes 6 à 8) par compte et tiers, pièces non lettrées des comptes
+   lettrables reprises une à une (échéance et références conservées pour le lettrage et la
+   balance âgée), résultat de l'exercice au report à nouveau (121 bénéfice, 1291 perte).
+
+Les écritures datées jusqu'à la fin de la période sont ensuite verrouillées (utils/clotures.py).
+Les deux clôtures d'un même dossier sont sérialisées par un verrou sur la ligne du dossier.
+"""
+from collections import defaultdict
+from calendar import monthrange
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+
+from comptabilite.models import (
+    ClotureComptable, CompteComptablePME, EcritureComptable, JournalComptable, LigneEcriture, SoldeCloture,
+)
+from comptabilite.utils import balance_generale, clotures, export_fec, sequences_pieces, totaux_pieces
+from dossiers_pme.models import DossierPME
+
+ZERO = Decimal('0.00')
+COMPTE_REPORT_BENEFICE = '121'
+COMPTE_REPORT_PERTE = '1291'
+CODE_JOURNAL_A_NOUVEAUX = 'AN'
+
+
+def soldes_cloture(dossier, date_fin: date) -> Dict[int, Decimal]:
+    """compte_pk -> solde signé (débiteur > 0) au `date_fin` inclus, comptes soldés exclus."""
+    soldes = {
+        pk: ouverture + debit - credit
+        for pk, (ouverture, debit, credit) in balance_generale.mouvements_par_compte(dossier, date_fin, date_fin).items()
+    }
+    return {pk: solde for pk, solde in soldes.items() if solde}
+
+
+def _controler(dossier, type_cloture: str, date_fin: date, aujourd_hui: date) -> None:
+    if date_fin >= aujourd_hui:
+        raise clotures.ClotureImpossible(f"La période se termine le {date_fin:%d/%m/%Y} : elle n'est pas encore close.")
+    derniere = ClotureComptable.objects.filter(dossier_pme=dossier).order_by('-date_fin', 'type_cloture').first()
+    if derniere and (date_fin < derniere.date_fin or (date_fin == derniere.date_fin and (
+            type_cloture == ClotureComptable.MOIS or derniere.type_cloture == ClotureComptable.EXERCICE))):
+        raise clotures.ClotureImpossible(f"Le dossier est déjà clôturé au {derniere.date_fin:%d/%m/%Y}.")
+    desequilibrees = totaux_pieces.pieces_desequilibrees(dossier).filter(date_ecriture__lte=date_fin).count()
+    if desequilibrees:
+        raise clotures.ClotureImpossible(
+            f"{desequilibrees} pièce(s) déséquilibrée(s) jusqu'au {date_fin:%d/%m/%Y} : corrigez-les avant de clôturer."
+        )
+
+
+def _journal_a_nouveaux(dossier) -> JournalComptable:
+    journal = JournalComptable.objects.filter(dossier_pme=dossier, type_journal='AN').order_by('code_journal').first()
+    if journal is None:
+        journal, __ = JournalComptable.objects.get_or_create(
+            dossier_pme=dossier, code_journal=CODE_JOURNAL_A_NOUVEAUX,
+            defaults={'libelle': "À nouveaux", 'type_journal': 'AN'},
+        )
+    return journal
+
+
+def _compte_report(dossier, numero: str) -> CompteComptablePME:
+    compte = CompteComptablePME.objects.filter(dossier_pme=dossier, numero_compte=numero).first()
+    if compte is None:
+        raise clotures.ClotureImpossible(f"Compte {numero} absent du plan du dossier : il reçoit le résultat de l'exercice.")
+    return compte
+
+
+def lignes_a_nouveaux(dossier, date_fin: date) -> List[LigneEcriture]:
+    """
+    Lignes (non enregistrées) de l'écriture d'à-nouveaux reprenant les soldes au `date_fin` :
+    trois requêtes, sur les lignes postérieures à la clôture d'exercice précédente.
+    """
+    lendemain = date_fin + timedelta(days=1)
+    libelle = f"À nouveaux au {lendemain:%d/%m/%Y}"
+    lignes = LigneEcriture.objects.filter(
+        ~balance_generale.filtre_comptes_gestion(), ecriture__dossier_pme=dossier, ecriture__date_ecriture__lte=date_fin,
+    )
+    origine = clotures.origine_report(dossier, date_fin)
+    if origine:
+        lignes = lignes.filter(ecriture__date_ecriture__gte=origine)
+
+    # Pièces ouvertes des comptes lettrables : une ligne d'à-nouveaux par ligne non lettrée
+    ouvertes = defaultdict(list)
+    for compte_pk, tiers_pk, libelle_ligne, echeance, facture, reference, debit, credit in lignes.filter(
+        compte_general__est_lettrable=True, lettrage_code__isnull=True,
+    ).values_list(
+        'compte_general_id', 'tiers_ligne_id', 'libelle_ligne',
+        Coalesce('date_echeance_ligne', 'ecriture__date_ecriture'),
+        Coalesce('numero_facture', 'ecriture__numero_facture_liee'), Coalesce('reference', 'ecriture__reference_piece'),
+        'debit', 'credit',
+    ).order_by('compte_general_id', 'tiers_ligne_id', 'ecriture__date_ecriture', 'ecriture_id', 'ordre', 'id'):
+        if debit == credit:
+            continue
+        ouvertes[(compte_pk, tiers_pk)].append(LigneEcriture(
+            compte_general_id=compte_pk, tiers_ligne_id=tiers_pk, libelle_ligne=libelle_ligne[:255],
+            date_echeance_ligne=echeance, numero_facture=facture, reference=reference,
+            debit=max(debit - credit, ZERO), credit=max(credit - debit, ZERO),
+        ))
+
+    resultat = []
+    for compte_pk, tiers_pk, solde in lignes.values('compte_general_id', 'tiers_ligne_id').annotate(
+        solde=Sum(F('debit') - F('credit')),
+    ).order_by('compte_general__numero_compte', 'tiers_ligne_id').values_list('compte_general_id', 'tiers_ligne_id', 'solde'):
+        detail = ouvertes.pop((compte_pk, tiers_pk), [])
+        resultat.extend(detail)
+        # Reliquat : solde non couvert par les pièces ouvertes (compte non lettrable, lettrage partiel...)
+        reste = (solde or ZERO) - sum((ligne.debit - ligne.credit for ligne in detail), ZERO)
+        if reste:
+            resultat.append(LigneEcriture(
+                compte_general_id=compte_pk, tiers_ligne_id=tiers_pk, libelle_ligne=libelle,
+                debit=max(reste, ZERO), credit=max(-reste, ZERO),
+            ))
+
+    solde_bilan = sum((ligne.debit - ligne.credit for ligne in resultat), ZERO)
+    if solde_bilan > 0:
+        resultat.append(LigneEcriture(compte_general=_compte_report(dossier, COMPTE_REPORT_BENEFICE),
+                                      libelle_ligne=f"Résultat de l'exercice clos le {date_fin:%d/%m/%Y}", credit=solde_bilan))
+    elif solde_bilan < 0:
+        resultat.append(LigneEcriture(compte_general=_compte_report(dossier, COMPTE_REPORT_PERTE),
+                                      libelle_ligne=f"Résultat de l'exercice clos le {date_fin:%d/%m/%Y}", debit=-solde_bilan))
+    for ordre, ligne in enumerate(resultat):
+        ligne.ordre, ligne.jour = ordre, lendemain.day
+    return resultat
+
+
+def ecriture_a_nouveaux(dossier, date_fin: date) -> Optional[EcritureComptable]:
+    """Passe l'écriture d'à-nouveaux du lendemain de `date_fin` (None si tous les comptes de bilan sont soldés)."""
+    lignes = lignes_a_nouveaux(dossier, date_fin)
+    if not lignes:
+        return None
+    lendemain = date_fin + timedelta(days=1)
+    journal = _journal_a_nouveaux(dossier)
+    ecriture = EcritureComptable.objects.create(
+        dossier_pme=dossier, journal=journal, date_ecriture=lendemain,
+        numero_piece=sequences_pieces.numero_pour_enregistrement(journal, lendemain, None),
+        libelle_piece=f"À nouveaux au {lendemain:%d/%m/%Y}",
+    )
+    for ligne in lignes:
+        ligne.ecriture = ecriture
+    LigneEcriture.objects.bulk_create(lignes, batch_size=1000)
+    return ecriture
+
+
+@transaction.atomic
+def _cloturer(dossier, type_cloture: str, date_fin: date, utilisateur=None,
+              aujourd_hui: Optional[date] = None) -> ClotureComptable:
+    DossierPME.objects.select_for_update().filter(pk=dossier.pk).first()
+    _controler(dossier, type_cloture, date_fin, aujourd_hui or date.today())
+    soldes = soldes_cloture(dossier, date_fin)
+    ecriture = ecriture_a_nouveaux(dossier, date_fin) if type_cloture == ClotureComptable.EXERCICE else None
+    cloture = ClotureComptable.objects.create(
+        dossier_pme=dossier, type_cloture=type_cloture, date_fin=date_fin,
+        ecriture_a_nouveau=ecriture, cloture_par=utilisateur,
+    )
+    SoldeCloture.objects.bulk_create([
+        SoldeCloture(cloture=cloture, compte_general_id=pk, solde_debit=max(solde, ZERO), solde_credit=max(-solde, ZERO))
+        for pk, solde in soldes.items()
+    ], batch_size=1000)
+    return cloture
+
+
+def cloturer_mois(dossier, annee: int, mois: int, utilisateur=None, aujourd_hui: Optional[date] = None) -> ClotureComptable:
+    """Clôture le dossier jusqu'au dernier jour du mois (mois antérieurs compris)."""
+    date_fin = date(annee, mois, monthrange(annee, mois)[1])
+    return _cloturer(dossier, ClotureComptable.MOIS, date_fin, utilisateur, aujourd_hui)
+
+
+def cloturer_exercice(dossier, exercice: int, utilisateur=None, aujourd_hui: Optional[date] = None) -> ClotureComptable:
+    """Clôture l'exercice commençant en `exercice` et passe l'écriture d'à-nouveaux de l'exercice suivant."""
+    date_fin = export_fec.periode_exercice(dossier, exercice)[1]
+    return _cloturer(dossier, ClotureComptable.EXERCICE, date_fin, utilisateur, aujourd_hui)
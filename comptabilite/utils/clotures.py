@@ -0,0 +1,87 @@
+"""
+Clôtures de période - Verrou des écritures clôturées et lecture des soldes figés
+
+Une clôture (ClotureComptable, voir utils/cloture_comptable.py pour les opérations) verrouille
+toutes les écritures du dossier datées jusqu'à sa date de fin : les vues de saisie refusent ces
+dates avec un message, et les signaux de comptabilite/signals.py bloquent toute autre écriture
+par le modèle (création, modification, déplacement ou suppression). La pièce d'à-nouveaux
+générée par une clôture d'exercice est verrouillée de la même façon.
+
+Les rapports ne relisent pas les lignes antérieures à la dernière clôture : ils repartent de ses
+soldes figés (SoldeCloture) ou, après une clôture d'exercice, de l'écriture d'à-nouveaux datée
+du lendemain (origine_report). Ce module ne lit que les modèles : il peut être importé par les
+utilitaires de calcul (balance_generale, soldes_periodes...) sans dépendance circulaire.
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, Optional
+
+from django.db.models import Max
+
+from comptabilite.models import ClotureComptable, SoldeCloture
+
+ZERO = Decimal('0.00')
+
+
+class PeriodeCloturee(ValueError):
+    """Écriture dans une période clôturée (ValueError : traitée comme une saisie invalide par les vues)."""
+
+
+class ClotureImpossible(ValueError):
+    pass
+
+
+# --- Verrou ---
+
+def date_verrouillage(dossier) -> Optional[date]:
+    """Date de fin de la dernière clôture du dossier (écritures verrouillées jusqu'à cette date incluse)."""
+    return ClotureComptable.objects.filter(dossier_pme=dossier).aggregate(date_fin=Max('date_fin'))['date_fin']
+
+
+def verifier_periode_ouverte(dossier, dates: Iterable[Optional[date]], ecriture_pk: Optional[int] = None) -> None:
+    """
+    Lève PeriodeCloturee si l'une des dates est couverte par une clôture du dossier, ou si
+    `ecriture_pk` est une pièce d'à-nouveaux de clôture. Une requête (clôtures du dossier).
+    """
+    clotures = list(ClotureComptable.objects.filter(dossier_pme=dossier).values_list('date_fin', 'ecriture_a_nouveau_id'))
+    if not clotures:
+        return
+    if ecriture_pk is not None and any(ecriture_pk == piece_pk for __, piece_pk in clotures):
+        raise PeriodeCloturee("Pièce d'à-nouveaux générée par une clôture d'exercice : elle ne peut pas être modifiée.")
+    verrou = max(date_fin for date_fin, __ in clotures)
+    if any(jour is not None and jour <= verrou for jour in dates):
+        raise PeriodeCloturee(
+            f"Période clôturée au {verrou:%d/%m/%Y} : les écritures jusqu'à cette date ne peuvent plus être modifiées."
+        )
+
+
+# --- Lecture ---
+
+def derniere_cloture(dossier, avant: date, exercices_seulement: bool = False) -> Optional[ClotureComptable]:
+    """Dernière clôture terminée avant `avant` ; à date égale, celle de l'exercice."""
+    clotures = ClotureComptable.objects.filter(dossier_pme=dossier, date_fin__lt=avant)
+    if exercices_seulement:
+        clotures = clotures.filter(type_cloture=ClotureComptable.EXERCICE)
+    return clotures.order_by('-date_fin', 'type_cloture').first()
+
+
+def origine_report(dossier, avant: Optional[date] = None) -> Optional[date]:
+    """
+    Lendemain de la dernière clôture d'exercice terminée avant `avant` (toutes par défaut) : les
+    soldes antérieurs sont repris par l'écriture d'à-nouveaux datée de ce jour. None sans clôture.
+    """
+    clotures = ClotureComptable.objects.filter(dossier_pme=dossier, type_cloture=ClotureComptable.EXERCICE)
+    if avant is not None:
+        clotures = clotures.filter(date_fin__lt=avant)
+    date_fin = clotures.aggregate(date_fin=Max('date_fin'))['date_fin']
+    return date_fin + timedelta(days=1) if date_fin else None
+
+
+def soldes_figes(cloture: ClotureComptable) -> Dict[int, Decimal]:
+    """compte_pk -> solde signé (débiteur > 0) figé par la clôture."""
+    return {
+        pk: debit - credit
+        for pk, debit, credit in SoldeCloture.objects.filter(cloture=cloture).values_list(
+            'compte_general_id', 'solde_debit', 'solde_credit',
+        )
+    }
@@ -0,0 +1,304 @@
+"""
+États financiers SYSCOHADA - Bilan et compte de résultat d'un exercice
+
+Les soldes sont lus dans SoldeComptePeriode par une requête groupée par compte (cumul avant
+l'exercice et mouvements de l'exercice), puis chaque compte est rattaché à un poste par le plus
+long préfixe de numéro connu. Au bilan, un compte de tiers ou de trésorerie va à l'actif ou au
+passif selon le sens de son solde ; les amortissements et dépréciations (28, 29, 39, 49, 59)
+viennent en déduction du brut de l'actif.
+
+Le résultat de l'exercice (classes 6 à 8) est porté au poste CJ ; celui des exercices antérieurs
+non encore affecté est ajouté au report à nouveau (CH), de sorte que le bilan reste équilibré
+sans écritures de clôture. Après une clôture d'exercice (utils/clotures.py), les soldes antérieurs
+ne sont plus relus : l'écriture d'à-nouveaux les reprend, résultat compris (compte 121 ou 1291).
+
+Les soldes étant mensuels, un exercice qui ne commence pas le 1er du mois est arrondi au mois.
+Les états d'un exercice terminé sont mis en cache sous l'empreinte des versions des soldes
+(soldes_periodes.empreinte_versions) : ils ne sont recalculés qu'après une écriture dans l'une
+des années qu'ils couvrent.
+"""
+from dataclasses import dataclass, field
+from datetime import date
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from django.core.cache import cache
+from django.db.models import F, Min, Q, Sum
+
+from comptabilite.models import SoldeComptePeriode
+from comptabilite.utils import clotures, export_fec, soldes_periodes
+
+ZERO = Decimal('0.00')
+DUREE_CACHE = 60 * 60 * 24 * 30
+CLASSES_RESULTAT = ('6', '7', '8')
+
+# (code, libellé, préfixes du brut, préfixes des amortissements et dépréciations)
+POSTES_ACTIF = (
+    ('AD', "Immobilisations incorporelles", ('21',), ('281', '291')),
+    ('AI', "Immobilisations corporelles", ('22', '23', '24', '2'), ('282', '283', '284', '292', '293', '294', '28', '29')),
+    ('AP', "Avances et acomptes versés sur immobilisations", ('25',), ('295',)),
+    ('AQ', "Immobilisations financières", ('26', '27'), ('296', '297')),
+    ('BA', "Actif circulant HAO", ('485', '488'), ('498',)),
+    ('BB', "Stocks et encours", ('3',), ('39',)),
+    ('BH', "Fournisseurs, avances versées", ('409',), ('490',)),
+    ('BI', "Clients", ('41',), ('491',)),
+    ('BJ', "Autres créances", ('4',), ('49',)),
+    ('BQ', "Titres de placement", ('50',), ('590',)),
+    ('BR', "Valeurs à encaisser", ('51',), ('591',)),
+    ('BS', "Banques, chèques postaux, caisse et assimilés", ('5',), ('59',)),
+    ('BU', "Écart de conversion-Actif", ('478',), ()),
+)
+
+# (code, libellé, préfixes)
+POSTES_PASSIF = (
+    ('CA', "Capital", ('101', '102', '103', '104', '10')),
+    ('CB', "Apporteurs capital non appelé (-)", ('109',)),
+    ('CD', "Primes liées au capital social", ('105',)),
+    ('CE', "Écarts de réévaluation", ('106',)),
+    ('CF', "Réserves indisponibles", ('111', '112')),
+    ('CG', "Réserves libres", ('11',)),
+    ('CH', "Report à nouveau (+ ou -)", ('12',)),
+    ('CJ', "Résultat net de l'exercice (bénéfice + ou perte -)", ('13',)),
+    ('CL', "Subventions d'investissement", ('14',)),
+    ('CM', "Provisions réglementées", ('15',)),
+    ('DA', "Emprunts et dettes financières diverses", ('16', '18', '1')),
+    ('DB', "Dettes de location-acquisition", ('17',)),
+    ('DC', "Provisions pour risques et charges", ('19',)),
+    ('DH', "Dettes circulantes HAO", ('481', '482', '484')),
+    ('DI', "Clients, avances reçues", ('419',)),
+    ('DJ', "Fournisseurs d'exploitation", ('40',)),
+    ('DK', "Dettes fiscales et sociales", ('42', '43', '44')),
+    ('DM', "Autres dettes", ('4',)),
+    ('DN', "Provisions pour risques à court terme", ('499',)),
+    ('DQ', "Banques, crédits d'escompte", ('565',)),
+    ('DR', "Banques, établissements financiers et crédits de trésorerie", ('5',)),
+    ('DV', "Écart de conversion-Passif", ('479',)),
+)
+
+# (code, libellé, sens, préfixes) ; sens 1 : produit (crédit - débit), -1 : charge (débit - crédit)
+POSTES_RESULTAT = (
+    ('TA', "Ventes de marchandises", 1, ('701',)),
+    ('RA', "Achats de marchandises", -1, ('601',)),
+    ('RB', "Variation de stocks de marchandises", -1, ('6031', '603')),
+    ('TB', "Ventes de produits fabriqués", 1, ('702', '703', '704')),
+    ('TC', "Travaux, services vendus", 1, ('705', '706', '70')),
+    ('TD', "Produits accessoires", 1, ('707',)),
+    ('TE', "Production stockée (ou déstockage)", 1, ('73',)),
+    ('TF', "Production immobilisée", 1, ('72',)),
+    ('TG', "Subventions d'exploitation", 1, ('71',)),
+    ('TH', "Autres produits", 1, ('75', '7')),
+    ('TI', "Transferts de charges d'exploitation", 1, ('781', '78')),
+    ('RC', "Achats de matières premières et fournitures liées", -1, ('602',)),
+    ('RD', "Variation de stocks de matières premières et fournitures liées", -1, ('6032',)),
+    ('RE', "Autres achats", -1, ('604', '605', '608', '60')),
+    ('RF', "Variation de stocks d'autres approvisionnements", -1, ('6033',)),
+    ('RG', "Transports", -1, ('61',)),
+    ('RH', "Services extérieurs", -1, ('62', '63')),
+    ('RI', "Impôts et taxes", -1, ('64',)),
+    ('RJ', "Autres charges", -1, ('65', '6')),
+    ('RK', "Charges de personnel", -1, ('66',)),
+    ('TJ', "Reprises d'amortissements, provisions et dépréciations", 1, ('791', '798', '799', '79')),
+    ('RL', "Dotations aux amortissements, aux provisions et dépréciations", -1, ('681', '691', '68', '69')),
+    ('TK', "Revenus financiers et assimilés", 1, ('77',)),
+    ('TL', "Reprises de provisions et dépréciations financières", 1, ('797',)),
+    ('TM', "Transferts de charges financières", 1, ('787',)),
+    ('RM', "Frais financiers et charges assimilées", -1, ('67',)),
+    ('RN', "Dotations aux provisions et aux dépréciations financières", -1, ('697',)),
+    ('TN', "Produits des cessions d'immobilisations", 1, ('82',)),
+    ('TO', "Autres produits HAO", 1, ('84', '86', '88', '8')),
+    ('RO', "Valeurs comptables des cessions d'immobilisations", -1, ('81',)),
+    ('RP', "Autres charges HAO", -1, ('83', '85')),
+    ('RQ', "Participation des travailleurs", -1, ('87',)),
+    ('RS', "Impôts sur le résultat", -1, ('89',)),
+)
+
+# Soldes intermédiaires : (code, libellé, postes ajoutés, postes retranchés), dans l'ordre du tableau
+SOLDES_INTERMEDIAIRES = (
+    ('XA', "Marge commerciale", ('TA',), ('RA', 'RB')),
+    ('XB', "Chiffre d'affaires", ('TA', 'TB', 'TC', 'TD'), ()),
+    ('XC', "Valeur ajoutée", ('XB', 'TE', 'TF', 'TG', 'TH', 'TI'),
+     ('RA', 'RB', 'RC', 'RD', 'RE', 'RF', 'RG', 'RH', 'RI', 'RJ')),
+    ('XD', "Excédent brut d'exploitation", ('XC',), ('RK',)),
+    ('XE', "Résultat d'exploitation", ('XD', 'TJ'), ('RL',)),
+    ('XF', "Résultat financier", ('TK', 'TL', 'TM'), ('RM', 'RN')),
+    ('XG', "Résultat des activités ordinaires", ('XE', 'XF'), ()),
+    ('XH', "Résultat hors activités ordinaires", ('TN', 'TO'), ('RO', 'RP')),
+    ('XI', "Résultat net", ('XG', 'XH'), ('RQ', 'RS')),
+)
+# Poste après lequel chaque solde intermédiaire s'affiche
+# (XG suit XF, lui-même un solde intermédiaire)
+POSITION_SOLDES = {'XA': 'RB', 'XB': 'TD', 'XC': 'RJ', 'XD': 'RK', 'XE': 'RL', 'XF': 'RN', 'XH': 'RP', 'XI': 'RS'}
+
+
+@dataclass
+class PosteEtat:
+    code: str
+    libelle: str
+    brut: Decimal = ZERO
+    amortissement: Decimal = ZERO
+    est_total: bool = False
+
+    @property
+    def net(self) -> Decimal:
+        return self.brut - self.amortissement
+
+    def vers_dict(self) -> dict:
+        return {'code': self.code, 'libelle': self.libelle, 'brut': self.brut, 'amortissement': self.amortissement,
+                'net': self.net, 'est_total': self.est_total}
+
+
+@dataclass
+class EtatsFinanciers:
+    exercice: int
+    date_debut: date
+    date_fin: date
+    actif: List[PosteEtat] = field(default_factory=list)
+    passif: List[PosteEtat] = field(default_factory=list)
+    resultat: List[PosteEtat] = field(default_factory=list)
+
+    def poste(self, code: str) -> Optional[PosteEtat]:
+        return next((p for p in (*self.actif, *self.passif, *self.resultat) if p.code == code), None)
+
+    @property
+    def total_actif(self) -> Decimal:
+        return sum((p.net for p in self.actif), ZERO)
+
+    @property
+    def total_passif(self) -> Decimal:
+        return sum((p.net for p in self.passif), ZERO)
+
+    @property
+    def chiffre_affaires(self) -> Decimal:
+        return self.poste('XB').net
+
+    @property
+    def resultat_net(self) -> Decimal:
+        return self.poste('XI').net
+
+    @property
+    def est_equilibre(self) -> bool:
+        return self.total_actif == self.total_passif
+
+    def vers_dict(self) -> dict:
+        return {
+            'exercice': self.exercice, 'date_debut': self.date_debut.isoformat(), 'date_fin': self.date_fin.isoformat(),
+            'actif': [p.vers_dict() for p in self.actif], 'passif': [p.vers_dict() for p in self.passif],
+            'resultat': [p.vers_dict() for p in self.resultat],
+            'total_actif': self.total_actif, 'total_passif': self.total_passif, 'est_equilibre': self.est_equilibre,
+        }
+
+
+def _index_prefixes(postes, *colonnes) -> Dict[str, Tuple[str, int]]:
+    """préfixe -> (code du poste, colonne) pour les colonnes de préfixes données."""
+    index = {}
+    for code, __, *groupes in postes:
+        for colonne in colonnes:
+            for prefixe in groupes[colonne]:
+                index.setdefault(prefixe, (code, colonne))
+    return index
+
+
+_ACTIF = _index_prefixes(POSTES_ACTIF, 0, 1)
+_PASSIF = _index_prefixes(POSTES_PASSIF, 0)
+_RESULTAT = {prefixe: code for code, __, __, prefixes in POSTES_RESULTAT for prefixe in prefixes}
+
+
+def _plus_long_prefixe(index: dict, numero: str):
+    for longueur in range(len(numero), 0, -1):
+        valeur = index.get(numero[:longueur])
+        if valeur is not None:
+            return numero[:longueur], valeur
+    return '', None
+
+
+def _filtre_avant(annee: int, mois: int) -> Q:
+    return Q(annee__lt=annee) | Q(annee=annee, mois__lt=mois)
+
+
+def soldes_par_compte(dossier, date_debut: date, date_fin: date) -> Dict[str, Tuple[Decimal, Decimal]]:
+    """numéro de compte -> (solde débiteur avant l'exercice, solde de l'exercice) : une requête groupée."""
+    solde = F('total_debit') - F('total_credit')
+    soldes = SoldeComptePeriode.objects.filter(_filtre_avant(date_fin.year, date_fin.month + 1), dossier_pme=dossier)
+    origine = clotures.origine_report(dossier, date_debut)
+    if origine:
+        soldes = soldes.exclude(_filtre_avant(origine.year, origine.month))
+    agregats = soldes.values('compte_general__numero_compte').annotate(
+        avant=Sum(solde, filter=_filtre_avant(date_debut.year, date_debut.month)),
+        exercice=Sum(solde, filter=~_filtre_avant(date_debut.year, date_debut.month)),
+    ).order_by().values_list('compte_general__numero_compte', 'avant', 'exercice')
+    return {
+        numero: ((avant or ZERO).quantize(ZERO), (exercice or ZERO).quantize(ZERO))
+        for numero, avant, exercice in agregats
+    }
+
+
+def calculer_etats(dossier, exercice: int) -> EtatsFinanciers:
+    """Bilan et compte de résultat de l'exercice commençant en `exercice`."""
+    date_debut, date_fin = export_fec.periode_exercice(dossier, exercice)
+    etats = EtatsFinanciers(exercice, date_debut, date_fin)
+    actif = {code: PosteEtat(code, libelle) for code, libelle, *__ in POSTES_ACTIF}
+    passif = {code: PosteEtat(code, libelle) for code, libelle, *__ in POSTES_PASSIF}
+    resultat = {code: PosteEtat(code, libelle) for code, libelle, *__ in POSTES_RESULTAT}
+    sens = {code: signe for code, __, signe, __ in POSTES_RESULTAT}
+    resultats_anterieurs = ZERO
+
+    for numero, (avant, pendant) in soldes_par_compte(dossier, date_debut, date_fin).items():
+        if numero[:1] in CLASSES_RESULTAT:
+            resultats_anterieurs -= avant
+            __, code = _plus_long_prefixe(_RESULTAT, numero)
+            if code:
+                resultat[code].brut += sens[code] * -pendant
+            continue
+        solde = avant + pendant
+        if not solde or numero[:1] not in '12345':
+            continue
+        prefixe_actif, valeur_actif = _plus_long_prefixe(_ACTIF, numero)
+        prefixe_passif, valeur_passif = _plus_long_prefixe(_PASSIF, numero)
+        code_actif, colonne = valeur_actif or (None, 0)
+        # Le préfixe le plus précis l'emporte ; à précision égale, le sens du solde départage actif et passif
+        if code_actif and (not valeur_passif or len(prefixe_actif) > len(prefixe_passif)
+                           or (len(prefixe_actif) == len(prefixe_passif) and solde > 0)):
+            if colonne == 1:  # amortissement ou dépréciation : en déduction du brut
+                actif[code_actif].amortissement -= solde
+            else:
+                actif[code_actif].brut += solde
+        else:
+            passif[valeur_passif[0]].brut -= solde
+
+    for code, libelle, ajoutes, retranches in SOLDES_INTERMEDIAIRES:
+        resultat[code] = PosteEtat(code, libelle, sum((resultat[c].net for c in ajoutes), ZERO)
+                                   - sum((resultat[c].net for c in retranches), ZERO), est_total=True)
+    passif['CH'].brut += resultats_anterieurs
+    passif['CJ'].brut += resultat['XI'].net
+
+    etats.actif = list(actif.values())
+    etats.passif = list(passif.values())
+    for code, *__ in POSTES_RESULTAT:
+        etats.resultat.append(resultat[code])
+        etats.resultat.extend(
+            resultat[solde] for solde, apres in POSITION_SOLDES.items() if apres == code
+        )
+    etats.resultat.insert(etats.resultat.index(resultat['XF']) + 1, resultat['XG'])
+    return etats
+
+
+def _cle_cache(dossier, exercice: int, date_debut: date, date_fin: date) -> Optional[str]:
+    premiere_annee = SoldeComptePeriode.objects.filter(dossier_pme=dossier).aggregate(annee=Min('annee'))['annee']
+    empreinte = soldes_periodes.empreinte_versions(dossier.pk, min(premiere_annee or date_fin.year, date_fin.year), date_fin.year)
+    return f"comptabilite:etats_financiers:{dossier.pk}:{exercice}:{date_debut:%Y%m%d}:{empreinte}"
+
+
+def etats_financiers(dossier, exercice: int, aujourd_hui: Optional[date] = None) -> EtatsFinanciers:
+    """
+    États de l'exercice ; ceux d'un exercice terminé sont servis depuis le cache tant que les
+    soldes des années couvertes n'ont pas changé.
+    """
+    date_debut, date_fin = export_fec.periode_exercice(dossier, exercice)
+    if date_fin >= (aujourd_hui or date.today()):
+        return calculer_etats(dossier, exercice)
+    cle = _cle_cache(dossier, exercice, date_debut, date_fin)
+    etats = cache.get(cle)
+    if etats is None:
+        etats = calculer_etats(dossier, exercice)
+        cache.set(cle, etats, DUREE_CACHE)
+    return etats
@@ -0,0 +1,142 @@
+"""
+Export FEC (Fichier des Écritures Comptables) - Une ligne par ligne d'écriture, en flux
+
+Les lignes d'un exercice sont lues par un curseur côté serveur (QuerySet.iterator) sous forme de
+tuples (values_list, sans instanciation de modèles) et formatées au fil de l'eau : la mémoire
+utilisée ne dépend pas du nombre de lignes du dossier. Le même générateur sert la réponse HTTP
+(StreamingHttpResponse) et la commande exporter_fec (fichier compressé).
+
+Format : 18 colonnes réglementaires séparées par '|', dates AAAAMMJJ, montants avec virgule
+décimale, plus la colonne DateEcheance (échéance de la ligne) sauf en mode strict.
+"""
+import re
+from datetime import date, timedelta
+from typing import Iterator, Optional, Tuple
+
+from django.utils.dateparse import parse_date
+
+from comptabilite.models import LigneEcriture
+from comptabilite.utils import sequences_pieces
+
+TAILLE_LOT = 5000  # lignes lues par aller-retour du curseur
+LIGNES_PAR_BLOC = 1000  # lignes du fichier par morceau envoyé au client
+SEPARATEUR = '|'
+FIN_DE_LIGNE = '\r\n'
+
+COLONNES_FEC = (
+    'JournalCode', 'JournalLib', 'EcritureNum', 'EcritureDate', 'CompteNum', 'CompteLib',
+    'CompAuxNum', 'CompAuxLib', 'PieceRef', 'PieceDate', 'EcritureLib', 'Debit', 'Credit',
+    'EcritureLet', 'DateLet', 'ValidDate', 'Montantdevise', 'Idevise',
+)
+COLONNE_ECHEANCE = 'DateEcheance'
+
+CHAMPS = (
+    'ecriture__journal__code_journal', 'ecriture__journal__libelle', 'ecriture__numero_piece',
+    'ecriture__date_ecriture', 'compte_general__numero_compte', 'compte_general__intitule_compte',
+    'tiers_ligne__code_tiers', 'tiers_ligne__nom_ou_raison_sociale', 'ecriture__reference_piece',
+    'libelle_ligne', 'debit', 'credit', 'lettrage_code', 'ecriture__date_creation', 'date_echeance_ligne',
+)
+
+_CARACTERES_INTERDITS = re.compile(r'[|\r\n\t]+')
+
+
+def periode_exercice(dossier, exercice: int) -> Tuple[date, date]:
+    """Dates de début et de fin de l'exercice commençant en `exercice` (exercice civil par défaut)."""
+    debut_type = dossier.date_debut_exercice_comptable
+    debut = date(exercice, debut_type.month, debut_type.day) if debut_type else date(exercice, 1, 1)
+    fin = date(exercice + 1, debut.month, debut.day) - timedelta(days=1)
+    return debut, fin
+
+
+def nom_fichier(dossier, date_fin: date) -> str:
+    """Nom réglementaire <identifiant>FEC<date de clôture>.txt (NCC du dossier, à défaut sa clé)."""
+    identifiant = re.sub(r'[^0-9A-Za-z]', '', dossier.numero_compte_contribuable or '') or f"DOSSIER{dossier.pk}"
+    return f"{identifiant}FEC{date_fin:%Y%m%d}.txt"
+
+
+def lignes_exercice(dossier, date_debut: date, date_fin: date):
+    """Lignes de la période par ordre chronologique des pièces, en tuples (voir CHAMPS)."""
+    return LigneEcriture.objects.filter(
+        ecriture__dossier_pme=dossier,
+        ecriture__date_ecriture__range=(date_debut, date_fin),
+    ).order_by('ecriture__date_ecriture', 'ecriture_id', 'ordre', 'id').values_list(*CHAMPS)
+
+
+def _texte(valeur) -> str:
+    return _CARACTERES_INTERDITS.sub(' ', valeur).strip() if valeur else ''
+
+
+def _date(valeur) -> str:
+    return valeur.strftime('%Y%m%d') if valeur else ''
+
+
+def _montant(valeur) -> str:
+    return f"{valeur:.2f}".replace('.', ',')
+
+
+def formater_ligne(valeurs, echeances: bool = True) -> str:
+    (code_journal, libelle_journal, numero_piece, date_ecriture, numero_compte, intitule_compte,
+     code_tiers, nom_tiers, reference, libelle, debit, credit, lettrage, date_creation, echeance) = valeurs
+    colonnes = [
+        _texte(code_journal), _texte(libelle_journal), _texte(numero_piece), _date(date_ecriture),
+        numero_compte, _texte(intitule_compte), _texte(code_tiers), _texte(nom_tiers),
+        _texte(reference or numero_piece), _date(date_ecriture), _texte(libelle),
+        _montant(debit), _montant(credit), _texte(lettrage), '', _date(date_creation), '', '',
+    ]
+    if echeances:
+        colonnes.append(_date(echeance))
+    return SEPARATEUR.join(colonnes)
+
+
+def iterer_fec(dossier, date_debut: date, date_fin: date, echeances: bool = True,
+               taille_lot: int = TAILLE_LOT) -> Iterator[str]:
+    """Contenu du fichier FEC par blocs de LIGNES_PAR_BLOC lignes (en-tête compris)."""
+    entete = COLONNES_FEC + ((COLONNE_ECHEANCE,) if echeances else ())
+    bloc = [SEPARATEUR.join(entete)]
+    for valeurs in lignes_exercice(dossier, date_debut, date_fin).iterator(chunk_size=taille_lot):
+        bloc.append(formater_ligne(valeurs, echeances))
+        if len(bloc) >= LIGNES_PAR_BLOC:
+            yield FIN_DE_LIGNE.join(bloc) + FIN_DE_LIGNE
+            bloc = []
+    if bloc:
+        yield FIN_DE_LIGNE.join(bloc) + FIN_DE_LIGNE
+
+
+def bornes_demandees(dossier, exercice: Optional[int] = None, date_debut: Optional[date] = None,
+                     date_fin: Optional[date] = None) -> Tuple[date, date]:
+    """Période à exporter : dates explicites, sinon l'exercice demandé (exercice en cours par défaut)."""
+    if date_debut and date_fin:
+        if date_debut > date_fin:
+            raise ValueError("La date de début doit précéder la date de fin.")
+        return date_debut, date_fin
+    if exercice is None:
+        exercice = sequences_pieces.exercice_de(dossier, date.today())
+    return periode_exercice(dossier, exercice)
+
+
+def _lire_date(valeur: str, nom: str) -> date:
+    try:
+        jour = parse_date(valeur)
+    except ValueError:  # format reconnu mais date inexistante (2024-02-30)
+        jour = None
+    if jour is None:
+        raise ValueError(f"Date invalide pour {nom} : « {valeur} » (format attendu AAAA-MM-JJ).")
+    return jour
+
+
+def periode_fec(dossier, exercice=None, date_debut: Optional[str] = None,
+                date_fin: Optional[str] = None) -> Tuple[date, date]:
+    """
+    bornes_demandees() depuis les paramètres de la vue (texte) et de la commande exporter_fec.
+    Un paramètre invalide ou une date seule lève ValueError (message affichable) au lieu de
+    retomber sur l'exercice en cours : le fichier remis ne doit pas couvrir une autre période.
+    """
+    if exercice:
+        if not str(exercice).isdigit() or not 1900 <= int(exercice) <= 9998:
+            raise ValueError(f"Exercice invalide : « {exercice} » (année sur 4 chiffres attendue).")
+        exercice = int(exercice)
+    if bool(date_debut) != bool(date_fin):
+        raise ValueError("Indiquez à la fois la date de début et la date de fin, ou aucune des deux.")
+    if date_debut:
+        return bornes_demandees(dossier, None, _lire_date(date_debut, 'date_debut'), _lire_date(date_fin, 'date_fin'))
+    return bornes_demandees(dossier, exercice or None)
@@ -0,0 +1,195 @@
+"""
+Grand livre - Lignes par compte avec solde progressif calculé en SQL, pagination par curseur
+
+Les lignes sont parcourues compte par compte (numéro croissant), puis dans l'ordre (date, pièce,
+ordre, id). Le solde progressif est une fonction de fenêtre SUM(debit - credit) OVER (ORDER BY ...
+ROWS UNBOUNDED PRECEDING) évaluée par la base : aucune ligne n'est cumulée en Python.
+
+Chaque requête porte sur un seul compte (index ligne_compte_ecriture_idx) et s'arrête à la taille
+de la page. Le curseur (signé) encode la clé de la dernière ligne renvoyée et le solde atteint sur
+son compte : la page suivante repart de cette clé et ajoute ce report au cumul de la fenêtre ; les
+comptes qui commencent dans la page reçoivent leur solde d'ouverture par une requête groupée limitée
+à ces comptes. Le coût d'une page dépend des comptes qu'elle affiche, pas de sa profondeur.
+"""
+from datetime import date
+from decimal import Decimal
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from django.core import signing
+from django.db.models import Exists, F, OuterRef, Q, Sum, Window
+from django.db.models.expressions import RowRange
+from django.utils.dateparse import parse_date
+
+from comptabilite.models import CompteComptablePME, LigneEcriture
+from comptabilite.utils import balance_generale
+
+TAILLE_PAGE_DEFAUT = 100
+TAILLE_PAGE_MAX = 1000
+TAILLE_LOT_COMPTES = 50
+ZERO = Decimal('0.00')
+SEL_CURSEUR = 'comptabilite.grand_livre'
+
+ORDRE_COMPTE = ('ecriture__date_ecriture', 'ecriture_id', 'ordre', 'id')
+CHAMPS = (
+    'id', 'ordre', 'ecriture_id', 'compte_general_id', 'compte_general__numero_compte', 'compte_general__intitule_compte',
+    'ecriture__date_ecriture', 'ecriture__numero_piece', 'ecriture__journal__code_journal',
+    'tiers_ligne__code_tiers', 'libelle_ligne', 'lettrage_code', 'date_echeance_ligne', 'debit', 'credit', 'cumul',
+)
+
+# (numéro de compte, date, pièce, ordre, id) de la dernière ligne, solde atteint sur son compte
+Curseur = Tuple[str, date, int, int, int, Decimal]
+
+
+class CurseurInvalide(ValueError):
+    pass
+
+
+def encoder_curseur(ligne: dict) -> str:
+    return signing.dumps([
+        ligne['compte'], ligne['date'].isoformat(), ligne['ecriture_id'], ligne['ordre'], ligne['id'], str(ligne['solde']),
+    ], salt=SEL_CURSEUR, compress=True)
+
+
+def decoder_curseur(curseur: str) -> Curseur:
+    try:
+        numero, date_iso, ecriture_id, ordre, pk, solde = signing.loads(curseur, salt=SEL_CURSEUR)
+        jour = parse_date(date_iso)
+        if jour is None:
+            raise ValueError
+        return numero, jour, int(ecriture_id), int(ordre), int(pk), Decimal(solde)
+    except (signing.BadSignature, ValueError, TypeError, ArithmeticError):
+        raise CurseurInvalide("Curseur de pagination invalide.")
+
+
+def filtrer_lignes(dossier, compte_debut: Optional[str] = None, compte_fin: Optional[str] = None,
+                   journal: Optional[str] = None, tiers: Optional[str] = None):
+    """
+    Lignes du dossier selon les filtres du grand livre, sans critère de date. La borne de fin
+    de la plage de comptes inclut ses sous-comptes ('401' -> '401999').
+    """
+    lignes = LigneEcriture.objects.filter(ecriture__dossier_pme=dossier)
+    if compte_debut:
+        lignes = lignes.filter(compte_general__numero_compte__gte=compte_debut)
+    if compte_fin:
+        lignes = lignes.filter(Q(compte_general__numero_compte__lte=compte_fin) | Q(compte_general__numero_compte__startswith=compte_fin))
+    if journal:
+        lignes = lignes.filter(ecriture__journal__code_journal__iexact=journal)
+    if tiers:
+        lignes = lignes.filter(tiers_ligne__code_tiers__iexact=tiers)
+    return lignes
+
+
+def soldes_ouverture(dossier, lignes, date_debut: date, compte_pks, soldes_figes: bool = True) -> Dict[int, Decimal]:
+    """
+    Solde avant `date_debut` des comptes donnés, pour les lignes filtrées (une requête groupée).
+    soldes_figes=False lorsque les lignes sont filtrées par journal ou tiers (voir balance_generale.report).
+    """
+    if not compte_pks:
+        return {}
+    filtre, depart = balance_generale.report(dossier, date_debut, soldes_figes)
+    soldes = {pk: depart[pk] for pk in compte_pks if pk in depart}
+    for pk, solde in lignes.filter(
+        filtre,
+        ecriture__date_ecriture__lt=date_debut,
+        compte_general_id__in=compte_pks,
+    ).values('compte_general_id').annotate(
+        solde=Sum(F('debit') - F('credit')),
+    ).order_by().values_list('compte_general_id', 'solde'):
+        soldes[pk] = soldes.get(pk, ZERO) + (solde or ZERO)
+    return {pk: solde.quantize(ZERO) for pk, solde in soldes.items()}
+
+
+def _comptes_a_parcourir(dossier, lignes, numero_depart: Optional[str]) -> Iterator[Tuple[int, str]]:
+    """
+    Comptes portant des lignes sélectionnées, par numéro croissant à partir de `numero_depart` (par lots).
+    Le test d'existence ignore la période : il reste une simple recherche dans l'index du compte.
+    """
+    comptes = CompteComptablePME.objects.filter(
+        Exists(lignes.filter(compte_general=OuterRef('pk'))), dossier_pme=dossier,
+    ).order_by('numero_compte').values_list('pk', 'numero_compte')
+    if numero_depart is not None:
+        comptes = comptes.filter(numero_compte__gte=numero_depart)
+    while True:
+        lot = list(comptes[:TAILLE_LOT_COMPTES])
+        yield from lot
+        if len(lot) < TAILLE_LOT_COMPTES:
+            return
+        comptes = comptes.filter(numero_compte__gt=lot[-1][1])
+
+
+def _lignes_compte(lignes, compte_pk: int, date_debut: date, date_fin: date, cle: Optional[Curseur]):
+    """Lignes d'un compte sur la période, après la clé éventuelle, avec leur cumul depuis le début de la sélection."""
+    lignes = lignes.filter(compte_general_id=compte_pk, ecriture__date_ecriture__range=(date_debut, date_fin))
+    if cle:
+        __, jour, ecriture_id, ordre, pk, __ = cle
+        lignes = lignes.filter(
+            Q(ecriture__date_ecriture__gt=jour)
+            | Q(ecriture__date_ecriture=jour, ecriture_id__gt=ecriture_id)
+            | Q(ecriture__date_ecriture=jour, ecriture_id=ecriture_id, ordre__gt=ordre)
+            | Q(ecriture__date_ecriture=jour, ecriture_id=ecriture_id, ordre=ordre, pk__gt=pk)
+        )
+    return lignes.annotate(
+        cumul=Window(
+            Sum(F('debit') - F('credit')),
+            order_by=[F(champ).asc() for champ in ORDRE_COMPTE],
+            frame=RowRange(start=None, end=0),
+        ),
+    ).order_by(*ORDRE_COMPTE).values_list(*CHAMPS)
+
+
+def page_grand_livre(dossier, lignes, date_debut: date, date_fin: date, curseur: Optional[str] = None,
+                     taille: int = TAILLE_PAGE_DEFAUT, soldes_figes: bool = True) -> Tuple[List[dict], Dict[str, Decimal], Optional[str]]:
+    """
+    Une page du grand livre : lignes avec solde progressif, solde reporté en tête de page pour
+    chaque compte de la page, et curseur de la page suivante (None en fin de parcours).
+    """
+    taille = max(1, min(taille, TAILLE_PAGE_MAX))
+    cle = decoder_curseur(curseur) if curseur else None
+    resultats, reports, suivant = [], {}, False
+    for compte_pk, numero in _comptes_a_parcourir(dossier, lignes, cle[0] if cle else None):
+        reprise = cle if cle and numero == cle[0] else None
+        reste = taille - len(resultats)
+        lot = list(_lignes_compte(lignes, compte_pk, date_debut, date_fin, reprise)[:reste + 1])
+        if lot and reprise:
+            reports[compte_pk] = reprise[5]
+        resultats.extend(lot[:reste])
+        if len(lot) > reste:
+            suivant = True
+            break
+
+    a_ouvrir = {valeurs[3] for valeurs in resultats} - set(reports)
+    ouvertures = soldes_ouverture(dossier, lignes, date_debut, a_ouvrir, soldes_figes)
+    reports.update({pk: ouvertures.get(pk, ZERO) for pk in a_ouvrir})
+
+    sortie, reports_par_numero = [], {}
+    for (pk, ordre, ecriture_id, compte_pk, numero, intitule, jour, piece, journal, tiers,
+         libelle, lettrage, echeance, debit, credit, cumul) in resultats:
+        reports_par_numero.setdefault(numero, reports[compte_pk])
+        sortie.append({
+            'id': pk, 'ordre': ordre, 'ecriture_id': ecriture_id,
+            'compte': numero, 'intitule_compte': intitule, 'date': jour, 'piece': piece, 'journal': journal,
+            'tiers': tiers or '', 'libelle': libelle, 'lettrage': lettrage or '', 'echeance': echeance,
+            'debit': debit, 'credit': credit,
+            'solde': (reports[compte_pk] + cumul).quantize(ZERO),
+        })
+    return sortie, reports_par_numero, (encoder_curseur(sortie[-1]) if suivant else None)
+
+
+def iterer_grand_livre(dossier, lignes, date_debut: date, date_fin: date, curseur: Optional[str] = None,
+                       taille_page: int = TAILLE_PAGE_MAX, soldes_figes: bool = True) -> Iterator[dict]:
+    """Toutes les lignes à partir du curseur, page par page."""
+    while True:
+        page, __, suivant = page_grand_livre(dossier, lignes, date_debut, date_fin, curseur, taille_page, soldes_figes)
+        yield from page
+        if suivant is None:
+            return
+        curseur = suivant
+
+
+def ligne_vers_dict(ligne: dict) -> dict:
+    return {
+        **ligne,
+        'date': ligne['date'].isoformat(),
+        'echeance': ligne['echeance'].isoformat() if ligne['echeance'] else None,
+        'debit': str(ligne['debit']), 'credit': str(ligne['credit']), 'solde': str(ligne['solde']),
+    }
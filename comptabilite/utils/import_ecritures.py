@@ -0,0 +1,512 @@
+"""
+Import d'écritures - Pipeline en flux pour fichiers CSV et exports Sage 100
+
+Le fichier est lu ligne à ligne par une chaîne de générateurs, sans jamais être chargé en mémoire :
+    lire_lignes -> convertir_lignes -> grouper_pieces -> importer (lots)
+- les montants suivent SageGridHandler.parse_monetary_value ('1 234,56'), les dates les formats de la grille ;
+- comptes, tiers et journaux sont résolus dans des dictionnaires chargés une fois (trois requêtes) ;
+- une ligne datée dans une période clôturée (utils/clotures.py, verrou lu une fois) rend sa pièce
+  invalide : elle est rejetée comme les autres au lieu de faire échouer tout le lot au signal ;
+- les pièces sont comptabilisées par lots dans une transaction chacun : bulk_create des pièces (totaux,
+  clé de séquence et numéros déjà calculés) puis des lignes, les soldes par période suivant le signal
+  lignes_ecriture_creees_en_masse ;
+- les numéros de pièce fournis sont contrôlés par lot contre le journal (une requête par journal du
+  lot, comme SageGridHandler.validate_batch) et entre pièces du lot : un numéro déjà utilisé rend la
+  pièce invalide ;
+- ImportEcritures mémorise la dernière ligne source traitée (comptabilisée ou rejetée) avec les rejets,
+  dans la transaction du lot : après un échec, l'import reprend au lot suivant sans rejeter deux fois
+  la même pièce.
+
+Colonnes CSV (en-tête obligatoire, séparateur ; , ou tabulation) :
+    journal, date, piece, compte, tiers, libelle, debit, credit, echeance, reference, facture
+Export Sage 100 (texte tabulé sans en-tête, colonnes dans l'ordre de COLONNES_SAGE) :
+    journal, date (JJMMAA ou JJ/MM/AAAA), compte général, compte tiers, n° pièce, référence,
+    libellé, échéance, sens (D/C), montant
+"""
+import csv
+import hashlib
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.db import transaction
+from django.utils.dateparse import parse_date
+
+from comptabilite.models import (
+    CompteComptablePME, EcritureComptable, ImportEcritures, JournalComptable, LigneEcriture, Tiers,
+)
+from comptabilite.utils import clotures, sequences_pieces, texte
+from comptabilite.utils.sage_grid_handler import SageGridHandler, existing_piece_numbers
+
+TAILLE_LOT = 5000  # lignes d'écriture par transaction
+NOMBRE_MAX_REJETS = 1000
+ZERO = Decimal('0.00')
+SEUIL_DESEQUILIBRE = Decimal('0.001')
+TYPES_COMPTES_TIERS = ('TIERS_CLIENT', 'TIERS_FOURNISSEUR', 'TIERS_SALARIE')
+
+COLONNES = ('journal', 'date', 'piece', 'compte', 'tiers', 'libelle', 'debit', 'credit', 'echeance', 'reference', 'facture')
+COLONNES_SAGE = ('journal', 'date', 'compte', 'tiers', 'piece', 'reference', 'libelle', 'echeance', 'sens', 'montant')
+ALIAS_COLONNES = {
+    'code_journal': 'journal', 'date_ecriture': 'date', 'jour': 'date',
+    'numero_piece': 'piece', 'n_piece': 'piece', 'no_piece': 'piece',
+    'compte_general': 'compte', 'numero_compte': 'compte', 'n_compte': 'compte',
+    'code_tiers': 'tiers', 'compte_tiers': 'tiers',
+    'libelle_ligne': 'libelle', 'libelle_ecriture': 'libelle',
+    'date_echeance': 'echeance', 'numero_facture': 'facture', 'n_facture': 'facture',
+}
+
+
+class ErreurImport(Exception):
+    """Erreur bloquante : le fichier ne peut pas être importé au-delà de `numero_ligne`."""
+
+    def __init__(self, message: str, numero_ligne: Optional[int] = None):
+        super().__init__(message)
+        self.numero_ligne = numero_ligne
+
+
+@dataclass
+class LigneImportee:
+    numero: int  # ligne du fichier source (1 = première ligne)
+    journal: Optional[JournalComptable] = None
+    date_ecriture: Optional[date] = None
+    piece: str = ''
+    compte_id: Optional[int] = None
+    tiers_id: Optional[int] = None
+    libelle: str = ''
+    debit: Decimal = ZERO
+    credit: Decimal = ZERO
+    echeance: Optional[date] = None
+    reference: str = ''
+    facture: str = ''
+    erreurs: List[str] = field(default_factory=list)
+
+
+@dataclass
+class PieceImportee:
+    lignes: List[LigneImportee]
+    erreurs: List[str] = field(default_factory=list)
+
+    @property
+    def premiere(self) -> LigneImportee:
+        return self.lignes[0]
+
+    @property
+    def derniere_ligne(self) -> int:
+        return self.lignes[-1].numero
+
+    @property
+    def total_debit(self) -> Decimal:
+        return sum((ligne.debit for ligne in self.lignes), ZERO)
+
+    @property
+    def total_credit(self) -> Decimal:
+        return sum((ligne.credit for ligne in self.lignes), ZERO)
+
+    def toutes_erreurs(self) -> List[str]:
+        return self.erreurs + [f"Ligne {l.numero} : {e}" for l in self.lignes for e in l.erreurs]
+
+
+def empreinte_fichier(fichier) -> str:
+    """SHA-256 d'un fichier binaire ouvert (relu en blocs, puis rembobiné)."""
+    sha = hashlib.sha256()
+    for bloc in iter(lambda: fichier.read(1 << 20), b''):
+        sha.update(bloc)
+    fichier.seek(0)
+    return sha.hexdigest()
+
+
+# --- Lecture -----------------------------------------------------------------------------------
+
+class PointVirgule(csv.excel):
+    delimiter = ';'
+
+
+def _nom_colonne(entete: str) -> str:
+    nom = '_'.join(texte.mots(entete))
+    return ALIAS_COLONNES.get(nom, nom)
+
+
+def lire_csv(flux) -> Iterator[Tuple[int, Dict[str, str]]]:
+    """(numéro de ligne, valeurs par colonne normalisée) pour chaque ligne de données du CSV."""
+    echantillon = flux.read(8192)
+    flux.seek(0)
+    try:
+        dialecte = csv.Sniffer().sniff(echantillon, delimiters=';,\t')
+    except csv.Error:
+        dialecte = PointVirgule
+    lecteur = csv.reader(flux, dialecte)
+    entetes = [_nom_colonne(entete) for entete in next(lecteur, [])]
+    if 'compte' not in entetes:
+        raise ErreurImport("En-tête CSV sans colonne 'compte'.")
+    for valeurs in lecteur:
+        if any(v.strip() for v in valeurs):
+            yield lecteur.line_num, dict(zip(entetes, valeurs))
+
+
+def lire_sage(flux) -> Iterator[Tuple[int, Dict[str, str]]]:
+    """Lignes d'un export Sage 100 tabulé, ramenées aux colonnes du format CSV."""
+    for numero, ligne in enumerate(flux, start=1):
+        if not ligne.strip():
+            continue
+        valeurs = dict(zip(COLONNES_SAGE, ligne.rstrip('\r\n').split('\t')))
+        sens = valeurs.pop('sens', '').strip().upper()
+        montant = valeurs.pop('montant', '')
+        valeurs['debit'] = montant if sens == 'D' else ''
+        valeurs['credit'] = montant if sens == 'C' else ''
+        if sens not in ('D', 'C'):
+            valeurs['_erreur'] = f"Sens '{sens}' invalide (D ou C attendu)"
+        yield numero, valeurs
+
+
+def lire_lignes(flux, format_fichier: str) -> Iterator[Tuple[int, Dict[str, str]]]:
+    return lire_sage(flux) if format_fichier == 'SAGE' else lire_csv(flux)
+
+
+# --- Conversion et regroupement -----------------------------------------------------------------
+
+class Referentiel:
+    """Comptes de détail actifs, tiers actifs, journaux et verrou de clôture du dossier, en quatre requêtes."""
+
+    def __init__(self, dossier):
+        self.comptes: Dict[str, Tuple[int, Optional[str]]] = {
+            numero: (pk, type_compte)
+            for pk, numero, type_compte in CompteComptablePME.objects.filter(
+                dossier_pme=dossier, est_actif=True, nature_compte='DETAIL'
+            ).values_list('pk', 'numero_compte', 'type_compte')
+        }
+        self.tiers: Dict[str, int] = dict(
+            Tiers.objects.filter(dossier_pme=dossier, est_actif=True).values_list('code_tiers', 'pk')
+        )
+        self.journaux: Dict[str, JournalComptable] = {
+            journal.code_journal.upper(): journal
+            for journal in JournalComptable.objects.filter(dossier_pme=dossier).select_related('dossier_pme')
+        }
+        self.verrou: Optional[date] = clotures.date_verrouillage(dossier)
+
+
+def _date(valeur: str) -> Optional[date]:
+    valeur = (valeur or '').strip()
+    if not valeur:
+        return None
+    if len(valeur) == 6 and valeur.isdigit():  # JJMMAA des exports Sage
+        valeur = f"{valeur[:2]}/{valeur[2:4]}/{valeur[4:]}"
+    try:
+        return parse_date(valeur) or SageGridHandler.validate_date(valeur)
+    except ValueError:
+        return None
+
+
+def convertir_lignes(lignes: Iterable[Tuple[int, Dict[str, str]]], referentiel: Referentiel,
+                     journal_defaut: Optional[JournalComptable] = None) -> Iterator[LigneImportee]:
+    """Valeurs brutes -> LigneImportee résolue, avec les mêmes règles que SageGridHandler.process_row."""
+    for numero, valeurs in lignes:
+        ligne = LigneImportee(numero=numero)
+        erreurs = ligne.erreurs
+        if valeurs.get('_erreur'):
+            erreurs.append(valeurs['_erreur'])
+
+        code_journal = (valeurs.get('journal') or '').strip().upper()
+        ligne.journal = referentiel.journaux.get(code_journal) if code_journal else journal_defaut
+        if ligne.journal is None:
+            erreurs.append(f"Journal '{code_journal}' inconnu" if code_journal else "Journal manquant")
+
+        ligne.date_ecriture = _date(valeurs.get('date'))
+        if ligne.date_ecriture is None:
+            erreurs.append(f"Date invalide '{valeurs.get('date', '')}'")
+        elif referentiel.verrou and ligne.date_ecriture <= referentiel.verrou:
+            erreurs.append(f"Période clôturée au {referentiel.verrou:%d/%m/%Y}")
+
+        numero_compte = (valeurs.get('compte') or '').strip()
+        compte = referentiel.comptes.get(numero_compte)
+        if compte is None:
+            erreurs.append(f"Compte invalide '{numero_compte}'")
+        else:
+            ligne.compte_id = compte[0]
+
+        code_tiers = (valeurs.get('tiers') or '').strip().upper()
+        if code_tiers:
+            ligne.tiers_id = referentiel.tiers.get(code_tiers)
+            if ligne.tiers_id is None:
+                erreurs.append(f"Tiers invalide '{code_tiers}'")
+        elif compte is not None and compte[1] in TYPES_COMPTES_TIERS:
+            erreurs.append(f"Code tiers obligatoire pour le compte {numero_compte}")
+
+        for sens in ('debit', 'credit'):
+            montant = SageGridHandler.parse_monetary_value((valeurs.get(sens) or '').strip())
+            if montant is None:
+                erreurs.append(f"Montant {sens} invalide '{valeurs.get(sens)}'")
+            else:
+                setattr(ligne, sens, montant)
+        if ligne.debit > 0 and ligne.credit > 0:
+            erreurs.append("Débit et crédit non nuls simultanément")
+        elif ligne.debit == 0 and ligne.credit == 0:
+            erreurs.append("Montant nul")
+
+        if valeurs.get('echeance', '').strip():
+            ligne.echeance = _date(valeurs['echeance'])
+            if ligne.echeance is None:
+                erreurs.append(f"Échéance invalide '{valeurs['echeance']}'")
+
+        ligne.piece = (valeurs.get('piece') or '').strip()[:50]
+        ligne.libelle = (valeurs.get('libelle') or '').strip()[:255]
+        ligne.reference = (valeurs.get('reference') or '').strip()[:100]
+        ligne.facture = (valeurs.get('facture') or '').strip()[:50]
+        yield ligne
+
+
+def grouper_pieces(lignes: Iterable[LigneImportee]) -> Iterator[PieceImportee]:
+    """
+    Regroupe les lignes consécutives d'une même pièce (journal, date, numéro). Sans numéro de pièce,
+    une pièce se termine dès que ses lignes s'équilibrent.
+    """
+    courante: List[LigneImportee] = []
+    solde = ZERO
+    for ligne in lignes:
+        if courante:
+            premiere = courante[0]
+            meme_piece = (ligne.journal, ligne.date_ecriture, ligne.piece) == (premiere.journal, premiere.date_ecriture, premiere.piece)
+            if not meme_piece or (not ligne.piece and abs(solde) < SEUIL_DESEQUILIBRE):
+                yield _piece(courante)
+                courante, solde = [], ZERO
+        courante.append(ligne)
+        solde += ligne.debit - ligne.credit
+    if courante:
+        yield _piece(courante)
+
+
+def _piece(lignes: List[LigneImportee]) -> PieceImportee:
+    piece = PieceImportee(lignes)
+    ecart = piece.total_debit - piece.total_credit
+    if abs(ecart) >= SEUIL_DESEQUILIBRE:
+        piece.erreurs.append(
+            f"Pièce {piece.premiere.piece or '(sans numéro)'} lignes {piece.premiere.numero}-{piece.derniere_ligne} "
+            f"déséquilibrée : débit {piece.total_debit}, crédit {piece.total_credit}"
+        )
+    return piece
+
+
+# --- Comptabilisation ---------------------------------------------------------------------------
+
+def _numeroter(pieces: List[PieceImportee]) -> List[str]:
+    """Numéros des pièces du lot : fournis (consommés) ou réservés, par journal et exercice."""
+    numeros = [piece.premiere.piece for piece in pieces]
+    groupes = defaultdict(list)
+    for index, piece in enumerate(pieces):
+        journal = piece.premiere.journal
+        cle = (journal.pk, sequences_pieces.exercice_de(journal.dossier_pme, piece.premiere.date_ecriture))
+        groupes[cle].append(index)
+    for indices in groupes.values():
+        premiere = pieces[indices[0]].premiere
+        fournis = [numeros[i] for i in indices if numeros[i]]
+        if fournis:
+            sequences_pieces.consommer_lot(premiere.journal, premiere.date_ecriture, fournis)
+        sans_numero = [i for i in indices if not numeros[i]]
+        if sans_numero:
+            reserves = sequences_pieces.reserver(premiere.journal, premiere.date_ecriture, len(sans_numero))
+            for i, numero in zip(sans_numero, reserves):
+                numeros[i] = numero
+    return numeros
+
+
+def controler_numeros(pieces: List[PieceImportee]) -> None:
+    """
+    Ajoute une erreur aux pièces du lot dont le numéro fourni existe déjà dans le journal ou est
+    repris par une pièce précédente du lot (une requête par journal du lot).
+    """
+    numeros_par_journal = defaultdict(set)
+    for piece in pieces:
+        if piece.premiere.piece:
+            numeros_par_journal[piece.premiere.journal].add(piece.premiere.piece)
+    existants = {
+        journal.pk: existing_piece_numbers(journal, numeros) for journal, numeros in numeros_par_journal.items()
+    }
+    vus = set()
+    for piece in pieces:
+        journal, numero = piece.premiere.journal, piece.premiere.piece
+        if not numero:
+            continue
+        if numero in existants[journal.pk]:
+            piece.erreurs.append(f"Numéro de pièce '{numero}' déjà utilisé dans le journal {journal.code_journal}")
+        elif (journal.pk, numero) in vus:
+            piece.erreurs.append(f"Numéro de pièce '{numero}' en double dans le fichier (journal {journal.code_journal})")
+        vus.add((journal.pk, numero))
+
+
+@transaction.atomic
+def comptabiliser_lot(dossier, pieces: List[PieceImportee], job: ImportEcritures,
+                      rejetees: Iterable[PieceImportee] = ()) -> None:
+    """
+    Crée les pièces et lignes du lot, enregistre les pièces rejetées depuis le lot précédent et fait
+    avancer le point de reprise, dans une même transaction.
+    """
+    rejetees = list(rejetees)
+    if not pieces and not rejetees:
+        return
+    lignes = []
+    if pieces:
+        numeros = _numeroter(pieces)
+        ecritures = []
+        for piece, numero in zip(pieces, numeros):
+            premiere = piece.premiere
+            total_debit, total_credit = piece.total_debit, piece.total_credit
+            ecritures.append(EcritureComptable(
+                dossier_pme=dossier,
+                journal=premiere.journal,
+                date_ecriture=premiere.date_ecriture,
+                numero_piece=numero,
+                # bulk_create n'appelle pas save() : clé de séquence et totaux calculés ici
+                cle_sequence=texte.cle_sequence(numero)[:120],
+                libelle_piece=premiere.libelle or numero,
+                reference_piece=premiere.reference or None,
+                numero_facture_liee=premiere.facture or None,
+                total_debit=total_debit,
+                total_credit=total_credit,
+                nombre_lignes=len(piece.lignes),
+                est_desequilibree=abs(total_debit - total_credit) >= SEUIL_DESEQUILIBRE,
+            ))
+        ecritures = EcritureComptable.objects.bulk_create(ecritures)
+
+        lignes = [
+            LigneEcriture(
+                ecriture=ecriture,
+                compte_general_id=ligne.compte_id,
+                tiers_ligne_id=ligne.tiers_id,
+                libelle_ligne=ligne.libelle or ecriture.libelle_piece,
+                date_echeance_ligne=ligne.echeance,
+                jour=ligne.date_ecriture.day,
+                numero_facture=ligne.facture or None,
+                reference=ligne.reference or None,
+                debit=ligne.debit,
+                credit=ligne.credit,
+                ordre=ordre,
+            )
+            for piece, ecriture in zip(pieces, ecritures)
+            for ordre, ligne in enumerate(piece.lignes)
+        ]
+        LigneEcriture.objects.bulk_create(lignes, batch_size=2000, maj_totaux_pieces=False)
+
+    for piece in rejetees:
+        _rejeter(job, piece)
+    job.lignes_traitees = max(piece.derniere_ligne for piece in pieces + rejetees)
+    job.lignes_importees += len(lignes)
+    job.pieces_importees += len(pieces)
+    job.save()
+
+
+def _rejeter(job: ImportEcritures, piece: PieceImportee) -> None:
+    job.pieces_rejetees += 1
+    if len(job.rejets) < NOMBRE_MAX_REJETS:
+        job.rejets.append({'lignes': [piece.premiere.numero, piece.derniere_ligne], 'erreurs': piece.toutes_erreurs()})
+
+
+def importer(flux, job: ImportEcritures, taille_lot: int = TAILLE_LOT, ignorer_erreurs: bool = False,
+             progression: Optional[Callable[[ImportEcritures], None]] = None) -> ImportEcritures:
+    """
+    Importe le flux texte dans le dossier du job, en reprenant après job.lignes_traitees.
+
+    Une pièce invalide arrête l'import (ErreurImport) après comptabilisation des pièces valides qui la
+    précèdent ; avec ignorer_erreurs, elle est rejetée (job.rejets) et l'import continue. Toute autre
+    erreur (encodage du fichier compris) arrête aussi l'import par une ErreurImport.
+    """
+    dossier = job.dossier_pme
+    debut = time.perf_counter() - job.duree_secondes
+    reprise = job.lignes_traitees
+    job.statut, job.message_erreur = 'EN_COURS', ''
+    job.save(update_fields=['statut', 'message_erreur', 'date_mise_a_jour'])
+
+    lignes_source = ((n, v) for n, v in lire_lignes(flux, job.format_fichier) if n > reprise)
+    referentiel = Referentiel(dossier)
+    lot: List[PieceImportee] = []
+    rejetees: List[PieceImportee] = []  # enregistrées avec le lot suivant (même point de reprise)
+    lignes_lot = 0
+
+    def erreur_piece(piece: PieceImportee, erreurs: List[str]) -> ErreurImport:
+        return ErreurImport(
+            f"Pièce invalide à partir de la ligne {piece.premiere.numero} : {'; '.join(erreurs[:10])}",
+            piece.premiere.numero,
+        )
+
+    def comptabiliser():
+        nonlocal lot, rejetees, lignes_lot
+        if not lot and not rejetees:
+            return
+        controler_numeros(lot)
+        invalides = [index for index, piece in enumerate(lot) if piece.erreurs]
+        if invalides and not ignorer_erreurs:
+            # Pièces valides qui précèdent la première pièce invalide, puis arrêt sur celle-ci
+            comptabiliser_lot(dossier, lot[:invalides[0]], job, rejetees)
+            raise erreur_piece(lot[invalides[0]], lot[invalides[0]].toutes_erreurs())
+        comptabiliser_lot(dossier, [piece for piece in lot if not piece.erreurs], job,
+                          rejetees + [lot[index] for index in invalides])
+        lot, rejetees, lignes_lot = [], [], 0
+        job.duree_secondes = time.perf_counter() - debut
+        if progression:
+            progression(job)
+
+    try:
+        for piece in grouper_pieces(convertir_lignes(lignes_source, referentiel, job.journal_defaut)):
+            erreurs = piece.toutes_erreurs()
+            if erreurs and not ignorer_erreurs:
+                comptabiliser()
+                raise erreur_piece(piece, erreurs)
+            if erreurs:
+                rejetees.append(piece)
+            else:
+                lot.append(piece)
+            lignes_lot += len(piece.lignes)
+            if lignes_lot >= taille_lot:
+                comptabiliser()
+        comptabiliser()
+    except Exception as e:
+        if isinstance(e, ErreurImport):
+            erreur = e
+        elif isinstance(e, UnicodeDecodeError):
+            erreur = ErreurImport(
+                f"Encodage du fichier incorrect après la ligne {job.lignes_traitees} : essayez « Windows (ANSI) » (cp1252).",
+                job.lignes_traitees + 1,
+            )
+        else:
+            erreur = ErreurImport(f"Import interrompu après la ligne {job.lignes_traitees} : {e}")
+        job.statut = 'ECHEC'
+        job.message_erreur = str(erreur)
+        job.duree_secondes = time.perf_counter() - debut
+        job.save()
+        if erreur is e:
+            raise
+        raise erreur from e
+
+    job.statut = 'TERMINE'
+    job.duree_secondes = time.perf_counter() - debut
+    job.save()
+    return job
+
+
+def preparer_job(dossier, fichier_binaire, nom_fichier: str, format_fichier: str = 'CSV',
+                 journal_defaut: Optional[JournalComptable] = None, utilisateur=None,
+                 reprendre: Optional[int] = None, recommencer: bool = False) -> ImportEcritures:
+    """
+    Job d'import du fichier : le job inachevé du même fichier (même empreinte) est repris
+    automatiquement, ou le job `reprendre` explicitement (fichier corrigé après un échec).
+    Lève ErreurImport si le fichier a déjà été importé, sauf avec `recommencer`.
+    """
+    empreinte = empreinte_fichier(fichier_binaire)
+    jobs = ImportEcritures.objects.filter(dossier_pme=dossier)
+    if reprendre:
+        job = jobs.filter(pk=reprendre).exclude(statut='TERMINE').first()
+        if job is None:
+            raise ErreurImport(f"Aucun import inachevé n°{reprendre} pour ce dossier.")
+        job.empreinte = empreinte
+        return job
+    if not recommencer:
+        precedent = jobs.filter(empreinte=empreinte).first()
+        if precedent is not None and precedent.statut == 'TERMINE':
+            raise ErreurImport(f"Fichier déjà importé (import n°{precedent.pk}).")
+        if precedent is not None:
+            return precedent
+    return ImportEcritures.objects.create(
+        dossier_pme=dossier, journal_defaut=journal_defaut, nom_fichier=nom_fichier[:255], empreinte=empreinte,
+        format_fichier=format_fichier, utilisateur=utilisateur,
+    )
@@ -0,0 +1,201 @@
+"""
+Index de recherche des comptes - Autocomplétion de la saisie (grille Sage, saisie interactive)
+
+Chaque processus garde, par dossier, un index en mémoire des comptes PME actifs :
+- un trie des numéros de compte (recherche par préfixe numérique) ;
+- les mots des intitulés, sans accents ni casse, triés pour une recherche par préfixe de mot.
+
+L'index d'un dossier est versionné via cache_versions et invalidé à chaque modification
+d'un CompteComptablePME du dossier (signaux) ou après un clonage du plan.
+"""
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from comptabilite.models import CompteComptablePME
+from comptabilite.utils import cache_versions
+from comptabilite.utils.texte import mots
+
+CLE_VERSION = 'index_comptes'
+NOMBRE_MAX_DOSSIERS = 64
+
+TYPES_COMPTES_TRESORERIE = ('TRESORERIE_ACTIF', 'TRESORERIE_PASSIF')
+
+# Comptes proposés selon le type du journal de saisie
+PREFIXES_PAR_TYPE_JOURNAL = {
+    'AC': ('401', '60', '44566'),  # fournisseurs et charges
+    'VE': ('411', '70', '44571'),  # clients et produits
+}
+TYPES_EXCLUS_PAR_TYPE_JOURNAL = {
+    'BQ': TYPES_COMPTES_TRESORERIE,  # banque : tous les comptes sauf trésorerie
+    'CA': TYPES_COMPTES_TRESORERIE,  # caisse : idem
+}
+
+@dataclass(frozen=True)
+class CompteIndexe:
+    pk: int
+    numero_compte: str
+    intitule_compte: str
+    type_compte: Optional[str]
+    nature_compte: str
+    est_lettrable: bool
+
+    def get_type_compte_display(self) -> str:
+        return str(dict(CompteComptablePME.TYPE_COMPTE_CHOICES).get(self.type_compte, self.type_compte or ''))
+
+
+class _NoeudTrie:
+    __slots__ = ('enfants', 'comptes')
+
+    def __init__(self):
+        self.enfants: Dict[str, '_NoeudTrie'] = {}
+        self.comptes: List[int] = []  # rangs (dans l'index trié) des comptes du sous-arbre
+
+
+class IndexComptes:
+    """Index en lecture seule des comptes actifs d'un dossier."""
+
+    def __init__(self, comptes: Iterable[CompteIndexe], version: str):
+        self.version = version
+        self.comptes: Tuple[CompteIndexe, ...] = tuple(sorted(comptes, key=lambda c: c.numero_compte))
+
+        # Les rangs sont insérés dans l'ordre des numéros : chaque liste de nœud reste triée
+        self._racine = _NoeudTrie()
+        for rang, compte in enumerate(self.comptes):
+            noeud = self._racine
+            noeud.comptes.append(rang)
+            for caractere in compte.numero_compte:
+                noeud = noeud.enfants.setdefault(caractere, _NoeudTrie())
+                noeud.comptes.append(rang)
+
+        mots_indexes = sorted(
+            (mot, rang)
+            for rang, compte in enumerate(self.comptes)
+            for mot in set(mots(compte.intitule_compte))
+        )
+        self._mots = tuple(mot for mot, __ in mots_indexes)
+        self._rangs_mots = tuple(rang for __, rang in mots_indexes)
+
+    def __len__(self):
+        return len(self.comptes)
+
+    def _par_numero(self, prefixe: str) -> List[int]:
+        noeud = self._racine
+        for caractere in prefixe:
+            noeud = noeud.enfants.get(caractere)
+            if noeud is None:
+                return []
+        return noeud.comptes
+
+    def _par_mot(self, prefixe: str) -> set:
+        debut = bisect_left(self._mots, prefixe)
+        fin = bisect_left(self._mots, prefixe + '￿', debut)
+        return set(self._rangs_mots[debut:fin])
+
+    def _rangs_candidats(self, journal_type: str) -> Iterable[int]:
+        prefixes = PREFIXES_PAR_TYPE_JOURNAL.get(journal_type)
+        if prefixes is None:
+            return range(len(self.comptes))
+        return sorted({rang for prefixe in prefixes for rang in self._par_numero(prefixe)})
+
+    def rechercher(self, query: str = '', journal_type: str = '', detail_seulement: bool = False,
+                   limite: Optional[int] = 50) -> List[CompteIndexe]:
+        """
+        Comptes dont le numéro commence par la requête, ou dont l'intitulé contient un mot
+        commençant par chaque terme de la requête. Résultats triés par numéro de compte.
+        """
+        query = (query or '').strip()
+        termes = mots(query)
+        if not termes:
+            rangs = self._rangs_candidats(journal_type)
+        else:
+            rangs = set(self._par_numero(query))
+            correspondances_mots = self._par_mot(termes[0])
+            for terme in termes[1:]:
+                correspondances_mots &= self._par_mot(terme)
+            rangs |= correspondances_mots
+            if journal_type in PREFIXES_PAR_TYPE_JOURNAL:
+                rangs &= set(self._rangs_candidats(journal_type))
+            rangs = sorted(rangs)
+
+        types_exclus = TYPES_EXCLUS_PAR_TYPE_JOURNAL.get(journal_type, ())
+        resultats = []
+        for rang in rangs:
+            compte = self.comptes[rang]
+            if detail_seulement and compte.nature_compte != 'DETAIL':
+                continue
+            if compte.type_compte in types_exclus:
+                continue
+            resultats.append(compte)
+            if limite is not None and len(resultats) >= limite:
+                break
+        return resultats
+
+
+_index: 'OrderedDict[int, IndexComptes]' = OrderedDict()
+_verrou = threading.Lock()
+
+
+def _comptes_actifs(dossier_pk: int):
+    return CompteComptablePME.objects.filter(dossier_pme_id=dossier_pk, est_actif=True).values(
+        'pk', 'numero_compte', 'intitule_compte', 'type_compte', 'nature_compte', 'est_lettrable',
+    )
+
+
+def _index_a_jour(dossier_pk: int, version: str) -> Optional[IndexComptes]:
+    with _verrou:
+        index = _index.get(dossier_pk)
+        if index is not None and index.version == version:
+            _index.move_to_end(dossier_pk)
+            return index
+    return None
+
+
+def _memoriser(dossier_pk: int, index: IndexComptes) -> IndexComptes:
+    with _verrou:
+        _index[dossier_pk] = index
+        _index.move_to_end(dossier_pk)
+        while len(_index) > NOMBRE_MAX_DOSSIERS:
+            _index.popitem(last=False)
+    return index
+
+
+def get_index_comptes(dossier_pk: int) -> IndexComptes:
+    """Index du dossier (reconstruit en une requête si sa version a changé)."""
+    version = cache_versions.version_courante(CLE_VERSION, dossier_pk)
+    index = _index_a_jour(dossier_pk, version)
+    if index is None:
+        index = _memoriser(dossier_pk, IndexComptes(
+            (CompteIndexe(**valeurs) for valeurs in _comptes_actifs(dossier_pk)), version
+        ))
+    return index
+
+
+async def aget_index_comptes(dossier_pk: int) -> IndexComptes:
+    """Variante asynchrone de get_index_comptes (ORM asynchrone)."""
+    version = await cache_versions.aversion_courante(CLE_VERSION, dossier_pk)
+    index = _index_a_jour(dossier_pk, version)
+    if index is None:
+        index = _memoriser(dossier_pk, IndexComptes(
+            [CompteIndexe(**valeurs) async for valeurs in _comptes_actifs(dossier_pk)], version
+        ))
+    return index
+
+
+def rechercher_comptes(dossier_pk: int, query: str = '', journal_type: str = '', detail_seulement: bool = False,
+                       limite: Optional[int] = 50) -> List[CompteIndexe]:
+    return get_index_comptes(dossier_pk).rechercher(query, journal_type, detail_seulement, limite)
+
+
+async def arechercher_comptes(dossier_pk: int, query: str = '', journal_type: str = '', detail_seulement: bool = False,
+                              limite: Optional[int] = 50) -> List[CompteIndexe]:
+    return (await aget_index_comptes(dossier_pk)).rechercher(query, journal_type, detail_seulement, limite)
+
+
+def invalider_index_comptes(dossier_pk: int) -> None:
+    """À appeler après toute modification du plan comptable PME du dossier."""
+    cache_versions.invalider(CLE_VERSION, dossier_pk)
+    with _verrou:
+        _index.pop(dossier_pk, None)
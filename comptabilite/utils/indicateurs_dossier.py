@@ -0,0 +1,136 @@
+"""
+Indicateurs des tableaux de bord d'un dossier - Calcul et mise en cache par dossier et par période
+
+Les indicateurs sont regroupés selon les écritures qui peuvent les modifier, chaque groupe étant
+mis en cache (framework de cache Django) sous le jeton de version (cache_versions) de sa portée :
+
+- référentiel (comptes, journaux et tiers actifs) : jeton du dossier, portée 'referentiel' ;
+- activité (trésorerie, dernières pièces, pièces déséquilibrées) : jetons 'referentiel' et 'pieces' ;
+- période (pièces et totaux d'un mois) : jeton (dossier, année, mois) ;
+- exercice (chiffre d'affaires XB, résultat net XI) : jetons annuels de soldes_periodes.
+
+Les signaux de comptabilite/signals.py remplacent, après commit, les jetons des mois touchés par
+une pièce ou une ligne (date précédente comprise en cas de déplacement) et celui du référentiel
+lorsqu'un compte, un journal ou un tiers change. Comme pour les soldes par période, les update()
+en masse ne déclenchent pas de signal : DUREE_CACHE borne alors l'obsolescence. Jetons et valeurs
+vivent dans le cache par défaut, partagé entre processus (settings.CACHES) : une pièce importée ou
+une clôture faite par une commande manage.py rend aussi obsolètes les indicateurs du serveur web.
+"""
+from calendar import monthrange
+from datetime import date
+from decimal import Decimal
+from typing import Callable, Dict, Iterable
+
+from django.core.cache import cache
+from django.db import transaction
+
+from comptabilite.models import CompteComptablePME, EcritureComptable, JournalComptable, Tiers
+from comptabilite.utils import cache_versions, etats_financiers, export_fec, soldes_periodes, totaux_pieces
+
+PREFIXE = 'comptabilite:indicateurs'
+CLE_VERSION = 'indicateurs'
+DUREE_CACHE = 24 * 3600
+NOMBRE_DERNIERES_PIECES = 5
+NOMBRE_PIECES_DESEQUILIBREES = 3  # détaillées dans les alertes du tableau de bord
+
+
+def _version(dossier_pk: int, *portee) -> str:
+    return cache_versions.version_courante(CLE_VERSION, dossier_pk, *portee)
+
+
+def _depuis_cache(cle: str, calcul: Callable[[], dict]) -> dict:
+    valeur = cache.get(cle)
+    if valeur is None:
+        valeur = calcul()
+        cache.set(cle, valeur, DUREE_CACHE)
+    return valeur
+
+
+# --- Invalidation (appelée par les signaux) ---
+
+def invalider_periodes(dossier_pk: int, dates: Iterable[date]) -> None:
+    """Après commit, rend obsolètes l'activité du dossier et les mois des dates données."""
+    periodes = {(jour.year, jour.month) for jour in dates if jour is not None}
+
+    def invalider():
+        cache_versions.invalider(CLE_VERSION, dossier_pk, 'pieces')
+        for annee, mois in periodes:
+            cache_versions.invalider(CLE_VERSION, dossier_pk, annee, mois)
+    transaction.on_commit(invalider)
+
+
+def invalider_referentiel(dossier_pk: int) -> None:
+    """Après commit, rend obsolètes les indicateurs qui dépendent des comptes, journaux ou tiers."""
+    transaction.on_commit(lambda: cache_versions.invalider(CLE_VERSION, dossier_pk, 'referentiel'))
+
+
+# --- Calcul ---
+
+def calculer_referentiel(dossier) -> Dict[str, int]:
+    return {
+        'nombre_comptes_plan': CompteComptablePME.objects.filter(dossier_pme=dossier, est_actif=True).count(),
+        'nombre_journaux_actifs': JournalComptable.objects.filter(dossier_pme=dossier, est_actif=True).count(),
+        'nombre_tiers_actifs': Tiers.objects.filter(dossier_pme=dossier, est_actif=True).count(),
+    }
+
+
+def calculer_activite(dossier) -> dict:
+    desequilibrees = totaux_pieces.pieces_desequilibrees(dossier).select_related('journal')
+    return {
+        'solde_tresorerie': soldes_periodes.solde_tresorerie(dossier),
+        'dernieres_ecritures': list(EcritureComptable.objects.filter(
+            dossier_pme=dossier
+        ).select_related('journal').order_by('-date_ecriture', '-id')[:NOMBRE_DERNIERES_PIECES]),
+        'nombre_pieces_desequilibrees': desequilibrees.count(),
+        'pieces_desequilibrees': list(desequilibrees[:NOMBRE_PIECES_DESEQUILIBREES]),
+    }
+
+
+def calculer_periode(dossier, annee: int, mois: int) -> dict:
+    totaux = soldes_periodes.totaux_periode(dossier, annee, mois)
+    return {
+        'nombre_ecritures_periode': EcritureComptable.objects.filter(
+            dossier_pme=dossier, date_ecriture__range=(date(annee, mois, 1), date(annee, mois, monthrange(annee, mois)[1])),
+        ).count(),
+        'total_debits_periode': totaux['total_debits'],
+        'total_credits_periode': totaux['total_credits'],
+    }
+
+
+def calculer_exercice(dossier, exercice: int) -> Dict[str, Decimal]:
+    etats = etats_financiers.calculer_etats(dossier, exercice)
+    return {'chiffre_affaires': etats.chiffre_affaires, 'resultat_net': etats.resultat_net}
+
+
+# --- Lecture (cache) ---
+
+def indicateurs_referentiel(dossier) -> Dict[str, int]:
+    cle = f"{PREFIXE}:referentiel:{dossier.pk}:{_version(dossier.pk, 'referentiel')}"
+    return _depuis_cache(cle, lambda: calculer_referentiel(dossier))
+
+
+def indicateurs_activite(dossier) -> dict:
+    cle = f"{PREFIXE}:activite:{dossier.pk}:{_version(dossier.pk, 'referentiel')}:{_version(dossier.pk, 'pieces')}"
+    return _depuis_cache(cle, lambda: calculer_activite(dossier))
+
+
+def indicateurs_periode(dossier, annee: int, mois: int) -> dict:
+    cle = f"{PREFIXE}:periode:{dossier.pk}:{annee}:{mois}:{_version(dossier.pk, annee, mois)}"
+    return _depuis_cache(cle, lambda: calculer_periode(dossier, annee, mois))
+
+
+def indicateurs_exercice(dossier, exercice: int) -> Dict[str, Decimal]:
+    """Chiffre d'affaires et résultat net de l'exercice (ne dépendent que des mouvements de l'exercice)."""
+    date_debut, date_fin = export_fec.periode_exercice(dossier, exercice)
+    empreinte = soldes_periodes.empreinte_versions(dossier.pk, date_debut.year, date_fin.year)
+    cle = f"{PREFIXE}:exercice:{dossier.pk}:{exercice}:{date_debut:%m%d}:{empreinte}"
+    return _depuis_cache(cle, lambda: calculer_exercice(dossier, exercice))
+
+
+def indicateurs_tableau_bord(dossier, annee: int, mois: int) -> dict:
+    """Indicateurs du tableau de bord comptable pour le mois donné."""
+    return {
+        **indicateurs_referentiel(dossier),
+        **indicateurs_activite(dossier),
+        **indicateurs_periode(dossier, annee, mois),
+    }
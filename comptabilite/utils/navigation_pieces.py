@@ -0,0 +1,141 @@
+"""
+Navigation dans un journal - Pièce précédente / suivante / première / dernière / n-ième
+
+Les pièces d'un journal sont ordonnées par (cle_sequence, id), où cle_sequence est le numéro de
+pièce normalisé pour un tri naturel (utils/texte.cle_sequence : 'VE9' < 'VE10'). Chaque
+déplacement est une seule requête sur l'index (journal, cle_sequence, id), qui renvoie aussi la
+fenêtre des pièces suivantes dans le sens du déplacement, leurs lignes étant chargées par une
+seconde requête (prefetch) : l'interface peut les afficher sans nouvel aller-retour quand
+l'utilisateur maintient la touche flèche.
+"""
+from typing import List, Optional, Tuple
+
+from django.db.models import Prefetch, Q
+
+from comptabilite.models import EcritureComptable, LigneEcriture
+from comptabilite.utils import recherche_pieces
+from comptabilite.utils.texte import cle_sequence
+
+TAILLE_FENETRE_DEFAUT = 10
+TAILLE_FENETRE_MAX = 100
+
+SENS_VALIDES = ('prev', 'next', 'first', 'last', 'nth')
+
+
+def _pieces(journal):
+    lignes = LigneEcriture.objects.select_related('compte_general', 'tiers_ligne').order_by('ordre', 'id')
+    return EcritureComptable.objects.filter(journal=journal).select_related('journal').prefetch_related(
+        Prefetch('lignes_ecriture', queryset=lignes)
+    )
+
+
+def _bornee(fenetre: int) -> int:
+    return max(0, min(fenetre, TAILLE_FENETRE_MAX))
+
+
+def _depuis(pieces, fenetre) -> Tuple[Optional[EcritureComptable], List[EcritureComptable]]:
+    resultats = list(pieces[:_bornee(fenetre) + 1])
+    return _decouper(resultats)
+
+
+def _decouper(resultats) -> Tuple[Optional[EcritureComptable], List[EcritureComptable]]:
+    if not resultats:
+        return None, []
+    return resultats[0], resultats[1:]
+
+
+def cle_position(numero_piece: str, piece_pk: Optional[int] = None) -> Tuple[str, Optional[int]]:
+    """Position d'une pièce dans le journal, sans la relire : (clé de séquence, id éventuel)."""
+    return cle_sequence(numero_piece)[:120], piece_pk
+
+
+def _suivantes(journal, position):
+    cle, pk = position
+    apres = Q(cle_sequence__gt=cle)
+    if pk is not None:
+        apres |= Q(cle_sequence=cle, pk__gt=pk)
+    return _pieces(journal).filter(apres).order_by('cle_sequence', 'id')
+
+
+def _precedentes(journal, position):
+    cle, pk = position
+    avant = Q(cle_sequence__lt=cle)
+    if pk is not None:
+        avant |= Q(cle_sequence=cle, pk__lt=pk)
+    return _pieces(journal).filter(avant).order_by('-cle_sequence', '-id')
+
+
+def suivante(journal, position, fenetre: int = TAILLE_FENETRE_DEFAUT):
+    """Pièce suivant la position, et jusqu'à `fenetre` pièces au-delà."""
+    return _depuis(_suivantes(journal, position), fenetre)
+
+
+def precedente(journal, position, fenetre: int = TAILLE_FENETRE_DEFAUT):
+    """Pièce précédant la position, et jusqu'à `fenetre` pièces en deçà (de la plus proche à la plus éloignée)."""
+    return _depuis(_precedentes(journal, position), fenetre)
+
+
+def premiere(journal, fenetre: int = TAILLE_FENETRE_DEFAUT):
+    return _depuis(_pieces(journal).order_by('cle_sequence', 'id'), fenetre)
+
+
+def derniere(journal, fenetre: int = TAILLE_FENETRE_DEFAUT):
+    return _depuis(_pieces(journal).order_by('-cle_sequence', '-id'), fenetre)
+
+
+def nieme(journal, rang: int, fenetre: int = TAILLE_FENETRE_DEFAUT):
+    """Pièce de rang `rang` (à partir de 1) dans l'ordre du journal, et les suivantes."""
+    if rang < 1:
+        return None, []
+    pieces = _pieces(journal).order_by('cle_sequence', 'id')
+    return _depuis(pieces[rang - 1:], fenetre)
+
+
+def _requete(journal, sens: str, numero_piece: str, piece_pk: Optional[int], rang: Optional[int]):
+    """Pièces dans l'ordre du déplacement, la cible en tête (None si aucune ne peut exister)."""
+    if sens == 'next':
+        return _suivantes(journal, cle_position(numero_piece, piece_pk))
+    if sens == 'prev':
+        return _precedentes(journal, cle_position(numero_piece, piece_pk))
+    if sens == 'first':
+        return _pieces(journal).order_by('cle_sequence', 'id')
+    if sens == 'last':
+        return _pieces(journal).order_by('-cle_sequence', '-id')
+    if sens == 'nth':
+        if not rang or rang < 1:
+            return None
+        return _pieces(journal).order_by('cle_sequence', 'id')[rang - 1:]
+    raise ValueError(f"Sens de navigation inconnu : {sens}")
+
+
+def naviguer(journal, sens: str, numero_piece: str = '', piece_pk: Optional[int] = None,
+             rang: Optional[int] = None, fenetre: int = TAILLE_FENETRE_DEFAUT):
+    """Point d'entrée unique des déplacements. Lève ValueError pour un sens inconnu."""
+    pieces = _requete(journal, sens, numero_piece, piece_pk, rang)
+    if pieces is None:
+        return None, []
+    return _depuis(pieces, fenetre)
+
+
+async def anaviguer(journal, sens: str, numero_piece: str = '', piece_pk: Optional[int] = None,
+                    rang: Optional[int] = None, fenetre: int = TAILLE_FENETRE_DEFAUT):
+    """Variante asynchrone de naviguer (ORM asynchrone)."""
+    pieces = _requete(journal, sens, numero_piece, piece_pk, rang)
+    if pieces is None:
+        return None, []
+    return _decouper([piece async for piece in pieces[:_bornee(fenetre) + 1]])
+
+
+def piece_vers_dict(piece: EcritureComptable) -> dict:
+    """En-tête de la pièce (recherche_pieces.piece_vers_dict) et ses lignes, telles que la grille les affiche."""
+    return {
+        **recherche_pieces.piece_vers_dict(piece),
+        'lines': [{
+            'compte': ligne.compte_general.numero_compte,
+            'tiers': ligne.tiers_ligne.code_tiers if ligne.tiers_ligne else '',
+            'libelle': ligne.libelle_ligne,
+            'echeance': ligne.date_echeance_ligne.isoformat() if ligne.date_echeance_ligne else '',
+            'debit': str(ligne.debit),
+            'credit': str(ligne.credit),
+        } for ligne in piece.lignes_ecriture.all()],
+    }
@@ -0,0 +1,91 @@
+"""
+Plan comptable - Initialisation du plan PME d'un dossier à partir du plan SYSCOHADA
+
+Le clonage se fait en un nombre borné de requêtes, indépendant de la taille du plan :
+plan de référence servi par l'index en mémoire (plan_reference), insertion en masse,
+puis une seule passe de rattachement des comptes parents.
+"""
+import logging
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from django.db import transaction
+
+from comptabilite.models import CompteComptablePME
+from comptabilite.utils.index_comptes import invalider_index_comptes
+from comptabilite.utils.plan_reference import get_plan_reference
+
+logger = logging.getLogger(__name__)
+
+TAILLE_LOT = 1000
+
+
+@dataclass
+class RapportClonagePlan:
+    """Résultat d'un clonage de plan comptable."""
+    dossier_pk: int
+    comptes_crees: int
+    parents_rattaches: int
+    duree_secondes: float
+
+    def __str__(self):
+        return (f"{self.comptes_crees} comptes créés, {self.parents_rattaches} rattachements parents "
+                f"en {self.duree_secondes * 1000:.0f} ms (dossier {self.dossier_pk})")
+
+
+@transaction.atomic
+def cloner_plan_syscohada(dossier) -> Optional[RapportClonagePlan]:
+    """
+    Copie le plan SYSCOHADA par défaut dans le plan PME du dossier, hiérarchie comprise.
+
+    Retourne None si le dossier possède déjà un plan comptable (rien n'est modifié).
+    """
+    debut = time.perf_counter()
+    if CompteComptablePME.objects.filter(dossier_pme=dossier).exists():
+        return None
+
+    comptes_defaut = get_plan_reference().comptes
+
+    comptes_pme = CompteComptablePME.objects.bulk_create([
+        CompteComptablePME(
+            dossier_pme=dossier,
+            compte_syscohada_ref_id=compte.pk,
+            numero_compte=compte.numero_compte,
+            intitule_compte=compte.intitule_compte,
+            type_compte=compte.type_compte,
+            nature_compte=compte.nature_compte,
+            sens_habituel=compte.sens_habituel,
+            est_lettrable=compte.est_lettrable_par_defaut,
+            est_actif=True,
+        )
+        for compte in comptes_defaut
+    ], batch_size=TAILLE_LOT)
+    comptes_par_numero = {compte.numero_compte: compte for compte in comptes_pme}
+
+    # Backends sans RETURNING sur les insertions en masse : relire les PKs en une requête
+    if any(compte.pk is None for compte in comptes_pme):
+        pks = dict(CompteComptablePME.objects.filter(dossier_pme=dossier).values_list('numero_compte', 'pk'))
+        for numero, compte in comptes_par_numero.items():
+            compte.pk = pks[numero]
+
+    a_rattacher = []
+    for compte in comptes_defaut:
+        parent = comptes_par_numero.get(compte.numero_parent)
+        if parent is not None:
+            enfant = comptes_par_numero[compte.numero_compte]
+            enfant.compte_parent_id = parent.pk
+            a_rattacher.append(enfant)
+    if a_rattacher:
+        CompteComptablePME.objects.bulk_update(a_rattacher, ['compte_parent'], batch_size=TAILLE_LOT)
+    # bulk_create/bulk_update n'émettent pas de signaux
+    transaction.on_commit(lambda: invalider_index_comptes(dossier.pk))
+
+    rapport = RapportClonagePlan(
+        dossier_pk=dossier.pk,
+        comptes_crees=len(comptes_pme),
+        parents_rattaches=len(a_rattacher),
+        duree_secondes=time.perf_counter() - debut,
+    )
+    logger.info("Plan comptable SYSCOHADA cloné : %s", rapport)
+    return rapport
@@ -0,0 +1,120 @@
+"""
+Plan de référence SYSCOHADA - Index immuable partagé par le processus
+
+CompteComptableDefaut est une donnée de référence statique : elle est chargée une fois par
+processus dans un PlanReference (numéro -> compte, arbre des parents, recherche par préfixe)
+et servie à tous les consommateurs (clonage du plan PME, formulaires, vues).
+
+L'index est versionné via cache_versions : charger_plan_comptable_defaut_view et toute
+modification de CompteComptableDefaut l'invalident.
+"""
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Iterable, Optional, Tuple
+
+from comptabilite.models import CompteComptableDefaut
+from comptabilite.utils import cache_versions
+
+CLE_VERSION = 'plan_reference'
+
+
+@dataclass(frozen=True)
+class CompteReference:
+    pk: int
+    numero_compte: str
+    intitule_compte: str
+    type_compte: Optional[str]
+    nature_compte: str
+    sens_habituel: Optional[str]
+    est_lettrable_par_defaut: bool
+    numero_parent: Optional[str]
+
+    def __str__(self):
+        return f"{self.numero_compte} - {self.intitule_compte}"
+
+
+class PlanReference:
+    """Index en lecture seule du plan SYSCOHADA par défaut."""
+
+    def __init__(self, comptes: Iterable[CompteReference], version: str):
+        self.version = version
+        self.comptes: Tuple[CompteReference, ...] = tuple(sorted(comptes, key=lambda c: c.numero_compte))
+        self._numeros = tuple(c.numero_compte for c in self.comptes)
+        self.par_numero = MappingProxyType({c.numero_compte: c for c in self.comptes})
+        self.par_pk = MappingProxyType({c.pk: c for c in self.comptes})
+        enfants = defaultdict(list)
+        for compte in self.comptes:
+            enfants[compte.numero_parent].append(compte)
+        self._enfants = MappingProxyType({parent: tuple(liste) for parent, liste in enfants.items()})
+
+    def __len__(self):
+        return len(self.comptes)
+
+    def get(self, numero_compte: str) -> Optional[CompteReference]:
+        return self.par_numero.get(numero_compte)
+
+    def racines(self) -> Tuple[CompteReference, ...]:
+        """Comptes sans parent (classes)."""
+        return self._enfants.get(None, ())
+
+    def enfants(self, numero_compte: str) -> Tuple[CompteReference, ...]:
+        return self._enfants.get(numero_compte, ())
+
+    def ancetres(self, numero_compte: str) -> Tuple[CompteReference, ...]:
+        """Chaîne des comptes parents, du parent direct jusqu'à la classe."""
+        chaine = []
+        compte = self.par_numero.get(numero_compte)
+        while compte is not None and compte.numero_parent:
+            compte = self.par_numero.get(compte.numero_parent)
+            if compte is None or compte in chaine:
+                break
+            chaine.append(compte)
+        return tuple(chaine)
+
+    def par_prefixe(self, prefixe: str) -> Tuple[CompteReference, ...]:
+        """Comptes dont le numéro commence par `prefixe` (tranche contiguë de l'index trié)."""
+        debut = bisect_left(self._numeros, prefixe)
+        fin = bisect_left(self._numeros, prefixe + '￿', debut)
+        return self.comptes[debut:fin]
+
+
+_plan: Optional[PlanReference] = None
+_verrou = threading.Lock()
+
+
+def get_plan_reference() -> PlanReference:
+    """Plan de référence courant (rechargé en une requête si sa version a changé)."""
+    global _plan
+    version = cache_versions.version_courante(CLE_VERSION)
+    plan = _plan
+    if plan is not None and plan.version == version:
+        return plan
+    with _verrou:
+        if _plan is None or _plan.version != version:
+            _plan = PlanReference((
+                CompteReference(
+                    pk=c['pk'],
+                    numero_compte=c['numero_compte'],
+                    intitule_compte=c['intitule_compte'],
+                    type_compte=c['type_compte'],
+                    nature_compte=c['nature_compte'],
+                    sens_habituel=c['sens_habituel'],
+                    est_lettrable_par_defaut=c['est_lettrable_par_defaut'],
+                    numero_parent=c['compte_parent_syscohada__numero_compte'],
+                )
+                for c in CompteComptableDefaut.objects.values(
+                    'pk', 'numero_compte', 'intitule_compte', 'type_compte', 'nature_compte',
+                    'sens_habituel', 'est_lettrable_par_defaut', 'compte_parent_syscohada__numero_compte',
+                )
+            ), version)
+        return _plan
+
+
+def invalider_plan_reference() -> None:
+    """À appeler après toute modification du plan SYSCOHADA par défaut."""
+    global _plan
+    cache_versions.invalider(CLE_VERSION)
+    _plan = None
@@ -0,0 +1,166 @@
+"""
+Portefeuille du cabinet - Indicateurs de chaque dossier pour le tableau de bord global
+
+Pour tous les dossiers à la fois, en un nombre constant de requêtes groupées par dossier :
+- pièces (EcritureComptable) : nombre de lignes (compteur nombre_lignes), date de la dernière
+  pièce, nombre de pièces déséquilibrées ;
+- soldes par période (SoldeComptePeriode) : solde des comptes de trésorerie actifs, depuis les
+  à-nouveaux de la dernière clôture d'exercice de chaque dossier (une requête groupée de plus) ;
+- soldes par période : chiffre d'affaires (comptes 70, postes TA à TD / XB des états financiers)
+  depuis le début de l'exercice en cours de chaque dossier, jusqu'au mois courant.
+
+La ligne de chaque dossier est mise en cache sous les jetons 'referentiel' et 'pieces' de
+indicateurs_dossier (jetons lus en un seul get_many) : seuls les dossiers modifiés depuis le
+dernier affichage sont recalculés, toujours par les mêmes requêtes groupées restreintes à ces
+dossiers. Le tri se fait en mémoire sur l'ensemble du portefeuille, avant pagination.
+"""
+from dataclasses import asdict, dataclass
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from django.core.cache import cache
+from django.db.models import Count, Max, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from comptabilite.models import ClotureComptable, EcritureComptable, SoldeComptePeriode
+from comptabilite.utils import cache_versions, export_fec, indicateurs_dossier, sequences_pieces, soldes_periodes
+from dossiers_pme.models import DossierPME
+
+ZERO = Decimal('0.00')
+PREFIXE = 'comptabilite:portefeuille'
+PREFIXE_CHIFFRE_AFFAIRES = '70'
+
+
+@dataclass
+class LignePortefeuille:
+    dossier_pk: int
+    nom_dossier: str
+    statut_dossier: str
+    nombre_lignes: int = 0
+    derniere_ecriture: Optional[date] = None
+    pieces_desequilibrees: int = 0
+    solde_tresorerie: Decimal = ZERO
+    chiffre_affaires: Decimal = ZERO
+
+    @property
+    def statut_libelle(self) -> str:
+        return dict(DossierPME.STATUT_CHOICES).get(self.statut_dossier, self.statut_dossier)
+
+    def vers_dict(self) -> dict:
+        valeurs = asdict(self)
+        valeurs['derniere_ecriture'] = self.derniere_ecriture.isoformat() if self.derniere_ecriture else None
+        return valeurs
+
+
+# clé de tri -> (attribut, libellé) ; '-cle' pour l'ordre décroissant
+TRIS = {
+    'nom': ('nom_dossier', "Dossier"),
+    'lignes': ('nombre_lignes', "Lignes"),
+    'derniere_ecriture': ('derniere_ecriture', "Dernière pièce"),
+    'desequilibrees': ('pieces_desequilibrees', "Pièces déséquilibrées"),
+    'tresorerie': ('solde_tresorerie', "Trésorerie"),
+    'chiffre_affaires': ('chiffre_affaires', "CA de l'exercice"),
+}
+TRI_DEFAUT = 'nom'
+
+
+def _debut_exercice(dossier, aujourd_hui: date) -> date:
+    return export_fec.periode_exercice(dossier, sequences_pieces.exercice_de(dossier, aujourd_hui))[0]
+
+
+def calculer_indicateurs(dossiers: List[DossierPME], aujourd_hui: date) -> Dict[int, dict]:
+    """Indicateurs des dossiers donnés (quatre requêtes groupées par dossier, quel que soit leur nombre)."""
+    pks = [dossier.pk for dossier in dossiers]
+    indicateurs = {pk: {'nombre_lignes': 0, 'derniere_ecriture': None, 'pieces_desequilibrees': 0,
+                        'solde_tresorerie': ZERO, 'chiffre_affaires': ZERO} for pk in pks}
+    if not pks:
+        return indicateurs
+
+    for pk, lignes, derniere, desequilibrees in EcritureComptable.objects.filter(dossier_pme_id__in=pks).values(
+        'dossier_pme_id',
+    ).annotate(
+        lignes=Coalesce(Sum('nombre_lignes'), Value(0)),
+        derniere=Max('date_ecriture'),
+        desequilibrees=Count('pk', filter=Q(est_desequilibree=True)),
+    ).order_by().values_list('dossier_pme_id', 'lignes', 'derniere', 'desequilibrees'):
+        indicateurs[pk].update(nombre_lignes=lignes, derniere_ecriture=derniere, pieces_desequilibrees=desequilibrees)
+
+    # Trésorerie : périodes postérieures à la dernière clôture d'exercice (reprise par les à-nouveaux)
+    par_origine = {}
+    for pk, date_fin in ClotureComptable.objects.filter(
+        dossier_pme_id__in=pks, type_cloture=ClotureComptable.EXERCICE,
+    ).values('dossier_pme_id').annotate(date_fin=Max('date_fin')).order_by().values_list('dossier_pme_id', 'date_fin'):
+        par_origine.setdefault(date_fin + timedelta(days=1), []).append(pk)
+    periodes_tresorerie = ~Q(dossier_pme_id__in=[pk for pks_origine in par_origine.values() for pk in pks_origine])
+    for origine, pks_origine in par_origine.items():
+        periodes_tresorerie |= Q(dossier_pme_id__in=pks_origine) & (Q(annee__gt=origine.year) | Q(annee=origine.year, mois__gte=origine.month))
+    for pk, debit, credit in SoldeComptePeriode.objects.filter(
+        periodes_tresorerie,
+        dossier_pme_id__in=pks,
+        compte_general__type_compte__in=soldes_periodes.TYPES_COMPTES_TRESORERIE,
+        compte_general__est_actif=True,
+    ).values('dossier_pme_id').annotate(
+        debit=Sum('total_debit'), credit=Sum('total_credit'),
+    ).order_by().values_list('dossier_pme_id', 'debit', 'credit'):
+        indicateurs[pk]['solde_tresorerie'] = ((debit or ZERO) - (credit or ZERO)).quantize(ZERO)
+
+    # Une condition par début d'exercice distinct (en pratique : quelques-uns pour tout le cabinet)
+    par_debut = {}
+    for dossier in dossiers:
+        par_debut.setdefault(_debut_exercice(dossier, aujourd_hui), []).append(dossier.pk)
+    periode_exercice = Q()
+    for debut, pks_debut in par_debut.items():
+        periode_exercice |= Q(dossier_pme_id__in=pks_debut) & (Q(annee__gt=debut.year) | Q(annee=debut.year, mois__gte=debut.month))
+    for pk, debit, credit in SoldeComptePeriode.objects.filter(
+        periode_exercice,
+        Q(annee__lt=aujourd_hui.year) | Q(annee=aujourd_hui.year, mois__lte=aujourd_hui.month),
+        compte_general__numero_compte__startswith=PREFIXE_CHIFFRE_AFFAIRES,
+    ).values('dossier_pme_id').annotate(
+        debit=Sum('total_debit'), credit=Sum('total_credit'),
+    ).order_by().values_list('dossier_pme_id', 'debit', 'credit'):
+        indicateurs[pk]['chiffre_affaires'] = ((credit or ZERO) - (debit or ZERO)).quantize(ZERO)
+    return indicateurs
+
+
+def _cle_cache(dossier, aujourd_hui: date, versions: dict) -> str:
+    referentiel = versions[(indicateurs_dossier.CLE_VERSION, dossier.pk, 'referentiel')]
+    pieces = versions[(indicateurs_dossier.CLE_VERSION, dossier.pk, 'pieces')]
+    return f"{PREFIXE}:{dossier.pk}:{aujourd_hui:%Y%m}:{_debut_exercice(dossier, aujourd_hui):%Y%m}:{referentiel}:{pieces}"
+
+
+def lignes_portefeuille(dossiers=None, aujourd_hui: Optional[date] = None) -> List[LignePortefeuille]:
+    """Ligne d'indicateurs de chaque dossier (tous par défaut), servie depuis le cache si à jour."""
+    aujourd_hui = aujourd_hui or date.today()
+    if dossiers is None:
+        dossiers = DossierPME.objects.all()
+    dossiers = list(dossiers.only('pk', 'nom_dossier', 'statut_dossier', 'date_debut_exercice_comptable').order_by())
+
+    versions = cache_versions.versions_courantes([
+        (indicateurs_dossier.CLE_VERSION, dossier.pk, portee) for dossier in dossiers for portee in ('referentiel', 'pieces')
+    ])
+    cles = {dossier.pk: _cle_cache(dossier, aujourd_hui, versions) for dossier in dossiers}
+    en_cache = cache.get_many(list(cles.values()))
+    a_calculer = [dossier for dossier in dossiers if cles[dossier.pk] not in en_cache]
+    if a_calculer:
+        calcules = calculer_indicateurs(a_calculer, aujourd_hui)
+        cache.set_many({cles[pk]: valeurs for pk, valeurs in calcules.items()}, indicateurs_dossier.DUREE_CACHE)
+        en_cache.update({cles[pk]: valeurs for pk, valeurs in calcules.items()})
+
+    return [
+        LignePortefeuille(dossier.pk, dossier.nom_dossier, dossier.statut_dossier, **en_cache[cles[dossier.pk]])
+        for dossier in dossiers
+    ]
+
+
+def trier(lignes: List[LignePortefeuille], tri: str = TRI_DEFAUT) -> List[LignePortefeuille]:
+    """Trie selon une clé de TRIS ('-cle' : décroissant) ; les dossiers sans pièce restent en fin de liste."""
+    decroissant = tri.startswith('-')
+    attribut = TRIS.get(tri.lstrip('-'), TRIS[TRI_DEFAUT])[0]
+    renseignees = [ligne for ligne in lignes if getattr(ligne, attribut) is not None]
+    vides = [ligne for ligne in lignes if getattr(ligne, attribut) is None]
+
+    def cle(ligne):
+        valeur = getattr(ligne, attribut)
+        return (valeur.casefold() if isinstance(valeur, str) else valeur, ligne.nom_dossier.casefold(), ligne.dossier_pk)
+    return sorted(renseignees, key=cle, reverse=decroissant) + sorted(vides, key=cle)
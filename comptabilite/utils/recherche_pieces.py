@@ -0,0 +1,133 @@
+"""
+Recherche de pièces - Pagination par curseur (keyset) et flux NDJSON
+
+Les pièces d'un journal sont parcourues dans l'ordre (date_ecriture, numero_piece, id). Le curseur
+encode la dernière clé renvoyée : la page suivante repart de cette clé via l'index
+(journal, date_ecriture, numero_piece), avec un coût constant quelle que soit la profondeur,
+contrairement à un OFFSET. Le montant de chaque pièce est le total débit stocké sur la pièce.
+"""
+import base64
+import json
+from datetime import date
+from decimal import Decimal, InvalidOperation
+from typing import Iterator, List, Optional, Tuple
+
+from django.db.models import Exists, OuterRef, Q
+from django.utils.dateparse import parse_date
+
+from comptabilite.models import EcritureComptable, LigneEcriture
+
+TAILLE_PAGE_DEFAUT = 50
+TAILLE_PAGE_MAX = 500
+ORDRE = ('date_ecriture', 'numero_piece', 'id')
+
+
+class CurseurInvalide(ValueError):
+    pass
+
+
+def encoder_curseur(piece: EcritureComptable) -> str:
+    cle = [piece.date_ecriture.isoformat(), piece.numero_piece, piece.pk]
+    return base64.urlsafe_b64encode(json.dumps(cle).encode()).decode().rstrip('=')
+
+
+def decoder_curseur(curseur: str) -> Tuple[date, str, int]:
+    try:
+        brut = base64.urlsafe_b64decode(curseur + '=' * (-len(curseur) % 4))
+        date_iso, numero_piece, pk = json.loads(brut)
+        date_ecriture = parse_date(date_iso)
+        if date_ecriture is None or not isinstance(numero_piece, str) or not isinstance(pk, int):
+            raise ValueError
+        return date_ecriture, numero_piece, pk
+    except (ValueError, TypeError):
+        raise CurseurInvalide("Curseur de pagination invalide.")
+
+
+def _apres(cle: Tuple[date, str, int]) -> Q:
+    """Pièces strictement après la clé (date, numéro, id) dans l'ordre du parcours."""
+    date_ecriture, numero_piece, pk = cle
+    return (
+        Q(date_ecriture__gt=date_ecriture)
+        | Q(date_ecriture=date_ecriture, numero_piece__gt=numero_piece)
+        | Q(date_ecriture=date_ecriture, numero_piece=numero_piece, pk__gt=pk)
+    )
+
+
+def filtrer_pieces(journal, numero_piece: Optional[str] = None, date_debut: Optional[str] = None,
+                   date_fin: Optional[str] = None, montant: Optional[str] = None):
+    """
+    Pièces du journal selon les critères de recherche (valeurs brutes de la requête HTTP).
+    Lève ValueError si une date ou un montant est invalide.
+    """
+    pieces = EcritureComptable.objects.filter(journal=journal)
+    if numero_piece:
+        pieces = pieces.filter(numero_piece__icontains=numero_piece)
+    for critere, valeur, lookup in (('dateStart', date_debut, 'date_ecriture__gte'),
+                                     ('dateEnd', date_fin, 'date_ecriture__lte')):
+        if valeur:
+            try:
+                jour = parse_date(valeur)
+            except ValueError:
+                jour = None
+            if jour is None:
+                raise ValueError(f"Date invalide pour {critere} : {valeur}")
+            pieces = pieces.filter(**{lookup: jour})
+    if montant:
+        try:
+            valeur_montant = Decimal(montant.replace(' ', '').replace(',', '.'))
+        except InvalidOperation:
+            raise ValueError(f"Montant invalide : {montant}")
+        # EXISTS plutôt qu'une jointure + DISTINCT : une pièce n'est renvoyée qu'une fois
+        pieces = pieces.filter(Exists(LigneEcriture.objects.filter(
+            Q(debit=valeur_montant) | Q(credit=valeur_montant), ecriture=OuterRef('pk')
+        )))
+    return pieces
+
+
+def page_pieces(pieces, curseur: Optional[str] = None,
+                taille: int = TAILLE_PAGE_DEFAUT) -> Tuple[List[EcritureComptable], Optional[str]]:
+    """Une page de résultats et le curseur de la suivante (None en fin de parcours)."""
+    pieces, taille = _page_requete(pieces, curseur, taille)
+    return _couper_page(list(pieces[:taille + 1]), taille)
+
+
+async def apage_pieces(pieces, curseur: Optional[str] = None,
+                       taille: int = TAILLE_PAGE_DEFAUT) -> Tuple[List[EcritureComptable], Optional[str]]:
+    """Variante asynchrone de page_pieces (ORM asynchrone)."""
+    pieces, taille = _page_requete(pieces, curseur, taille)
+    return _couper_page([piece async for piece in pieces[:taille + 1]], taille)
+
+
+def _page_requete(pieces, curseur: Optional[str], taille: int):
+    taille = max(1, min(taille, TAILLE_PAGE_MAX))
+    pieces = pieces.order_by(*ORDRE)
+    if curseur:
+        pieces = pieces.filter(_apres(decoder_curseur(curseur)))
+    return pieces, taille
+
+
+def _couper_page(resultats: List[EcritureComptable], taille: int) -> Tuple[List[EcritureComptable], Optional[str]]:
+    if len(resultats) > taille:
+        resultats = resultats[:taille]
+        return resultats, encoder_curseur(resultats[-1])
+    return resultats, None
+
+
+def iterer_pieces(pieces, curseur: Optional[str] = None, taille_lot: int = TAILLE_PAGE_MAX) -> Iterator[EcritureComptable]:
+    """Parcourt toutes les pièces par lots successifs (une requête keyset par lot)."""
+    while True:
+        lot, curseur = page_pieces(pieces, curseur, taille_lot)
+        yield from lot
+        if curseur is None:
+            return
+
+
+def piece_vers_dict(piece: EcritureComptable) -> dict:
+    return {
+        'id': piece.pk,
+        'numero': piece.numero_piece,
+        'date': piece.date_ecriture.isoformat(),
+        'libelle': piece.libelle_piece,
+        'reference': piece.reference_piece or '',
+        'montant': str(piece.total_debit),
+    }
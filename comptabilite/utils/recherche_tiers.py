@@ -0,0 +1,221 @@
+"""
+Recherche de tiers - Backend indexé des API de saisie (search_tiers_view, tiers_lookup, tiers_lookup_view)
+
+La recherche porte sur Tiers.cle_recherche (code, nom et prénom sans accents ni casse) :
+chaque mot de la requête doit y figurer.
+- PostgreSQL : filtres LIKE servis par l'index GIN pg_trgm (migration 0006), départage par similarité ;
+- autres bases : index de trigrammes en mémoire par dossier, versionné comme index_comptes.
+
+Classement : code commençant par la requête, puis mot commençant par la requête, puis simple
+sous-chaîne ; à rang égal, ordre des codes tiers. L'ordre étant total, la pagination est stable.
+"""
+import threading
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from django.db import connection
+from django.db.models import Case, IntegerField, Value, When
+
+from comptabilite.models import Tiers
+from comptabilite.utils import cache_versions
+from comptabilite.utils.texte import mots
+
+CLE_VERSION = 'index_tiers'
+NOMBRE_MAX_DOSSIERS = 64
+TAILLE_PAGE_MAX = 100
+
+RANG_CODE = 3
+RANG_MOT = 2
+RANG_SOUS_CHAINE = 1
+
+
+@dataclass
+class PageTiers:
+    resultats: List[Tiers]
+    page: int
+    taille_page: int
+    a_suivante: bool
+
+    def pagination(self) -> Dict:
+        return {'page': self.page, 'page_size': self.taille_page, 'has_more': self.a_suivante}
+
+
+def _rang(cle: str, requete: str) -> int:
+    if cle.startswith(requete):
+        return RANG_CODE
+    if f' {requete}' in cle:
+        return RANG_MOT
+    return RANG_SOUS_CHAINE
+
+
+def _trigrammes(texte: str) -> set:
+    return {texte[i:i + 3] for i in range(len(texte) - 2)}
+
+
+class IndexTiers:
+    """Index de trigrammes en lecture seule des tiers actifs d'un dossier."""
+
+    def __init__(self, entrees: Iterable[Tuple[int, str, str, str]], version: str):
+        self.version = version
+        # (pk, code_tiers, cle_recherche, type_tiers) triés par code
+        self.entrees = tuple(sorted(entrees, key=lambda e: e[1]))
+        postings = defaultdict(list)
+        for rang, (__, __, cle, __) in enumerate(self.entrees):
+            for trigramme in _trigrammes(cle):
+                postings[trigramme].append(rang)
+        self._postings = dict(postings)
+
+    def __len__(self):
+        return len(self.entrees)
+
+    def _candidats(self, termes: Sequence[str]) -> Iterable[int]:
+        candidats = None
+        for terme in termes:
+            for trigramme in _trigrammes(terme):
+                rangs = set(self._postings.get(trigramme, ()))
+                candidats = rangs if candidats is None else candidats & rangs
+                if not candidats:
+                    return ()
+        return range(len(self.entrees)) if candidats is None else candidats
+
+    def rechercher(self, termes: Sequence[str], types_tiers: Optional[Sequence[str]] = None) -> List[int]:
+        """PKs des tiers correspondants, dans l'ordre de classement."""
+        requete = ' '.join(termes)
+        trouves = []
+        for rang in self._candidats(termes):
+            pk, code, cle, type_tiers = self.entrees[rang]
+            if types_tiers and type_tiers not in types_tiers:
+                continue
+            if all(terme in cle for terme in termes):
+                trouves.append((-_rang(cle, requete) if requete else 0, code, pk))
+        trouves.sort()
+        return [pk for __, __, pk in trouves]
+
+
+_index: 'OrderedDict[int, IndexTiers]' = OrderedDict()
+_verrou = threading.Lock()
+
+
+def _entrees_index(dossier_pk: int):
+    return Tiers.objects.filter(dossier_pme_id=dossier_pk, est_actif=True).values_list(
+        'pk', 'code_tiers', 'cle_recherche', 'type_tiers'
+    )
+
+
+def _index_a_jour(dossier_pk: int, version: str) -> Optional[IndexTiers]:
+    with _verrou:
+        index = _index.get(dossier_pk)
+        if index is not None and index.version == version:
+            _index.move_to_end(dossier_pk)
+            return index
+    return None
+
+
+def _memoriser(dossier_pk: int, index: IndexTiers) -> IndexTiers:
+    with _verrou:
+        _index[dossier_pk] = index
+        _index.move_to_end(dossier_pk)
+        while len(_index) > NOMBRE_MAX_DOSSIERS:
+            _index.popitem(last=False)
+    return index
+
+
+def get_index_tiers(dossier_pk: int) -> IndexTiers:
+    """Index du dossier (reconstruit en une requête si sa version a changé)."""
+    version = cache_versions.version_courante(CLE_VERSION, dossier_pk)
+    index = _index_a_jour(dossier_pk, version)
+    if index is None:
+        index = _memoriser(dossier_pk, IndexTiers(_entrees_index(dossier_pk), version))
+    return index
+
+
+async def aget_index_tiers(dossier_pk: int) -> IndexTiers:
+    """Variante asynchrone de get_index_tiers (ORM asynchrone)."""
+    version = await cache_versions.aversion_courante(CLE_VERSION, dossier_pk)
+    index = _index_a_jour(dossier_pk, version)
+    if index is None:
+        entrees = [entree async for entree in _entrees_index(dossier_pk)]
+        index = _memoriser(dossier_pk, IndexTiers(entrees, version))
+    return index
+
+
+def invalider_index_tiers(dossier_pk: int) -> None:
+    cache_versions.invalider(CLE_VERSION, dossier_pk)
+    with _verrou:
+        _index.pop(dossier_pk, None)
+
+
+def _tiers_actifs(dossier_pk: int, types_tiers: Optional[Sequence[str]]):
+    tiers = Tiers.objects.filter(dossier_pme_id=dossier_pk, est_actif=True).select_related('compte_comptable_associe')
+    if types_tiers:
+        tiers = tiers.filter(type_tiers__in=types_tiers)
+    return tiers
+
+
+def _tiers_postgresql(dossier_pk, termes, types_tiers):
+    from django.contrib.postgres.search import TrigramSimilarity
+
+    tiers = _tiers_actifs(dossier_pk, types_tiers)
+    if not termes:
+        return tiers.order_by('code_tiers')
+    for terme in termes:
+        tiers = tiers.filter(cle_recherche__contains=terme)
+    requete = ' '.join(termes)
+    return tiers.annotate(
+        rang=Case(
+            When(cle_recherche__startswith=requete, then=Value(RANG_CODE)),
+            When(cle_recherche__contains=f' {requete}', then=Value(RANG_MOT)),
+            default=Value(RANG_SOUS_CHAINE),
+            output_field=IntegerField(),
+        ),
+        similarite=TrigramSimilarity('cle_recherche', requete),
+    ).order_by('-rang', '-similarite', 'code_tiers')
+
+
+def _bornes(page: int, taille_page: int) -> Tuple[int, int, int, int]:
+    page = max(1, page)
+    taille_page = max(1, min(taille_page, TAILLE_PAGE_MAX))
+    debut = (page - 1) * taille_page
+    fin = debut + taille_page + 1  # un résultat de plus pour savoir s'il existe une page suivante
+    return page, taille_page, debut, fin
+
+
+def _page(resultats: List[Tiers], page: int, taille_page: int) -> PageTiers:
+    return PageTiers(
+        resultats=resultats[:taille_page],
+        page=page,
+        taille_page=taille_page,
+        a_suivante=len(resultats) > taille_page,
+    )
+
+
+def rechercher_tiers(dossier_pk: int, query: str = '', types_tiers: Optional[Sequence[str]] = None,
+                     page: int = 1, taille_page: int = 20) -> PageTiers:
+    """
+    Page `page` (à partir de 1) des tiers actifs du dossier correspondant à `query`.
+    Une requête vide liste les tiers par code.
+    """
+    page, taille_page, debut, fin = _bornes(page, taille_page)
+    termes = mots(query)
+    if connection.vendor == 'postgresql':
+        resultats = list(_tiers_postgresql(dossier_pk, termes, types_tiers)[debut:fin])
+    else:
+        pks = get_index_tiers(dossier_pk).rechercher(termes, types_tiers)[debut:fin]
+        tiers = _tiers_actifs(dossier_pk, None).in_bulk(pks)
+        resultats = [tiers[pk] for pk in pks if pk in tiers]
+    return _page(resultats, page, taille_page)
+
+
+async def arechercher_tiers(dossier_pk: int, query: str = '', types_tiers: Optional[Sequence[str]] = None,
+                            page: int = 1, taille_page: int = 20) -> PageTiers:
+    """Variante asynchrone de rechercher_tiers (ORM asynchrone)."""
+    page, taille_page, debut, fin = _bornes(page, taille_page)
+    termes = mots(query)
+    if connection.vendor == 'postgresql':
+        resultats = [t async for t in _tiers_postgresql(dossier_pk, termes, types_tiers)[debut:fin]]
+    else:
+        pks = (await aget_index_tiers(dossier_pk)).rechercher(termes, types_tiers)[debut:fin]
+        tiers = await _tiers_actifs(dossier_pk, None).ain_bulk(pks)
+        resultats = [tiers[pk] for pk in pks if pk in tiers]
+    return _page(resultats, page, taille_page)
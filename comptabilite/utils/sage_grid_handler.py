@@ -4,15 +4,16 @@ Sage Grid Handler - Utility for handling accounting grid operations
 This module provides utility functions to interact with the Sage-like grid interface for
 accounting entries. It handles grid data validation, formatting, and computation.
 """
-from typing import Dict, List, Optional, Union, Tuple, Any
+from typing import Dict, List, Optional, Set, Union, Tuple, Any
 from decimal import Decimal
+import calendar
 import re
 import json
 from datetime import datetime, date
 
-from django.db.models import Q
 from django.db import transaction
 from django.http import JsonResponse
+from django.utils.dateparse import parse_date
 from django.utils.translation import gettext_lazy as _
 
 from comptabilite.models import (
@@ -22,6 +23,119 @@ from comptabilite.models import (
     CompteComptablePME,
     Tiers
 )
+from comptabilite.utils import clotures, sequences_pieces
+from comptabilite.utils.index_comptes import rechercher_comptes
+
+
+class GridReferenceResolver:
+    """
+    Per-request cache of the accounts and tiers referenced by a grid.
+    
+    All account numbers and tiers codes of the grid are loaded with one `__in` query
+    each; rows are then validated from dictionaries with the same rules as
+    SageGridHandler.validate_account_number / validate_tiers_code.
+    """
+    
+    def __init__(self, dossier_pme):
+        self.dossier_pme = dossier_pme
+        # Unknown references are cached as None so they are not queried again
+        self.accounts: Dict[str, Optional[CompteComptablePME]] = {}
+        self.tiers: Dict[str, Optional[Tiers]] = {}
+    
+    @classmethod
+    def from_grid(cls, dossier_pme, grid_data: List[Dict[str, Any]], extra_tiers_codes=()) -> 'GridReferenceResolver':
+        """
+        Build a resolver preloaded with every reference found in the grid rows.
+        
+        Args:
+            dossier_pme: The DossierPME instance to resolve against
+            grid_data: List of dictionaries containing grid row data
+            extra_tiers_codes: Additional tiers codes to preload (e.g. the header tiers)
+        """
+        resolver = cls(dossier_pme)
+        resolver.load(
+            account_numbers=[row.get('compte') for row in grid_data],
+            tiers_codes=[row.get('tiers') for row in grid_data] + list(extra_tiers_codes),
+        )
+        return resolver
+    
+    @staticmethod
+    def _clean_account_number(account_number) -> str:
+        return account_number.strip() if isinstance(account_number, str) else ''
+    
+    @staticmethod
+    def _clean_tiers_code(tiers_code) -> str:
+        return tiers_code.strip().upper() if isinstance(tiers_code, str) else ''
+    
+    def load(self, account_numbers=(), tiers_codes=()) -> None:
+        """Load the given account numbers and tiers codes not already cached."""
+        numbers = {self._clean_account_number(n) for n in account_numbers} - {''} - set(self.accounts)
+        if numbers:
+            self.accounts.update(dict.fromkeys(numbers))
+            self.accounts.update({
+                account.numero_compte: account
+                for account in CompteComptablePME.objects.filter(
+                    dossier_pme=self.dossier_pme,
+                    numero_compte__in=numbers,
+                    est_actif=True,
+                    nature_compte='DETAIL'
+                )
+            })
+        
+        codes = {self._clean_tiers_code(c) for c in tiers_codes} - {''} - set(self.tiers)
+        if codes:
+            self.tiers.update(dict.fromkeys(codes))
+            self.tiers.update({
+                tiers.code_tiers: tiers
+                for tiers in Tiers.objects.filter(
+                    dossier_pme=self.dossier_pme,
+                    code_tiers__in=codes,
+                    est_actif=True
+                )
+            })
+    
+    def resolve_account(self, account_number: str) -> Tuple[bool, Optional[CompteComptablePME]]:
+        """
+        Resolve an account number (same contract as SageGridHandler.validate_account_number).
+        
+        Returns:
+            Tuple of (is_valid, account_instance)
+        """
+        number = self._clean_account_number(account_number)
+        if not number:
+            return False, None
+        if number not in self.accounts:
+            self.load(account_numbers=[number])
+        account = self.accounts[number]
+        return account is not None, account
+    
+    def resolve_tiers(self, tiers_code: str) -> Tuple[bool, Optional[Tiers]]:
+        """
+        Resolve a tiers code (same contract as SageGridHandler.validate_tiers_code).
+        
+        Returns:
+            Tuple of (is_valid, tiers_instance)
+        """
+        code = self._clean_tiers_code(tiers_code)
+        if not code:
+            return False, None
+        if code not in self.tiers:
+            self.load(tiers_codes=[code])
+        tiers = self.tiers[code]
+        return tiers is not None, tiers
+
+
+def existing_piece_numbers(journal, numbers) -> Set[str]:
+    """
+    Piece numbers among `numbers` already used by a piece of the journal (one query).
+    Shared by validate_batch and the file import (utils/import_ecritures.py).
+    """
+    numbers = {str(number).strip() for number in numbers if number and str(number).strip()}
+    if journal is None or not numbers:
+        return set()
+    return set(EcritureComptable.objects.filter(
+        journal=journal, numero_piece__in=numbers
+    ).values_list('numero_piece', flat=True))
 
 
 class SageGridHandler:
@@ -191,7 +305,7 @@ class SageGridHandler:
             return None
             
         try:
-            day = int(day_str.strip())
+            day = int(str(day_str).strip())
             if 1 <= day <= 31:
                 return day
         except ValueError:
@@ -199,12 +313,104 @@ class SageGridHandler:
             
         return None
     
-    def process_grid_data(self, grid_data: List[Dict[str, Any]]) -> Tuple[bool, Dict[str, Any]]:
+    def process_row(self, row_index: int, row: Dict[str, Any], resolver: 'GridReferenceResolver') -> Tuple[Optional[Dict[str, Any]], List[str]]:
+        """
+        Process and validate a single grid row.
+        
+        Args:
+            row_index: Zero-based position of the row in the grid (used in error messages)
+            row: Dictionary containing the row data
+            resolver: GridReferenceResolver preloaded with the grid's accounts and tiers
+            
+        Returns:
+            Tuple of (processed_row or None for an empty row, errors)
+        """
+        errors = []
+        processed_row = {}
+        
+        # Skip empty rows
+        if all(not value for value in row.values()):
+            return None, errors
+            
+        # Process each field
+        for field, value in row.items():
+            if field == 'jour':
+                day = self.validate_day(value)
+                if day:
+                    processed_row['jour'] = day
+                else:
+                    errors.append(f"Row {row_index+1}: Invalid day '{value}'")
+            
+            elif field == 'compte':
+                is_valid, account = resolver.resolve_account(value)
+                if is_valid:
+                    processed_row['compte_general'] = account
+                else:
+                    errors.append(f"Row {row_index+1}: Invalid account '{value}'")
+            
+            elif field == 'tiers':
+                if value:
+                    is_valid, tiers = resolver.resolve_tiers(value)
+                    if is_valid:
+                        processed_row['tiers_ligne'] = tiers
+                    else:
+                        errors.append(f"Row {row_index+1}: Invalid tiers code '{value}'")
+            
+            elif field == 'echeance':
+                if value:
+                    parsed_date = self.validate_date(value)
+                    if parsed_date:
+                        processed_row['date_echeance_ligne'] = parsed_date
+                    else:
+                        errors.append(f"Row {row_index+1}: Invalid date format '{value}'")
+            
+            elif field == 'debit':
+                if value:
+                    debit = self.parse_monetary_value(value)
+                    if debit is not None:
+                        processed_row['debit'] = debit
+                    else:
+                        errors.append(f"Row {row_index+1}: Invalid debit amount '{value}'")
+            
+            elif field == 'credit':
+                if value:
+                    credit = self.parse_monetary_value(value)
+                    if credit is not None:
+                        processed_row['credit'] = credit
+                    else:
+                        errors.append(f"Row {row_index+1}: Invalid credit amount '{value}'")
+            
+            else:
+                # Direct mapping for other fields
+                processed_row[field] = value
+        
+        # Validate account/tiers relationship
+        if 'compte_general' in processed_row and processed_row['compte_general'].type_compte in [
+            'TIERS_CLIENT', 'TIERS_FOURNISSEUR', 'TIERS_SALARIE'
+        ] and 'tiers_ligne' not in processed_row:
+            errors.append(
+                f"Row {row_index+1}: Tiers code required for account {processed_row['compte_general'].numero_compte}"
+            )
+        
+        # Validate debit/credit rules
+        debit = processed_row.get('debit', Decimal('0.00'))
+        credit = processed_row.get('credit', Decimal('0.00'))
+        
+        if debit > 0 and credit > 0:
+            errors.append(f"Row {row_index+1}: Cannot have both debit and credit values")
+        
+        if debit == 0 and credit == 0 and 'compte_general' in processed_row:
+            errors.append(f"Row {row_index+1}: Must specify either debit or credit amount")
+        
+        return processed_row, errors
+    
+    def process_grid_data(self, grid_data: List[Dict[str, Any]], resolver: Optional['GridReferenceResolver'] = None) -> Tuple[bool, Dict[str, Any]]:
         """
         Process and validate grid data from the frontend.
         
         Args:
             grid_data: List of dictionaries containing grid row data
+            resolver: Optional preloaded GridReferenceResolver (built from grid_data otherwise)
             
         Returns:
             Tuple of (is_valid, processed_data)
@@ -214,86 +420,18 @@ class SageGridHandler:
         total_debit = Decimal('0.00')
         total_credit = Decimal('0.00')
         
+        # Resolve every account and tiers referenced by the grid up front (one query each)
+        if resolver is None:
+            resolver = GridReferenceResolver.from_grid(self.dossier_pme, grid_data)
+        
         # Process each row in the grid
         for row_index, row in enumerate(grid_data):
-            processed_row = {}
-            
-            # Skip empty rows
-            if all(not value for value in row.values()):
+            processed_row, row_errors = self.process_row(row_index, row, resolver)
+            self.errors.extend(row_errors)
+            if processed_row is None:
                 continue
-                
-            # Process each field
-            for field, value in row.items():
-                if field == 'jour':
-                    day = self.validate_day(value)
-                    if day:
-                        processed_row['jour'] = day
-                    else:
-                        self.errors.append(f"Row {row_index+1}: Invalid day '{value}'")
-                
-                elif field == 'compte':
-                    is_valid, account = self.validate_account_number(value, self.dossier_pme)
-                    if is_valid:
-                        processed_row['compte_general'] = account
-                    else:
-                        self.errors.append(f"Row {row_index+1}: Invalid account '{value}'")
-                
-                elif field == 'tiers':
-                    if value:
-                        is_valid, tiers = self.validate_tiers_code(value, self.dossier_pme)
-                        if is_valid:
-                            processed_row['tiers_ligne'] = tiers
-                        else:
-                            self.errors.append(f"Row {row_index+1}: Invalid tiers code '{value}'")
-                
-                elif field == 'echeance':
-                    if value:
-                        parsed_date = self.validate_date(value)
-                        if parsed_date:
-                            processed_row['date_echeance_ligne'] = parsed_date
-                        else:
-                            self.errors.append(f"Row {row_index+1}: Invalid date format '{value}'")
-                
-                elif field == 'debit':
-                    if value:
-                        debit = self.parse_monetary_value(value)
-                        if debit is not None:
-                            processed_row['debit'] = debit
-                            total_debit += debit
-                        else:
-                            self.errors.append(f"Row {row_index+1}: Invalid debit amount '{value}'")
-                
-                elif field == 'credit':
-                    if value:
-                        credit = self.parse_monetary_value(value)
-                        if credit is not None:
-                            processed_row['credit'] = credit
-                            total_credit += credit
-                        else:
-                            self.errors.append(f"Row {row_index+1}: Invalid credit amount '{value}'")
-                
-                else:
-                    # Direct mapping for other fields
-                    processed_row[field] = value
-            
-            # Validate account/tiers relationship
-            if 'compte_general' in processed_row and processed_row['compte_general'].type_compte in [
-                'TIERS_CLIENT', 'TIERS_FOURNISSEUR', 'TIERS_SALARIE'
-            ] and 'tiers_ligne' not in processed_row:
-                self.errors.append(
-                    f"Row {row_index+1}: Tiers code required for account {processed_row['compte_general'].numero_compte}"
-                )
-            
-            # Validate debit/credit rules
-            debit = processed_row.get('debit', Decimal('0.00'))
-            credit = processed_row.get('credit', Decimal('0.00'))
-            
-            if debit > 0 and credit > 0:
-                self.errors.append(f"Row {row_index+1}: Cannot have both debit and credit values")
-            
-            if debit == 0 and credit == 0 and 'compte_general' in processed_row:
-                self.errors.append(f"Row {row_index+1}: Must specify either debit or credit amount")
-            
+            total_debit += processed_row.get('debit', Decimal('0.00'))
+            total_credit += processed_row.get('credit', Decimal('0.00'))
             processed_rows.append(processed_row)
         
         # Validate overall balance
@@ -315,6 +453,125 @@ class SageGridHandler:
         
         return len(self.errors) == 0, result
 
+    def validate_batch(self, pieces: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """
+        Validate many pieces of the handler's journal and period in one pass (e.g. an imported month).
+
+        Every account and tiers referenced by the batch is resolved up front (one query each),
+        and the piece numbers are checked against the journal with one more query, so the cost
+        grows with the number of rows, not with the number of database round trips.
+
+        Args:
+            pieces: List of {'header': {...}, 'grid': [rows]} dictionaries, with the same header
+                keys as save_grid_data and the same row keys as process_row
+
+        Returns:
+            Tuple of (report, processed_pieces). The report is JSON-serializable: global totals and
+            errors, plus one entry per piece that has errors, with its row errors keyed by row
+            number. processed_pieces holds {'header', 'rows', 'date_ecriture'} for each piece, in
+            order, ready to be saved once the report is valid.
+        """
+        periode = date(self.date_ecriture.year, self.date_ecriture.month, 1) if self.date_ecriture else None
+        jours_du_mois = calendar.monthrange(periode.year, periode.month)[1] if periode else 31
+
+        headers = [piece.get('header') or {} for piece in pieces]
+        resolver = GridReferenceResolver.from_grid(
+            self.dossier_pme,
+            [row for piece in pieces for row in piece.get('grid') or []],
+            extra_tiers_codes=[header.get('tiers_en_tete') for header in headers],
+        )
+
+        numbers = [str(header.get('numero_piece') or '').strip() for header in headers]
+        existing_numbers = existing_piece_numbers(self.journal, numbers)
+        seen_numbers: Dict[str, int] = {}
+
+        report_pieces = []
+        processed_pieces = []
+        total_debit = total_credit = Decimal('0.00')
+        row_count = 0
+
+        for index, (piece, header, number) in enumerate(zip(pieces, headers, numbers)):
+            piece_errors = []
+            row_errors: Dict[int, List[str]] = {}
+            rows = []
+            piece_debit = piece_credit = Decimal('0.00')
+
+            if number:
+                if number in seen_numbers:
+                    piece_errors.append(f"Piece number '{number}' already used by piece {seen_numbers[number] + 1} of the batch")
+                else:
+                    seen_numbers[number] = index
+                if number in existing_numbers:
+                    piece_errors.append(f"Piece number '{number}' already exists in the journal")
+
+            piece_date = header.get('date_ecriture') or periode
+            if isinstance(piece_date, str):
+                try:
+                    piece_date = parse_date(piece_date) or self.validate_date(piece_date)
+                except ValueError:
+                    piece_date = None
+                if piece_date is None:
+                    piece_errors.append(f"Invalid piece date '{header['date_ecriture']}'")
+            if piece_date and periode and (piece_date.year, piece_date.month) != (periode.year, periode.month):
+                piece_errors.append(f"Piece date {piece_date:%d/%m/%Y} is outside the period {periode:%m/%Y}")
+
+            tiers_code = header.get('tiers_en_tete')
+            if tiers_code and not resolver.resolve_tiers(tiers_code)[0]:
+                piece_errors.append(f"Invalid header tiers code '{tiers_code}'")
+
+            for row_index, row in enumerate(piece.get('grid') or []):
+                processed_row, errors = self.process_row(row_index, row, resolver)
+                if processed_row is None:
+                    continue
+                if processed_row.get('jour', 0) > jours_du_mois:
+                    errors.append(f"Row {row_index+1}: Day {processed_row['jour']} is outside the period")
+                if errors:
+                    row_errors[row_index + 1] = errors
+                piece_debit += processed_row.get('debit', Decimal('0.00'))
+                piece_credit += processed_row.get('credit', Decimal('0.00'))
+                rows.append(processed_row)
+
+            if not rows:
+                piece_errors.append("Piece has no lines")
+            elif piece_debit != piece_credit:
+                piece_errors.append(
+                    f"Piece is not balanced. Debit: {self.format_monetary_value(piece_debit)}, "
+                    f"Credit: {self.format_monetary_value(piece_credit)}, "
+                    f"Difference: {self.format_monetary_value(abs(piece_debit - piece_credit))}"
+                )
+
+            total_debit += piece_debit
+            total_credit += piece_credit
+            row_count += len(rows)
+            processed_pieces.append({'header': header, 'rows': rows, 'date_ecriture': piece_date})
+            if piece_errors or row_errors:
+                report_pieces.append({
+                    'index': index,
+                    'numero_piece': number,
+                    'errors': piece_errors,
+                    'rows': [{'row': row, 'errors': errors} for row, errors in row_errors.items()],
+                })
+
+        global_errors = []
+        if total_debit != total_credit:
+            global_errors.append(
+                f"Batch is not balanced. Debit: {self.format_monetary_value(total_debit)}, "
+                f"Credit: {self.format_monetary_value(total_credit)}"
+            )
+
+        report = {
+            'is_valid': not report_pieces and not global_errors,
+            'piece_count': len(pieces),
+            'row_count': row_count,
+            'invalid_piece_count': len(report_pieces),
+            'total_debit': str(total_debit),
+            'total_credit': str(total_credit),
+            'is_balanced': total_debit == total_credit,
+            'errors': global_errors,
+            'pieces': report_pieces,
+        }
+        return report, processed_pieces
+
     @transaction.atomic
     def save_grid_data(self, piece_header: Dict[str, Any], grid_data: List[Dict[str, Any]]) -> Tuple[bool, Union[EcritureComptable, List[str]]]:
         """
@@ -327,7 +584,10 @@ class SageGridHandler:
         Returns:
             Tuple of (success, entry_or_errors)
         """
-        is_valid, processed_data = self.process_grid_data(grid_data)
+        resolver = GridReferenceResolver.from_grid(
+            self.dossier_pme, grid_data, extra_tiers_codes=[piece_header.get('tiers_en_tete')]
+        )
+        is_valid, processed_data = self.process_grid_data(grid_data, resolver)
         
         if not is_valid:
             return False, self.errors
@@ -335,14 +595,23 @@ class SageGridHandler:
         # Create the accounting entry header
         try:
             piece_date = piece_header.get('date_ecriture', self.date_ecriture)
+            if isinstance(piece_date, str):
+                piece_date = parse_date(piece_date) or self.validate_date(piece_date)
             if not piece_date:
                 return False, ["Missing entry date"]
+            clotures.verifier_periode_ouverte(self.dossier_pme, [piece_date])
+            
+            # Supplied number is consumed from the journal sequence (refused if already used), otherwise
+            # the next one is reserved; a kept suggestion ('numero_suggere') is reserved again under lock
+            numero_piece = sequences_pieces.numero_pour_enregistrement(
+                self.journal, piece_date, piece_header.get('numero_piece', ''), piece_header.get('numero_suggere'),
+            )
                 
             entry = EcritureComptable(
                 dossier_pme=self.dossier_pme,
                 journal=self.journal,
                 date_ecriture=piece_date,
-                numero_piece=piece_header.get('numero_piece', ''),
+                numero_piece=numero_piece,
                 libelle_piece=piece_header.get('libelle_piece', ''),
                 numero_facture_liee=piece_header.get('numero_facture', ''),
                 reference_piece=piece_header.get('reference', ''),
@@ -352,20 +621,24 @@ class SageGridHandler:
             # Add tiers if provided
             if 'tiers_en_tete' in piece_header and piece_header['tiers_en_tete']:
                 tiers_code = piece_header['tiers_en_tete']
-                is_valid, tiers = self.validate_tiers_code(tiers_code, self.dossier_pme)
+                is_valid, tiers = resolver.resolve_tiers(tiers_code)
                 if is_valid:
                     entry.tiers_en_tete = tiers
             
             entry.save()
             
-            # Create the accounting entry lines
-            for row_data in processed_data['rows']:
+            # Create the accounting entry lines in a single INSERT.
+            # The entry is new, so `ordre` is simply the row position: this avoids the
+            # per-line Max('ordre') query done by LigneEcriture.save().
+            lines = []
+            for ordre, row_data in enumerate(processed_data['rows']):
                 line = LigneEcriture(
                     ecriture=entry,
                     compte_general=row_data['compte_general'],
                     libelle_ligne=row_data.get('libelle', entry.libelle_piece),
                     debit=row_data.get('debit', Decimal('0.00')),
                     credit=row_data.get('credit', Decimal('0.00')),
+                    ordre=ordre,
                 )
                 
                 # Add optional fields if present
@@ -387,11 +660,15 @@ class SageGridHandler:
                 if 'date_echeance_ligne' in row_data:
                     line.date_echeance_ligne = row_data['date_echeance_ligne']
                 
-                line.save()
+                lines.append(line)
+            
+            LigneEcriture.objects.bulk_create(lines)
                 
             return True, entry
             
         except Exception as e:
+            # Errors are reported to the caller: make sure the partial entry is not committed
+            transaction.set_rollback(True)
             return False, [str(e)]
 
 
@@ -453,15 +730,8 @@ def search_accounts(request, dossier_pme):
     if not query:
         return JsonResponse({'results': []})
     
-    # Search by account number or name
-    accounts = CompteComptablePME.objects.filter(
-        dossier_pme=dossier_pme,
-        est_actif=True,
-        nature_compte='DETAIL'
-    ).filter(
-        Q(numero_compte__icontains=query) | 
-        Q(intitule_compte__icontains=query)
-    ).order_by('numero_compte')[:20]
+    # Search by account number prefix or label word prefixes (in-memory index)
+    accounts = rechercher_comptes(dossier_pme.pk, query, detail_seulement=True, limite=20)
     
     results = [{
         'numero': acc.numero_compte,
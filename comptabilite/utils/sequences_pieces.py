@@ -0,0 +1,200 @@
+"""
+Séquences de pièces - Numérotation sans trou des pièces d'un journal par exercice
+
+Un compteur SequencePiece par (journal, exercice) est verrouillé (SELECT ... FOR UPDATE) le temps
+d'attribuer les numéros : deux saisies concurrentes ne reçoivent jamais le même numéro, et le coût
+ne dépend pas du nombre de pièces du journal. Le numéro d'une pièce supprimée est libéré (signal
+post_delete) : il fait reculer le compteur s'il était le dernier, sinon il rejoint NumeroPieceLibere
+et est réattribué en priorité, de sorte que la séquence reste continue.
+
+La suggestion affichée dans la saisie (prochain_numero) ne réserve rien : le numéro n'est attribué
+qu'à l'enregistrement de la pièce (numero_pour_enregistrement), et une grille rechargée ou
+abandonnée ne consomme aucun numéro. Un numéro fourni déjà porté par une pièce du journal est
+refusé sous le verrou du compteur (NumeroPieceUtilise) : deux saisies concurrentes du même
+numéro ne créent jamais de doublon.
+
+Format par défaut : code journal + deux derniers chiffres de l'exercice + numéro sur 4 chiffres
+(VE240001), identique à l'ancienne suggestion de suggest_piece_number.
+"""
+import re
+from datetime import date
+from typing import List, Optional
+
+from django.db import IntegrityError, transaction
+
+from comptabilite.models import EcritureComptable, NumeroPieceLibere, SequencePiece
+
+LARGEUR_DEFAUT = 4
+# Au-delà, un numéro saisi manuellement fait avancer le compteur sans remplir le trou dans la réserve
+TROU_MAX_REMPLI = 1000
+
+
+class NumeroPieceUtilise(ValueError):
+    """Numéro de pièce déjà porté par une pièce du journal (ValueError : saisie invalide pour les vues)."""
+
+
+def exercice_de(dossier, jour: date) -> int:
+    """Année de début de l'exercice contenant `jour` (exercice civil par défaut)."""
+    debut = dossier.date_debut_exercice_comptable
+    if debut is None or (jour.month, jour.day) >= (debut.month, debut.day):
+        return jour.year
+    return jour.year - 1
+
+
+def prefixe_par_defaut(journal, exercice: int) -> str:
+    return f"{journal.code_journal}{exercice % 100:02d}"
+
+
+def _rang(sequence: SequencePiece, numero_piece: str) -> Optional[int]:
+    """Numéro séquentiel porté par `numero_piece` s'il appartient à la séquence, sinon None."""
+    if not numero_piece or not numero_piece.startswith(sequence.prefixe):
+        return None
+    suffixe = numero_piece[len(sequence.prefixe):]
+    return int(suffixe) if suffixe.isdigit() else None
+
+
+def _dernier_numero_existant(journal, prefixe: str) -> int:
+    """Plus grand numéro déjà saisi avec ce préfixe (amorçage d'un compteur sur un journal existant)."""
+    dernier = EcritureComptable.objects.filter(
+        journal=journal, numero_piece__regex=rf'^{re.escape(prefixe)}[0-9]+$'
+    ).order_by('-cle_sequence', '-id').values_list('numero_piece', flat=True).first()
+    return int(dernier[len(prefixe):]) if dernier else 0
+
+
+def _sequence_verrouillee(journal, exercice: int) -> SequencePiece:
+    """Compteur du journal pour l'exercice, verrouillé jusqu'à la fin de la transaction (créé au besoin)."""
+    sequence = SequencePiece.objects.select_for_update().filter(journal=journal, exercice=exercice).first()
+    if sequence is not None:
+        return sequence
+    prefixe = prefixe_par_defaut(journal, exercice)
+    try:
+        with transaction.atomic():
+            return SequencePiece.objects.create(
+                journal=journal, exercice=exercice, prefixe=prefixe, largeur=LARGEUR_DEFAUT,
+                dernier_numero=_dernier_numero_existant(journal, prefixe),
+            )
+    except IntegrityError:
+        # Créé entre-temps par une transaction concurrente : on attend son verrou
+        return SequencePiece.objects.select_for_update().get(journal=journal, exercice=exercice)
+
+
+def _liberer_numeros(sequence: SequencePiece, numeros) -> None:
+    NumeroPieceLibere.objects.bulk_create(
+        [NumeroPieceLibere(sequence=sequence, numero=n) for n in numeros], ignore_conflicts=True
+    )
+
+
+@transaction.atomic
+def reserver(journal, jour: date, nombre: int = 1) -> List[str]:
+    """
+    Réserve `nombre` numéros de pièce pour l'exercice de `jour` (numéros libérés d'abord, par ordre
+    croissant, puis numéros neufs). Une requête de verrouillage et au plus trois écritures par appel,
+    quel que soit `nombre` : c'est le point d'entrée des imports en lot.
+    """
+    if nombre < 1:
+        return []
+    sequence = _sequence_verrouillee(journal, exercice_de(journal.dossier_pme, jour))
+    repris = list(sequence.numeros_liberes.order_by('numero').values_list('pk', 'numero')[:nombre])
+    if repris:
+        NumeroPieceLibere.objects.filter(pk__in=[pk for pk, __ in repris]).delete()
+    numeros = [numero for __, numero in repris]
+    neufs = nombre - len(numeros)
+    if neufs:
+        numeros.extend(range(sequence.dernier_numero + 1, sequence.dernier_numero + neufs + 1))
+        sequence.dernier_numero += neufs
+        sequence.save(update_fields=['dernier_numero', 'date_mise_a_jour'])
+    return [sequence.formater(numero) for numero in numeros]
+
+
+@transaction.atomic
+def liberer(journal, numero_piece: str) -> bool:
+    """
+    Rend un numéro qu'aucune pièce ne porte plus (pièce supprimée). `journal` : instance ou clé.
+    Le dernier numéro attribué fait simplement reculer le compteur ; les autres rejoignent la réserve. Retourne False si le numéro n'appartient à aucune
+    séquence du journal ou qu'une pièce le porte déjà.
+    """
+    for sequence in SequencePiece.objects.select_for_update().filter(journal=journal):
+        rang = _rang(sequence, numero_piece)
+        if rang is None or not 0 < rang <= sequence.dernier_numero:
+            continue
+        if EcritureComptable.objects.filter(journal=journal, numero_piece=numero_piece).exists():
+            return False
+        if rang < sequence.dernier_numero:
+            _liberer_numeros(sequence, [rang])
+            return True
+        # Recul du compteur, en absorbant les numéros libérés qui le précèdent immédiatement
+        liberes = set(sequence.numeros_liberes.filter(numero__lt=rang).values_list('numero', flat=True))
+        dernier = rang - 1
+        while dernier in liberes:
+            dernier -= 1
+        sequence.numeros_liberes.filter(numero__gt=dernier).delete()
+        sequence.dernier_numero = dernier
+        sequence.save(update_fields=['dernier_numero', 'date_mise_a_jour'])
+        return True
+    return False
+
+
+@transaction.atomic
+def consommer(journal, jour: date, numero_piece: str) -> None:
+    """
+    Enregistre l'utilisation d'un numéro fourni par l'utilisateur (suggestion réservée ou saisie manuelle) :
+    il quitte la réserve, et un numéro au-delà du compteur le fait avancer. Lève NumeroPieceUtilise
+    si une pièce du journal porte déjà ce numéro (contrôle fait sous le verrou du compteur).
+    """
+    sequence = _sequence_verrouillee(journal, exercice_de(journal.dossier_pme, jour))
+    if EcritureComptable.objects.filter(journal=journal, numero_piece=numero_piece).exists():
+        raise NumeroPieceUtilise(f"Numéro de pièce '{numero_piece}' déjà utilisé dans le journal {journal.code_journal}")
+    rang = _rang(sequence, numero_piece)
+    if rang is None:
+        return
+    if rang <= sequence.dernier_numero:
+        sequence.numeros_liberes.filter(numero=rang).delete()
+        return
+    if rang - sequence.dernier_numero - 1 <= TROU_MAX_REMPLI:
+        _liberer_numeros(sequence, range(sequence.dernier_numero + 1, rang))
+    sequence.dernier_numero = rang
+    sequence.save(update_fields=['dernier_numero', 'date_mise_a_jour'])
+
+
+@transaction.atomic
+def consommer_lot(journal, jour: date, numeros) -> None:
+    """
+    consommer() pour tous les numéros d'un lot du même exercice (imports) : un seul verrou, une
+    suppression dans la réserve et au plus une avance du compteur, sans combler les trous.
+    """
+    sequence = _sequence_verrouillee(journal, exercice_de(journal.dossier_pme, jour))
+    rangs = {rang for rang in (_rang(sequence, numero) for numero in numeros) if rang is not None}
+    if not rangs:
+        return
+    sequence.numeros_liberes.filter(numero__in=rangs).delete()
+    if max(rangs) > sequence.dernier_numero:
+        sequence.dernier_numero = max(rangs)
+        sequence.save(update_fields=['dernier_numero', 'date_mise_a_jour'])
+
+
+def prochain_numero(journal, jour: date) -> str:
+    """
+    Numéro que recevrait la prochaine pièce de l'exercice de `jour`, sans rien réserver (lecture
+    seule, sans verrou) : deux utilisateurs peuvent se voir proposer le même numéro.
+    """
+    exercice = exercice_de(journal.dossier_pme, jour)
+    sequence = SequencePiece.objects.filter(journal=journal, exercice=exercice).first()
+    if sequence is None:
+        sequence = SequencePiece(journal=journal, exercice=exercice,
+                                 prefixe=prefixe_par_defaut(journal, exercice), largeur=LARGEUR_DEFAUT)
+        return sequence.formater(_dernier_numero_existant(journal, sequence.prefixe) + 1)
+    libere = sequence.numeros_liberes.order_by('numero').values_list('numero', flat=True).first()
+    return sequence.formater(libere if libere is not None else sequence.dernier_numero + 1)
+
+
+def numero_pour_enregistrement(journal, jour: date, numero_piece: Optional[str], suggestion: Optional[str] = None) -> str:
+    """
+    Numéro à enregistrer pour une nouvelle pièce : celui fourni (consommé), sinon un numéro réservé.
+    Un numéro égal à la `suggestion` affichée (prochain_numero) est réservé à nouveau sous verrou :
+    s'il a été pris entre-temps, la pièce reçoit le suivant au lieu d'un doublon.
+    """
+    numero_piece = (numero_piece or '').strip()
+    if not numero_piece or numero_piece == (suggestion or '').strip():
+        return reserver(journal, jour)[0]
+    consommer(journal, jour, numero_piece)
+    return numero_piece
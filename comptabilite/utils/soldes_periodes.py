@@ -0,0 +1,207 @@
+"""
+Soldes par période - Maintenance et lecture de la table SoldeComptePeriode
+
+Chaque ligne d'écriture alimente le cumul (dossier, compte, année, mois) de son compte.
+Les signaux de comptabilite/signals.py appliquent les mouvements au fil de l'eau ;
+reconstruire_soldes() et verifier_soldes() permettent de repartir des lignes en cas de doute
+(chargement de fixtures, update() en masse, etc.).
+
+Chaque écriture dans la table remplace, après commit, le jeton de version (cache_versions) des
+années touchées du dossier : empreinte_versions() permet aux états calculés à partir des soldes
+(états financiers...) d'être mis en cache tant qu'aucune de leurs années n'a changé.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Q, Sum, Value, DecimalField
+from django.db.models.functions import Coalesce, ExtractMonth, ExtractYear
+
+from comptabilite.models import LigneEcriture, SoldeComptePeriode
+from comptabilite.utils import cache_versions, clotures
+
+# (dossier_pme_id, compte_general_id, annee, mois)
+CleSolde = Tuple[int, int, int, int]
+
+ZERO = Decimal('0.00')
+TYPES_COMPTES_TRESORERIE = ['TRESORERIE_ACTIF', 'TRESORERIE_PASSIF']
+CLE_VERSION = 'soldes_periodes'
+COMPTES_PAR_VERROU = 200  # (dossier, compte, année) par SELECT ... FOR UPDATE (taille de la clause WHERE)
+
+
+def nouveaux_mouvements() -> Dict[CleSolde, List[Decimal]]:
+    """Dictionnaire cle -> [debit, credit] à passer à appliquer_mouvements()."""
+    return defaultdict(lambda: [ZERO, ZERO])
+
+
+def ajouter_mouvement(mouvements, dossier_id, compte_id, date_ecriture, debit, credit, signe=1):
+    """Cumule un mouvement (signe=-1 pour l'annuler) dans le dictionnaire de mouvements."""
+    cle = (dossier_id, compte_id, date_ecriture.year, date_ecriture.month)
+    mouvements[cle][0] += signe * (debit or ZERO)
+    mouvements[cle][1] += signe * (credit or ZERO)
+
+
+@transaction.atomic
+def appliquer_mouvements(mouvements: Dict[CleSolde, List[Decimal]]) -> None:
+    """
+    Applique des variations de débit/crédit aux soldes par période.
+
+    Un INSERT des périodes manquantes à zéro (ignore_conflicts), un SELECT ... FOR UPDATE par
+    COMPTES_PAR_VERROU comptes-années et un bulk_update. L'insertion préalable rend la création
+    concurrente d'une même période sûre : la transaction qui arrive en second ignore le conflit
+    puis attend le verrou de la ligne au lieu d'échouer sur l'unicité (dossier, compte, année, mois).
+    Seules les périodes modifiées sont verrouillées, toujours dans l'ordre de la clé : deux
+    transactions sur des comptes communs (import et saisie) s'attendent sans interblocage.
+    """
+    mouvements = {cle: valeurs for cle, valeurs in mouvements.items() if valeurs[0] or valeurs[1]}
+    if not mouvements:
+        return
+
+    SoldeComptePeriode.objects.bulk_create([
+        SoldeComptePeriode(
+            dossier_pme_id=cle[0], compte_general_id=cle[1], annee=cle[2], mois=cle[3],
+            total_debit=ZERO, total_credit=ZERO,
+        )
+        for cle in sorted(mouvements)
+    ], ignore_conflicts=True)
+
+    mois_par_compte = defaultdict(list)
+    for dossier_pk, compte_pk, annee, mois in sorted(mouvements):
+        mois_par_compte[(dossier_pk, compte_pk, annee)].append(mois)
+    mois_par_compte = list(mois_par_compte.items())
+    a_mettre_a_jour = []
+    for debut in range(0, len(mois_par_compte), COMPTES_PAR_VERROU):
+        cles = Q(*(
+            Q(dossier_pme_id=dossier_pk, compte_general_id=compte_pk, annee=annee, mois__in=mois)
+            for (dossier_pk, compte_pk, annee), mois in mois_par_compte[debut:debut + COMPTES_PAR_VERROU]
+        ), _connector=Q.OR)
+        for solde in SoldeComptePeriode.objects.select_for_update().filter(cles).order_by(
+            'dossier_pme_id', 'compte_general_id', 'annee', 'mois'
+        ):
+            valeurs = mouvements[(solde.dossier_pme_id, solde.compte_general_id, solde.annee, solde.mois)]
+            solde.total_debit += valeurs[0]
+            solde.total_credit += valeurs[1]
+            a_mettre_a_jour.append(solde)
+    SoldeComptePeriode.objects.bulk_update(a_mettre_a_jour, ['total_debit', 'total_credit'])
+    invalider_versions({(cle[0], cle[2]) for cle in mouvements})
+
+
+def invalider_versions(annees_modifiees) -> None:
+    """Nouveau jeton, après commit, pour chaque (dossier_pk, année) modifié."""
+    annees_modifiees = set(annees_modifiees)
+    transaction.on_commit(lambda: [cache_versions.invalider(CLE_VERSION, *cle) for cle in annees_modifiees])
+
+
+def empreinte_versions(dossier_pk: int, annee_debut: int, annee_fin: int) -> str:
+    """Jetons de version des soldes du dossier pour les années données (incluses)."""
+    return ':'.join([
+        cache_versions.version_courante(CLE_VERSION),
+        cache_versions.version_courante(CLE_VERSION, dossier_pk),
+        *(cache_versions.version_courante(CLE_VERSION, dossier_pk, annee) for annee in range(annee_debut, annee_fin + 1)),
+    ])
+
+
+def mouvements_depuis_lignes(filtre_lignes) -> Dict[CleSolde, List[Decimal]]:
+    """Agrège en une requête groupée les lignes du queryset donné par clé de solde."""
+    mouvements = nouveaux_mouvements()
+    agregats = filtre_lignes.values(
+        'ecriture__dossier_pme_id', 'compte_general_id',
+    ).annotate(
+        annee=ExtractYear('ecriture__date_ecriture'),
+        mois=ExtractMonth('ecriture__date_ecriture'),
+    ).values(
+        'ecriture__dossier_pme_id', 'compte_general_id', 'annee', 'mois',
+    ).annotate(
+        total_debit=Coalesce(Sum('debit'), Value(ZERO), output_field=DecimalField()),
+        total_credit=Coalesce(Sum('credit'), Value(ZERO), output_field=DecimalField()),
+    ).order_by()
+    for agg in agregats:
+        cle = (agg['ecriture__dossier_pme_id'], agg['compte_general_id'], agg['annee'], agg['mois'])
+        mouvements[cle][0] += agg['total_debit']
+        mouvements[cle][1] += agg['total_credit']
+    return mouvements
+
+
+@transaction.atomic
+def reconstruire_soldes(dossier=None) -> int:
+    """Recalcule entièrement les soldes par période (d'un dossier ou de tous). Retourne le nombre de soldes créés."""
+    soldes = SoldeComptePeriode.objects.all()
+    lignes = LigneEcriture.objects.all()
+    if dossier is not None:
+        soldes = soldes.filter(dossier_pme=dossier)
+        lignes = lignes.filter(ecriture__dossier_pme=dossier)
+    soldes.delete()
+    a_creer = [
+        SoldeComptePeriode(
+            dossier_pme_id=cle[0], compte_general_id=cle[1], annee=cle[2], mois=cle[3],
+            total_debit=debit, total_credit=credit,
+        )
+        for cle, (debit, credit) in mouvements_depuis_lignes(lignes).items()
+    ]
+    SoldeComptePeriode.objects.bulk_create(a_creer, batch_size=1000)
+    transaction.on_commit(lambda: cache_versions.invalider(CLE_VERSION, *([dossier.pk] if dossier is not None else [])))
+    return len(a_creer)
+
+
+def verifier_soldes(dossier=None) -> List[dict]:
+    """Compare la table des soldes aux lignes d'écriture. Retourne la liste des écarts constatés."""
+    soldes = SoldeComptePeriode.objects.all()
+    lignes = LigneEcriture.objects.all()
+    if dossier is not None:
+        soldes = soldes.filter(dossier_pme=dossier)
+        lignes = lignes.filter(ecriture__dossier_pme=dossier)
+    attendus = mouvements_depuis_lignes(lignes)
+    stockes = {
+        (s['dossier_pme_id'], s['compte_general_id'], s['annee'], s['mois']): [s['total_debit'], s['total_credit']]
+        for s in soldes.values('dossier_pme_id', 'compte_general_id', 'annee', 'mois', 'total_debit', 'total_credit')
+    }
+    ecarts = []
+    for cle in set(attendus) | set(stockes):
+        attendu = attendus.get(cle, [ZERO, ZERO])
+        stocke = stockes.get(cle, [ZERO, ZERO])
+        if attendu[0] != stocke[0] or attendu[1] != stocke[1]:
+            ecarts.append({
+                'dossier_pme_id': cle[0], 'compte_general_id': cle[1], 'annee': cle[2], 'mois': cle[3],
+                'debit_attendu': attendu[0], 'credit_attendu': attendu[1],
+                'debit_stocke': stocke[0], 'credit_stocke': stocke[1],
+            })
+    return ecarts
+
+
+# --- Lecture ---
+
+def _totaux(soldes) -> Dict[str, Decimal]:
+    return soldes.aggregate(
+        total_debits=Coalesce(Sum('total_debit'), Value(ZERO), output_field=DecimalField()),
+        total_credits=Coalesce(Sum('total_credit'), Value(ZERO), output_field=DecimalField()),
+    )
+
+
+def totaux_periode(dossier, annee: int, mois: Optional[int] = None) -> Dict[str, Decimal]:
+    """Totaux débit/crédit de tous les comptes pour un mois (ou une année si mois=None)."""
+    soldes = SoldeComptePeriode.objects.filter(dossier_pme=dossier, annee=annee)
+    if mois is not None:
+        soldes = soldes.filter(mois=mois)
+    return _totaux(soldes)
+
+
+def totaux_classe(dossier, annee: int, prefixe: str) -> Dict[str, Decimal]:
+    """Totaux débit/crédit d'une année pour les comptes dont le numéro commence par `prefixe` (ex: '7')."""
+    return _totaux(SoldeComptePeriode.objects.filter(
+        dossier_pme=dossier, annee=annee, compte_general__numero_compte__startswith=prefixe
+    ))
+
+
+def solde_tresorerie(dossier) -> Decimal:
+    """Solde global des comptes de trésorerie actifs du dossier (depuis les à-nouveaux de la dernière clôture d'exercice)."""
+    soldes = SoldeComptePeriode.objects.filter(
+        dossier_pme=dossier,
+        compte_general__type_compte__in=TYPES_COMPTES_TRESORERIE,
+        compte_general__est_actif=True,
+    )
+    origine = clotures.origine_report(dossier)
+    if origine:
+        soldes = soldes.filter(Q(annee__gt=origine.year) | Q(annee=origine.year, mois__gte=origine.month))
+    totaux = _totaux(soldes)
+    return totaux['total_debits'] - totaux['total_credits']
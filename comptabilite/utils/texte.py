@@ -0,0 +1,42 @@
+"""
+Normalisation de texte pour la recherche (accents, casse, ponctuation)
+"""
+import re
+import unicodedata
+from typing import List
+
+_SEPARATEURS = re.compile(r'[^0-9a-z]+')
+
+
+def normaliser(texte: str) -> str:
+    """Minuscules sans accents ('Créances' -> 'creances')."""
+    decompose = unicodedata.normalize('NFKD', texte or '')
+    return ''.join(c for c in decompose if not unicodedata.combining(c)).lower()
+
+
+def mots(texte: str) -> List[str]:
+    """Mots normalisés du texte ('F-DURAND & Fils' -> ['f', 'durand', 'fils'])."""
+    return [mot for mot in _SEPARATEURS.split(normaliser(texte)) if mot]
+
+
+def cle_recherche(*textes: str) -> str:
+    """Clé de recherche : mots normalisés des textes séparés par une espace."""
+    return ' '.join(mot for texte in textes for mot in mots(texte))
+
+
+_SEGMENTS_NUMERIQUES = re.compile(r'(\d+)')
+
+
+def cle_sequence(numero: str) -> str:
+    """
+    Clé de tri « naturel » d'un numéro de pièce : chaque nombre est préfixé de sa longueur,
+    de sorte que l'ordre alphabétique des clés suive l'ordre numérique ('VE9' < 'VE10').
+    """
+    segments = []
+    for i, segment in enumerate(_SEGMENTS_NUMERIQUES.split((numero or '').strip())):
+        if i % 2:
+            chiffres = segment.lstrip('0') or '0'
+            segments.append(f"{len(chiffres):02d}{chiffres}")
+        else:
+            segments.append(normaliser(segment))
+    return ''.join(segments)
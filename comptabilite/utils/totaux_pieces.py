@@ -0,0 +1,122 @@
+"""
+Totaux des pièces - Maintenance et rapprochement de EcritureComptable.total_debit / total_credit /
+nombre_lignes / est_desequilibree
+
+Les signaux des lignes (comptabilite/signals.py) appliquent des variations par UPDATE ... SET x = x + delta,
+sans relire la pièce, et recalculent dans la même requête l'indicateur est_desequilibree (registre des
+pièces déséquilibrées, couvert par un index partiel). reconstruire_totaux() et verifier_totaux()
+repartent des lignes en cas de doute (fixtures, update() en masse, etc.).
+"""
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, Iterable, List, Tuple
+
+from django.db import transaction
+from django.db.models import BooleanField, Case, Count, DecimalField, F, Sum, Value, When
+from django.db.models.functions import Abs, Coalesce
+from django.db.models.lookups import GreaterThanOrEqual
+
+from comptabilite.models import EcritureComptable, LigneEcriture
+
+ZERO = Decimal('0.00')
+SEUIL_DESEQUILIBRE = Decimal('0.001')  # même seuil que EcritureComptable.est_equilibree
+
+# ecriture_id -> [debit, credit, nombre_lignes]
+Variations = Dict[int, List]
+
+
+def nouvelles_variations() -> Variations:
+    return defaultdict(lambda: [ZERO, ZERO, 0])
+
+
+def ajouter_ligne(variations: Variations, ecriture_id, debit, credit, signe=1):
+    """Cumule l'ajout (signe=1) ou le retrait (signe=-1) d'une ligne de la pièce."""
+    valeurs = variations[ecriture_id]
+    valeurs[0] += signe * (debit or ZERO)
+    valeurs[1] += signe * (credit or ZERO)
+    valeurs[2] += signe
+
+
+def appliquer_variations(variations: Variations, ecritures: Iterable[EcritureComptable] = ()) -> None:
+    """
+    Applique les variations en base (une requête UPDATE par pièce, sans lecture préalable),
+    puis sur les instances de pièces déjà chargées en mémoire passées dans `ecritures`.
+    """
+    variations = {pk: v for pk, v in variations.items() if v[0] or v[1] or v[2]}
+    for ecriture_id, (debit, credit, lignes) in variations.items():
+        # Dans un UPDATE, les F() désignent les valeurs avant modification
+        ecart = Abs(F('total_debit') + Value(debit) - F('total_credit') - Value(credit))
+        EcritureComptable.objects.filter(pk=ecriture_id).update(
+            total_debit=F('total_debit') + debit,
+            total_credit=F('total_credit') + credit,
+            nombre_lignes=F('nombre_lignes') + lignes,
+            est_desequilibree=Case(
+                When(GreaterThanOrEqual(ecart, SEUIL_DESEQUILIBRE), then=Value(True)),
+                default=Value(False), output_field=BooleanField(),
+            ),
+        )
+    deja_vues = set()
+    for ecriture in ecritures:
+        if ecriture is None or id(ecriture) in deja_vues or ecriture.pk not in variations:
+            continue
+        deja_vues.add(id(ecriture))
+        debit, credit, lignes = variations[ecriture.pk]
+        ecriture.total_debit += debit
+        ecriture.total_credit += credit
+        ecriture.nombre_lignes += lignes
+        ecriture.est_desequilibree = not ecriture.est_equilibree
+
+
+def _totaux_depuis_lignes(ecritures) -> Dict[int, Tuple[Decimal, Decimal, int]]:
+    agregats = LigneEcriture.objects.filter(ecriture__in=ecritures).values('ecriture_id').annotate(
+        debit=Coalesce(Sum('debit'), Value(ZERO), output_field=DecimalField()),
+        credit=Coalesce(Sum('credit'), Value(ZERO), output_field=DecimalField()),
+        lignes=Count('pk'),
+    ).order_by()
+    return {agg['ecriture_id']: (agg['debit'], agg['credit'], agg['lignes']) for agg in agregats}
+
+
+def verifier_totaux(dossier=None) -> List[dict]:
+    """Compare les totaux stockés aux lignes. Retourne la liste des pièces en écart."""
+    ecritures = EcritureComptable.objects.all()
+    if dossier is not None:
+        ecritures = ecritures.filter(dossier_pme=dossier)
+    attendus = _totaux_depuis_lignes(ecritures)
+    ecarts = []
+    for pk, numero_piece, debit, credit, lignes, desequilibree in ecritures.values_list(
+        'pk', 'numero_piece', 'total_debit', 'total_credit', 'nombre_lignes', 'est_desequilibree'
+    ).order_by('pk').iterator(chunk_size=2000):
+        attendu = attendus.get(pk, (ZERO, ZERO, 0))
+        desequilibree_attendu = abs(attendu[0] - attendu[1]) >= SEUIL_DESEQUILIBRE
+        if (debit, credit, lignes, desequilibree) != (*attendu, desequilibree_attendu):
+            ecarts.append({
+                'ecriture_id': pk, 'numero_piece': numero_piece,
+                'debit_attendu': attendu[0], 'credit_attendu': attendu[1], 'lignes_attendues': attendu[2],
+                'desequilibree_attendu': desequilibree_attendu,
+                'debit_stocke': debit, 'credit_stocke': credit, 'lignes_stockees': lignes,
+                'desequilibree_stocke': desequilibree,
+            })
+    return ecarts
+
+
+@transaction.atomic
+def reconstruire_totaux(dossier=None) -> int:
+    """Corrige les pièces dont les totaux stockés divergent des lignes. Retourne le nombre de pièces corrigées."""
+    ecarts = verifier_totaux(dossier)
+    a_corriger = [
+        EcritureComptable(
+            pk=ecart['ecriture_id'],
+            total_debit=ecart['debit_attendu'],
+            total_credit=ecart['credit_attendu'],
+            nombre_lignes=ecart['lignes_attendues'],
+            est_desequilibree=ecart['desequilibree_attendu'],
+        )
+        for ecart in ecarts
+    ]
+    EcritureComptable.objects.bulk_update(a_corriger, list(EcritureComptable.CHAMPS_TOTAUX), batch_size=1000)
+    return len(a_corriger)
+
+
+def pieces_desequilibrees(dossier):
+    """Pièces déséquilibrées du dossier, plus récentes d'abord (servies par l'index partiel)."""
+    return EcritureComptable.objects.filter(dossier_pme=dossier, est_desequilibree=True).order_by('-date_ecriture', '-id')
@@ -7,9 +7,12 @@ from django.db import transaction, IntegrityError
 from datetime import date, timedelta
 from django.db.models import Sum, Q, Value, DecimalField, F, Max # Ajout de Max
 from django.db.models.functions import Coalesce
-from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse # Ajout de JsonResponse
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse # Ajout de JsonResponse
 from django.utils.translation import gettext_lazy as _
+from django.utils.dateparse import parse_date
 from decimal import Decimal
+import csv
+import io
 import json
 from django.core.management import call_command
 from django.conf import settings
@@ -17,13 +20,14 @@ import os
 from django.template.loader import render_to_string
 from django.views.decorators.http import require_POST # Pour la nouvelle vue AJAX
 from django.core.serializers.json import DjangoJSONEncoder # Pour sérialiser les objets QuerySet
+from django.core.paginator import Paginator
 from django.http import Http404 # Import Http404 for explicit handling
 import logging # Add this import
 logger = logging.getLogger(__name__) # Add this for logging
 from dossiers_pme.models import DossierPME
 from .models import (
     CompteComptablePME, EcritureComptable, JournalComptable, 
-    LigneEcriture, Tiers, TauxDeTaxe, CompteComptableDefaut
+    LigneEcriture, Tiers, TauxDeTaxe, CompteComptableDefaut, ImportEcritures, ClotureComptable
 )
 from .forms import (
     CompteComptablePMEForm,
@@ -33,7 +37,13 @@ from .forms import (
     LigneEcritureSaisieForm, # Ajout de l'import manquant
     JournalComptableForm,
     TiersForm, 
-    TauxDeTaxeForm 
+    TauxDeTaxeForm,
+    ImportEcrituresForm,
+    ClotureForm
+)
+from .utils import (
+    balance_agee, balance_generale, cloture_comptable, clotures, etats_financiers, export_fec, grand_livre, import_ecritures, indicateurs_dossier,
+    plan_comptable, plan_reference, sequences_pieces, totaux_pieces,
 )
 
 def get_mois_courant_dates():
@@ -72,92 +82,39 @@ def tableau_bord_compta_view(request, dossier_pk):
         mois_selectionne = current_month
         
     premier_jour_periode = date(annee_selectionnee, mois_selectionne, 1)
-    if mois_selectionne == 12:
-        dernier_jour_periode = date(annee_selectionnee, mois_selectionne, 31)
-    else:
-        dernier_jour_periode = date(annee_selectionnee, mois_selectionne + 1, 1) - timedelta(days=1)
-        
-    nombre_comptes_plan = CompteComptablePME.objects.filter(dossier_pme=dossier, est_actif=True).count()
-    nombre_journaux_actifs = JournalComptable.objects.filter(dossier_pme=dossier, est_actif=True).count()
-    nombre_tiers_actifs = Tiers.objects.filter(dossier_pme=dossier, est_actif=True).count()
-    
-    nombre_ecritures_periode = 0
-    total_debits_periode = Decimal(0)
-    total_credits_periode = Decimal(0)
-    solde_tresorerie = Decimal(0)
-    dernieres_ecritures = EcritureComptable.objects.none() # Initialisation
 
+    # Indicateurs servis depuis le cache par dossier et par période (invalidé par les signaux d'écriture)
+    indicateurs = {
+        'nombre_comptes_plan': 0, 'nombre_journaux_actifs': 0, 'nombre_tiers_actifs': 0,
+        'nombre_ecritures_periode': 0, 'total_debits_periode': Decimal(0), 'total_credits_periode': Decimal(0),
+        'solde_tresorerie': Decimal(0), 'dernieres_ecritures': [],
+        'nombre_pieces_desequilibrees': 0, 'pieces_desequilibrees': [],
+    }
     try:
-        # KPIs pour la période sélectionnée
-        ecritures_periode_queryset = EcritureComptable.objects.filter(
-            dossier_pme=dossier, 
-            date_ecriture__gte=premier_jour_periode, 
-            date_ecriture__lte=dernier_jour_periode
-        )
-        
-        nombre_ecritures_periode = ecritures_periode_queryset.count()
-
-        periode_totals = ecritures_periode_queryset.aggregate(
-            total_debits=Coalesce(Sum('lignes_ecriture__debit'), Value(Decimal(0), output_field=DecimalField())),
-            total_credits=Coalesce(Sum('lignes_ecriture__credit'), Value(Decimal(0), output_field=DecimalField()))
-        )
-        total_debits_periode = periode_totals['total_debits']
-        total_credits_periode = periode_totals['total_credits']
-            
-        # Dernières écritures (indépendant de la période sélectionnée pour les KPIs)
-        dernieres_ecritures = EcritureComptable.objects.filter(
-            dossier_pme=dossier
-        ).select_related('journal').order_by('-date_ecriture', '-id')[:5]
-        
-        # Solde de trésorerie global
-        comptes_tresorerie_pks = CompteComptablePME.objects.filter(
-            dossier_pme=dossier, 
-            type_compte__in=['TRESORERIE_ACTIF', 'TRESORERIE_PASSIF'], 
-            est_actif=True
-        ).values_list('pk', flat=True)
-        
-        if comptes_tresorerie_pks:
-            solde_agg = LigneEcriture.objects.filter(
-                compte_general_id__in=list(comptes_tresorerie_pks), 
-                ecriture__dossier_pme=dossier
-            ).aggregate(
-                total_debits=Coalesce(Sum('debit'), Value(Decimal(0), output_field=DecimalField())),
-                total_credits=Coalesce(Sum('credit'), Value(Decimal(0), output_field=DecimalField()))
-            )
-            solde_tresorerie = solde_agg['total_debits'] - solde_agg['total_credits']
-            
+        indicateurs.update(indicateurs_dossier.indicateurs_tableau_bord(dossier, annee_selectionnee, mois_selectionne))
     except Exception as e:
         messages.warning(request, _("Erreur lors du calcul des KPIs du TDB Compta: %(error)s") % {'error': e})
+    total_debits_periode = indicateurs['total_debits_periode']
+    total_credits_periode = indicateurs['total_credits_periode']
 
-    # Alertes comptables
+    # Alertes comptables : registre des pièces déséquilibrées tenu à jour à l'écriture (index partiel)
     alertes_comptables = []
-    count_desequilibrees = 0
-    ecritures_desequilibrees = EcritureComptable.objects.filter(dossier_pme=dossier).annotate(
-        total_debit_lignes_agg=Coalesce(Sum('lignes_ecriture__debit'), Value(Decimal(0))),
-        total_credit_lignes_agg=Coalesce(Sum('lignes_ecriture__credit'), Value(Decimal(0)))
-    ).annotate(
-        solde_piece_agg=F('total_debit_lignes_agg') - F('total_credit_lignes_agg')
-    ).filter(
-        Q(solde_piece_agg__gt=Decimal('0.001')) | Q(solde_piece_agg__lt=Decimal('-0.001'))
-    )
+    count_desequilibrees = indicateurs['nombre_pieces_desequilibrees']
     
-    count_desequilibrees = ecritures_desequilibrees.count()
-    
-    for ecriture_check in ecritures_desequilibrees[:3]: # Limiter à 3 pour l'affichage détaillé
+    for ecriture_check in indicateurs['pieces_desequilibrees']: # Limité à 3 pour l'affichage détaillé
         alertes_comptables.append({
             'type': 'danger',
             'message': _("Pièce N°%(num)s (%(date)s) déséquilibrée (D: %(debit).2f, C: %(credit).2f).") % {
                 'num': ecriture_check.numero_piece or ecriture_check.pk,
                 'date': ecriture_check.date_ecriture.strftime('%d/%m/%Y'),
-                'debit': ecriture_check.total_debit_lignes_agg,
-                'credit': ecriture_check.total_credit_lignes_agg,
+                'debit': ecriture_check.total_debit,
+                'credit': ecriture_check.total_credit,
             },
             'url': reverse('comptabilite:saisie_piece', kwargs={
                 'dossier_pk': dossier.pk,
                 'journal_pk': ecriture_check.journal.pk,
                 'annee': ecriture_check.date_ecriture.year,
                 'mois': ecriture_check.date_ecriture.month,
-                'piece_pk': ecriture_check.pk # Ajout du PK de la pièce pour l'édition directe
             })
         })
     
@@ -191,21 +148,56 @@ def tableau_bord_compta_view(request, dossier_pk):
         'annees_disponibles': annees_disponibles,
         'mois_disponibles': mois_disponibles,
         'premier_jour_periode': premier_jour_periode, # Ajouté pour affichage
-        'kpi_nombre_comptes_plan': nombre_comptes_plan,
-        'kpi_nombre_journaux_actifs': nombre_journaux_actifs,
-        'kpi_nombre_tiers_actifs': nombre_tiers_actifs,
-        'kpi_nombre_ecritures_periode': nombre_ecritures_periode, # Renommé pour clarté
+        'kpi_nombre_comptes_plan': indicateurs['nombre_comptes_plan'],
+        'kpi_nombre_journaux_actifs': indicateurs['nombre_journaux_actifs'],
+        'kpi_nombre_tiers_actifs': indicateurs['nombre_tiers_actifs'],
+        'kpi_nombre_ecritures_periode': indicateurs['nombre_ecritures_periode'], # Renommé pour clarté
         'kpi_total_debits_periode': total_debits_periode,       # Renommé pour clarté
         'kpi_total_credits_periode': total_credits_periode,     # Renommé pour clarté
         'kpi_solde_periode': total_debits_periode - total_credits_periode,
-        'kpi_solde_tresorerie_global': solde_tresorerie,
+        'kpi_solde_tresorerie_global': indicateurs['solde_tresorerie'],
         'kpi_prochaine_echeance_valeur': kpi_prochaine_echeance_valeur,
         'kpi_prochaine_echeance_libelle': kpi_prochaine_echeance_libelle,
-        'dernieres_ecritures': dernieres_ecritures,
+        'dernieres_ecritures': indicateurs['dernieres_ecritures'],
         'alertes_comptables': alertes_comptables,
+        'natures_balance_agee': [('clients', _("Encours clients")), ('fournisseurs', _("Encours fournisseurs"))],
     }
     return render(request, 'comptabilite/tableau_bord_compta.html', context)
 
+@login_required
+def pieces_desequilibrees_view(request, dossier_pk):
+    """Liste paginée (JSON) des pièces déséquilibrées du dossier, plus récentes d'abord."""
+    dossier = get_object_or_404(DossierPME, pk=dossier_pk)
+    try:
+        taille_page = min(max(int(request.GET.get('page_size', 25)), 1), 100)
+    except (TypeError, ValueError):
+        taille_page = 25
+    paginator = Paginator(totaux_pieces.pieces_desequilibrees(dossier).select_related('journal'), taille_page)
+    page = paginator.get_page(request.GET.get('page'))
+    return JsonResponse({
+        'results': [{
+            'pk': ecriture.pk,
+            'numero_piece': ecriture.numero_piece,
+            'date_ecriture': ecriture.date_ecriture.isoformat(),
+            'journal': ecriture.journal.code_journal,
+            'libelle_piece': ecriture.libelle_piece,
+            'total_debit': ecriture.total_debit,
+            'total_credit': ecriture.total_credit,
+            'ecart': ecriture.solde_piece,
+            'url': reverse('comptabilite:saisie_piece', kwargs={
+                'dossier_pk': dossier.pk,
+                'journal_pk': ecriture.journal_id,
+                'annee': ecriture.date_ecriture.year,
+                'mois': ecriture.date_ecriture.month,
+            }),
+        } for ecriture in page],
+        'pagination': {
+            'page': page.number, 'page_size': taille_page,
+            'num_pages': paginator.num_pages, 'count': paginator.count,
+            'has_more': page.has_next(),
+        },
+    }, encoder=DjangoJSONEncoder)
+
 @login_required
 def plan_comptable_view(request, dossier_pk):
     dossier = get_object_or_404(DossierPME, pk=dossier_pk)
@@ -324,6 +316,7 @@ def charger_plan_comptable_defaut_view(request):
     try:
         nombre_comptes_avant = CompteComptableDefaut.objects.count()
         call_command('loaddata', fixture_name, app_label='comptabilite')
+        plan_reference.invalider_plan_reference()
         nombre_comptes_apres = CompteComptableDefaut.objects.count()
         comptes_charges = nombre_comptes_apres - nombre_comptes_avant
         if comptes_charges > 0:
@@ -339,22 +332,17 @@ def charger_plan_comptable_defaut_view(request):
 @transaction.atomic
 def initialiser_plan_pme_depuis_defaut_view(request, dossier_pk):
     dossier = get_object_or_404(DossierPME, pk=dossier_pk)
-    comptes_defaut = CompteComptableDefaut.objects.all()
-    if not comptes_defaut.exists():
+    if not plan_reference.get_plan_reference():
         messages.error(request, _("Aucun compte SYSCOHADA par défaut trouvé. Chargez-les d'abord."))
         return redirect('comptabilite:plan_comptable', dossier_pk=dossier.pk)
     
-    # Utiliser la logique du signal pour la création
-    # Le signal est déjà connecté et s'exécute à la création d'un DossierPME.
-    # Si on veut forcer une réinitialisation, il faudrait une logique plus complexe
-    # pour supprimer les comptes PME existants (avec précautions) avant de recréer.
-    # Pour l'instant, on simule une "initialisation" si aucun compte PME n'existe.
-    if not CompteComptablePME.objects.filter(dossier_pme=dossier).exists():
-        from comptabilite.signals import creer_plan_comptable_pour_nouveau_dossier
-        # Le signal s'attend à `created=True` pour un nouveau dossier.
-        # Ici, on l'appelle manuellement pour un dossier existant mais sans plan.
-        creer_plan_comptable_pour_nouveau_dossier(sender=DossierPME, instance=dossier, created=True)
-        messages.success(request, _("Plan comptable PME initialisé à partir du plan SYSCOHADA par défaut."))
+    # Initialisation uniquement si le dossier n'a pas encore de plan PME : une réinitialisation
+    # demanderait de supprimer (avec précautions) les comptes PME existants avant de recréer.
+    rapport = plan_comptable.cloner_plan_syscohada(dossier)
+    if rapport:
+        messages.success(request, _("Plan comptable PME initialisé à partir du plan SYSCOHADA par défaut (%(count)s comptes, %(ms)s ms).") % {
+            'count': rapport.comptes_crees, 'ms': round(rapport.duree_secondes * 1000)
+        })
     else:
         messages.info(request, _("Le plan comptable PME existe déjà pour ce dossier."))
         
@@ -707,6 +695,270 @@ def saisie_selection_journal_periode_view(request, dossier_pk):
     }
     return render(request, 'comptabilite/saisie_selection_journal_periode.html', context)
 
+@login_required
+def balance_generale_view(request, dossier_pk):
+    """
+    Balance générale du dossier (?date_debut=&date_fin=, exercice en cours par défaut).
+    ?format=csv ou ?format=json pour l'export ; ?tous=1 inclut les comptes sans mouvement.
+    """
+    dossier = get_object_or_404(DossierPME, pk=dossier_pk)
+    try:
+        date_debut, date_fin = export_fec.bornes_demandees(
+            dossier, None, parse_date(request.GET.get('date_debut') or ''), parse_date(request.GET.get('date_fin') or ''),
+        )
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    balance = balance_generale.calculer_balance(
+        dossier, date_debut, date_fin, comptes_sans_mouvement=request.GET.get('tous') in ('1', 'true'),
+    )
+    format_sortie = request.GET.get('format')
+    if format_sortie == 'json':
+        return JsonResponse(balance.vers_dict())
+    if format_sortie == 'csv':
+        response = HttpResponse(content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="balance_{dossier.pk}_{date_debut:%Y%m%d}_{date_fin:%Y%m%d}.csv"'
+        response.write('\ufeff')  # BOM : ouverture directe dans Excel
+        csv.writer(response, delimiter=';').writerows(balance_generale.lignes_csv(balance))
+        return response
+
+    context = {
+        'dossier': dossier,
+        'balance': balance,
+        'page_title': _("Balance Générale"),
+        'niveaux_breadcrumb': [
+            {'url': reverse('core:home'), 'label': _('TDB Global')},
+            {'url': reverse('dossiers_pme:detail_dossier', kwargs={'pk': dossier.pk}), 'label': dossier.nom_dossier},
+            {'url': reverse('comptabilite:tableau_bord_compta', kwargs={'dossier_pk': dossier.pk}), 'label': _('Comptabilité')},
+            {'label': _("Balance Générale")}
+        ]
+    }
+    return render(request, 'comptabilite/balance_generale.html', context)
+
+@login_required
+def grand_livre_view(request, dossier_pk):
+    """
+    Grand livre avec solde progressif, page par page (?cursor=). Filtres : compte_debut, compte_fin,
+    journal, tiers, date_debut, date_fin (exercice en cours par défaut).
+    ?format=json pour une page, ?format=ndjson pour toutes les lignes en flux.
+    """
+    dossier = get_object_or_404(DossierPME, pk=dossier_pk)
+    filtres = {cle: request.GET.get(cle, '').strip() for cle in ('compte_debut', 'compte_fin', 'journal', 'tiers')}
+    try:
+        date_debut, date_fin = export_fec.bornes_demandees(
+            dossier, None, parse_date(request.GET.get('date_debut') or ''), parse_date(request.GET.get('date_fin') or ''),
+        )
+        taille = int(request.GET.get('page_size') or grand_livre.TAILLE_PAGE_DEFAUT)
+        curseur = request.GET.get('cursor') or None
+        if curseur:
+            grand_livre.decoder_curseur(curseur)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    lignes = grand_livre.filtrer_lignes(dossier, **filtres)
+    # Les soldes figés des clôtures de mois sont par compte : inutilisables pour une sélection par journal ou tiers
+    soldes_figes = not (filtres['journal'] or filtres['tiers'])
+
+    format_sortie = request.GET.get('format')
+    if format_sortie == 'ndjson':
+        return StreamingHttpResponse(
+            (json.dumps(grand_livre.ligne_vers_dict(ligne), ensure_ascii=False) + '\n'
+             for ligne in grand_livre.iterer_grand_livre(
+                 dossier, lignes, date_debut, date_fin, curseur, soldes_figes=soldes_figes,
+             )),
+            content_type='application/x-ndjson; charset=utf-8',
+        )
+    page, reports, suivant = grand_livre.page_grand_livre(
+        dossier, lignes, date_debut, date_fin, curseur, taille, soldes_figes=soldes_figes,
+    )
+    if format_sortie == 'json':
+        return JsonResponse({
+            'lignes': [grand_livre.ligne_vers_dict(ligne) for ligne in page],
+            'reports': reports,
+            'next_cursor': suivant,
+        })
+
+    comptes = []
+    for ligne in page:
+        if not comptes or comptes[-1]['numero'] != ligne['compte']:
+            comptes.append({'numero': ligne['compte'], 'intitule': ligne['intitule_compte'],
+                            'report': reports[ligne['compte']], 'lignes': []})
+        comptes[-1]['lignes'].append(ligne)
+    parametres = request.GET.copy()
+    parametres.pop('cursor', None)
+    context = {
+        'dossier': dossier,
+        'comptes': comptes,
+        'filtres': filtres,
+        'date_debut': date_debut,
+        'date_fin': date_fin,
+        'parametres': parametres.urlencode(),
+        'curseur_suivant': suivant,
+        'page_title': _("Grand Livre"),
+        'niveaux_breadcrumb': [
+            {'url': reverse('core:home'), 'label': _('TDB Global')},
+            {'url': reverse('dossiers_pme:detail_dossier', kwargs={'pk': dossier.pk}), 'label': dossier.nom_dossier},
+            {'url': reverse('comptabilite:tableau_bord_compta', kwargs={'dossier_pk': dossier.pk}), 'label': _('Comptabilité')},
+            {'label': _("Grand Livre")}
+        ]
+    }
+    return render(request, 'comptabilite/grand_livre.html', context)
+
+@login_required
+def balance_agee_view(request, dossier_pk):
+    """
+    Balance âgée des clients ou fournisseurs (?nature=clients|fournisseurs) au ?date= (aujourd'hui par défaut).
+    ?format=json pour le tableau de bord, ?format=csv pour l'export.
+    """
+    dossier = get_object_or_404(DossierPME, pk=dossier_pk)
+    nature = request.GET.get('nature') or 'clients'
+    date_reference = parse_date(request.GET.get('date') or '') if request.GET.get('date') else date.today()
+    if date_reference is None or nature not in balance_agee.NATURES:
+        return HttpResponseBadRequest(_("Nature ou date de référence invalide."))
+    balance = balance_agee.calculer_balance_agee(dossier, nature, date_reference)
+    format_sortie = request.GET.get('format')
+    if format_sortie == 'json':
+        return JsonResponse(balance.vers_dict())
+    if format_sortie == 'csv':
+        response = HttpResponse(content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="balance_agee_{nature}_{dossier.pk}_{date_reference:%Y%m%d}.csv"'
+        response.write('\ufeff')  # BOM : ouverture directe dans Excel
+        csv.writer(response, delimiter=';').writerows(balance_agee.lignes_csv(balance))
+        return response
+
+    context = {
+        'dossier': dossier,
+        'balance': balance,
+        'tranches': balance_agee.TRANCHES,
+        'natures': [('clients', _("Clients")), ('fournisseurs', _("Fournisseurs"))],
+        'page_title': _("Balance Âgée"),
+        'niveaux_breadcrumb': [
+            {'url': reverse('core:home'), 'label': _('TDB Global')},
+            {'url': reverse('dossiers_pme:detail_dossier', kwargs={'pk': dossier.pk}), 'label': dossier.nom_dossier},
+            {'url': reverse('comptabilite:tableau_bord_compta', kwargs={'dossier_pk': dossier.pk}), 'label': _('Comptabilité')},
+            {'label': _("Balance Âgée")}
+        ]
+    }
+    return render(request, 'comptabilite/balance_agee.html', context)
+
+@login_required
+def etats_financiers_view(request, dossier_pk):
+    """Bilan et compte de résultat SYSCOHADA de l'?exercice=AAAA (en cours par défaut) ; ?format=json."""
+    dossier = get_object_or_404(DossierPME, pk=dossier_pk)
+    exercice_en_cours = sequences_pieces.exercice_de(dossier, date.today())
+    try:
+        exercice = int(request.GET.get('exercice') or exercice_en_cours)
+    except ValueError:
+        return HttpResponseBadRequest(_("Exercice invalide."))
+    etats = etats_financiers.etats_financiers(dossier, exercice)
+    if request.GET.get('format') == 'json':
+        return JsonResponse(etats.vers_dict())
+
+    context = {
+        'dossier': dossier,
+        'etats': etats,
+        'exercices': range(exercice_en_cours, exercice_en_cours - 6, -1),
+        'page_title': _("États Financiers"),
+        'niveaux_breadcrumb': [
+            {'url': reverse('core:home'), 'label': _('TDB Global')},
+            {'url': reverse('dossiers_pme:detail_dossier', kwargs={'pk': dossier.pk}), 'label': dossier.nom_dossier},
+            {'url': reverse('comptabilite:tableau_bord_compta', kwargs={'dossier_pk': dossier.pk}), 'label': _('Comptabilité')},
+            {'label': _("États Financiers")}
+        ]
+    }
+    return render(request, 'comptabilite/etats_financiers.html', context)
+
+@login_required
+def export_fec_view(request, dossier_pk):
+    """
+    Fichier des Écritures Comptables d'un exercice (?exercice=AAAA, ou ?date_debut=&date_fin=),
+    servi en flux : la mémoire utilisée ne dépend pas du nombre de lignes. ?strict=1 omet DateEcheance.
+    """
+    dossier = get_object_or_404(DossierPME, pk=dossier_pk)
+    try:
+        date_debut, date_fin = export_fec.periode_fec(
+            dossier, request.GET.get('exercice'), request.GET.get('date_debut'), request.GET.get('date_fin'),
+        )
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    echeances = request.GET.get('strict') not in ('1', 'true')
+    response = StreamingHttpResponse(
+        export_fec.iterer_fec(dossier, date_debut, date_fin, echeances=echeances),
+        content_type='text/plain; charset=utf-8',
+    )
+    response['Content-Disposition'] = f'attachment; filename="{export_fec.nom_fichier(dossier, date_fin)}"'
+    return response
+
+@login_required
+def import_ecritures_view(request, dossier_pk):
+    """Import d'un fichier d'écritures (CSV ou export Sage 100) par lots, avec reprise après échec."""
+    dossier = get_object_or_404(DossierPME, pk=dossier_pk)
+    if request.method == 'POST':
+        form = ImportEcrituresForm(request.POST, request.FILES, dossier_pme=dossier)
+        if form.is_valid():
+            fichier = form.cleaned_data['fichier']
+            try:
+                job = import_ecritures.preparer_job(
+                    dossier, fichier, fichier.name, form.cleaned_data['format_fichier'],
+                    form.cleaned_data['journal'], utilisateur=request.user,
+                )
+                flux = io.TextIOWrapper(fichier.file, encoding=form.cleaned_data['encodage'], newline='')
+                job = import_ecritures.importer(flux, job, ignorer_erreurs=form.cleaned_data['ignorer_erreurs'])
+                messages.success(request, _("%(pieces)s pièces (%(lignes)s lignes) importées en %(duree).1f s.") % {
+                    'pieces': job.pieces_importees, 'lignes': job.lignes_importees, 'duree': job.duree_secondes,
+                })
+                if job.pieces_rejetees:
+                    messages.warning(request, _("%(nombre)s pièces rejetées.") % {'nombre': job.pieces_rejetees})
+                return redirect('comptabilite:import_ecritures', dossier_pk=dossier.pk)
+            except import_ecritures.ErreurImport as e:  # encodage incorrect compris
+                messages.error(request, _("Échec de l'import : %(error)s") % {'error': str(e)})
+    else:
+        form = ImportEcrituresForm(dossier_pme=dossier)
+    context = {
+        'form': form,
+        'dossier': dossier,
+        'imports': ImportEcritures.objects.filter(dossier_pme=dossier).select_related('journal_defaut')[:20],
+        'page_title': _("Import d'Écritures"),
+        'niveaux_breadcrumb': [
+            {'url': reverse('core:home'), 'label': _('TDB Global')},
+            {'url': reverse('dossiers_pme:detail_dossier', kwargs={'pk': dossier.pk}), 'label': dossier.nom_dossier},
+            {'url': reverse('comptabilite:tableau_bord_compta', kwargs={'dossier_pk': dossier.pk}), 'label': _('Comptabilité')},
+            {'label': _("Import d'Écritures")}
+        ]
+    }
+    return render(request, 'comptabilite/import_ecritures.html', context)
+
+@login_required
+def clotures_view(request, dossier_pk):
+    """Clôture d'un mois ou d'un exercice (soldes figés, écriture d'à-nouveaux) et historique des clôtures."""
+    dossier = get_object_or_404(DossierPME, pk=dossier_pk)
+    if request.method == 'POST':
+        form = ClotureForm(request.POST)
+        if form.is_valid():
+            donnees = form.cleaned_data
+            try:
+                if donnees['type_cloture'] == ClotureComptable.EXERCICE:
+                    cloture = cloture_comptable.cloturer_exercice(dossier, donnees['annee'], utilisateur=request.user)
+                else:
+                    cloture = cloture_comptable.cloturer_mois(dossier, donnees['annee'], donnees['mois'], utilisateur=request.user)
+                messages.success(request, _("Dossier clôturé au %(date)s.") % {'date': cloture.date_fin.strftime('%d/%m/%Y')})
+                return redirect('comptabilite:clotures', dossier_pk=dossier.pk)
+            except clotures.ClotureImpossible as e:
+                messages.error(request, _("Clôture impossible : %(error)s") % {'error': str(e)})
+    else:
+        form = ClotureForm(initial={'annee': date.today().year})
+    context = {
+        'form': form,
+        'dossier': dossier,
+        'clotures': ClotureComptable.objects.filter(dossier_pme=dossier).select_related('ecriture_a_nouveau', 'cloture_par'),
+        'page_title': _("Clôtures"),
+        'niveaux_breadcrumb': [
+            {'url': reverse('core:home'), 'label': _('TDB Global')},
+            {'url': reverse('dossiers_pme:detail_dossier', kwargs={'pk': dossier.pk}), 'label': dossier.nom_dossier},
+            {'url': reverse('comptabilite:tableau_bord_compta', kwargs={'dossier_pk': dossier.pk}), 'label': _('Comptabilité')},
+            {'label': _("Clôtures")}
+        ]
+    }
+    return render(request, 'comptabilite/clotures.html', context)
+
 @login_required
 @transaction.atomic 
 def saisie_piece_view(request, dossier_pk, journal_pk, annee, mois):
@@ -718,6 +970,7 @@ def saisie_piece_view(request, dossier_pk, journal_pk, annee, mois):
         date_ecriture_default_entete = date(annee_saisie, mois_saisie, 1) 
         if not (1 <= mois_saisie <= 12 and 1900 <= annee_saisie <= date.today().year + 10):
             raise ValueError(_("Période invalide."))
+        clotures.verifier_periode_ouverte(dossier, [date_ecriture_default_entete])
     except ValueError as e: 
         messages.error(request, str(e))
         return redirect('comptabilite:saisie_selection_journal_periode', dossier_pk=dossier.pk)
@@ -995,6 +1248,7 @@ def enregistrer_ligne_ajax_view(request, dossier_pk, journal_pk, annee, mois):
             date_ecriture_default_entete = date(annee_saisie, mois_saisie, 1)
             if not (1 <= mois_saisie <= 12 and 1900 <= annee_saisie <= date.today().year + 10):
                 raise ValueError(_("Période invalide."))
+            clotures.verifier_periode_ouverte(dossier, [date_ecriture_default_entete])
         except ValueError as e_period:
             logger.warning(f"Invalid period in enregistrer_ligne_ajax_view: {e_period} for dossier {dossier_pk}, journal {journal_pk}")
             return JsonResponse({'success': False, 'errors': {'__all__': [str(e_period)]}}, status=400)
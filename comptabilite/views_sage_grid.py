@@ -6,13 +6,14 @@ import json
 from datetime import date, datetime
 from decimal import Decimal
 
-from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse, HttpResponseBadRequest
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
+from django.http import JsonResponse, HttpResponseBadRequest, StreamingHttpResponse
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.http import require_POST
 from django.db import transaction
 from django.contrib import messages
 from django.utils.translation import gettext_lazy as _
+from django.utils.dateparse import parse_date
 from django.urls import reverse
 from django.db.models import Q
 
@@ -27,8 +28,17 @@ from comptabilite.models import (
 from comptabilite.utils.sage_grid_handler import (
     SageGridHandler,
     process_sage_grid_data,
-    search_accounts
 )
+from comptabilite.utils.index_comptes import arechercher_comptes, rechercher_comptes
+from comptabilite.utils.recherche_tiers import arechercher_tiers, rechercher_tiers
+from comptabilite.utils import clotures, navigation_pieces, recherche_pieces, sequences_pieces
+
+
+def _page_demandee(request) -> int:
+    try:
+        return max(1, int(request.GET.get('page', 1)))
+    except (TypeError, ValueError):
+        return 1
 
 
 @login_required
@@ -100,17 +110,50 @@ def save_sage_grid_entry(request, dossier_pk, journal_pk, annee, mois):
 
 
 @login_required
-def search_accounts_view(request, dossier_pk):
+@require_POST
+def validate_sage_grid_batch(request, dossier_pk, journal_pk, annee, mois):
     """
-    API endpoint to search for accounts in a dossier.
+    API endpoint to validate many pieces of a journal month in one call (e.g. before an import).
+
+    Body: {"pieces": [{"header": {...}, "grid": [rows]}, ...]}. Nothing is saved; the response
+    is the structured report of SageGridHandler.validate_batch.
     """
     dossier = get_object_or_404(DossierPME, pk=dossier_pk)
+    journal = get_object_or_404(JournalComptable, pk=journal_pk, dossier_pme=dossier)
+    
+    try:
+        date_ecriture = date(int(annee), int(mois), 1)
+        body = json.loads(request.body)
+        pieces = body.get('pieces') if isinstance(body, dict) else None
+        if not isinstance(pieces, list):
+            raise ValueError("'pieces' must be a list")
+        for index, piece in enumerate(pieces, start=1):
+            if not isinstance(piece, dict):
+                raise ValueError(f"Piece {index}: must be an object with 'header' and 'grid'")
+            if not isinstance(piece.get('header', {}), dict):
+                raise ValueError(f"Piece {index}: 'header' must be an object")
+            grid = piece.get('grid', [])
+            if not isinstance(grid, list) or not all(isinstance(row, dict) for row in grid):
+                raise ValueError(f"Piece {index}: 'grid' must be a list of rows")
+    except (ValueError, AttributeError) as e:
+        return JsonResponse({'success': False, 'errors': [str(e)]}, status=400)
+    
+    report, __ = SageGridHandler(dossier, journal, date_ecriture).validate_batch(pieces)
+    return JsonResponse({'success': True, **report})
+
+
+@login_required
+async def search_accounts_view(request, dossier_pk):
+    """
+    API endpoint to search for accounts in a dossier (async: keystroke lookups never wait on a save).
+    """
+    dossier = await aget_object_or_404(DossierPME, pk=dossier_pk)
     query = request.GET.get('q', '')
     
     if not query:
         return JsonResponse({'results': []})
         
-    accounts = search_accounts(dossier, query)
+    accounts = await arechercher_comptes(dossier.pk, query, detail_seulement=True, limite=20)
     results = [{
         'id': account.numero_compte,
         'text': f"{account.numero_compte} - {account.intitule_compte}",
@@ -133,22 +176,16 @@ def search_tiers_view(request, dossier_pk):
     if not query:
         return JsonResponse({'results': []})
     
-    # Search by tiers code or name
-    tiers_list = Tiers.objects.filter(
-        dossier_pme=dossier,
-        est_actif=True
-    ).filter(
-        Q(code_tiers__icontains=query) | 
-        Q(nom_ou_raison_sociale__icontains=query)
-    ).order_by('code_tiers')[:20]
+    # Ranked search on the folded code/name key (trigram index)
+    page = rechercher_tiers(dossier.pk, query, page=_page_demandee(request), taille_page=20)
     
     results = [{
         'code': tiers.code_tiers,
         'nom': tiers.nom_ou_raison_sociale,
         'type': tiers.get_type_tiers_display()
-    } for tiers in tiers_list]
+    } for tiers in page.resultats]
     
-    return JsonResponse({'results': results})
+    return JsonResponse({'results': results, 'pagination': page.pagination()})
 
 
 @login_required
@@ -227,35 +264,12 @@ def comptes_lookup(request):
     query = request.GET.get('query', '').strip()
     journal_type = request.GET.get('journal_type', '')
     
-    # Filtres de base
-    base_filters = Q(
-        dossier_pme_id=dossier_pk,
-        est_actif=True,
-        # nature_compte='DETAIL' # Permettre tous les types de comptes actifs
-    )
-    
-    # Filtres spécifiques selon le type de journal
-    if journal_type == 'AC':
-        # Pour les achats: comptes fournisseurs et charges
-        compte_filters = Q(numero_compte__startswith='401') | Q(numero_compte__startswith='60') | Q(numero_compte__startswith='44566')
-    elif journal_type == 'VE':
-        # Pour les ventes: comptes clients et produits
-        compte_filters = Q(numero_compte__startswith='411') | Q(numero_compte__startswith='70') | Q(numero_compte__startswith='44571')
-    elif journal_type in ['BQ', 'CA']:
-        # Pour banque et caisse: tous les comptes sauf trésorerie
-        compte_filters = ~Q(type_compte__in=['TRESORERIE_ACTIF', 'TRESORERIE_PASSIF'])
-    else:
-        # Pour les OD: tous les comptes de détail
-        compte_filters = Q()
-    
-    # Recherche
-    if query:
-        search_filter = Q(numero_compte__icontains=query) | Q(intitule_compte__icontains=query)
-        comptes = CompteComptablePME.objects.filter(base_filters & compte_filters & search_filter)
-    else:
-        comptes = CompteComptablePME.objects.filter(base_filters & compte_filters)
+    if not (dossier_pk or '').isdigit():
+        return JsonResponse({'results': []})
     
-    comptes = comptes.order_by('numero_compte')[:50]
+    # Index en mémoire du dossier : préfixe du numéro ou des mots de l'intitulé,
+    # avec les filtres propres au type de journal (AC/VE : préfixes, BQ/CA : hors trésorerie)
+    comptes = rechercher_comptes(int(dossier_pk), query, journal_type=journal_type, limite=50)
     
     return JsonResponse({
         'results': [{
@@ -273,28 +287,19 @@ def tiers_lookup(request):
     query = request.GET.get('query', '').strip()
     journal_type = request.GET.get('journal_type', '')
     
-    # Filtres de base
-    base_filters = Q(
-        dossier_pme_id=dossier_pk,
-        est_actif=True
-    )
+    if not (dossier_pk or '').isdigit():
+        return JsonResponse({'results': []})
     
     # Filtres spécifiques selon le type de journal
     if journal_type == 'AC':
-        tiers_filters = Q(type_tiers='FO')  # Fournisseurs
+        types_tiers = ['FO']  # Fournisseurs
     elif journal_type == 'VE':
-        tiers_filters = Q(type_tiers='CL')  # Clients
+        types_tiers = ['CL']  # Clients
     else:
-        tiers_filters = Q()  # Tous les tiers
+        types_tiers = None  # Tous les tiers
     
-    # Recherche
-    if query:
-        search_filter = Q(code_tiers__icontains=query) | Q(nom_ou_raison_sociale__icontains=query)
-        tiers = Tiers.objects.filter(base_filters & tiers_filters & search_filter)
-    else:
-        tiers = Tiers.objects.filter(base_filters & tiers_filters)
-    
-    tiers = tiers.order_by('code_tiers')[:50]
+    page = rechercher_tiers(int(dossier_pk), query, types_tiers=types_tiers,
+                            page=_page_demandee(request), taille_page=50)
     
     return JsonResponse({
         'results': [{
@@ -302,7 +307,8 @@ def tiers_lookup(request):
             'libelle': t.nom_ou_raison_sociale,
             'type': t.type_tiers,
             'compte_associe': t.compte_comptable_associe.numero_compte if t.compte_comptable_associe else None
-        } for t in tiers]
+        } for t in page.resultats],
+        'pagination': page.pagination(),
     })
 
 @login_required
@@ -323,16 +329,25 @@ def save_piece(request):
     """API pour sauvegarder une pièce comptable"""
     try:
         data = json.loads(request.body)
-        journal = get_object_or_404(JournalComptable, pk=data['journal_pk'])
+        journal = get_object_or_404(JournalComptable.objects.select_related('dossier_pme'), pk=data['journal_pk'])
+        date_piece = parse_date(data['date'])
+        if date_piece is None:
+            raise ValueError(f"Date invalide : {data['date']}")
+        clotures.verifier_periode_ouverte(journal.dossier_pme, [date_piece])
         
         with transaction.atomic():
+            # Numéro saisi manuellement, ou attribué par la séquence du journal (champ vide ou suggestion conservée)
+            numero_piece = sequences_pieces.numero_pour_enregistrement(
+                journal, date_piece, data.get('piece'), data.get('numero_suggere'),
+            )
+            
             # Créer l'en-tête
             piece = EcritureComptable.objects.create(
                 dossier_pme=journal.dossier_pme,
                 journal=journal,
-                date_ecriture=data['date'],
-                numero_piece=data['piece'],
-                libelle_piece=data.get('libelle', data['piece'])
+                date_ecriture=date_piece,
+                numero_piece=numero_piece,
+                libelle_piece=data.get('libelle') or numero_piece
             )
             
             # Créer les lignes
@@ -362,7 +377,7 @@ def save_piece(request):
                     credit=Decimal(ligne_data.get('credit', '0'))
                 )
             
-            return JsonResponse({'success': True, 'piece_id': piece.id})
+            return JsonResponse({'success': True, 'piece_id': piece.id, 'numero': piece.numero_piece})
     
     except (KeyError, ValueError, json.JSONDecodeError) as e:
         return JsonResponse({
@@ -376,42 +391,41 @@ def save_piece(request):
         }, status=500)
 
 @login_required
-def tiers_lookup_view(request, dossier_pk):
+async def tiers_lookup_view(request, dossier_pk):
     """
-    API endpoint to search for business partners (tiers) in a dossier.
+    API endpoint to search for business partners (tiers) in a dossier (async).
     """
-    dossier = get_object_or_404(DossierPME, pk=dossier_pk)
+    dossier = await aget_object_or_404(DossierPME, pk=dossier_pk)
     query = request.GET.get('q', '')
     
     if not query:
         return JsonResponse({'results': []})
     
-    tiers = Tiers.objects.filter(
-        Q(code_tiers__icontains=query) | 
-        Q(nom_tiers__icontains=query),
-        dossier_pme=dossier
-    )[:10]
+    page = await arechercher_tiers(dossier.pk, query, page=_page_demandee(request), taille_page=10)
     
     results = [{
         'id': t.code_tiers,
-        'text': f"{t.code_tiers} - {t.nom_tiers}",
+        'text': f"{t.code_tiers} - {t.nom_ou_raison_sociale}",
         'code': t.code_tiers,
-        'nom': t.nom_tiers
-    } for t in tiers]
+        'nom': t.nom_ou_raison_sociale
+    } for t in page.resultats]
     
-    return JsonResponse({'results': results})
+    return JsonResponse({'results': results, 'pagination': page.pagination()})
 
 @login_required
-def journal_info_view(request, journal_pk):
+async def journal_info_view(request, journal_pk):
     """
-    API endpoint to get journal information.
+    API endpoint to get journal information (async).
     """
-    journal = get_object_or_404(JournalComptable, pk=journal_pk)
+    journal = await aget_object_or_404(
+        JournalComptable.objects.select_related('compte_contrepartie_par_defaut'), pk=journal_pk
+    )
+    contrepartie = journal.compte_contrepartie_par_defaut
     
     info = {
         'code': journal.code_journal,
         'type': journal.type_journal,
-        'contrepartie_auto': journal.compte_contrepartie.numero_compte if journal.compte_contrepartie else None,
+        'contrepartie_auto': contrepartie.numero_compte if contrepartie else None,
     }
     
     return JsonResponse(info)
@@ -427,15 +441,20 @@ def save_piece_view(request):
         data = json.loads(request.body)
         
         # Get the journal
-        journal = get_object_or_404(JournalComptable, pk=data['journal_id'])
+        journal = get_object_or_404(JournalComptable.objects.select_related('dossier_pme'), pk=data['journal_id'])
+        date_piece = datetime.strptime(data['date'], '%Y-%m-%d').date()
+        clotures.verifier_periode_ouverte(journal.dossier_pme, [date_piece])
         
-        # Create the accounting entry
+        # Create the accounting entry, numbered from the journal sequence when no number is supplied
+        # or when the suggested number was kept
         ecriture = EcritureComptable.objects.create(
             journal=journal,
-            date_ecriture=datetime.strptime(data['date'], '%Y-%m-%d').date(),
-            numero_piece=data['numero_piece'],
-            reference=data.get('reference', ''),
-            libelle=data.get('libelle', ''),
+            date_ecriture=date_piece,
+            numero_piece=sequences_pieces.numero_pour_enregistrement(
+                journal, date_piece, data.get('numero_piece'), data.get('numero_suggere'),
+            ),
+            reference_piece=data.get('reference', ''),
+            libelle_piece=data.get('libelle', ''),
             dossier_pme=journal.dossier_pme
         )
         
@@ -444,144 +463,152 @@ def save_piece_view(request):
             compte = get_object_or_404(CompteComptablePME, 
                                      numero_compte=ligne['compte'],
                                      dossier_pme=journal.dossier_pme)
+            tiers = None
+            if ligne.get('tiers'):
+                tiers = get_object_or_404(Tiers, dossier_pme=journal.dossier_pme, code_tiers=ligne['tiers'])
             
             LigneEcriture.objects.create(
                 ecriture=ecriture,
-                compte=compte,
+                compte_general=compte,
                 debit=Decimal(str(ligne.get('debit', '0'))),
                 credit=Decimal(str(ligne.get('credit', '0'))),
-                date_echeance=datetime.strptime(ligne['echeance'], '%Y-%m-%d').date() if ligne.get('echeance') else None,
-                code_tiers=ligne.get('tiers'),
-                libelle=ligne.get('libelle', '')
+                date_echeance_ligne=datetime.strptime(ligne['echeance'], '%Y-%m-%d').date() if ligne.get('echeance') else None,
+                tiers_ligne=tiers,
+                libelle_ligne=ligne.get('libelle', '')
             )
         
         return JsonResponse({
             'success': True,
             'message': 'Pièce enregistrée avec succès',
-            'id': ecriture.pk
+            'id': ecriture.pk,
+            'numero': ecriture.numero_piece
         })
         
     except (ValueError, KeyError, json.JSONDecodeError) as e:
+        # Nothing of the piece (nor its reserved number) is kept
+        transaction.set_rollback(True)
         return JsonResponse({
             'success': False,
             'message': f'Erreur lors de l\'enregistrement: {str(e)}'
         }, status=400)
     except Exception as e:
+        transaction.set_rollback(True)
         return JsonResponse({
             'success': False,
             'message': 'Erreur serveur lors de l\'enregistrement'
         }, status=500)
 
 @login_required
-def get_adjacent_piece(request, dossier_pk, journal_pk, piece_number, direction):
-    """Get previous or next piece relative to the current one."""
-    journal = get_object_or_404(JournalComptable, pk=journal_pk, dossier_pme__pk=dossier_pk)
-    
+async def get_adjacent_piece(request, dossier_pk, journal_pk, piece_number, direction):
+    """
+    Move from the current piece to the previous, next, first, last or n-th piece of the journal.
+
+    `direction` is one of prev, next, first, last, nth (with `?n=`, 1-based). Pieces are in natural
+    number order (VE9 before VE10); pass `?id=` to break ties between pieces sharing a number.
+    The response also carries `window`: up to `?window=` further pieces in the direction of
+    travel, with their lines like `piece`, so the grid can keep scrolling without another round
+    trip. Async view.
+    """
+    journal = await aget_object_or_404(JournalComptable, pk=journal_pk, dossier_pme__pk=dossier_pk)
+    if direction not in navigation_pieces.SENS_VALIDES:
+        return JsonResponse({'success': False, 'message': f'Direction inconnue : {direction}'}, status=400)
     try:
-        current_piece = EcritureComptable.objects.get(
-            journal=journal,
-            numero_piece=piece_number
-        )
-        
-        # Chercher la pièce adjacente
-        if direction == 'prev':
-            piece = EcritureComptable.objects.filter(
-                journal=journal,
-                date_ecriture__lte=current_piece.date_ecriture,
-                numero_piece__lt=piece_number
-            ).order_by('-date_ecriture', '-numero_piece').first()
-        else:
-            piece = EcritureComptable.objects.filter(
-                journal=journal,
-                date_ecriture__gte=current_piece.date_ecriture,
-                numero_piece__gt=piece_number
-            ).order_by('date_ecriture', 'numero_piece').first()
-        
-        if piece:
-            return JsonResponse({
-                'success': True,
-                'piece': piece.to_dict()
-            })
-        else:
-            return JsonResponse({
-                'success': False,
-                'message': f'Pas de pièce {direction == "prev" and "précédente" or "suivante"}'
-            })
-            
-    except EcritureComptable.DoesNotExist:
+        piece_pk = int(request.GET['id']) if request.GET.get('id') else None
+        rang = int(request.GET.get('n', 0))
+        fenetre = int(request.GET.get('window', navigation_pieces.TAILLE_FENETRE_DEFAUT))
+    except ValueError:
+        return JsonResponse({'success': False, 'message': 'Paramètre de navigation invalide'}, status=400)
+
+    piece, suivantes = await navigation_pieces.anaviguer(
+        journal, direction, numero_piece=piece_number, piece_pk=piece_pk, rang=rang, fenetre=fenetre
+    )
+    if piece is None:
+        libelles = {'prev': 'précédente', 'next': 'suivante', 'nth': f'de rang {rang}'}
         return JsonResponse({
             'success': False,
-            'message': 'Pièce non trouvée'
+            'message': f'Pas de pièce {libelles.get(direction, "dans ce journal")}'
         })
+    return JsonResponse({
+        'success': True,
+        'piece': navigation_pieces.piece_vers_dict(piece),
+        'window': [navigation_pieces.piece_vers_dict(p) for p in suivantes],
+    })
 
 @login_required
-def search_pieces(request, dossier_pk, journal_pk):
-    """Search for pieces based on criteria."""
-    journal = get_object_or_404(JournalComptable, pk=journal_pk, dossier_pme__pk=dossier_pk)
-    
-    # Extraire les critères de recherche
-    piece_number = request.GET.get('pieceNumber')
-    date_start = request.GET.get('dateStart')
-    date_end = request.GET.get('dateEnd')
-    amount = request.GET.get('amount')
-    
-    # Construire la requête
-    pieces = EcritureComptable.objects.filter(journal=journal)
-    
-    if piece_number:
-        pieces = pieces.filter(numero_piece__icontains=piece_number)
-    
-    if date_start:
-        pieces = pieces.filter(date_ecriture__gte=date_start)
-    
-    if date_end:
-        pieces = pieces.filter(date_ecriture__lte=date_end)
-    
-    if amount:
-        amount = Decimal(amount.replace(',', '.'))
-        pieces = pieces.filter(
-            Q(lignes__debit=amount) | Q(lignes__credit=amount)
-        ).distinct()
-    
-    # Convertir les résultats
-    results = [{
-        'numero': p.numero_piece,
-        'date': p.date_ecriture.isoformat(),
-        'reference': p.reference or '',
-        'montant': sum(l.debit for l in p.lignes.all())
-    } for p in pieces[:50]]  # Limiter à 50 résultats
+async def search_pieces(request, dossier_pk, journal_pk):
+    """
+    Search for pieces based on criteria, one keyset page at a time (async).
+
+    Pass the returned `next_cursor` as `?cursor=` to fetch the following page.
+    """
+    journal = await aget_object_or_404(JournalComptable, pk=journal_pk, dossier_pme__pk=dossier_pk)
+    try:
+        pieces = _pieces_recherchees(request, journal)
+        taille = int(request.GET.get('limit', recherche_pieces.TAILLE_PAGE_DEFAUT))
+        resultats, next_cursor = await recherche_pieces.apage_pieces(pieces, request.GET.get('cursor'), taille)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
     
     return JsonResponse({
         'success': True,
-        'results': results
+        'results': [recherche_pieces.piece_vers_dict(p) for p in resultats],
+        'next_cursor': next_cursor,
     })
 
 @login_required
-def suggest_piece_number(request, dossier_pk, journal_pk):
-    """Get suggested piece number for new piece."""
+def stream_pieces(request, dossier_pk, journal_pk):
+    """
+    Stream every piece matching the search criteria as NDJSON (one JSON object per line).
+
+    Each object carries the cursor of its position, so an interrupted download can resume
+    with `?cursor=`.
+    """
     journal = get_object_or_404(JournalComptable, pk=journal_pk, dossier_pme__pk=dossier_pk)
-    
-    # Trouver le dernier numéro utilisé
-    last_piece = EcritureComptable.objects.filter(
-        journal=journal,
-        date_ecriture__year=datetime.now().year
-    ).order_by('-numero_piece').first()
-    
-    if last_piece:
-        # Extraire le numéro séquentiel et l'incrémenter
-        try:
-            prefix = ''.join(c for c in last_piece.numero_piece if not c.isdigit())
-            number = int(''.join(c for c in last_piece.numero_piece if c.isdigit()))
-            next_number = f"{prefix}{number + 1:04d}"
-        except ValueError:
-            next_number = f"{journal.code_journal}{datetime.now().year % 100}0001"
-    else:
-        # Premier numéro de l'année
-        next_number = f"{journal.code_journal}{datetime.now().year % 100}0001"
+    try:
+        pieces = _pieces_recherchees(request, journal)
+        curseur = request.GET.get('cursor')
+        if curseur:
+            recherche_pieces.decoder_curseur(curseur)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+
+    def lignes():
+        for piece in recherche_pieces.iterer_pieces(pieces, curseur):
+            donnees = recherche_pieces.piece_vers_dict(piece)
+            donnees['cursor'] = recherche_pieces.encoder_curseur(piece)
+            yield json.dumps(donnees, ensure_ascii=False) + '\n'
+
+    return StreamingHttpResponse(lignes(), content_type='application/x-ndjson; charset=utf-8')
+
+def _pieces_recherchees(request, journal):
+    return recherche_pieces.filtrer_pieces(
+        journal,
+        numero_piece=request.GET.get('pieceNumber'),
+        date_debut=request.GET.get('dateStart'),
+        date_fin=request.GET.get('dateEnd'),
+        montant=request.GET.get('amount'),
+    )
+
+@login_required
+def suggest_piece_number(request, dossier_pk, journal_pk):
+    """
+    Suggest the next piece number of the journal for the fiscal year of `?date=` (default: today).
+
+    Read-only: nothing is reserved. Send the suggestion back as `numero_suggere` when saving; if
+    the user kept it, the number is assigned from the sequence at save time (the next free one
+    if another user took it meanwhile).
+    """
+    journal = get_object_or_404(JournalComptable.objects.select_related('dossier_pme'), pk=journal_pk, dossier_pme__pk=dossier_pk)
+    try:
+        jour = parse_date(request.GET['date']) if request.GET.get('date') else date.today()
+    except ValueError:
+        jour = None
+    if jour is None:
+        return JsonResponse({'success': False, 'message': 'Date invalide'}, status=400)
     
     return JsonResponse({
         'success': True,
-        'numero': next_number
+        'numero': sequences_pieces.prochain_numero(journal, jour)
     })
 
 @login_required
@@ -1,25 +1,52 @@
 # core/views.py
+from decimal import Decimal
+
 from django.shortcuts import render
+from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from dossiers_pme.models import DossierPME # Pour afficher la liste des dossiers PME
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse
+from comptabilite.utils import portefeuille # Indicateurs par dossier du tableau de bord global
+
+TAILLE_PAGE_DEFAUT = 25
+TAILLE_PAGE_MAX = 200
 
 @login_required # La page d'accueil globale nécessite aussi d'être connecté
 def home_view(request):
-    # Récupérer la liste des DossierPME pour affichage sur le tableau de bord global
-    # Ceci correspond à votre plan: "Affichage de la liste des DossierPME sur le tableau de bord global."
+    # Portefeuille du cabinet : indicateurs de chaque dossier calculés en quelques requêtes groupées
+    # (voir comptabilite/utils/portefeuille.py), triés puis paginés en mémoire.
+    tri = request.GET.get('tri', portefeuille.TRI_DEFAUT)
+    if tri.lstrip('-') not in portefeuille.TRIS:
+        tri = portefeuille.TRI_DEFAUT
     try:
-        dossiers_pme = DossierPME.objects.all().order_by('nom_dossier') # Ou nom_pme
+        taille_page = min(max(int(request.GET.get('page_size', TAILLE_PAGE_DEFAUT)), 1), TAILLE_PAGE_MAX)
+    except (TypeError, ValueError):
+        taille_page = TAILLE_PAGE_DEFAUT
+
+    try:
+        lignes = portefeuille.lignes_portefeuille()
     except Exception as e:
-        # Gérer l'erreur si besoin, pour l'instant on passe une liste vide
-        dossiers_pme = []
-        # logger.error(f"Erreur de récupération des dossiers PME pour home_view: {e}")
+        lignes = []
+        messages.warning(request, f"Erreur lors du calcul des indicateurs du portefeuille : {e}")
+    page = Paginator(portefeuille.trier(lignes, tri), taille_page).get_page(request.GET.get('page'))
+
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'tri': tri, 'page': page.number, 'pages': page.paginator.num_pages, 'total': page.paginator.count,
+            'dossiers': [ligne.vers_dict() for ligne in page],
+        }, encoder=DjangoJSONEncoder)
 
     context = {
         'page_title': "Tableau de Bord Global - OPTIMA GEST PME",
-        'dossiers_pme': dossiers_pme,
-        # Plus tard, vous ajouterez des KPIs globaux ici
-        # 'kpi_total_dossiers': DossierPME.objects.count(),
-        # 'kpi_taches_globales': ...
+        'page_dossiers': page,
+        'tri': tri,
+        'taille_page': taille_page,
+        'colonnes_tri': [(cle, libelle) for cle, (__, libelle) in portefeuille.TRIS.items()],
+        'kpi_total_dossiers': len(lignes),
+        'kpi_dossiers_desequilibres': sum(1 for ligne in lignes if ligne.pieces_desequilibrees),
+        'kpi_tresorerie_totale': sum((ligne.solde_tresorerie for ligne in lignes), Decimal(0)),
+        'kpi_chiffre_affaires_total': sum((ligne.chiffre_affaires for ligne in lignes), Decimal(0)),
     }
     return render(request, 'core/home.html', context)
 
@@ -3,13 +3,13 @@ from django.shortcuts import render, get_object_or_404, redirect # redirect si b
 from django.contrib.auth.decorators import login_required # Si vos vues sont protégées
 from django.urls import reverse # Pour générer des URLs dans le contexte
 from django.utils import timezone # Utile pour les dates
-from datetime import date, timedelta
-from django.db.models import Sum, Count, Value, DecimalField
-from django.db.models.functions import Coalesce # Très utile pour les agrégations
+from datetime import date
+from decimal import Decimal
 
 from .models import DossierPME
 # Import des modèles de l'application comptabilite
-from comptabilite.models import EcritureComptable, LigneEcriture, CompteComptablePME 
+from comptabilite.models import LigneEcriture, CompteComptablePME 
+from comptabilite.utils import indicateurs_dossier, sequences_pieces
 # Note: CompteComptablePME est importé mais pas directement utilisé dans le calcul ci-dessous,
 # car LigneEcriture.compte_general est déjà une instance de CompteComptablePME.
 # Il pourrait être utile si vous voulez afficher le plan comptable spécifique au dossier.
@@ -40,74 +40,19 @@ def detail_dossier_pme_view(request, pk):
     prochain_jalon_compta = "Déclaration TVA - 15/ProchainMois" # Placeholder
     taches_ouvertes_count = 0 # Placeholder
 
-    # Définition de l'année N (par exemple, l'année actuelle ou l'année du dernier exercice clôturé)
-    # Pour cet exemple, utilisons l'année actuelle.
-    # Pour une application réelle, vous auriez un concept d'"exercice courant" pour le dossier.
-    annee_n = date.today().year 
-    # Vous pouvez aussi permettre à l'utilisateur de sélectionner l'année via la requête GET
-    # annee_selectionnee = request.GET.get('annee', date.today().year)
-    # try:
-    #     annee_n = int(annee_selectionnee)
-    # except ValueError:
-    #     annee_n = date.today().year
+    # Exercice en cours du dossier (exercice civil par défaut)
+    annee_n = sequences_pieces.exercice_de(dossier, date.today())
 
-
-    # --- Calcul du Chiffre d'Affaires Année N ---
-    ca_annee_n = "N/A" # Initialisation
+    # --- Chiffre d'affaires (XB) et résultat net (XI) de l'exercice ---
+    # Compte de résultat SYSCOHADA mis en cache tant que les soldes de l'exercice ne changent pas
+    ca_annee_n = "N/A"
+    resultat_net_annee_n = "N/A"
     try:
-        # Les produits sont généralement les comptes de la classe 7 (SYSCOHADA)
-        # Le CA est la somme des crédits (ventes) moins les débits (annulations, retours) sur ces comptes.
-        lignes_produits = LigneEcriture.objects.filter(
-            ecriture__dossier_pme=dossier,
-            ecriture__date_ecriture__year=annee_n,
-            # --- CORRECTION ICI ---
-            compte_general__numero_compte__startswith='7' 
-            # --- FIN CORRECTION ---
-        ).aggregate(
-            total_credits=Coalesce(Sum('credit'), Value(0, output_field=DecimalField())),
-            total_debits=Coalesce(Sum('debit'), Value(0, output_field=DecimalField()))
-        )
-        
-        ca_annee_n = lignes_produits['total_credits'] - lignes_produits['total_debits']
-    except Exception as e:
-        # Il est bon de logguer cette erreur pour le débogage
-        print(f"Erreur calcul CA pour dossier {dossier.pk} annee {annee_n}: {e}")
-        # Vous pourriez vouloir afficher un message à l'utilisateur ou simplement laisser "N/A"
-        # messages.warning(request, "Impossible de calculer le chiffre d'affaires pour l'année sélectionnée.")
-
-
-    # --- Calcul du Résultat Net Année N (Simplifié) ---
-    resultat_net_annee_n = "N/A" # Initialisation
-    try:
-        # Total des Produits (Classe 7)
-        total_produits = ca_annee_n # On réutilise le calcul du CA si le CA = Total Produits
-
-        # Total des Charges (Classe 6)
-        # Les charges sont la somme des débits (achats, frais) moins les crédits (annulations)
-        lignes_charges = LigneEcriture.objects.filter(
-            ecriture__dossier_pme=dossier,
-            ecriture__date_ecriture__year=annee_n,
-            # --- CORRECTION ICI ---
-            compte_general__numero_compte__startswith='6'
-            # --- FIN CORRECTION ---
-        ).aggregate(
-            total_credits=Coalesce(Sum('credit'), Value(0, output_field=DecimalField())),
-            total_debits=Coalesce(Sum('debit'), Value(0, output_field=DecimalField()))
-        )
-        total_charges = lignes_charges['total_debits'] - lignes_charges['total_credits']
-        
-        # Résultat = Total Produits - Total Charges
-        # Assurez-vous que ca_annee_n n'est pas "N/A"
-        if isinstance(ca_annee_n, (int, float, DecimalField().to_python_value(0).__class__)) and \
-           isinstance(total_charges, (int, float, DecimalField().to_python_value(0).__class__)):
-            resultat_net_annee_n = ca_annee_n - total_charges
-        else:
-            # Si ca_annee_n est "N/A", le résultat net ne peut pas être calculé proprement
-            resultat_net_annee_n = "N/A"
-
+        indicateurs = indicateurs_dossier.indicateurs_exercice(dossier, annee_n)
+        ca_annee_n = indicateurs['chiffre_affaires']
+        resultat_net_annee_n = indicateurs['resultat_net']
     except Exception as e:
-        print(f"Erreur calcul Résultat Net pour dossier {dossier.pk} annee {annee_n}: {e}")
-        # messages.warning(request, "Impossible de calculer le résultat net pour l'année sélectionnée.")
+        print(f"Erreur calcul des états financiers pour dossier {dossier.pk} exercice {annee_n}: {e}")
 
 
     context = {
@@ -2,6 +2,7 @@
 
 from pathlib import Path
 import os # Pour .env
+import tempfile
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -89,6 +90,8 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'optimagest_project.wsgi.application'
+# Déploiement ASGI (uvicorn/daphne) : les API de recherche de la saisie sont des vues async
+ASGI_APPLICATION = 'optimagest_project.asgi.application'
 
 
 # Database
@@ -105,6 +108,24 @@ DATABASES = {
 }
 
 
+# Cache
+# Partagé par défaut entre tous les processus de la machine (serveur web, workers, commandes
+# manage.py : import_ecritures, cloturer_periode, lettrer_comptes...) : les jetons de version
+# (utils/cache_versions.py) qu'une écriture remplace sont vus de tous, et les états et
+# indicateurs en cache ne survivent pas à une écriture faite par un autre processus.
+# Sur plusieurs serveurs, utiliser un cache réseau (CACHE_BACKEND=django.core.cache.backends.redis.RedisCache,
+# CACHE_LOCATION=redis://...). LocMemCache (un cache par processus) ne convient qu'à un processus unique.
+# Jetons de version et indicateurs comptent quelques entrées par dossier : la limite par défaut
+# de Django (300 entrées) provoquerait des évictions en continu sur un cabinet de quelques centaines de dossiers.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', os.path.join(tempfile.gettempdir(), 'optimagest_cache')),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '50000'))},
+    }
+}
+
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -118,6 +118,7 @@ class SageGrid {
                 journal_pk: this.currentJournal,
                 date: this.elements.pieceDate.value,
                 piece: this.elements.pieceNumber.value,
+                numero_suggere: this.suggestedPieceNumber || '',
                 reference: this.elements.pieceRef.value,
                 lignes: this.getGridData()
             };
@@ -194,6 +195,7 @@ class SageGrid {
         return {
             journal_pk: this.journalId,
             numero: document.getElementById('pieceNumber').value,
+            numero_suggere: this.suggestedPieceNumber || '',
             date: document.getElementById('pieceDate').value,
             reference: document.getElementById('pieceRef').value,
             lines: this.getGridLines()
@@ -255,17 +257,24 @@ class SageGrid {
     initializeGrid() {
         this.clearGrid();
         
-        // Suggérer un nouveau numéro de pièce
-        this.api.getSuggestedPieceNumber()
+        // Initialiser la date dans la période de la grille (aujourd'hui si la période est le mois en cours)
+        const today = new Date().toISOString().split('T')[0];
+        const period = document.getElementById('periodSelect')?.value;
+        const pieceDate = period && !today.startsWith(period) ? `${period}-01` : today;
+        document.getElementById('pieceDate').value = pieceDate;
+        
+        // Suggérer un numéro de pièce pour l'exercice de la date (simple proposition :
+        // le numéro est attribué par la séquence du journal à l'enregistrement)
+        this.suggestedPieceNumber = '';
+        document.getElementById('pieceNumber').value = '';
+        this.api.getSuggestedPieceNumber(pieceDate)
             .then(response => {
                 if (response.success) {
+                    this.suggestedPieceNumber = response.numero;
                     document.getElementById('pieceNumber').value = response.numero;
                 }
             });
         
-        // Initialiser la date
-        document.getElementById('pieceDate').value = new Date().toISOString().split('T')[0];
-        
         // Vider la référence
         document.getElementById('pieceRef').value = '';
         
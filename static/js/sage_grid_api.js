@@ -13,7 +13,8 @@ class SageGridAPI {
 
     /**
      * Save a grid entry to the server
-     * @param {Object} headerData - Header data for the accounting entry
+     * @param {Object} headerData - Header data for the accounting entry (numero_piece, and numero_suggere:
+     *     the number from getSuggestedPieceNumber, re-reserved by the server when it was kept)
      * @param {Array} gridData - Grid data for the accounting entry lines
      * @returns {Promise} - Promise with the server response
      */
@@ -125,10 +126,15 @@ class SageGridAPI {
      * Get data for an adjacent piece (previous or next)
      * @param {string} currentPiece - Current piece number
      * @param {string} direction - 'prev' or 'next'
-     * @returns {Promise} - Promise with adjacent piece data
+     * @param {number} [currentId] - Current piece id (tie-break between pieces sharing a number)
+     * @returns {Promise} - Promise with the adjacent piece and `window`, the following pieces in
+     *     the same direction, both with their lines
      */
-    getAdjacentPiece(currentPiece, direction) {
-        const url = `${this.baseUrl}/api/dossier/${this.dossierId}/journal/${this.journalId}/piece/${currentPiece}/${direction}/`;
+    getAdjacentPiece(currentPiece, direction, currentId) {
+        let url = `${this.baseUrl}/api/dossier/${this.dossierId}/journal/${this.journalId}/piece/${encodeURIComponent(currentPiece)}/${direction}/`;
+        if (currentId) {
+            url += `?id=${currentId}`;
+        }
         return fetch(url).then(response => response.json());
     }
 
@@ -163,11 +169,13 @@ class SageGridAPI {
     }
 
     /**
-     * Get suggested piece number for new piece
+     * Get suggested piece number for new piece (read-only: the number is assigned at save)
+     * @param {string} date - Piece date (YYYY-MM-DD), selects the fiscal year
      * @returns {Promise} - Promise with suggested number
      */
-    getSuggestedPieceNumber() {
-        const url = `${this.baseUrl}/api/dossier/${this.dossierId}/journal/${this.journalId}/suggest-piece-number/`;
+    getSuggestedPieceNumber(date) {
+        const url = `${this.baseUrl}/api/dossier/${this.dossierId}/journal/${this.journalId}/suggest-piece-number/` +
+                   (date ? `?date=${encodeURIComponent(date)}` : '');
         return fetch(url).then(response => response.json());
     }
 
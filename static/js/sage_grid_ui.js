@@ -20,6 +20,9 @@ class SageGridUI {
         this.currentJournal = null;
         this.lookupVisible = false;
         this.calculatorVisible = false;
+        this.currentPieceId = null;
+        // Pièces déjà reçues dans le sens du déplacement (réponse `window` de la navigation)
+        this.navigation = { direction: null, fromId: null, pieces: [], loading: null, exhausted: false };
 
         this.setupEventListeners();
         this.setupKeyboardNavigation();
@@ -161,6 +164,14 @@ class SageGridUI {
                     e.preventDefault();
                     this.grid.savePiece();
                     break;
+                case 'PageUp':
+                    e.preventDefault();
+                    this.navigatePiece('prev');
+                    break;
+                case 'PageDown':
+                    e.preventDefault();
+                    this.navigatePiece('next');
+                    break;
             }
             
             // Recherche avec F4
@@ -206,6 +217,7 @@ class SageGridUI {
             }
         }
         this.grid.initializeGrid();
+        this.currentPieceId = null;
         this.setStatusMessage('Nouvelle pièce');
     }
 
@@ -271,24 +283,70 @@ class SageGridUI {
         }
     }
 
-    // Navigation entre les pièces
+    // Navigation entre les pièces : les pièces de la fenêtre reçue avec la précédente réponse
+    // s'affichent sans aller-retour (touche maintenue), la suite est demandée avant qu'elle s'épuise
     navigatePiece(direction) {
+        const libelle = direction === 'prev' ? 'précédente' : 'suivante';
+        const navigation = this.navigation;
+        if (navigation.direction === direction && navigation.fromId === this.currentPieceId && navigation.pieces.length) {
+            this.showNavigatedPiece(navigation.pieces.shift(), libelle);
+            if (navigation.pieces.length <= SageGridUI.NAVIGATION_REFILL_THRESHOLD) {
+                this.refillNavigationWindow(direction);
+            }
+            return;
+        }
+        if (navigation.loading && navigation.direction === direction && navigation.fromId === this.currentPieceId) {
+            return; // Réponse en cours pour ce déplacement : la touche maintenue ne multiplie pas les requêtes
+        }
+
         const currentPiece = document.getElementById('pieceNumber').value;
-        this.api.getAdjacentPiece(currentPiece, direction)
+        const requete = { direction: direction, fromId: this.currentPieceId, pieces: [], loading: null, exhausted: false };
+        this.navigation = requete;
+        requete.loading = this.api.getAdjacentPiece(currentPiece, direction, this.currentPieceId)
             .then(data => {
+                requete.loading = null;
+                if (this.navigation !== requete) return; // Déplacement abandonné pour un autre
                 if (data.success && data.piece) {
-                    this.loadPieceData(data.piece, true);
-                    this.setStatusMessage(`Pièce ${direction === 'prev' ? 'précédente' : 'suivante'}`);
+                    this.showNavigatedPiece(data.piece, libelle);
+                    requete.pieces = data.window || [];
                 } else {
-                    alert(`Pas de pièce ${direction === 'prev' ? 'précédente' : 'suivante'}`);
+                    alert(data.message || `Pas de pièce ${libelle}`);
                 }
             })
             .catch(error => {
+                requete.loading = null;
                 console.error('Erreur de navigation:', error);
                 alert('Erreur lors de la navigation');
             });
     }
 
+    showNavigatedPiece(piece, libelle) {
+        this.loadPieceData(piece, true);
+        this.navigation.fromId = piece.id;
+        this.setStatusMessage(`Pièce ${libelle}`);
+    }
+
+    // Complète la fenêtre à partir de sa dernière pièce, sans changer la pièce affichée
+    refillNavigationWindow(direction) {
+        const navigation = this.navigation;
+        if (navigation.loading || navigation.exhausted) return;
+        const depart = navigation.pieces.length ? navigation.pieces[navigation.pieces.length - 1] : null;
+        if (!depart) return; // Fenêtre épuisée : le prochain déplacement interroge le serveur
+        navigation.loading = this.api.getAdjacentPiece(depart.numero, direction, depart.id)
+            .then(data => {
+                navigation.loading = null;
+                if (data.success && data.piece) {
+                    navigation.pieces.push(data.piece, ...(data.window || []));
+                } else {
+                    navigation.exhausted = true; // Début ou fin du journal atteint
+                }
+            })
+            .catch(error => {
+                navigation.loading = null;
+                console.error('Erreur de navigation:', error);
+            });
+    }
+
     // Rechercher une pièce
     searchPiece() {
         const searchForm = document.createElement('div');
@@ -451,7 +509,9 @@ class SageGridUI {
 
     // Charger les données d'une pièce
     loadPieceData(piece, readOnly = false) {
-        // Remplir l'en-tête
+        // Remplir l'en-tête (pièce existante : plus de numéro suggéré)
+        this.grid.suggestedPieceNumber = '';
+        this.currentPieceId = piece.id || null;
         document.getElementById('pieceNumber').value = piece.numero;
         document.getElementById('pieceDate').value = piece.date;
         document.getElementById('pieceRef').value = piece.reference || '';
@@ -803,3 +863,6 @@ class SageGridUI {
         }
     }
 }
+
+// Pièces restantes dans la fenêtre de navigation en dessous desquelles la suite est demandée
+SageGridUI.NAVIGATION_REFILL_THRESHOLD = 3;